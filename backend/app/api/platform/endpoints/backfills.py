@@ -0,0 +1,95 @@
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from propelauth_fastapi import User
+
+from app.api.platform.models import BackfillJob, BackfillJobs
+from app.security import verify_if_propelauth_user_can_access_project
+from app.security.authentification import propelauth
+from app.services.mongo.backfills import (
+    cancel_backfill_job,
+    get_backfill_job,
+    get_backfill_jobs,
+    pause_backfill_job,
+    resume_backfill_job,
+    run_backfill_job,
+)
+
+router = APIRouter(tags=["Backfills"])
+
+
+@router.get(
+    "/backfills/{project_id}",
+    response_model=BackfillJobs,
+    description="Get the backfill jobs of a project, the most recent first",
+)
+async def get_project_backfill_jobs(
+    project_id: str,
+    limit: int = 100,
+    user: User = Depends(propelauth.require_user),
+) -> BackfillJobs:
+    await verify_if_propelauth_user_can_access_project(user, project_id)
+    backfill_jobs = await get_backfill_jobs(project_id, limit=min(limit, 1000))
+    return BackfillJobs(backfill_jobs=backfill_jobs)
+
+
+@router.get(
+    "/backfills/{project_id}/{backfill_job_id}",
+    response_model=BackfillJob,
+    description="Get the progress and the metrics of a backfill job",
+)
+async def get_project_backfill_job(
+    project_id: str,
+    backfill_job_id: str,
+    user: User = Depends(propelauth.require_user),
+) -> BackfillJob:
+    await verify_if_propelauth_user_can_access_project(user, project_id)
+    backfill_job = await get_backfill_job(project_id, backfill_job_id)
+    if backfill_job is None:
+        raise HTTPException(
+            status_code=404, detail=f"Backfill job {backfill_job_id} not found"
+        )
+    return backfill_job
+
+
+@router.post(
+    "/backfills/{project_id}/{backfill_job_id}/pause",
+    response_model=BackfillJob,
+    description="Pause a running backfill job",
+)
+async def post_pause_backfill_job(
+    project_id: str,
+    backfill_job_id: str,
+    user: User = Depends(propelauth.require_user),
+) -> BackfillJob:
+    await verify_if_propelauth_user_can_access_project(user, project_id)
+    return await pause_backfill_job(project_id, backfill_job_id)
+
+
+@router.post(
+    "/backfills/{project_id}/{backfill_job_id}/resume",
+    response_model=BackfillJob,
+    description="Resume a paused or failed backfill job from its last checkpoint",
+)
+async def post_resume_backfill_job(
+    project_id: str,
+    backfill_job_id: str,
+    background_tasks: BackgroundTasks,
+    user: User = Depends(propelauth.require_user),
+) -> BackfillJob:
+    await verify_if_propelauth_user_can_access_project(user, project_id)
+    backfill_job = await resume_backfill_job(project_id, backfill_job_id)
+    background_tasks.add_task(run_backfill_job, backfill_job.id)
+    return backfill_job
+
+
+@router.post(
+    "/backfills/{project_id}/{backfill_job_id}/cancel",
+    response_model=BackfillJob,
+    description="Cancel a backfill job. A cancelled job can't be resumed.",
+)
+async def post_cancel_backfill_job(
+    project_id: str,
+    backfill_job_id: str,
+    user: User = Depends(propelauth.require_user),
+) -> BackfillJob:
+    await verify_if_propelauth_user_can_access_project(user, project_id)
+    return await cancel_backfill_job(project_id, backfill_job_id)
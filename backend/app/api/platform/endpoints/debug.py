@@ -1,7 +1,9 @@
 from fastapi import APIRouter, Depends
 from propelauth_py.user import User
 
+from app.core import config
 from app.security.authentification import propelauth
+from app.services.mongo.results_cache import get_results_cache_stats
 
 router = APIRouter(include_in_schema=False)
 
@@ -14,3 +16,13 @@ def read_root(user: User = Depends(propelauth.require_user)):
 @router.get("/health")
 def health_check():
     return {"status": "OK"}
+
+
+@router.get("/debug/results-cache")
+def results_cache_stats(user: User = Depends(propelauth.require_user)):
+    """
+    Hits, stale hits and misses of the cache of the explore and metadata results.
+    Only for the members of the phospho org.
+    """
+    propelauth.require_org_member(user, config.PHOSPHO_ORG_ID)
+    return get_results_cache_stats()
@@ -6,6 +6,7 @@ from app.security.authentification import (
     propelauth,
     verify_if_propelauth_user_can_access_project,
 )
+from app.services.mongo.backfills import run_backfill_job
 from app.services.mongo.events import run_event_detection_on_timeframe
 from app.core import config
 
@@ -40,10 +41,9 @@ async def post_backfill_event(
             detail="You need to add a payment method to access this service. Please update your payment details: https://platform.phospho.ai/org/settings/billing",
         )
 
-    background_tasks.add_task(
-        run_event_detection_on_timeframe,
-        org_id=org_id,
+    backfill_job = await run_event_detection_on_timeframe(
         project_id=project_id,
         event_backfill_request=event_backfill_request,
     )
-    return {"status": "ok"}
+    background_tasks.add_task(run_backfill_job, backfill_job.id)
+    return {"status": "ok", "backfill_job_id": backfill_job.id}
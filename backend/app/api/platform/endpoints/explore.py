@@ -37,6 +37,7 @@ from app.services.mongo.explore import (
     get_dashboard_aggregated_metrics,
 )
 from app.services.mongo.projects import get_all_events
+from app.services.mongo.results_cache import cached_result
 from app.core import config
 
 
@@ -160,10 +161,13 @@ async def get_tasks_project_metrics(
     project_id: str,
     metrics: Optional[List[str]] = None,
     filters: Optional[ProjectDataFilters] = None,
+    include_timings: bool = False,
     user: User = Depends(propelauth.require_user),
 ) -> dict:
     """
     Get aggregated metrics for the tasks of a project. Used for the Tasks dashboard.
+
+    If include_timings is True, the duration of each metric in seconds is returned in "timings".
     """
     await verify_if_propelauth_user_can_access_project(user, project_id)
     if filters is None:
@@ -176,10 +180,18 @@ async def get_tasks_project_metrics(
     if isinstance(filters.created_at_end, datetime.datetime):
         filters.created_at_end = int(filters.created_at_end.timestamp())
 
-    output = await get_tasks_aggregated_metrics(
-        project_id=project_id,
+    output = await cached_result(
+        "tasks_metrics",
+        project_id,
+        lambda: get_tasks_aggregated_metrics(
+            project_id=project_id,
+            metrics=metrics,
+            filters=filters,
+            include_timings=include_timings,
+        ),
         metrics=metrics,
         filters=filters,
+        include_timings=include_timings,
     )
     return output
 
@@ -192,6 +204,7 @@ async def get_sessions_project_metrics(
     project_id: str,
     metrics: Optional[List[str]] = None,
     filters: Optional[ProjectDataFilters] = None,
+    include_timings: bool = False,
     user: User = Depends(propelauth.require_user),
 ) -> dict:
     """
@@ -209,10 +222,18 @@ async def get_sessions_project_metrics(
     if isinstance(filters.created_at_end, datetime.datetime):
         filters.created_at_end = int(filters.created_at_end.timestamp())
 
-    output = await get_sessions_aggregated_metrics(
-        project_id=project_id,
+    output = await cached_result(
+        "sessions_metrics",
+        project_id,
+        lambda: get_sessions_aggregated_metrics(
+            project_id=project_id,
+            metrics=metrics,
+            filters=filters,
+            include_timings=include_timings,
+        ),
         metrics=metrics,
         filters=filters,
+        include_timings=include_timings,
     )
     return output
 
@@ -225,6 +246,7 @@ async def get_events_project_metrics(
     project_id: str,
     metrics: Optional[List[str]] = None,
     filters: Optional[ProjectDataFilters] = None,
+    include_timings: bool = False,
     user: User = Depends(propelauth.require_user),
 ):
     """
@@ -239,10 +261,18 @@ async def get_events_project_metrics(
     if isinstance(filters.created_at_end, datetime.datetime):
         filters.created_at_end = int(filters.created_at_end.timestamp())
 
-    output = await get_events_aggregated_metrics(
-        project_id=project_id,
+    output = await cached_result(
+        "events_metrics",
+        project_id,
+        lambda: get_events_aggregated_metrics(
+            project_id=project_id,
+            metrics=metrics,
+            filters=filters,
+            include_timings=include_timings,
+        ),
         metrics=metrics,
         filters=filters,
+        include_timings=include_timings,
     )
     return output
 
@@ -385,8 +415,15 @@ async def get_compute_nb_items_with_metadata_field(
         bottom_quantile,
         average,
         top_quantile,
-    ) = await compute_nb_items_with_metadata_field(
-        project_id=project_id,
+    ) = await cached_result(
+        "nb_items_with_metadata_field_quantiles",
+        project_id,
+        lambda: compute_nb_items_with_metadata_field(
+            project_id=project_id,
+            collection_name=collection_name,
+            metadata_field=metadata_field,
+            quantile_value=quantile_value,
+        ),
         collection_name=collection_name,
         metadata_field=metadata_field,
         quantile_value=quantile_value,
@@ -417,8 +454,14 @@ async def get_compute_session_length_per_metadata(
         bottom_quantile,
         average,
         top_quantile,
-    ) = await compute_session_length_per_metadata(
-        project_id=project_id,
+    ) = await cached_result(
+        "session_length_per_metadata_quantiles",
+        project_id,
+        lambda: compute_session_length_per_metadata(
+            project_id=project_id,
+            metadata_field=metadata_field,
+            quantile_value=quantile_value,
+        ),
         metadata_field=metadata_field,
         quantile_value=quantile_value,
     )
@@ -447,8 +490,14 @@ async def get_successrate_stats(
         bottom_quantile,
         average,
         top_quantile,
-    ) = await compute_successrate_metadata_quantiles(
-        project_id, metadata_field, collection_name=collection_name
+    ) = await cached_result(
+        "successrate_metadata_quantiles",
+        project_id,
+        lambda: compute_successrate_metadata_quantiles(
+            project_id, metadata_field, collection_name=collection_name
+        ),
+        metadata_field=metadata_field,
+        collection_name=collection_name,
     )
 
     return {
@@ -472,8 +521,13 @@ async def get_dashboard_graphs(
         metric = DashboardMetricsFilter()
     if metric.graph_name is None:
         metric.graph_name = []
-    output = await get_dashboard_aggregated_metrics(
-        project_id=project_id, metrics=metric.graph_name
+    output = await cached_result(
+        "dashboard_graphs",
+        project_id,
+        lambda: get_dashboard_aggregated_metrics(
+            project_id=project_id, metrics=metric.graph_name
+        ),
+        metrics=metric.graph_name,
     )
     return output
 
@@ -511,8 +565,14 @@ async def get_event_detection_metrics(
     # TODO : Use event_id instead of event_name
     filters.event_name = [event.event_name]
 
-    output = await get_events_aggregated_metrics(
-        project_id=project_id,
+    output = await cached_result(
+        "events_metrics",
+        project_id,
+        lambda: get_events_aggregated_metrics(
+            project_id=project_id,
+            metrics=metrics,
+            filters=filters,
+        ),
         metrics=metrics,
         filters=filters,
     )
@@ -1,6 +1,6 @@
 import datetime
-from typing import Dict, List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Dict, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
 from loguru import logger
 
 from phospho.models import ProjectDataFilters
@@ -9,19 +9,23 @@ from app.security.authentification import propelauth
 from app.security import verify_if_propelauth_user_can_access_project
 
 # Service
+from app.services.mongo.results_cache import cached_result
 from app.services.mongo.metadata import (
     collect_unique_metadata_field_values,
     fetch_count,
     calculate_average_for_metadata,
     calculate_top10_percent,
     calculate_bottom10_percent,
+    calculate_metadata_quantiles,
     fetch_user_metadata,
     collect_unique_metadata_fields,
     breakdown_by_sum_of_metadata_field,
 )
+from app.services.mongo.metadata_catalog import get_metadata_catalog
 
 # Models
 from app.api.platform.models import (
+    MetadataQuantilesResponse,
     MetadataValueResponse,
     UserMetadata,
     MetadataPivotResponse,
@@ -46,8 +50,14 @@ async def get_metadata_count(
     Get the number of different metadata values in a project.
     """
     await verify_if_propelauth_user_can_access_project(user, project_id)
-    count = await fetch_count(
-        project_id=project_id,
+    count = await cached_result(
+        "metadata_count",
+        project_id,
+        lambda: fetch_count(
+            project_id=project_id,
+            collection_name=collection_name,
+            metadata_field=metadata_field,
+        ),
         collection_name=collection_name,
         metadata_field=metadata_field,
     )
@@ -69,8 +79,14 @@ async def get_metadata_average(
     Get the average number of metadata values in a project.
     """
     await verify_if_propelauth_user_can_access_project(user, project_id)
-    average_metadata = await calculate_average_for_metadata(
-        project_id=project_id,
+    average_metadata = await cached_result(
+        "metadata_average",
+        project_id,
+        lambda: calculate_average_for_metadata(
+            project_id=project_id,
+            collection_name=collection_name,
+            metadata_field=metadata_field,
+        ),
         collection_name=collection_name,
         metadata_field=metadata_field,
     )
@@ -92,8 +108,14 @@ async def get_metadata_top10(
     Get the top 10% metadata values in a project.
     """
     await verify_if_propelauth_user_can_access_project(user, project_id)
-    top10_metadata = await calculate_top10_percent(
-        project_id=project_id,
+    top10_metadata = await cached_result(
+        "metadata_top10",
+        project_id,
+        lambda: calculate_top10_percent(
+            project_id=project_id,
+            collection_name=collection_name,
+            metadata_field=metadata_field,
+        ),
         collection_name=collection_name,
         metadata_field=metadata_field,
     )
@@ -115,14 +137,52 @@ async def get_metadata_bottom10(
     Get the bottom 10% metadata values in a project.
     """
     await verify_if_propelauth_user_can_access_project(user, project_id)
-    bottom10_metadata = await calculate_bottom10_percent(
-        project_id=project_id,
+    bottom10_metadata = await cached_result(
+        "metadata_bottom10",
+        project_id,
+        lambda: calculate_bottom10_percent(
+            project_id=project_id,
+            collection_name=collection_name,
+            metadata_field=metadata_field,
+        ),
         collection_name=collection_name,
         metadata_field=metadata_field,
     )
     return MetadataValueResponse(value=bottom10_metadata)
 
 
+@router.get(
+    "/metadata/{project_id}/quantiles/{metadata_field}",
+    description="Get the quantiles and the average of a number metadata field in a project.",
+    response_model=MetadataQuantilesResponse,
+)
+async def get_metadata_quantiles(
+    project_id: str,
+    metadata_field: str,
+    quantiles: List[float] = Query(default=[0.1, 0.5, 0.9]),
+    created_at_start: Optional[int] = None,
+    created_at_end: Optional[int] = None,
+    user: User = Depends(propelauth.require_user),
+) -> MetadataQuantilesResponse:
+    """
+    Get the quantiles and the average of a number metadata field of the tasks,
+    eg: the median of metadata.total_tokens. The quantiles are estimates.
+    """
+    await verify_if_propelauth_user_can_access_project(user, project_id)
+    if any(quantile < 0 or quantile > 1 for quantile in quantiles):
+        raise HTTPException(
+            status_code=400, detail="The quantiles must be between 0 and 1"
+        )
+    result = await calculate_metadata_quantiles(
+        project_id=project_id,
+        metadata_field=metadata_field,
+        quantiles=quantiles,
+        created_at_start=created_at_start,
+        created_at_end=created_at_end,
+    )
+    return MetadataQuantilesResponse.model_validate(result)
+
+
 @router.get(
     "/metadata/{project_id}/user/{user_id}",
     description="Get the metadata of a user in a project.",
@@ -157,11 +217,17 @@ async def get_metadata_fields(
     Get the list of all unique metadata fields names in a project.
     """
     await verify_if_propelauth_user_can_access_project(user, project_id)
-    unique_number_metadata_fields = await collect_unique_metadata_fields(
-        project_id=project_id, type="number"
+    unique_number_metadata_fields = await cached_result(
+        "metadata_fields",
+        project_id,
+        lambda: collect_unique_metadata_fields(project_id=project_id, type="number"),
+        type="number",
     )
-    unique_string_metadata_fields = await collect_unique_metadata_fields(
-        project_id=project_id, type="string"
+    unique_string_metadata_fields = await cached_result(
+        "metadata_fields",
+        project_id,
+        lambda: collect_unique_metadata_fields(project_id=project_id, type="string"),
+        type="string",
     )
     return {
         "number": unique_number_metadata_fields,
@@ -169,6 +235,29 @@ async def get_metadata_fields(
     }
 
 
+@router.get(
+    "/metadata/{project_id}/catalog",
+    description="Get the catalog of the metadata fields of a project: types, number of distinct values, min and max, most frequent values.",
+    response_model=List[dict],
+)
+async def get_metadata_catalog_of_project(
+    project_id: str,
+    user: User = Depends(propelauth.require_user),
+) -> List[dict]:
+    """
+    Get the catalog of the metadata fields of a project, the most used fields first.
+    The number of distinct values (cardinality) is an estimate.
+    """
+    await verify_if_propelauth_user_can_access_project(user, project_id)
+    catalog = await get_metadata_catalog(project_id)
+    if catalog is None:
+        raise HTTPException(
+            status_code=404,
+            detail="The metadata catalog of this project is not built yet",
+        )
+    return catalog
+
+
 @router.post(
     "/metadata/{project_id}/fields/values",
     description="Get a list of all unique metadata fields values in a project, with their associated unique values.",
@@ -182,8 +271,13 @@ async def get_metadata_fields_values(
     Get the list of all unique metadata fields values in a project.
     """
     await verify_if_propelauth_user_can_access_project(user, project_id)
-    metadata_fields_to_unique_values = await collect_unique_metadata_field_values(
-        project_id=project_id, type="string"
+    metadata_fields_to_unique_values = await cached_result(
+        "metadata_fields_values",
+        project_id,
+        lambda: collect_unique_metadata_field_values(
+            project_id=project_id, type="string"
+        ),
+        type="string",
     )
     return {
         "number": {},  # TODO: implement group of values/ranges?
@@ -217,13 +311,18 @@ async def post_metadata_pivot(
             pivot_query.filters.created_at_end.timestamp()
         )
 
-    pivot_table = await breakdown_by_sum_of_metadata_field(
-        project_id=project_id,
-        metric=pivot_query.metric,
-        metadata_field=pivot_query.metric_metadata,
-        breakdown_by=pivot_query.breakdown_by,
-        number_metadata_fields=pivot_query.number_metadata_fields,
-        category_metadata_fields=pivot_query.category_metadata_fields,
-        filters=pivot_query.filters,
+    pivot_table = await cached_result(
+        "metadata_pivot",
+        project_id,
+        lambda: breakdown_by_sum_of_metadata_field(
+            project_id=project_id,
+            metric=pivot_query.metric,
+            metadata_field=pivot_query.metric_metadata,
+            breakdown_by=pivot_query.breakdown_by,
+            number_metadata_fields=pivot_query.number_metadata_fields,
+            category_metadata_fields=pivot_query.category_metadata_fields,
+            filters=pivot_query.filters,
+        ),
+        pivot_query=pivot_query,
     )
     return MetadataPivotResponse(pivot_table=pivot_table)
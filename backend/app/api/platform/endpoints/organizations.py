@@ -10,6 +10,7 @@ from app.api.platform.models import (
 )
 from app.core import config
 from app.security.authentification import propelauth
+from app.security.cache import invalidate_org
 from app.services.mongo.emails import email_user_onboarding, send_payment_issue_email
 from app.services.mongo.organizations import (
     create_project_by_org,
@@ -116,6 +117,7 @@ def post_init_org(
             max_users=config.PLAN_HOBBY_MAX_USERS,
             metadata={"plan": "hobby", "initialized": True},
         )
+        invalidate_org(org_id)
         logger.info(
             f"Organization {org_id} initialized with max_users={config.PLAN_HOBBY_MAX_USERS} and plan=hobby"
         )
@@ -1,10 +1,17 @@
+import asyncio
 import datetime
+import os
 from typing import Dict, Optional, List
 
-from app.services.mongo.files import process_file_upload_into_log_events
+from app.services.mongo.files import (
+    count_upload_rows,
+    process_file_upload_into_log_events,
+    read_upload_columns,
+    save_upload_to_disk,
+)
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, UploadFile
+from fastapi.responses import FileResponse
 from loguru import logger
-import pandas as pd
 from propelauth_fastapi import User
 
 from app.api.platform.models import (
@@ -20,6 +27,7 @@ from app.api.platform.models import (
     OnboardingSurvey,
     Users,
     ProjectDataFilters,
+    Pagination,
     QuerySessionsTasksRequest,
 )
 from app.security.authentification import (
@@ -29,7 +37,6 @@ from app.security.authentification import (
 from app.services.mongo.projects import (
     delete_project_from_id,
     delete_project_related_resources,
-    email_project_tasks,
     get_all_events,
     get_all_sessions,
     get_all_tasks,
@@ -42,9 +49,15 @@ from app.services.mongo.projects import (
     collect_languages,
 )
 
+from app.services.mongo.exports import email_project_tasks, get_export_file_path
+from app.services.mongo.pagination import get_next_cursor
+from app.services.mongo.user_stats import get_users_next_cursor
 from app.services.mongo.search import (
-    search_tasks_in_project,
-    search_sessions_in_project,
+    get_next_offset,
+    get_session_ids,
+    get_sessions_of_results,
+    get_tasks_of_results,
+    search_in_project,
 )
 
 from app.services.mongo.extractor import collect_langsmith_data
@@ -145,7 +158,10 @@ async def post_sessions(
         pagination=query.pagination,
         sorting=query.sorting,
     )
-    return Sessions(sessions=sessions)
+    return Sessions(
+        sessions=sessions,
+        next_cursor=get_next_cursor(sessions, query.pagination, query.sorting),
+    )
 
 
 @router.get(
@@ -168,12 +184,16 @@ async def get_sessions(
 async def get_events(
     project_id: str,
     limit: int = 1000,
+    cursor: Optional[str] = None,
     user: User = Depends(propelauth.require_user),
 ) -> Events:
     project = await get_project_by_id(project_id)
     propelauth.require_org_member(user, project.org_id)
-    events = await get_all_events(project_id=project_id, limit=limit)
-    return Events(events=events)
+    events = await get_all_events(project_id=project_id, limit=limit, cursor=cursor)
+    return Events(
+        events=events,
+        next_cursor=get_next_cursor(events, Pagination(per_page=limit)),
+    )
 
 
 @router.post(
@@ -187,18 +207,34 @@ async def post_search_tasks(
     user: User = Depends(propelauth.require_user),
 ):
     """
-    Get the resulting session_ids of a semantic search in the project's sessions.
+    Get the resulting task_ids of a semantic search in the project's tasks.
     The search is based on embedding similarity of the text conversation to the query.
+
+    The results are paginated with limit and offset. With payload_only (default),
+    the full tasks are not returned.
     """
 
     project = await get_project_by_id(project_id)
     propelauth.require_org_member(user, project.org_id)
+    limit = min(
+        search_query.limit or config.SEARCH_DEFAULT_LIMIT, config.SEARCH_MAX_LIMIT
+    )
     # Perform the semantic search
-    relevant_tasks = await search_tasks_in_project(
+    results = await search_in_project(
         project_id=project_id,
         search_query=search_query.query,
+        limit=limit,
+        offset=search_query.offset,
+        keyword_prefilter=search_query.keyword_prefilter,
     )
-    return SearchResponse(task_ids=[task.id for task in relevant_tasks])
+    response = SearchResponse(
+        task_ids=[result.task_id for result in results],
+        results=results,
+        next_offset=get_next_offset(results, limit, search_query.offset),
+    )
+    if not search_query.payload_only:
+        response.relevant_tasks = await get_tasks_of_results(results)
+    return response
 
 
 @router.get(
@@ -236,15 +272,27 @@ async def post_search_sessions(
 
     project = await get_project_by_id(project_id)
     propelauth.require_org_member(user, project.org_id)
+    limit = min(
+        search_query.limit or config.SEARCH_DEFAULT_LIMIT, config.SEARCH_MAX_LIMIT
+    )
     # Perform the semantic search
-    relevant_tasks, relevant_sessions = await search_sessions_in_project(
+    results = await search_in_project(
         project_id=project_id,
         search_query=search_query.query,
+        limit=limit,
+        offset=search_query.offset,
+        keyword_prefilter=search_query.keyword_prefilter,
     )
-    return SearchResponse(
-        task_ids=[task.id for task in relevant_tasks],
-        session_ids=[session.id for session in relevant_sessions],
+    response = SearchResponse(
+        task_ids=[result.task_id for result in results],
+        session_ids=get_session_ids(results),
+        results=results,
+        next_offset=get_next_offset(results, limit, search_query.offset),
     )
+    if not search_query.payload_only:
+        response.relevant_tasks = await get_tasks_of_results(results)
+        response.relevant_sessions = await get_sessions_of_results(project_id, results)
+    return response
 
 
 @router.post(
@@ -282,7 +330,10 @@ async def post_tasks(
         sorting=query.sorting,
         pagination=query.pagination,
     )
-    return Tasks(tasks=tasks)
+    return Tasks(
+        tasks=tasks,
+        next_cursor=get_next_cursor(tasks, query.pagination, query.sorting),
+    )
 
 
 @router.get(
@@ -299,7 +350,7 @@ async def get_tasks(
 
 @router.get(
     "/projects/{project_id}/tasks/email",
-    description="Get an email with the tasks of a project in csv and xlsx format",
+    description="Get an email with links to download the tasks of a project in csv and parquet format",
 )
 async def email_tasks(
     project_id: str,
@@ -318,6 +369,19 @@ async def email_tasks(
     return {"status": "ok"}
 
 
+@router.get(
+    "/exports/{export_id}/{filename}",
+    description="Download an exported file. The link is sent by email.",
+)
+async def download_export(export_id: str, filename: str) -> FileResponse:
+    """
+    The random export_id of the link authorizes the download, so that the
+    link can be opened from the email.
+    """
+    path = await get_export_file_path(export_id, filename)
+    return FileResponse(path, filename=filename)
+
+
 @router.get(
     "/projects/{project_id}/tests",
     response_model=Tests,
@@ -381,14 +445,22 @@ async def add_events(
 )
 async def get_users(
     project_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
     user: User = Depends(propelauth.require_user),
 ) -> Users:
     """
-    Get metadata about the end-users of a project
+    Get metadata about the end-users of a project, the most active first.
+
+    Pass a limit to get the users page by page. To get the next page, pass the
+    next_cursor of the response as cursor.
     """
     await verify_if_propelauth_user_can_access_project(user, project_id)
-    users = await get_all_users_metadata(project_id)
-    return Users(users=users)
+    pagination = (
+        Pagination(page=0, per_page=limit, cursor=cursor) if limit is not None else None
+    )
+    users = await get_all_users_metadata(project_id, pagination)
+    return Users(users=users, next_cursor=get_users_next_cursor(users, pagination))
 
 
 @router.get(
@@ -453,44 +525,49 @@ async def post_upload_tasks(
             detail=f"Error: The extension {file_extension} is not supported (supported: {SUPPORTED_EXTENSIONS}).",
         )
 
-    # Read file content -> into memory
-    file_params = {}
+    # Copy the file to disk, it's read in chunks when it's processed. The file
+    # operations run in a thread, not to block the event loop.
     try:
-        if file_extension == "csv":
-            tasks_df = pd.read_csv(file.file, sep=None, **file_params)
-        elif file_extension == "xlsx":
-            tasks_df = pd.read_excel(file.file, **file_params)
-        else:
-            # This only happens if you add a new extension and forget to update the supported extensions list
-            raise NotImplementedError(
-                f"Error: The extension {file_extension} is not supported (supported: {SUPPORTED_EXTENSIONS})."
-            )
+        file_path = await asyncio.to_thread(
+            save_upload_to_disk, file.file, file_extension
+        )
     except Exception as e:
         raise HTTPException(
             status_code=400, detail=f"Error: Could not read the file content. {e}"
         )
 
-    # Strip and lowercase the columns
-    tasks_df.columns = tasks_df.columns.str.strip().str.lower()
-
-    # Verify if the required columns are present
-    required_columns = ["input", "output"]
-    missing_columns = set(required_columns) - set(tasks_df.columns)
-    if missing_columns:
+    try:
+        columns = await asyncio.to_thread(
+            read_upload_columns, file_path, file_extension
+        )
+        # Verify if the required columns are present
+        required_columns = ["input", "output"]
+        missing_columns = set(required_columns) - set(columns)
+        if missing_columns:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Error: Missing columns: {missing_columns}",
+            )
+        num_rows = await asyncio.to_thread(count_upload_rows, file_path, file_extension)
+    except HTTPException:
+        await asyncio.to_thread(os.remove, file_path)
+        raise
+    except Exception as e:
+        await asyncio.to_thread(os.remove, file_path)
         raise HTTPException(
-            status_code=400,
-            detail=f"Error: Missing columns: {missing_columns}",
+            status_code=400, detail=f"Error: Could not read the file content. {e}"
         )
 
-    # Process the csv file as a background task
+    # Process the file as a background task
     logger.info(f"File {file.filename} uploaded successfully. Processing tasks.")
     background_tasks.add_task(
         process_file_upload_into_log_events,
-        tasks_df=tasks_df,
+        file_path=file_path,
+        file_extension=file_extension,
         project_id=project_id,
         org_id=project.org_id,
     )
-    return {"status": "ok", "num_rows": tasks_df.shape[0]}
+    return {"status": "ok", "num_rows": num_rows}
 
 
 @router.post(
@@ -1,4 +1,6 @@
 from app.api.v2.models import (
+    BackfillJob,
+    BackfillJobs,
     Eval,
     Event,
     EventDefinition,
@@ -9,6 +11,7 @@ from app.api.v2.models import (
     ProjectUpdateRequest,
     SearchQuery,
     SearchResponse,
+    SearchResult,
     Session,
     Sessions,
     SessionUpdateRequest,
@@ -32,7 +35,12 @@ from .explore import (
     Pagination,
     QuerySessionsTasksRequest,
 )
-from .metadata import MetadataPivotQuery, MetadataPivotResponse, MetadataValueResponse
+from .metadata import (
+    MetadataPivotQuery,
+    MetadataPivotResponse,
+    MetadataQuantilesResponse,
+    MetadataValueResponse,
+)
 from .projects import AddEventsQuery, OnboardingSurvey, UploadTasksRequest
 from .tasks import AddEventRequest, RemoveEventRequest
 from .topics import Topic, Topics
@@ -7,3 +7,5 @@ class EventBackfillRequest(BaseModel):
     created_at_end: Optional[int] = None
     event_id: str
     sample_rate: float = Field(ge=0, le=1)
+    # Throughput cap, capped by the server
+    max_tasks_per_minute: Optional[int] = Field(default=None, ge=1)
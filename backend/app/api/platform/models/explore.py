@@ -23,6 +23,9 @@ class DashboardMetricsFilter(BaseModel):
 class Pagination(BaseModel):
     page: int = 1
     per_page: int = 10
+    # Continuation token returned as next_cursor by the previous page.
+    # If set, page is ignored.
+    cursor: Optional[str] = None
 
 
 class Sorting(BaseModel):
@@ -6,6 +6,17 @@ class MetadataValueResponse(BaseModel):
     value: float
 
 
+class MetadataQuantile(BaseModel):
+    quantile: float
+    value: float | None
+
+
+class MetadataQuantilesResponse(BaseModel):
+    count: int
+    average: float | None
+    quantiles: list[MetadataQuantile]
+
+
 class MetadataPivotResponse(BaseModel):
     pivot_table: list
 
@@ -15,6 +15,7 @@ from app.security import (
     verify_propelauth_org_owns_project_id,
     get_quota,
 )
+from app.security.authorization import record_usage
 from app.services.mongo.extractor import run_log_process, store_open_telemetry_data
 from app.services.mongo.emails import send_quota_exceeded_email
 from app.core import config
@@ -89,6 +90,9 @@ async def store_batch_of_log_events(
             logger.warning(f"Skip logevent processing due to unknown error: {e}")
             logged_events.append(LogError(error_in_log=str(e)))
 
+    # Keep the cached quota up to date until the next refresh
+    record_usage(org["org"].get("org_id"), len(logs_to_process))
+
     log_reply = LogReply(logged_events=logged_events)
     logger.debug(
         f"Project {project_id} replying to log request with {len(logged_events)}: {len(logs_to_process)} valid logs and {len(extra_logs_to_save)} extra logs to save."
@@ -1,24 +1,41 @@
 from typing import Optional
 from loguru import logger
 
-from fastapi import APIRouter, Depends, BackgroundTasks
+from fastapi import APIRouter, Depends, BackgroundTasks, HTTPException
+from fastapi.responses import StreamingResponse
 
 from app.api.v2.models import (
+    BackfillJob,
     ComputeJobsRequest,
     Sessions,
     Tasks,
     FlattenedTasks,
     FlattenedTasksRequest,
+    TasksStreamRequest,
+    Users,
 )
 
-from app.api.platform.models.explore import ProjectDataFilters
+from app.api.platform.models.explore import (
+    Pagination,
+    ProjectDataFilters,
+    QuerySessionsTasksRequest,
+)
 
 from app.security import authenticate_org_key, verify_propelauth_org_owns_project_id
 from app.services.mongo.projects import (
     get_all_sessions,
     get_all_tasks,
+    get_all_users_metadata,
     backcompute_recipes,
 )
+from app.services.mongo.backfills import get_backfill_job, run_backfill_job
+from app.services.mongo.exports import (
+    get_stream_fields,
+    stream_tasks_arrow,
+    stream_tasks_ndjson,
+)
+from app.services.mongo.pagination import get_next_cursor
+from app.services.mongo.user_stats import get_users_next_cursor
 from app.services.mongo.explore import (
     fetch_flattened_tasks,
     update_from_flattened_tasks,
@@ -35,11 +52,40 @@ router = APIRouter(tags=["Projects"])
 async def get_sessions(
     project_id: str,
     limit: int = 1000,
+    cursor: Optional[str] = None,
+    org: dict = Depends(authenticate_org_key),
+):
+    """
+    Get the sessions of a project, the most recent first. To get the next
+    sessions, pass the next_cursor of the response as cursor.
+    """
+    await verify_propelauth_org_owns_project_id(org, project_id)
+    pagination = Pagination(page=0, per_page=limit, cursor=cursor)
+    sessions = await get_all_sessions(project_id, pagination=pagination)
+    return Sessions(
+        sessions=sessions, next_cursor=get_next_cursor(sessions, pagination)
+    )
+
+
+@router.get(
+    "/projects/{project_id}/users",
+    response_model=Users,
+    description="Get the end-users of a project, with their stats",
+)
+async def get_users(
+    project_id: str,
+    limit: int = 1000,
+    cursor: Optional[str] = None,
     org: dict = Depends(authenticate_org_key),
 ):
+    """
+    Get the end-users of a project (metadata.user_id), the most active first.
+    To get the next users, pass the next_cursor of the response as cursor.
+    """
     await verify_propelauth_org_owns_project_id(org, project_id)
-    sessions = await get_all_sessions(project_id, limit)
-    return Sessions(sessions=sessions)
+    pagination = Pagination(page=0, per_page=limit, cursor=cursor)
+    users = await get_all_users_metadata(project_id, pagination)
+    return Users(users=users, next_cursor=get_users_next_cursor(users, pagination))
 
 
 @router.get(
@@ -50,6 +96,7 @@ async def get_sessions(
 async def get_tasks(
     project_id: str,
     limit: int = 1000,
+    cursor: Optional[str] = None,
     filters: Optional[ProjectDataFilters] = None,
     org: dict = Depends(authenticate_org_key),
 ) -> Tasks:
@@ -59,6 +106,7 @@ async def get_tasks(
     Args:
         project_id: The id of the project
         limit: The maximum number of tasks to return
+        cursor: The next_cursor of the previous response, to get the next tasks
         filters: This model is used to filter tasks in the get_tasks endpoint. The filters are applied as AND filters.
     """
     await verify_propelauth_org_owns_project_id(org, project_id)
@@ -67,8 +115,93 @@ async def get_tasks(
     if isinstance(filters.event_name, str):
         filters.event_name = [filters.event_name]
 
-    tasks = await get_all_tasks(project_id=project_id, limit=limit, filters=filters)
-    return Tasks(tasks=tasks)
+    pagination = Pagination(page=0, per_page=limit, cursor=cursor)
+    tasks = await get_all_tasks(
+        project_id=project_id, filters=filters, pagination=pagination
+    )
+    return Tasks(tasks=tasks, next_cursor=get_next_cursor(tasks, pagination))
+
+
+@router.post(
+    "/projects/{project_id}/tasks",
+    response_model=Tasks,
+    description="Get the tasks of a project, page by page",
+)
+async def post_tasks(
+    project_id: str,
+    query: Optional[QuerySessionsTasksRequest] = None,
+    org: dict = Depends(authenticate_org_key),
+) -> Tasks:
+    """
+    Get the tasks of a project matching the filters, page by page.
+
+    To get the next page, pass the next_cursor of the response as the cursor
+    of the pagination. next_cursor is None on the last page.
+    """
+    await verify_propelauth_org_owns_project_id(org, project_id)
+    if query is None:
+        query = QuerySessionsTasksRequest()
+    if query.pagination is None:
+        query.pagination = Pagination(page=0, per_page=1000)
+    if isinstance(query.filters.event_name, str):
+        query.filters.event_name = [query.filters.event_name]
+
+    tasks = await get_all_tasks(
+        project_id=project_id,
+        filters=query.filters,
+        pagination=query.pagination,
+        sorting=query.sorting,
+    )
+    return Tasks(
+        tasks=tasks,
+        next_cursor=get_next_cursor(tasks, query.pagination, query.sorting),
+    )
+
+
+@router.post(
+    "/projects/{project_id}/tasks/stream",
+    description="Stream the tasks of a project as NDJSON or as an Arrow IPC stream",
+)
+async def post_tasks_stream(
+    project_id: str,
+    stream_request: Optional[TasksStreamRequest] = None,
+    org: dict = Depends(authenticate_org_key),
+) -> StreamingResponse:
+    """
+    Stream all the tasks of a project matching the filters, the most recent first.
+    The tasks are read batch by batch from the database, so there is no limit on
+    the number of tasks.
+
+    - ndjson: one JSON task per line
+    - arrow: Arrow IPC stream, one record batch per batch of tasks. The dicts and
+    lists (eg: metadata, events) are JSON strings.
+    """
+    await verify_propelauth_org_owns_project_id(org, project_id)
+    if stream_request is None:
+        stream_request = TasksStreamRequest()
+    if isinstance(stream_request.filters.event_name, str):
+        stream_request.filters.event_name = [stream_request.filters.event_name]
+    fields = get_stream_fields(stream_request.fields)
+
+    if stream_request.format == "arrow":
+        return StreamingResponse(
+            stream_tasks_arrow(
+                project_id,
+                fields,
+                stream_request.filters,
+                stream_request.batch_size,
+            ),
+            media_type="application/vnd.apache.arrow.stream",
+        )
+    return StreamingResponse(
+        stream_tasks_ndjson(
+            project_id,
+            fields,
+            stream_request.filters,
+            stream_request.batch_size,
+        ),
+        media_type="application/x-ndjson",
+    )
 
 
 @router.post(
@@ -151,12 +284,35 @@ async def post_backcompute_job(
 
     job_ids = compute_job_request.job_ids[:NB_JOBS_LIMIT]
 
-    background_tasks.add_task(
-        backcompute_recipes,
+    backfill_jobs = await backcompute_recipes(
         project_id,
         job_ids,
         compute_job_request.filters,
         limit=limit,
     )
+    for backfill_job in backfill_jobs:
+        background_tasks.add_task(run_backfill_job, backfill_job.id)
+
+    return {
+        "message": "Backcompute job started",
+        "backfill_jobs": [backfill_job.model_dump() for backfill_job in backfill_jobs],
+    }
+
 
-    return {"message": "Backcompute job started"}
+@router.get(
+    "/projects/{project_id}/compute-jobs/{backfill_job_id}",
+    response_model=BackfillJob,
+    description="Get the progress of a backcompute job",
+)
+async def get_backcompute_job(
+    project_id: str,
+    backfill_job_id: str,
+    org: dict = Depends(authenticate_org_key),
+) -> BackfillJob:
+    await verify_propelauth_org_owns_project_id(org, project_id)
+    backfill_job = await get_backfill_job(project_id, backfill_job_id)
+    if backfill_job is None:
+        raise HTTPException(
+            status_code=404, detail=f"Backcompute job {backfill_job_id} not found"
+        )
+    return backfill_job
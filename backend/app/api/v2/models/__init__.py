@@ -17,6 +17,8 @@ from .log import (
 from .models import Model, ModelsResponse
 from .predict import PredictRequest, PredictResponse
 from .projects import (
+    BackfillJob,
+    BackfillJobs,
     ComputeJobsRequest,
     EventDefinition,
     FlattenedTasksRequest,
@@ -24,11 +26,12 @@ from .projects import (
     ProjectCreationRequest,
     Projects,
     ProjectUpdateRequest,
+    TasksStreamRequest,
     UserMetadata,
     Users,
     ProjectDataFilters,
 )
-from .search import SearchQuery, SearchResponse
+from .search import SearchQuery, SearchResponse, SearchResult
 from .sessions import Session, SessionCreationRequest, Sessions, SessionUpdateRequest
 from .tasks import (
     FlattenedTasks,
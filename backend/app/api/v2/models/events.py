@@ -7,6 +7,8 @@ from .log import MinimalLogEvent
 
 class Events(BaseModel):
     events: List[Event]
+    # Pass it as the cursor of the pagination to get the next page
+    next_cursor: Optional[str] = None
 
 
 class DetectEventsInTaskRequest(MinimalLogEvent):
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import List, Literal, Optional
 from pydantic import BaseModel, Field
 
 from app.db.models import (
@@ -44,6 +44,7 @@ class UserMetadata(BaseModel):
 
 class Users(BaseModel):
     users: List[UserMetadata]
+    next_cursor: Optional[str] = None
 
 
 class FlattenedTasksRequest(BaseModel):
@@ -52,6 +53,54 @@ class FlattenedTasksRequest(BaseModel):
     with_sessions: bool = True
 
 
+class TasksStreamRequest(BaseModel):
+    filters: ProjectDataFilters = Field(default_factory=ProjectDataFilters)
+    # The fields of the tasks to return. Default: all the fields
+    fields: Optional[List[str]] = None
+    # ndjson: one JSON task per line. arrow: Arrow IPC stream of record batches
+    format: Literal["ndjson", "arrow"] = "ndjson"
+    batch_size: int = Field(default=1000, ge=1, le=10000)
+
+
 class ComputeJobsRequest(BaseModel):
     job_ids: List[str]
     filters: ProjectDataFilters = Field(default_factory=ProjectDataFilters)
+
+
+class BackfillJob(BaseModel):
+    """
+    A job running a recipe on the existing tasks of a project, see
+    app.services.mongo.backfills
+    """
+
+    id: str
+    project_id: str
+    org_id: Optional[str] = None
+    recipe_id: str
+    status: Literal["running", "paused", "cancelled", "done", "failed"]
+    filters: ProjectDataFilters = Field(default_factory=ProjectDataFilters)
+    sample_rate: Optional[float] = None
+    # Maximum number of tasks to read
+    limit: Optional[int] = None
+    max_tasks_per_minute: int
+    # Estimated number of tasks to read
+    nb_tasks: int
+    # Checkpoint: the last task read, in the order of the backfill
+    cursor: Optional[str] = None
+    nb_scanned: int = 0
+    # Tasks sent to the extractor, the others were already processed
+    nb_dispatched: int = 0
+    # Job results billed, ie the LLM cost of the job in credits
+    nb_job_results: int = 0
+    nb_errors: int = 0
+    nb_attempts: int = 0
+    error: Optional[str] = None
+    # Seconds spent running, without the pauses
+    running_time: float = 0.0
+    tasks_per_second: Optional[float] = None
+    created_at: int
+    updated_at: int
+
+
+class BackfillJobs(BaseModel):
+    backfill_jobs: List[BackfillJob]
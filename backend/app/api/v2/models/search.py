@@ -1,10 +1,31 @@
 from app.db.models import Task, Session
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 
 
 class SearchQuery(BaseModel):
     query: str
+    # Number of results, defaults to SEARCH_DEFAULT_LIMIT
+    limit: Optional[int] = Field(default=None, ge=1)
+    offset: int = Field(default=0, ge=0)
+    # Only rank the tasks containing the keywords of the query, by a mix of
+    # vector similarity and keyword score
+    keyword_prefilter: bool = False
+    # Return the results built from the vector payloads, without the full
+    # tasks and sessions
+    payload_only: bool = True
+
+
+class SearchResult(BaseModel):
+    task_id: str
+    session_id: Optional[str] = None
+    created_at: Optional[int] = None
+    score: float
+    vector_score: float
+    keyword_score: Optional[float] = None
+    input_preview: Optional[str] = None
+    output_preview: Optional[str] = None
+    metadata: Optional[dict] = None
 
 
 class SearchResponse(BaseModel):
@@ -12,3 +33,6 @@ class SearchResponse(BaseModel):
     session_ids: Optional[List[str]] = None
     relevant_tasks: Optional[List[Task]] = None
     relevant_sessions: Optional[List[Session]] = None
+    results: Optional[List[SearchResult]] = None
+    # Offset of the next page, None if this is the last page
+    next_offset: Optional[int] = None
@@ -5,6 +5,8 @@ from app.db.models import Session
 
 class Sessions(BaseModel):
     sessions: List[Session]
+    # Pass it as the cursor of the pagination to get the next page
+    next_cursor: Optional[str] = None
 
 
 class SessionCreationRequest(BaseModel):
@@ -9,6 +9,8 @@ from app.utils import generate_uuid
 
 class Tasks(BaseModel):
     tasks: List[Task]
+    # Pass it as the cursor of the pagination to get the next page
+    next_cursor: Optional[str] = None
 
 
 class TaskCreationRequest(BaseModel):
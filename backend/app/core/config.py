@@ -3,6 +3,8 @@ App configuration file
 """
 
 import os
+import re
+import tempfile
 
 from dotenv import load_dotenv
 from loguru import logger
@@ -39,6 +41,50 @@ PLAN_HOBBY_MAX_NB_DETECTIONS = 10
 PLAN_HOBBY_MAX_USERS = 1
 PLAN_PRO_MAX_USERS = 15
 
+### ROLLUPS ###
+# Number of days of counters recomputed every hour for the active projects
+ROLLUPS_RECOMPUTE_DAYS = 2
+# Maximum number of projects backfilled every hour
+ROLLUPS_MAX_BACKFILLS_PER_RUN = 20
+# Number of days of tasks aggregated at once when the counters are recomputed
+ROLLUPS_PAGE_DAYS = 30
+
+### METADATA CATALOG ###
+# Maximum number of projects whose metadata catalog is built every hour
+METADATA_CATALOG_MAX_BUILDS_PER_RUN = 20
+
+### QUANTILE SKETCHES ###
+# Maximum number of projects whose quantile sketches are built every hour
+QUANTILE_SKETCHES_MAX_BUILDS_PER_RUN = 20
+
+### USER STATS ###
+# Maximum number of projects whose user stats are built every hour
+USER_STATS_MAX_BUILDS_PER_RUN = 20
+
+### BACKFILLS ###
+# Number of tasks sent to the extractor per request, see app.services.mongo.backfills
+BACKFILL_CHUNK_SIZE = int(os.getenv("BACKFILL_CHUNK_SIZE", 100))
+# Maximum number of tasks sent to the extractor per minute, per backfill job
+BACKFILL_MAX_TASKS_PER_MINUTE = int(os.getenv("BACKFILL_MAX_TASKS_PER_MINUTE", 600))
+BACKFILL_MAX_RUNNING_JOBS_PER_PROJECT = 5
+# A backfill job is resumed at most this number of times
+BACKFILL_MAX_ATTEMPTS = 3
+# A running backfill job without progress for this long (seconds) is resumed
+BACKFILL_STALE_AFTER = 600
+# Timeout (seconds) of the extractor processing a chunk, below BACKFILL_STALE_AFTER
+BACKFILL_CHUNK_TIMEOUT = int(os.getenv("BACKFILL_CHUNK_TIMEOUT", 300))
+
+### RESULTS CACHE ###
+# Cache of the explore and metadata results, see app.services.mongo.results_cache
+RESULTS_CACHE_ENABLED = os.getenv("RESULTS_CACHE_ENABLED", "true") == "true"
+# Also store the results in MongoDB, to share them between the instances
+RESULTS_CACHE_SHARED = os.getenv("RESULTS_CACHE_SHARED", "false") == "true"
+RESULTS_CACHE_TTL = 60  # in seconds, a result is fresh for this time at most
+# in seconds, stale results older than this are recomputed before being returned
+RESULTS_CACHE_MAX_STALE = 600
+RESULTS_CACHE_MAX_SIZE = 1000  # number of results kept in memory
+RESULTS_CACHE_VERSION_TTL = 5  # in seconds, the data versions are kept in memory
+
 ### DOCUMENTATION ##
 
 ADMIN_EMAIL = "notifications@phospho.app"  # Used when new users sign up
@@ -48,11 +94,63 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 ### Vector Search ###
 QDRANT_URL = os.getenv("QDRANT_URL")
-if QDRANT_URL is None:
-    raise Exception("QDRANT_URL is missing from the environment variables")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
-if QDRANT_API_KEY is None:
-    raise Exception("QDRANT_API_KEY is missing from the environment variables")
+# "qdrant", or "local" for the in-process index of phospho.lab.vector_index.
+# Defaults to "local" if QDRANT_URL is not set.
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "qdrant" if QDRANT_URL else "local")
+if VECTOR_INDEX == "qdrant":
+    if QDRANT_URL is None:
+        raise Exception("QDRANT_URL is missing from the environment variables")
+    if QDRANT_API_KEY is None:
+        raise Exception("QDRANT_API_KEY is missing from the environment variables")
+# Directory of the local index. Set the same directory in the backend and in
+# the extractor to search the tasks vectorized by the extractor. If not set, the
+# index is in a temporary directory.
+LOCAL_VECTOR_INDEX_PATH = os.getenv("LOCAL_VECTOR_INDEX_PATH")
+if VECTOR_INDEX == "local" and LOCAL_VECTOR_INDEX_PATH is None:
+    if ENVIRONMENT in ["production", "staging"]:
+        raise Exception(
+            "QDRANT_URL or LOCAL_VECTOR_INDEX_PATH is missing from the environment variables"
+        )
+    logger.warning(
+        "LOCAL_VECTOR_INDEX_PATH is not set: the local vector index is in a temporary directory and the tasks vectorized by the extractor can't be searched"
+    )
+
+### EMBEDDINGS ###
+# "provider:model", see phospho.lab.embeddings. Must be the same in the backend
+# and in the extractor.
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "openai:text-embedding-3-small")
+# The vectors of different models can't be compared, so each model has its own
+# Qdrant collection. The tasks embedded with the default model are in "tasks".
+QDRANT_COLLECTION_NAME = (
+    "tasks"
+    if EMBEDDING_MODEL == "openai:text-embedding-3-small"
+    else "tasks_" + re.sub(r"[^a-zA-Z0-9]+", "_", EMBEDDING_MODEL)
+)
+# Local models: number of processes and batch size of the inference
+EMBEDDING_LOCAL_MAX_WORKERS = int(os.getenv("EMBEDDING_LOCAL_MAX_WORKERS", 2))
+EMBEDDING_LOCAL_BATCH_SIZE = 64
+
+### SEARCH ###
+# Semantic search in the tasks, see app.services.mongo.search
+SEARCH_EMBEDDING_CACHE_TTL = 86400  # in seconds, the query embeddings are cached
+SEARCH_EMBEDDING_CACHE_MAX_SIZE = 1000  # number of query embeddings kept in memory
+SEARCH_DEFAULT_LIMIT = 10
+SEARCH_MAX_LIMIT = 100
+# Number of tasks matching the keywords of the query ranked by vector similarity
+SEARCH_MAX_KEYWORD_CANDIDATES = 1000
+# Weight of the vector similarity in the score of a hybrid search, the rest is
+# the keyword score
+SEARCH_VECTOR_WEIGHT = 0.7
+# Hybrid search (keyword_prefilter) uses a text index on the input and output of
+# the tasks. Every logged task adds all its words to this index, which slows
+# down the inserts of the extractor, so the index is only created when enabled.
+SEARCH_KEYWORD_PREFILTER_ENABLED = (
+    os.getenv("SEARCH_KEYWORD_PREFILTER_ENABLED", "false") == "true"
+)
+# Number of characters of the previews, same as QDRANT_PAYLOAD_PREVIEW_LENGTH in
+# the extractor. Used for the tasks vectorized before the previews were stored.
+SEARCH_PREVIEW_LENGTH = 200
 
 ### WATCHERS ###
 OPENAI_MODEL_ID = "gpt-4"  # "gpt-4"
@@ -77,6 +175,11 @@ SENTRY_DSN = os.getenv("SENTRY_DSN")
 ### PROPELAUTH ###
 PROPELAUTH_URL = os.getenv("PROPELAUTH_URL")
 PROPELAUTH_API_KEY = os.getenv("PROPELAUTH_API_KEY")
+# Cache of the API keys, projects owners and orgs plans
+AUTH_CACHE_TTL = 60  # in seconds
+AUTH_NEGATIVE_CACHE_TTL = 10  # in seconds, for invalid API keys and unknown projects
+AUTH_CACHE_MAX_SIZE = 10_000
+USAGE_QUOTA_CACHE_TTL = 10  # in seconds
 if ENVIRONMENT == "test":
     PHOSPHO_ORG_ID = "3fe248a3-834c-4c26-8dcc-4e55112f702d"
 else:
@@ -115,6 +218,26 @@ elif ENVIRONMENT == "staging":
 else:
     PHOSPHO_FRONTEND_URL = "http://localhost:3000"
 
+### EXPORTS ###
+# URL of this backend, used in the download links of the exports
+if ENVIRONMENT == "production":
+    PHOSPHO_BACKEND_URL = os.getenv("PHOSPHO_BACKEND_URL", "https://api.phospho.ai")
+else:
+    PHOSPHO_BACKEND_URL = os.getenv("PHOSPHO_BACKEND_URL", "http://localhost:8000")
+# Directory of the exported files. With several instances of the backend, this
+# must be a shared volume (eg: a mounted bucket): the download links can be
+# requested on any instance, and the temporary directory of Cloud Run is in
+# memory.
+EXPORTS_DIR = os.getenv("EXPORTS_DIR")
+if EXPORTS_DIR is None:
+    if ENVIRONMENT in ["production", "staging"]:
+        raise Exception(
+            "EXPORTS_DIR is missing from the environment variables. Set it to a volume shared by the instances."
+        )
+    EXPORTS_DIR = os.path.join(tempfile.gettempdir(), "phospho-exports")
+EXPORTS_PAGE_SIZE = 1000  # number of tasks read and written at once
+EXPORTS_EXPIRATION_DAYS = 7
+
 if ENVIRONMENT == "production":
     PRO_PLAN_STRIPE_PRICE_ID = "price_1PC0wPKMbS7I1rNcv09yd05H"
 else:
@@ -141,6 +264,23 @@ if ENVIRONMENT != "preview":
         logger.warning("ANYSCALE_API_KEY is missing from the environment variables")
 
 CSV_UPLOAD_MAX_ROWS = 100000
+
+### REQUESTS ###
+# Maximum size of a gzip request body once decompressed, in bytes
+MAX_DECOMPRESSED_REQUEST_SIZE = 100 * 1024 * 1024
+
+### UPLOADS ###
+# Directory where the uploaded task files are stored until they're processed.
+# In production, this must be a mounted volume: the temporary directory of
+# Cloud Run is in memory.
+UPLOADS_DIR = os.getenv("UPLOADS_DIR")
+if UPLOADS_DIR is None:
+    if ENVIRONMENT in ["production", "staging"]:
+        raise Exception(
+            "UPLOADS_DIR is missing from the environment variables. Set it to a mounted volume."
+        )
+    UPLOADS_DIR = os.path.join(tempfile.gettempdir(), "phospho-uploads")
+UPLOAD_BATCH_SIZE = 500  # number of rows read and sent to the extractor at once
 FINE_TUNING_MINIMUM_DOCUMENTS = 20
 
 ### PHOSPHO AI HUB ###
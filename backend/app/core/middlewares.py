@@ -0,0 +1,67 @@
+import zlib
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class GZipRequestMiddleware:
+    """
+    Decompress the bodies of the requests sent with Content-Encoding: gzip, eg:
+    the batches of phospho.bulk_import.
+
+    The decompressed body is limited to max_size bytes.
+    """
+
+    def __init__(self, app: ASGIApp, max_size: int) -> None:
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = [
+            (key, value)
+            for key, value in scope["headers"]
+            if key.lower() not in [b"content-encoding", b"content-length"]
+        ]
+        content_encoding = dict(scope["headers"]).get(b"content-encoding", b"")
+        if content_encoding.strip().lower() != b"gzip":
+            await self.app(scope, receive, send)
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            decompressed_body = decompressor.decompress(body, self.max_size + 1)
+        except zlib.error:
+            response = JSONResponse(
+                {"detail": "The request body is not valid gzip"}, status_code=400
+            )
+            await response(scope, receive, send)
+            return
+        if len(decompressed_body) > self.max_size:
+            response = JSONResponse(
+                {"detail": f"The request body is larger than {self.max_size} bytes"},
+                status_code=413,
+            )
+            await response(scope, receive, send)
+            return
+
+        headers.append((b"content-length", str(len(decompressed_body)).encode()))
+        body_sent = False
+
+        async def receive_decompressed() -> Message:
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": decompressed_body}
+
+        await self.app({**scope, "headers": headers}, receive_decompressed, send)
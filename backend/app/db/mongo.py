@@ -6,6 +6,7 @@ from app.core.config import (
     MONGODB_MINPOOLSIZE,
     MONGODB_NAME,
     MONGODB_URL,
+    SEARCH_KEYWORD_PREFILTER_ENABLED,
 )
 from motor.motor_asyncio import AsyncIOMotorClient
 
@@ -55,6 +56,18 @@ async def connect_and_init_db():
             mongo_db[MONGODB_NAME]["sessions"].create_index(
                 ["project_id", ("created_at", pymongo.DESCENDING)], background=True
             )
+            mongo_db[MONGODB_NAME]["sessions"].create_index(
+                ["project_id", "tasks_updated_at"], background=True
+            )
+            # Cursor pagination
+            mongo_db[MONGODB_NAME]["sessions"].create_index(
+                [
+                    "project_id",
+                    ("created_at", pymongo.DESCENDING),
+                    ("id", pymongo.DESCENDING),
+                ],
+                background=True,
+            )
 
             # Tasks
             mongo_db[MONGODB_NAME]["tasks"].create_index(
@@ -82,6 +95,16 @@ async def connect_and_init_db():
                 ["project_id", "test_id", ("created_at", pymongo.ASCENDING)],
                 background=True,
             )
+            # Cursor pagination
+            mongo_db[MONGODB_NAME]["tasks"].create_index(
+                [
+                    "project_id",
+                    "test_id",
+                    ("created_at", pymongo.DESCENDING),
+                    ("id", pymongo.DESCENDING),
+                ],
+                background=True,
+            )
             mongo_db[MONGODB_NAME]["tasks"].create_index(
                 ["project_id", "flag"], background=True
             )
@@ -106,6 +129,10 @@ async def connect_and_init_db():
             mongo_db[MONGODB_NAME]["evals"].create_index(
                 ["project_id", "source", "value"], background=True
             )
+            mongo_db[MONGODB_NAME]["evals"].create_index(
+                ["project_id", "value", ("created_at", pymongo.DESCENDING)],
+                background=True,
+            )
 
             # Events
             mongo_db[MONGODB_NAME]["events"].create_index(
@@ -135,66 +162,100 @@ async def connect_and_init_db():
                 ["project_id", ("created_at", pymongo.DESCENDING)], background=True
             )
 
-            try:
-                await mongo_db[MONGODB_NAME].command(
-                    {
-                        "create": "sessions_with_events",
-                        "viewOn": "sessions",
-                        "pipeline": [
-                            {
-                                "$lookup": {
-                                    "from": "events",
-                                    "localField": "id",
-                                    "foreignField": "session_id",
-                                    "as": "events",
-                                },
-                            },
-                            {
-                                "$addFields": {
-                                    "events": {
-                                        "$filter": {
-                                            "input": "$events",
-                                            "as": "event",
-                                            "cond": {"$ne": ["$$event.removed", True]},
-                                        }
-                                    }
-                                }
-                            },
-                        ],
-                    }
-                )
-            except Exception as e:
-                logger.info("sessions_with_events already exists")
-            try:
-                await mongo_db[MONGODB_NAME].command(
-                    {
-                        "create": "tasks_with_events",
-                        "viewOn": "tasks",
-                        "pipeline": [
-                            {
-                                "$lookup": {
-                                    "from": "events",
-                                    "localField": "id",
-                                    "foreignField": "task_id",
-                                    "as": "events",
-                                },
-                            },
-                            {
-                                "$addFields": {
-                                    "events": {
-                                        "$filter": {
-                                            "input": "$events",
-                                            "as": "event",
-                                            "cond": {"$ne": ["$$event.removed", True]},
-                                        }
-                                    }
-                                }
-                            },
-                        ],
-                    }
+            # The events of the tasks and sessions are stored on the documents
+            mongo_db[MONGODB_NAME]["tasks"].create_index(
+                ["project_id", "events.event_name"], background=True
+            )
+            mongo_db[MONGODB_NAME]["sessions"].create_index(
+                ["project_id", "events.event_name"], background=True
+            )
+            # Keyword search in the tasks of a project, see app.services.mongo.search
+            # Only when enabled, as the text index slows down the inserts of tasks
+            if SEARCH_KEYWORD_PREFILTER_ENABLED:
+                mongo_db[MONGODB_NAME]["tasks"].create_index(
+                    [
+                        ("project_id", pymongo.ASCENDING),
+                        ("input", pymongo.TEXT),
+                        ("output", pymongo.TEXT),
+                    ],
+                    name="project_id_input_output_text",
+                    default_language="none",
+                    background=True,
                 )
-            except Exception as e:
-                logger.info("tasks_with_events already exists")
+
+            # Usage
+            mongo_db[MONGODB_NAME]["job_results"].create_index(
+                "org_id", background=True
+            )
+            mongo_db[MONGODB_NAME]["org_usage"].create_index(
+                "org_id", unique=True, background=True
+            )
+            mongo_db[MONGODB_NAME]["rollups"].create_index(
+                ["project_id", "dimension", "granularity", "period_start", "value"],
+                unique=True,
+                background=True,
+            )
+            mongo_db[MONGODB_NAME]["rollups_status"].create_index(
+                "project_id", unique=True, background=True
+            )
+            mongo_db[MONGODB_NAME]["task_positions_status"].create_index(
+                "project_id", unique=True, background=True
+            )
+            mongo_db[MONGODB_NAME]["quantile_sketches"].create_index(
+                ["project_id", "metric", "day"], unique=True, background=True
+            )
+            mongo_db[MONGODB_NAME]["quantile_sketches_status"].create_index(
+                "project_id", unique=True, background=True
+            )
+            mongo_db[MONGODB_NAME]["user_stats"].create_index(
+                ["project_id", "user_id"], unique=True, background=True
+            )
+            mongo_db[MONGODB_NAME]["user_stats"].create_index(
+                [
+                    "project_id",
+                    ("nb_tasks", pymongo.DESCENDING),
+                    ("user_id", pymongo.DESCENDING),
+                ],
+                background=True,
+            )
+            mongo_db[MONGODB_NAME]["user_stats_status"].create_index(
+                "project_id", unique=True, background=True
+            )
+            mongo_db[MONGODB_NAME]["backfill_jobs"].create_index(
+                "id", unique=True, background=True
+            )
+            mongo_db[MONGODB_NAME]["backfill_jobs"].create_index(
+                ["status", "updated_at"], background=True
+            )
+            mongo_db[MONGODB_NAME]["backfill_jobs"].create_index(
+                ["project_id", "created_at"], background=True
+            )
+            mongo_db[MONGODB_NAME]["job_results"].create_index(
+                ["job_metadata.recipe_id", "task_id"], background=True
+            )
+            mongo_db[MONGODB_NAME]["metadata_catalog"].create_index(
+                ["project_id", "field"], unique=True, background=True
+            )
+            mongo_db[MONGODB_NAME]["metadata_catalog_status"].create_index(
+                "project_id", unique=True, background=True
+            )
+            mongo_db[MONGODB_NAME]["projects_data_versions"].create_index(
+                "project_id", unique=True, background=True
+            )
+            mongo_db[MONGODB_NAME]["results_cache"].create_index(
+                "key", unique=True, background=True
+            )
+            mongo_db[MONGODB_NAME]["results_cache"].create_index(
+                "expires_at", expireAfterSeconds=0, background=True
+            )
+
+            # Exports
+            mongo_db[MONGODB_NAME]["exports"].create_index(
+                "id", unique=True, background=True
+            )
+            mongo_db[MONGODB_NAME]["exports"].create_index(
+                "expires_at", expireAfterSeconds=0, background=True
+            )
 
             # EventDefinitions
             mongo_db[MONGODB_NAME]["event_definitions"].create_index(
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 
 import sentry_sdk
@@ -6,11 +7,20 @@ from fastapi.middleware.cors import CORSMiddleware
 
 import phospho
 from app.core import config
+from app.core.middlewares import GZipRequestMiddleware
 from app.db.mongo import close_mongo_db, connect_and_init_db
 from app.db.qdrant import close_qdrant, init_qdrant
+from phospho.lab.embeddings import close_embedding_providers
 from app.services.mongo.extractor import check_health
 from app.services.mongo.ai_hub import check_health_ai_hub
 from app.api.v2.endpoints.cron import run_langsmith_sync_pipeline
+from app.services.mongo.organizations import reconcile_usage_counters
+from app.services.mongo.exports import delete_expired_exports
+from app.services.mongo.metadata_catalog import backfill_metadata_catalogs
+from app.services.mongo.quantile_sketches import backfill_quantile_sketches
+from app.services.mongo.backfills import resume_backfill_jobs
+from app.services.mongo.user_stats import backfill_user_stats
+from app.services.mongo.rollups import compact_rollups
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.jobstores.memory import MemoryJobStore
@@ -97,6 +107,8 @@ app.add_event_handler("shutdown", close_mongo_db)
 if config.ENVIRONMENT != "preview":
     app.add_event_handler("startup", init_qdrant)
     app.add_event_handler("shutdown", close_qdrant)
+    # Stop the worker processes of the local embedding models
+    app.add_event_handler("shutdown", close_embedding_providers)
 else:
     logging.info("Not initializing Qdrant in preview mode.")
 
@@ -144,6 +156,10 @@ api_v2 = FastAPI(
         "email": "contact@phospho.app",
     },
 )
+# The SDK can compress the large batches of logs
+api_v2.add_middleware(
+    GZipRequestMiddleware, max_size=config.MAX_DECOMPRESSED_REQUEST_SIZE
+)
 
 api_v2.include_router(evals.router)
 api_v2.include_router(files.router)
@@ -170,6 +186,7 @@ app.mount("/v0", api_v2)
 
 ### PLATEFORM ENDPOINTS ###
 from app.api.platform.endpoints import (
+    backfills,
     debug,
     events,
     explore,
@@ -188,6 +205,7 @@ api_platform.include_router(projects.router)
 api_platform.include_router(tasks.router)
 api_platform.include_router(sessions.router)
 api_platform.include_router(events.router)
+api_platform.include_router(backfills.router)
 api_platform.include_router(explore.router)
 api_platform.include_router(metadata.router)
 
@@ -207,3 +225,46 @@ scheduler.start()
 @scheduler.scheduled_job("interval", seconds=3600)
 async def run_cron_job():
     await run_langsmith_sync_pipeline()
+
+
+# We reconcile the usage counters of the orgs with the job results every day
+@scheduler.scheduled_job("interval", seconds=86400)
+async def run_usage_reconciliation_job():
+    await reconcile_usage_counters()
+
+
+# We recompute the recent dashboard counters of the active projects every hour
+@scheduler.scheduled_job("interval", seconds=3600)
+async def run_rollups_compaction_job():
+    await compact_rollups()
+
+
+# We build the metadata catalog of the projects created before it every hour
+@scheduler.scheduled_job("interval", seconds=3600)
+async def run_metadata_catalog_backfill_job():
+    await backfill_metadata_catalogs()
+
+
+# We build the user stats of the projects created before them every hour
+@scheduler.scheduled_job("interval", seconds=3600)
+async def run_user_stats_backfill_job():
+    await backfill_user_stats()
+
+
+# We build the quantile sketches of the projects created before them every hour
+@scheduler.scheduled_job("interval", seconds=3600)
+async def run_quantile_sketches_backfill_job():
+    await backfill_quantile_sketches()
+
+
+# We resume the backfill jobs that failed or stopped every 10 minutes
+@scheduler.scheduled_job("interval", seconds=600)
+async def run_backfill_jobs_resume_job():
+    await resume_backfill_jobs()
+
+
+# We delete the expired exported files every day
+@scheduler.scheduled_job("interval", seconds=86400)
+async def run_exports_cleanup_job():
+    # The files are deleted in a thread, not to block the event loop
+    await asyncio.to_thread(delete_expired_exports)
@@ -4,16 +4,23 @@ Handle all authentification related tasks.
 We now use Propelauth for authentification.
 """
 
+import hashlib
 from typing import Literal, Optional
 
 from fastapi import Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security.http import HTTPAuthorizationCredentials, HTTPBearer
 from fastapi.security.utils import get_authorization_scheme_param
 from loguru import logger
 from propelauth_fastapi import User, init_auth
+from propelauth_py.errors import (
+    EndUserApiKeyException,
+    EndUserApiKeyNotFoundException,
+)
 
 from app.core import config
 from app.db.mongo import get_mongo_db
+from app.security.cache import org_api_keys_cache, projects_org_id_cache
 
 propelauth = init_auth(config.PROPELAUTH_URL, config.PROPELAUTH_API_KEY)
 
@@ -32,7 +39,35 @@ def is_org_in_alpha(org: dict) -> bool:
     return org_metadata.get("is_in_alpha", False)
 
 
-def authenticate_org_key(
+async def validate_org_api_key(api_key_token: str) -> Optional[dict]:
+    """
+    Validate an org API key with PropelAuth. Returns None if the key is invalid.
+
+    The result is cached for AUTH_CACHE_TTL seconds (AUTH_NEGATIVE_CACHE_TTL
+    if the key is invalid). The PropelAuth call is blocking, so it runs in a thread.
+    """
+    # Don't keep the API keys in memory
+    cache_key = hashlib.sha256(api_key_token.encode()).hexdigest()
+    is_cached, org = org_api_keys_cache.get(cache_key)
+    if is_cached:
+        return org
+
+    try:
+        org = await run_in_threadpool(propelauth.validate_org_api_key, api_key_token)
+    except (EndUserApiKeyException, EndUserApiKeyNotFoundException) as e:
+        logger.debug(f"Caught Exception: {e}")
+        org_api_keys_cache.set(cache_key, None, ttl=config.AUTH_NEGATIVE_CACHE_TTL)
+        return None
+    except Exception as e:
+        # Errors of PropelAuth (rate limit, network,...) are not cached
+        logger.debug(f"Caught Exception: {e}")
+        return None
+
+    org_api_keys_cache.set(cache_key, org)
+    return org
+
+
+async def authenticate_org_key(
     authorization: HTTPAuthorizationCredentials = Depends(bearer),
 ) -> dict:
     """
@@ -41,11 +76,8 @@ def authenticate_org_key(
     # Parse credentials
     api_key_token = authorization.credentials
 
-    try:
-        org = propelauth.validate_org_api_key(api_key_token)
-
-    except Exception as e:
-        logger.debug(f"Caught Exception: {e}")
+    org = await validate_org_api_key(api_key_token)
+    if org is None:
         raise HTTPException(status_code=401, detail="Invalid token")
 
     logger.debug(
@@ -55,7 +87,7 @@ def authenticate_org_key(
     return org
 
 
-def authenticate_org_key_in_alpha(
+async def authenticate_org_key_in_alpha(
     authorization: HTTPAuthorizationCredentials = Depends(bearer),
 ) -> dict:
     """
@@ -65,19 +97,16 @@ def authenticate_org_key_in_alpha(
     # Parse credentials
     api_key_token = authorization.credentials
 
-    try:
-        org = propelauth.validate_org_api_key(api_key_token)
-
-        if not is_org_in_alpha(org):
-            raise HTTPException(
-                status_code=403,
-                detail="Organization not in the Alpha program. Request access at contact@phospho.app",
-            )
-
-    except Exception as e:
-        logger.debug(f"Caught Exception: {e}")
+    org = await validate_org_api_key(api_key_token)
+    if org is None:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+    if not is_org_in_alpha(org):
+        raise HTTPException(
+            status_code=403,
+            detail="Organization not in the Alpha program. Request access at contact@phospho.app",
+        )
+
     logger.debug(
         f"API key authentification for org {org['org']['org_id']} ending in {api_key_token[-4:]}"
     )
@@ -85,19 +114,17 @@ def authenticate_org_key_in_alpha(
     return org
 
 
-def authenticate_org_key_no_exception(request: Request) -> Optional[dict]:
+async def authenticate_org_key_no_exception(request: Request) -> Optional[dict]:
     """
     API key authentification for orgs. Does NOT raise an exception if the token is invalid.
     """
-    try:
-        # Parse credentials
-        authorization = request.headers.get("Authorization")
-        scheme, credentials = get_authorization_scheme_param(authorization)
-        if authorization is None or scheme.lower() != "bearer":
-            return None
-        org = propelauth.validate_org_api_key(credentials)
-    except Exception as e:
-        logger.debug(f"Caught Exception: {e}")
+    # Parse credentials
+    authorization = request.headers.get("Authorization")
+    scheme, credentials = get_authorization_scheme_param(authorization)
+    if authorization is None or scheme.lower() != "bearer":
+        return None
+    org = await validate_org_api_key(credentials)
+    if org is None:
         return None
 
     logger.debug(
@@ -107,6 +134,29 @@ def authenticate_org_key_no_exception(request: Request) -> Optional[dict]:
     return org
 
 
+async def get_project_org_id(project_id: str) -> Optional[str]:
+    """
+    Get the org_id of a project. Returns None if the project doesn't exist.
+
+    The result is cached for AUTH_CACHE_TTL seconds (AUTH_NEGATIVE_CACHE_TTL
+    if the project doesn't exist).
+    """
+    is_cached, org_id = projects_org_id_cache.get(project_id)
+    if is_cached:
+        return org_id
+
+    mongo_db = await get_mongo_db()
+    project_data = await mongo_db["projects"].find_one(
+        {"id": project_id}, {"_id": 0, "org_id": 1}
+    )
+    if not project_data:
+        projects_org_id_cache.set(project_id, None, ttl=config.AUTH_NEGATIVE_CACHE_TTL)
+        return None
+    org_id = project_data.get("org_id")
+    projects_org_id_cache.set(project_id, org_id)
+    return org_id
+
+
 async def verify_propelauth_org_owns_project_id(
     org: dict, project_id: str, bdd: Literal["firebase", "mongo"] = "mongo"
 ) -> None:
@@ -114,20 +164,18 @@ async def verify_propelauth_org_owns_project_id(
     Fetch the project and check that the org is the owner of the project.
     Used as a workaround when you don't know the org_id.
 
-    TODO : Add org_id to the documents to avoid this costy check.
+    The owner of the project is cached, see get_project_org_id.
     """
     org_id = org["org"].get("org_id")
     if not org_id:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    mongo_db = await get_mongo_db()
-    project_data = await mongo_db["projects"].find_one({"id": project_id})
-    if not project_data:
+    org_id_of_project = await get_project_org_id(project_id)
+    if org_id_of_project is None:
         raise HTTPException(
             status_code=404,
             detail=f"Project {project_id} not found",
         )
-    org_id_of_project = project_data.get("org_id")
 
     # Check that the org is the owner of the project
     if org_id != org_id_of_project:
@@ -1,55 +1,81 @@
-from app.db.mongo import get_mongo_db
-from app.security.authentification import propelauth
+from fastapi.concurrency import run_in_threadpool
+
+from app.security.authentification import get_project_org_id, propelauth
+from app.security.cache import orgs_plan_cache, usage_quota_cache
 from app.services.mongo.organizations import get_usage_quota
 
 
-async def get_quota(project_id: str) -> dict:
+async def get_org_plan(org_id: str) -> str:
     """
-    Get the quota of a project
+    Get the plan of an organization from the propelauth metadata.
+    The plan is cached for AUTH_CACHE_TTL seconds.
     """
-    mongo_db = await get_mongo_db()
-    project = await mongo_db["projects"].find_one({"id": project_id})
-    if not project:
-        raise ValueError(f"Project {project_id} not found for quota")
-    org_id = project["org_id"]
-    org = propelauth.fetch_org(org_id)
+    is_cached, org_plan = orgs_plan_cache.get(org_id)
+    if is_cached:
+        return org_plan
+
+    # The PropelAuth call is blocking
+    org = await run_in_threadpool(propelauth.fetch_org, org_id)
     if not org:
-        raise ValueError(f"Organization {org_id} not found for quota")
+        raise ValueError(f"Organization {org_id} not found")
+
+    # Default org_plan: org_plan = "hobby"
     org_plan = "hobby"
     org_metadata = org.get("metadata", None)
     if org_metadata:
         org_plan = org_metadata.get("plan", "hobby")
+
+    orgs_plan_cache.set(org_id, org_plan)
+    return org_plan
+
+
+async def get_org_quota(org_id: str) -> dict:
+    """
+    Get the quota of an organization.
+    The quota is cached for USAGE_QUOTA_CACHE_TTL seconds.
+    """
+    is_cached, usage = usage_quota_cache.get(org_id)
+    if is_cached:
+        # Copy, so that the callers can't modify the cached value
+        return dict(usage)
+
+    org_plan = await get_org_plan(org_id)
     usage = await get_usage_quota(org_id, org_plan)
-    return usage
+    usage_quota_cache.set(org_id, usage)
+    return dict(usage)
 
 
-async def authorize_main_pipeline(project_id: str) -> bool:
+def record_usage(org_id: str, nb_tasks: int) -> None:
     """
-    Authorize the main pipeline of a project
+    Add tasks to the cached usage of an organization, so that the quota stays
+    accurate between two refreshes of the cache.
     """
-    mongo_db = await get_mongo_db()
+    is_cached, usage = usage_quota_cache.get(org_id)
+    if is_cached and nb_tasks > 0:
+        usage["current_usage"] = usage.get("current_usage", 0) + nb_tasks
 
-    # Get the org_id from the project document in the db
-    project = await mongo_db["projects"].find_one({"id": project_id})
-    if not project:
-        raise ValueError(f"Project {project_id} not found for authorization")
-    # Get the organization plan from the propelauth metadata
-    org_id = project["org_id"]
-    org = propelauth.fetch_org(org_id)
-    if not org:
-        raise ValueError(f"Organization {org_id} not found for authorization")
 
-    # Default org_plan: org_plan = "hobby"
-    org_plan = "hobby"
+async def get_quota(project_id: str) -> dict:
+    """
+    Get the quota of a project
+    """
+    org_id = await get_project_org_id(project_id)
+    if not org_id:
+        raise ValueError(f"Project {project_id} not found for quota")
+    return await get_org_quota(org_id)
 
-    # Get the org plan
-    org_metadata = org.get("metadata", None)
 
-    if org_metadata:
-        org_plan = org_metadata.get("plan", "hobby")
+async def authorize_main_pipeline(project_id: str) -> bool:
+    """
+    Authorize the main pipeline of a project
+    """
+    # Get the org_id from the project document in the db
+    org_id = await get_project_org_id(project_id)
+    if not org_id:
+        raise ValueError(f"Project {project_id} not found for authorization")
 
     # Get the usage quota
-    usage = await get_usage_quota(org_id, org_plan)
+    usage = await get_org_quota(org_id)
 
     if usage["max_usage"] is None:
         return True
@@ -0,0 +1,77 @@
+"""
+In-memory caches used on the hot paths of the API (eg: /log)
+
+Every request authenticates an org API key, checks that the org owns the
+project and fetches the plan of the org. These values change rarely, so they
+are kept in memory for a short time instead of calling PropelAuth and MongoDB
+on every request. Negative results (invalid key, unknown project) are cached
+too, with a shorter TTL.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+from app.core import config
+
+
+class TTLCache:
+    """
+    A simple dict with a time to live on each entry and a maximum size.
+    When the cache is full, the least recently set entry is evicted.
+    """
+
+    def __init__(self, ttl: float, max_size: int = config.AUTH_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Returns (True, value) if the key is in the cache and not expired,
+        (False, None) otherwise. The value can be None (negative caching).
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return False, None
+        return True, value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if ttl is None:
+            ttl = self.ttl
+        self._data.pop(key, None)
+        self._data[key] = (time.monotonic() + ttl, value)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# Hash of the API key -> org returned by PropelAuth, or None if the key is invalid
+org_api_keys_cache = TTLCache(ttl=config.AUTH_CACHE_TTL)
+# project_id -> org_id of the project, or None if the project doesn't exist
+projects_org_id_cache = TTLCache(ttl=config.AUTH_CACHE_TTL)
+# org_id -> plan of the org
+orgs_plan_cache = TTLCache(ttl=config.AUTH_CACHE_TTL)
+# org_id -> usage quota of the org
+usage_quota_cache = TTLCache(ttl=config.USAGE_QUOTA_CACHE_TTL)
+
+
+def invalidate_project(project_id: str) -> None:
+    projects_org_id_cache.invalidate(project_id)
+
+
+def invalidate_org(org_id: str) -> None:
+    orgs_plan_cache.invalidate(org_id)
+    usage_quota_cache.invalidate(org_id)
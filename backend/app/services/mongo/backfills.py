@@ -0,0 +1,475 @@
+"""
+Backfill jobs: run a recipe on the existing tasks of a project
+
+A backfill job is stored in the backfill_jobs collection, with the filters of
+the tasks to process. The job reads the matching tasks chunk by chunk, the most
+recent first, with a cursor (see pagination.py): the tasks are never all loaded
+in memory. The tasks that already have a result for the recipe are skipped, and
+the ids of the others are sent to the extractor, which responds once they are
+processed.
+
+The job is checkpointed after each chunk: the cursor of the last task read and
+the metrics (tasks read and sent, job results billed, errors, running time). A
+job is sent at most max_tasks_per_minute tasks per minute, to not flood the LLM
+provider.
+
+A job can be paused, resumed and cancelled. The runner reads the status of the
+job before each chunk and stops when it's not running anymore. Only one runner
+processes a job: a runner stops when another one claimed the job (run_id).
+A job that failed, or that stopped because the backend restarted, is resumed
+from its checkpoint by resume_backfill_jobs. nb_attempts counts the runs since
+the last chunk processed: a job that fails BACKFILL_MAX_ATTEMPTS times in a row
+without progress is marked as failed and not resumed anymore.
+"""
+
+import asyncio
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from loguru import logger
+
+from app.api.v2.models.projects import BackfillJob
+from app.core import config
+from app.db.models import ProjectDataFilters, Recipe
+from app.db.mongo import get_mongo_db
+from app.services.mongo.extractor import run_recipe_on_task_ids
+from app.services.mongo.pagination import build_cursor_match, encode_cursor
+from app.services.mongo.tasks import task_filtering_pipeline_match
+from app.utils import generate_timestamp, generate_uuid
+
+# The most recent tasks first
+BACKFILL_SORTING = {"created_at": -1, "id": -1}
+# References to the resumed jobs, so that their tasks are not garbage collected
+running_backfill_tasks: Set[asyncio.Task] = set()
+
+
+def chunk(items: List[str], size: int) -> List[List[str]]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def get_tasks_per_second(nb_scanned: int, running_time: float) -> Optional[float]:
+    if running_time <= 0:
+        return None
+    return nb_scanned / running_time
+
+
+def to_backfill_job(job: dict) -> BackfillJob:
+    backfill_job = BackfillJob.model_validate(job)
+    backfill_job.tasks_per_second = get_tasks_per_second(
+        backfill_job.nb_scanned, backfill_job.running_time
+    )
+    return backfill_job
+
+
+def get_backfill_match(
+    project_id: str, filters: Optional[ProjectDataFilters] = None
+) -> Tuple[Dict[str, object], str]:
+    main_filter, collection = task_filtering_pipeline_match(
+        project_id=project_id, filters=filters, collection="tasks"
+    )
+    main_filter["test_id"] = None
+    return main_filter, collection
+
+
+async def get_next_tasks(backfill_job: BackfillJob) -> List[dict]:
+    """
+    The id and created_at of the next chunk of tasks of a job, after its cursor.
+    """
+    # At most a minute of tasks per chunk, so that a throttled job is
+    # checkpointed at least every minute
+    size = min(config.BACKFILL_CHUNK_SIZE, backfill_job.max_tasks_per_minute)
+    if backfill_job.limit is not None:
+        size = min(size, backfill_job.limit - backfill_job.nb_scanned)
+    if size <= 0:
+        return []
+
+    mongo_db = await get_mongo_db()
+    main_filter, collection = get_backfill_match(
+        backfill_job.project_id, backfill_job.filters
+    )
+    if backfill_job.sample_rate is not None:
+        main_filter["$sampleRate"] = backfill_job.sample_rate
+    if backfill_job.cursor is not None:
+        main_filter = {
+            "$and": [
+                main_filter,
+                build_cursor_match(BACKFILL_SORTING, backfill_job.cursor),
+            ]
+        }
+    pipeline: List[Dict[str, object]] = [
+        {"$match": main_filter},
+        {"$sort": BACKFILL_SORTING},
+        {"$limit": size},
+        {"$project": {"_id": 0, "id": 1, "created_at": 1}},
+    ]
+    return await mongo_db[collection].aggregate(pipeline).to_list(length=None)
+
+
+async def get_unprocessed_task_ids(recipe_id: str, task_ids: List[str]) -> List[str]:
+    """
+    The task ids without a job result for the recipe, in the same order.
+    """
+    mongo_db = await get_mongo_db()
+    processed_task_ids = set()
+    for task_ids_chunk in chunk(task_ids, config.BACKFILL_CHUNK_SIZE * 10):
+        processed_task_ids.update(
+            await mongo_db["job_results"].distinct(
+                "task_id",
+                {
+                    "job_metadata.recipe_id": recipe_id,
+                    "task_id": {"$in": task_ids_chunk},
+                },
+            )
+        )
+    return [task_id for task_id in task_ids if task_id not in processed_task_ids]
+
+
+async def check_nb_running_backfill_jobs(project_id: str, nb_new_jobs: int = 1) -> None:
+    """
+    Raise a 429 if the project can't run nb_new_jobs more backfill jobs
+    (BACKFILL_MAX_RUNNING_JOBS_PER_PROJECT).
+    """
+    mongo_db = await get_mongo_db()
+    nb_running_jobs = await mongo_db["backfill_jobs"].count_documents(
+        {"project_id": project_id, "status": "running"}
+    )
+    if nb_running_jobs + nb_new_jobs > config.BACKFILL_MAX_RUNNING_JOBS_PER_PROJECT:
+        raise HTTPException(
+            status_code=429,
+            detail=f"This project already has {nb_running_jobs} running backfill jobs. Wait for them to finish, or pause them.",
+        )
+
+
+async def create_backfill_job(
+    recipe: Recipe,
+    filters: Optional[ProjectDataFilters] = None,
+    limit: Optional[int] = None,
+    sample_rate: Optional[float] = None,
+    max_tasks_per_minute: Optional[int] = None,
+) -> BackfillJob:
+    """
+    Create a job running the recipe on the tasks matching the filters. Run it
+    with run_backfill_job.
+
+    max_tasks_per_minute is capped to BACKFILL_MAX_TASKS_PER_MINUTE.
+    """
+    mongo_db = await get_mongo_db()
+    if filters is None:
+        filters = ProjectDataFilters()
+
+    await check_nb_running_backfill_jobs(recipe.project_id)
+
+    main_filter, collection = get_backfill_match(recipe.project_id, filters)
+    nb_tasks = await mongo_db[collection].count_documents(main_filter)
+    if sample_rate is not None:
+        nb_tasks = round(nb_tasks * sample_rate)
+    if limit is not None:
+        nb_tasks = min(nb_tasks, limit)
+
+    if max_tasks_per_minute is None:
+        max_tasks_per_minute = config.BACKFILL_MAX_TASKS_PER_MINUTE
+    max_tasks_per_minute = min(
+        max(max_tasks_per_minute, 1), config.BACKFILL_MAX_TASKS_PER_MINUTE
+    )
+
+    now = generate_timestamp()
+    backfill_job = BackfillJob(
+        id=generate_uuid(),
+        project_id=recipe.project_id,
+        org_id=recipe.org_id,
+        recipe_id=recipe.id,
+        status="running",
+        filters=filters,
+        sample_rate=sample_rate,
+        limit=limit,
+        max_tasks_per_minute=max_tasks_per_minute,
+        nb_tasks=nb_tasks,
+        created_at=now,
+        updated_at=now,
+    )
+    await mongo_db["backfill_jobs"].insert_one(
+        backfill_job.model_dump(exclude={"tasks_per_second"})
+    )
+    return backfill_job
+
+
+async def claim_backfill_job(backfill_job_id: str, run_id: str) -> Optional[dict]:
+    """
+    Mark the job as processed by this runner. Returns None if the job is not
+    running or failed, eg: paused, cancelled or done.
+    """
+    mongo_db = await get_mongo_db()
+    result = await mongo_db["backfill_jobs"].update_one(
+        {"id": backfill_job_id, "status": {"$in": ["running", "failed"]}},
+        {
+            "$set": {
+                "status": "running",
+                "run_id": run_id,
+                "updated_at": generate_timestamp(),
+            },
+            "$inc": {"nb_attempts": 1},
+        },
+    )
+    if result.matched_count == 0:
+        return None
+    return await mongo_db["backfill_jobs"].find_one({"id": backfill_job_id}, {"_id": 0})
+
+
+async def is_claimed_and_running(backfill_job_id: str, run_id: str) -> bool:
+    mongo_db = await get_mongo_db()
+    job = await mongo_db["backfill_jobs"].find_one(
+        {"id": backfill_job_id, "run_id": run_id}, {"_id": 0, "status": 1}
+    )
+    return job is not None and job["status"] == "running"
+
+
+async def run_backfill_job(backfill_job_id: str) -> None:
+    """
+    Send the tasks of a job to the extractor, chunk by chunk, from its last
+    checkpoint.
+    """
+    mongo_db = await get_mongo_db()
+    run_id = generate_uuid()
+    job = await claim_backfill_job(backfill_job_id, run_id)
+    if job is None:
+        logger.info(f"Backfill job {backfill_job_id} is not running, not started")
+        return
+    backfill_job = to_backfill_job(job)
+
+    recipe = await mongo_db["recipes"].find_one({"id": backfill_job.recipe_id})
+    if recipe is None:
+        await mongo_db["backfill_jobs"].update_one(
+            {"id": backfill_job_id, "run_id": run_id},
+            {
+                "$set": {
+                    "status": "failed",
+                    "error": "Recipe not found",
+                    # Not resumed
+                    "nb_attempts": config.BACKFILL_MAX_ATTEMPTS,
+                },
+                "$inc": {"nb_errors": 1},
+            },
+        )
+        return
+    recipe = Recipe.model_validate(recipe)
+
+    next_chunk_at = time.monotonic()
+    while True:
+        chunk_started_at = time.monotonic()
+        # Throttling
+        if next_chunk_at > chunk_started_at:
+            await asyncio.sleep(next_chunk_at - chunk_started_at)
+        if not await is_claimed_and_running(backfill_job_id, run_id):
+            logger.info(f"Backfill job {backfill_job_id} stopped")
+            return
+
+        tasks = await get_next_tasks(backfill_job)
+        if len(tasks) == 0:
+            break
+        task_ids = await get_unprocessed_task_ids(
+            recipe.id, [task["id"] for task in tasks]
+        )
+        nb_job_results = 0
+        if len(task_ids) > 0:
+            dispatched_at = time.monotonic()
+            nb_job_results = await run_recipe_on_task_ids(
+                task_ids=task_ids, recipe=recipe, org_id=backfill_job.org_id
+            )
+            if nb_job_results is None:
+                await mongo_db["backfill_jobs"].update_one(
+                    {"id": backfill_job_id, "run_id": run_id},
+                    {
+                        "$set": {
+                            "status": "failed",
+                            "error": "Error calling the extractor",
+                            "updated_at": generate_timestamp(),
+                        },
+                        "$inc": {
+                            "nb_errors": 1,
+                            "running_time": time.monotonic() - chunk_started_at,
+                        },
+                    },
+                )
+                logger.error(f"Backfill job {backfill_job_id} failed, will be resumed")
+                return
+            next_chunk_at = (
+                dispatched_at + len(task_ids) * 60 / backfill_job.max_tasks_per_minute
+            )
+
+        # Checkpoint
+        backfill_job.cursor = encode_cursor(
+            {key: tasks[-1][key] for key in BACKFILL_SORTING}
+        )
+        backfill_job.nb_scanned += len(tasks)
+        await mongo_db["backfill_jobs"].update_one(
+            {"id": backfill_job_id, "run_id": run_id},
+            {
+                "$set": {
+                    "cursor": backfill_job.cursor,
+                    "error": None,
+                    # The job progresses, its next failure is a new attempt
+                    "nb_attempts": 0,
+                    "updated_at": generate_timestamp(),
+                },
+                "$inc": {
+                    "nb_scanned": len(tasks),
+                    "nb_dispatched": len(task_ids),
+                    "nb_job_results": nb_job_results,
+                    "running_time": time.monotonic() - chunk_started_at,
+                },
+            },
+        )
+
+    await mongo_db["backfill_jobs"].update_one(
+        {"id": backfill_job_id, "run_id": run_id, "status": "running"},
+        {"$set": {"status": "done", "error": None, "updated_at": generate_timestamp()}},
+    )
+    logger.info(f"Backfill job {backfill_job_id} done")
+
+
+async def get_backfill_job(
+    project_id: str, backfill_job_id: str
+) -> Optional[BackfillJob]:
+    mongo_db = await get_mongo_db()
+    job = await mongo_db["backfill_jobs"].find_one(
+        {"id": backfill_job_id, "project_id": project_id}, {"_id": 0}
+    )
+    if job is None:
+        return None
+    return to_backfill_job(job)
+
+
+async def get_backfill_jobs(project_id: str, limit: int = 100) -> List[BackfillJob]:
+    """
+    The backfill jobs of a project, the most recent first.
+    """
+    mongo_db = await get_mongo_db()
+    jobs = (
+        await mongo_db["backfill_jobs"]
+        .find({"project_id": project_id}, {"_id": 0})
+        .sort([("created_at", -1), ("id", -1)])
+        .limit(limit)
+        .to_list(length=limit)
+    )
+    return [to_backfill_job(job) for job in jobs]
+
+
+async def update_backfill_job_status(
+    project_id: str,
+    backfill_job_id: str,
+    previous_statuses: List[str],
+    update: dict,
+) -> BackfillJob:
+    """
+    Update a job if its status is one of previous_statuses. Raise a 404 if the
+    job doesn't exist and a 400 if it has another status.
+    """
+    mongo_db = await get_mongo_db()
+    result = await mongo_db["backfill_jobs"].update_one(
+        {
+            "id": backfill_job_id,
+            "project_id": project_id,
+            "status": {"$in": previous_statuses},
+        },
+        {"$set": {**update, "updated_at": generate_timestamp()}},
+    )
+    backfill_job = await get_backfill_job(project_id, backfill_job_id)
+    if backfill_job is None:
+        raise HTTPException(
+            status_code=404, detail=f"Backfill job {backfill_job_id} not found"
+        )
+    if result.matched_count == 0:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Backfill job {backfill_job_id} is {backfill_job.status}",
+        )
+    return backfill_job
+
+
+async def pause_backfill_job(project_id: str, backfill_job_id: str) -> BackfillJob:
+    """
+    Pause a job. Its runner stops before the next chunk.
+    """
+    return await update_backfill_job_status(
+        project_id, backfill_job_id, ["running"], {"status": "paused"}
+    )
+
+
+async def resume_backfill_job(project_id: str, backfill_job_id: str) -> BackfillJob:
+    """
+    Mark a paused or failed job as running. Run it with run_backfill_job.
+    """
+    return await update_backfill_job_status(
+        project_id,
+        backfill_job_id,
+        ["paused", "failed"],
+        {"status": "running", "error": None, "nb_attempts": 0},
+    )
+
+
+async def cancel_backfill_job(project_id: str, backfill_job_id: str) -> BackfillJob:
+    """
+    Cancel a job. Its runner stops before the next chunk, and it can't be
+    resumed.
+    """
+    return await update_backfill_job_status(
+        project_id,
+        backfill_job_id,
+        ["running", "paused", "failed"],
+        {"status": "cancelled"},
+    )
+
+
+async def resume_backfill_jobs() -> None:
+    """
+    Resume the failed jobs, and the running jobs without progress for
+    BACKFILL_STALE_AFTER seconds (eg: the backend restarted), unless they
+    already ran BACKFILL_MAX_ATTEMPTS times without progress.
+    """
+    mongo_db = await get_mongo_db()
+    stale_before = generate_timestamp() - config.BACKFILL_STALE_AFTER
+    # The jobs without progress after BACKFILL_MAX_ATTEMPTS runs are not
+    # resumed. They are marked as failed, so that they don't count as running.
+    await mongo_db["backfill_jobs"].update_many(
+        {
+            "status": "running",
+            "updated_at": {"$lt": stale_before},
+            "nb_attempts": {"$gte": config.BACKFILL_MAX_ATTEMPTS},
+        },
+        {
+            "$set": {
+                "status": "failed",
+                "error": f"No progress after {config.BACKFILL_MAX_ATTEMPTS} attempts",
+                "updated_at": generate_timestamp(),
+            }
+        },
+    )
+    jobs = (
+        await mongo_db["backfill_jobs"]
+        .find(
+            {
+                "$or": [
+                    {"status": "failed"},
+                    {"status": "running", "updated_at": {"$lt": stale_before}},
+                ],
+                "nb_attempts": {"$lt": config.BACKFILL_MAX_ATTEMPTS},
+            },
+            {"_id": 0, "id": 1},
+        )
+        .to_list(length=None)
+    )
+
+    async def resume(backfill_job_id: str) -> None:
+        try:
+            await run_backfill_job(backfill_job_id)
+        except Exception as e:
+            logger.error(f"Error resuming backfill job {backfill_job_id}: {e}")
+        finally:
+            running_backfill_tasks.discard(asyncio.current_task())
+
+    # The jobs are throttled, so they run concurrently, in the background: the
+    # scheduler can run this function again while they are running
+    for job in jobs:
+        running_backfill_tasks.add(asyncio.create_task(resume(job["id"])))
+    logger.info(f"Resumed {len(jobs)} backfill jobs")
@@ -2,9 +2,8 @@ from app.db.models import EventDefinition, Recipe
 from app.db.mongo import get_mongo_db
 from fastapi import HTTPException
 from loguru import logger
-from app.services.mongo.extractor import run_recipe_on_tasks
-from app.services.mongo.projects import get_all_tasks
-from app.api.platform.models import EventBackfillRequest
+from app.services.mongo.backfills import create_backfill_job
+from app.api.platform.models import BackfillJob, EventBackfillRequest
 from phospho.models import ProjectDataFilters
 
 
@@ -81,10 +80,11 @@ async def get_recipe_by_id(recipe_id: str) -> Recipe:
 
 
 async def run_event_detection_on_timeframe(
-    org_id: str, project_id: str, event_backfill_request: EventBackfillRequest
-) -> None:
+    project_id: str, event_backfill_request: EventBackfillRequest
+) -> BackfillJob:
     """
-    Run event detection on a given event_id and event_data
+    Create a backfill job detecting an event on the tasks of a timeframe.
+    Run it with run_backfill_job.
     """
     event_definition = await get_event_definition_from_event_id(
         project_id, event_backfill_request.event_id
@@ -93,15 +93,17 @@ async def run_event_detection_on_timeframe(
         logger.error(
             f"Event {event_definition.event_name} has no recipe_id for project {project_id}. Canceling."
         )
-        return
+        raise HTTPException(
+            status_code=400,
+            detail=f"Event {event_definition.event_name} has no recipe",
+        )
     recipe = await get_recipe_by_id(recipe_id=event_definition.recipe_id)
-    tasks = await get_all_tasks(
-        project_id=project_id,
+    return await create_backfill_job(
+        recipe,
         filters=ProjectDataFilters(
             created_at_start=event_backfill_request.created_at_start,
             created_at_end=event_backfill_request.created_at_end,
         ),
         sample_rate=event_backfill_request.sample_rate,
+        max_tasks_per_minute=event_backfill_request.max_tasks_per_minute,
     )
-    await run_recipe_on_tasks(tasks=tasks, recipe=recipe, org_id=org_id)
-    return None
@@ -16,9 +16,18 @@ from app.api.platform.models import ABTest, Topics, ProjectDataFilters
 from app.db.models import Eval, FlattenedTask
 from app.db.mongo import get_mongo_db
 from app.services.mongo.projects import (
+    cast_datetime_or_timestamp_to_timestamp,
     get_all_events,
     get_all_tasks,
 )
+from app.services.mongo.metrics_engine import StandaloneMetrics, compute_metrics
+from app.services.mongo.quantile_sketches import get_session_length_histogram
+from app.services.mongo.results_cache import bump_data_version
+from app.services.mongo.rollups import can_use_rollups, get_daily_counts, has_rollups
+from app.services.mongo.user_stats import (
+    compute_users_success_rate_quantiles,
+    has_user_stats,
+)
 from app.services.mongo.tasks import (
     get_total_nb_of_tasks,
     task_filtering_pipeline_match,
@@ -463,25 +472,75 @@ async def get_most_detected_event_name(
     return most_detected_event_name
 
 
-async def get_nb_of_daily_tasks(
-    project_id: str,
-    filters: ProjectDataFilters,
-    **kwargs,
-) -> List[dict]:
+def _daily_counts_to_df(
+    daily_counts: Dict[datetime.date, Dict[Optional[str], int]],
+    value: Optional[str],
+    column: str,
+) -> pd.DataFrame:
     """
-    Get the number of daily tasks of a project.
+    Convert the daily counts of the rollups to a dataframe with the date, the
+    timestamp of the start of the day and the count of value.
     """
-    tasks = await get_all_tasks(project_id=project_id, limit=None, filters=filters)
-    df = pd.DataFrame([task.model_dump() for task in tasks])
+    return pd.DataFrame(
+        [
+            {
+                "date": date,
+                "created_at": int(
+                    datetime.datetime.combine(
+                        date, datetime.time(), datetime.timezone.utc
+                    ).timestamp()
+                ),
+                column: counts.get(value, 0),
+            }
+            for date, counts in sorted(daily_counts.items())
+        ],
+        columns=["date", "created_at", column],
+    )
+
+
+# Group the documents by day (UTC). _id is the timestamp of the start of the day.
+DAY_START = {"$subtract": ["$created_at", {"$mod": ["$created_at", 86400]}]}
+DAILY_TASKS_STAGES: List[Dict[str, object]] = [
+    {
+        "$group": {
+            "_id": DAY_START,
+            "nb_tasks": {"$sum": 1},
+            "nb_success": {"$sum": {"$cond": [{"$eq": ["$flag", "success"]}, 1, 0]}},
+        }
+    },
+]
+DAILY_SESSIONS_STAGES: List[Dict[str, object]] = [
+    {"$group": {"_id": DAY_START, "nb_sessions": {"$sum": 1}}},
+]
 
-    if not df.empty:
-        # If start and end date are not provided, we take the first and last task date
-        if filters.created_at_start is None:
-            filters.created_at_start = df["created_at"].min()
-    else:
-        if filters.created_at_start is None:
-            filters.created_at_start = datetime.datetime.now().timestamp()
 
+def _daily_groups_to_df(result: List[dict], columns: List[str]) -> pd.DataFrame:
+    """
+    Convert the result of DAILY_TASKS_STAGES or DAILY_SESSIONS_STAGES to a dataframe
+    with the date, the timestamp of the start of the day and the columns.
+    """
+    df = pd.DataFrame(result, columns=["_id"] + columns)
+    df = df.rename(columns={"_id": "created_at"})
+    df["date"] = pd.to_datetime(df["created_at"], unit="s", utc=True).dt.date
+    if "nb_success" in columns:
+        df["success_rate"] = df["nb_success"] / df["nb_tasks"]
+    return df
+
+
+def _fill_missing_days(
+    per_day: pd.DataFrame, column: str, filters: ProjectDataFilters
+) -> List[dict]:
+    """
+    Add the days without data between the start and the end of the filters,
+    with a value of 0.
+
+    If start and end date are not provided, we take the first day and today.
+    """
+    if filters.created_at_start is None:
+        if not per_day.empty:
+            filters.created_at_start = per_day["created_at"].min()
+        else:
+            filters.created_at_start = datetime.datetime.now().timestamp()
     if filters.created_at_end is None:
         filters.created_at_end = datetime.datetime.now().timestamp()
 
@@ -493,28 +552,66 @@ async def get_nb_of_daily_tasks(
         freq="D",
     )
     complete_df = pd.DataFrame({"date": complete_date_range})
+    complete_df["date"] = pd.to_datetime(complete_df["date"]).dt.date
 
-    if not df.empty:
-        df["date"] = pd.to_datetime(df["created_at"], unit="s", utc=True).dt.date
-        # Group by date and count
-        nb_tasks_per_day = (
-            df.groupby(["date"])
-            .count()
-            .reset_index()[["date", "id"]]
-            .rename(columns={"id": "nb_tasks"})
+    if not per_day.empty:
+        result = pd.merge(
+            complete_df, per_day[["date", column]], on="date", how="left"
+        ).fillna(0)
+    else:
+        result = complete_df
+        result[column] = 0
+
+    return result[["date", column]].to_dict(orient="records")
+
+
+async def get_daily_tasks_df(
+    project_id: str,
+    filters: ProjectDataFilters,
+) -> pd.DataFrame:
+    """
+    Get the number of tasks and the success rate per day of a project.
+
+    Read from the rollups if the project has them and only dates are filtered.
+    """
+    daily_tasks = None
+    if can_use_rollups(filters):
+        daily_tasks = await get_daily_counts(
+            project_id, "tasks", filters.created_at_start, filters.created_at_end
+        )
+    if daily_tasks is not None:
+        daily_flags = await get_daily_counts(
+            project_id, "flag", filters.created_at_start, filters.created_at_end
         )
+        df = _daily_counts_to_df(daily_tasks, None, "nb_tasks")
+        df["nb_success"] = [
+            (daily_flags or {}).get(date, {}).get("success", 0) for date in df["date"]
+        ]
+        df["success_rate"] = df["nb_success"] / df["nb_tasks"]
+        return df
 
-        # Add missing days
+    mongo_db = await get_mongo_db()
+    main_filter, collection = task_filtering_pipeline_match(
+        project_id=project_id, filters=filters
+    )
+    result = (
+        await mongo_db[collection]
+        .aggregate([{"$match": main_filter}] + DAILY_TASKS_STAGES)
+        .to_list(length=None)
+    )
+    return _daily_groups_to_df(result, ["nb_tasks", "nb_success"])
 
-        complete_df["date"] = pd.to_datetime(complete_df["date"]).dt.date
-        nb_tasks_per_day = pd.merge(
-            complete_df, nb_tasks_per_day, on="date", how="left"
-        ).fillna(0)
-    else:
-        nb_tasks_per_day = complete_df
-        nb_tasks_per_day["nb_tasks"] = 0
 
-    return nb_tasks_per_day[["date", "nb_tasks"]].to_dict(orient="records")
+async def get_nb_of_daily_tasks(
+    project_id: str,
+    filters: ProjectDataFilters,
+    **kwargs,
+) -> List[dict]:
+    """
+    Get the number of daily tasks of a project.
+    """
+    df = await get_daily_tasks_df(project_id=project_id, filters=filters)
+    return _fill_missing_days(df, "nb_tasks", filters)
 
 
 async def get_top_event_names_and_count(
@@ -593,78 +690,124 @@ async def get_daily_success_rate(
     """
     Get the daily success rate of a project.
     """
-    mongo_db = await get_mongo_db()
+    df = await get_daily_tasks_df(project_id=project_id, filters=filters)
+    return _fill_missing_days(df, "success_rate", filters)
 
-    main_filter, collection = task_filtering_pipeline_match(
-        project_id=project_id, filters=filters
-    )
-    # Add the success rate computation
-    pipeline = [
-        {"$match": main_filter},
-        {"$addFields": {"is_success": {"$eq": ["$flag", "success"]}}},
-        {
-            "$project": {
-                "_id": 0,
-                "created_at": 1,
-                "is_success": 1,
-            }
-        },
-        {"$sort": {"date": 1}},
-    ]
-    result = await mongo_db[collection].aggregate(pipeline).to_list(length=None)
-
-    df = pd.DataFrame(result)
 
-    # If start and end date are not provided, we take the first and last task date
-    if not df.empty:
-        if filters.created_at_start is None:
-            filters.created_at_start = df["created_at"].min()
-    else:
-        if filters.created_at_start is None:
-            filters.created_at_start = datetime.datetime.now().timestamp()
+def _first_value(key: str, default: object = None):
+    """
+    Format a facet returning at most one document to the value of key
+    """
+    return lambda result: result[0][key] if len(result) > 0 else default
 
-    if filters.created_at_end is None:
-        filters.created_at_end = datetime.datetime.now().timestamp()
 
-    complete_date_range = pd.date_range(
-        datetime.datetime.fromtimestamp(
-            filters.created_at_start, datetime.timezone.utc
-        ),
-        datetime.datetime.fromtimestamp(filters.created_at_end, datetime.timezone.utc),
-        freq="D",
-    )
-    complete_df = pd.DataFrame({"date": complete_date_range})
-    complete_df["date"] = pd.to_datetime(complete_df["date"]).dt.date
-
-    if not df.empty:
-        df["date"] = pd.to_datetime(df["created_at"], unit="s", utc=True).dt.date
-        # Group by date and count
-        daily_success_rate = (
-            df.groupby(["date"])[["is_success"]]
-            .mean()
-            .reset_index()[["date", "is_success"]]
-            .rename(columns={"is_success": "success_rate"})
+def _events_count_stages(
+    limit: int, filters: ProjectDataFilters
+) -> List[Dict[str, object]]:
+    """
+    Count the tasks per detected event name. The events are stored on the tasks.
+    The events are filtered on their name and on their creation date.
+    """
+    stages: List[Dict[str, object]] = [{"$unwind": "$events"}]
+    events_match: Dict[str, object] = {}
+    if filters.event_name is not None:
+        events_match["events.event_name"] = {"$in": filters.event_name}
+    events_created_at: Dict[str, object] = {}
+    if filters.created_at_start is not None:
+        events_created_at["$gte"] = cast_datetime_or_timestamp_to_timestamp(
+            filters.created_at_start
+        )
+    if filters.created_at_end is not None:
+        events_created_at["$lte"] = cast_datetime_or_timestamp_to_timestamp(
+            filters.created_at_end
         )
+    if events_created_at:
+        events_match["events.created_at"] = events_created_at
+    if events_match:
+        stages.append({"$match": events_match})
+    return stages + [
+        # Deduplicate the events by task_id and event_name
+        {"$group": {"_id": {"task_id": "$id", "event_name": "$events.event_name"}}},
+        {"$group": {"_id": "$_id.event_name", "nb_events": {"$sum": 1}}},
+        {"$sort": {"nb_events": -1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "event_name": "$_id", "nb_events": 1}},
+    ]
 
-        # Add missing days
 
-        daily_success_rate = pd.merge(
-            complete_df, daily_success_rate, on="date", how="left"
-        ).fillna(0)
-    else:
-        daily_success_rate = complete_df
-        daily_success_rate["success_rate"] = 0
+def _tasks_facet_metrics(
+    filters: ProjectDataFilters, metrics: List[str], use_rollups: bool
+) -> Dict[str, dict]:
+    """
+    The metrics of the Tasks dashboard computed in the $facet over the tasks.
 
-    return daily_success_rate[["date", "success_rate"]].to_dict(orient="records")
+    The shared $match doesn't filter on the event names: each metric filters
+    on them in its own stages. The events ranking and the most detected event
+    also filter the events on their creation date.
+    """
+    event_match: List[Dict[str, object]] = []
+    if filters.event_name is not None:
+        event_match = [{"$match": {"events.event_name": {"$in": filters.event_name}}}]
+
+    facet_metrics: Dict[str, dict] = {
+        "total_nb_tasks": {
+            "pipeline": event_match + [{"$count": "nb_tasks"}],
+            "format": _first_value("nb_tasks"),
+        },
+        "global_success_rate": {
+            "pipeline": event_match
+            + [
+                {
+                    "$group": {
+                        "_id": None,
+                        "global_success_rate": {
+                            "$avg": {"$cond": [{"$eq": ["$flag", "success"]}, 1, 0]}
+                        },
+                    }
+                }
+            ],
+            "format": _first_value("global_success_rate"),
+        },
+        "most_detected_event": {
+            "pipeline": _events_count_stages(limit=1, filters=filters),
+            "format": _first_value("event_name"),
+        },
+        "events_ranking": {
+            "pipeline": _events_count_stages(limit=5, filters=filters),
+            "format": lambda result: result,
+        },
+    }
+    if not use_rollups:
+        facet_metrics["nb_daily_tasks"] = {
+            "pipeline": event_match + DAILY_TASKS_STAGES,
+            "format": lambda result: _fill_missing_days(
+                _daily_groups_to_df(result, ["nb_tasks", "nb_success"]),
+                "nb_tasks",
+                filters.model_copy(),
+            ),
+        }
+        facet_metrics["daily_success_rate"] = {
+            "pipeline": event_match + DAILY_TASKS_STAGES,
+            "format": lambda result: _fill_missing_days(
+                _daily_groups_to_df(result, ["nb_tasks", "nb_success"]),
+                "success_rate",
+                filters.model_copy(),
+            ),
+        }
+    return {name: facet_metrics[name] for name in metrics if name in facet_metrics}
 
 
 async def get_tasks_aggregated_metrics(
     project_id: str,
     metrics: Optional[List[str]] = None,
     filters: Optional[ProjectDataFilters] = None,
+    include_timings: bool = False,
 ) -> Dict[str, object]:
     """
     Compute aggregated metrics for the tasks of a project. Used for the Tasks dashboard.
+
+    The metrics over the filtered tasks are computed in a single $facet query,
+    concurrently with the metrics that need the sessions.
     """
     if await project_has_tasks(project_id) is False:
         return {}
@@ -683,51 +826,35 @@ async def get_tasks_aggregated_metrics(
             "success_rate_per_task_position",
         ]
 
-    today_datetime = datetime.datetime.now(datetime.timezone.utc)
-    today_timestamp = int(today_datetime.timestamp())
-    seven_days_ago_datetime = today_datetime - datetime.timedelta(days=6)
-    # Round to the beginning of the day
-    seven_days_ago_datetime = seven_days_ago_datetime.replace(
-        hour=0, minute=0, second=0, microsecond=0
+    # The daily metrics are read from the rollups when possible
+    use_rollups = can_use_rollups(filters) and await has_rollups(project_id)
+    facet_metrics = _tasks_facet_metrics(filters, metrics, use_rollups)
+    tasks_match, collection = task_filtering_pipeline_match(
+        project_id=project_id,
+        filters=filters.model_copy(update={"event_name": None}),
     )
-    seven_days_ago_timestamp = int(seven_days_ago_datetime.timestamp())
 
-    output: Dict[str, object] = {}
-
-    if "total_nb_tasks" in metrics:
-        output["total_nb_tasks"] = await get_total_nb_of_tasks(
-            project_id=project_id, filters=filters
-        )
-    if "global_success_rate" in metrics:
-        output["global_success_rate"] = await get_total_success_rate(
-            project_id=project_id, filters=filters
-        )
-    if "most_detected_event" in metrics:
-        output["most_detected_event"] = await get_most_detected_event_name(
-            project_id=project_id,
-            **filters.model_dump(),
-        )
-    if "nb_daily_tasks" in metrics:
-        output["nb_daily_tasks"] = await get_nb_of_daily_tasks(
-            project_id=project_id, filters=filters
-        )
-    if "events_ranking" in metrics:
-        output["events_ranking"] = await get_top_event_names_and_count(
-            project_id=project_id,
-            limit=5,
-            filters=filters,
+    standalone_metrics: StandaloneMetrics = {}
+    if "success_rate_per_task_position" in metrics:
+        standalone_metrics["success_rate_per_task_position"] = (
+            lambda: get_success_rate_per_task_position(
+                project_id=project_id, filters=filters.model_copy()
+            )
         )
-    if "daily_success_rate" in metrics:
-        output["daily_success_rate"] = await get_daily_success_rate(
-            project_id=project_id,
-            filters=filters,
+    if use_rollups and "nb_daily_tasks" in metrics:
+        standalone_metrics["nb_daily_tasks"] = lambda: get_nb_of_daily_tasks(
+            project_id=project_id, filters=filters.model_copy()
         )
-    if "success_rate_per_task_position" in metrics:
-        output[
-            "success_rate_per_task_position"
-        ] = await get_success_rate_per_task_position(
-            project_id=project_id, filters=filters
+    if use_rollups and "daily_success_rate" in metrics:
+        standalone_metrics["daily_success_rate"] = lambda: get_daily_success_rate(
+            project_id=project_id, filters=filters.model_copy()
         )
+
+    output, timings = await compute_metrics(
+        [(collection, tasks_match, facet_metrics)], standalone_metrics
+    )
+    if include_timings:
+        output["timings"] = timings
     return output
 
 
@@ -757,17 +884,8 @@ async def get_total_nb_of_sessions(
         {"$match": main_filter},
     ]
     if event_name is not None:
-        collection_name = "sessions_with_events"
-        pipeline.append(
-            {
-                "$match": {
-                    "$and": [
-                        {"events": {"$ne": []}},
-                        {"events": {"$elemMatch": {"event_name": {"$in": event_name}}}},
-                    ]
-                },
-            },
-        )
+        # The events are stored on the session documents
+        pipeline.append({"$match": {"events.event_name": {"$in": event_name}}})
     pipeline.append(
         {"$count": "nb_sessions"},
     )
@@ -807,17 +925,8 @@ async def get_global_average_session_length(
         {"$match": main_filter},
     ]
     if event_name is not None:
-        collection_name = "sessions_with_events"
-        pipeline.append(
-            {
-                "$match": {
-                    "$and": [
-                        {"events": {"$ne": []}},
-                        {"events": {"$elemMatch": {"event_name": {"$in": event_name}}}},
-                    ]
-                },
-            },
-        )
+        # The events are stored on the session documents
+        pipeline.append({"$match": {"events.event_name": {"$in": event_name}}})
     result = (
         await mongo_db[collection_name]
         .aggregate(
@@ -863,17 +972,8 @@ async def get_last_message_success_rate(
         }
     pipeline: List[Dict[str, object]] = [{"$match": main_filter}]
     if event_name is not None:
-        collection_name = "sessions_with_events"
-        pipeline.append(
-            {
-                "$match": {
-                    "$and": [
-                        {"events": {"$ne": []}},
-                        {"events": {"$elemMatch": {"event_name": {"$in": event_name}}}},
-                    ]
-                },
-            },
-        )
+        # The events are stored on the session documents
+        pipeline.append({"$match": {"events.event_name": {"$in": event_name}}})
     pipeline.extend(
         [
             {
@@ -924,16 +1024,13 @@ async def get_last_message_success_rate(
     return last_message_success_rate
 
 
-async def get_nb_sessions_per_day(
-    project_id: str,
-    filters: ProjectDataFilters,
-) -> List[dict]:
+def sessions_filtering_match(
+    project_id: str, filters: ProjectDataFilters
+) -> Dict[str, object]:
     """
-    Get the nb of sessions per day of a project.
+    Generate the match of the sessions of a project, filtered by creation date and events.
     """
-    mongo_db = await get_mongo_db()
-    collection_name = "sessions"
-    main_filter = {"project_id": project_id}
+    main_filter: Dict[str, object] = {"project_id": project_id}
     if filters.created_at_start is not None:
         main_filter["created_at"] = {"$gte": filters.created_at_start}
     if filters.created_at_end is not None:
@@ -941,76 +1038,40 @@ async def get_nb_sessions_per_day(
             **main_filter.get("created_at", {}),
             "$lte": filters.created_at_end,
         }
-
-    pipeline: List[Dict[str, object]] = [
-        {"$match": main_filter},
-    ]
-
     if filters.event_name is not None:
-        collection_name = "sessions_with_events"
-        pipeline.append(
-            {
-                "$match": {
-                    "$and": [
-                        {"events": {"$ne": []}},
-                        {"events": {"$elemMatch": {"event_name": {"$in": event_name}}}},
-                    ]
-                },
-            },
-        )
-    result = (
-        await mongo_db[collection_name]
-        .aggregate(
-            pipeline
-            + [
-                {"$project": {"_id": 0, "created_at": 1}},
-                {"$sort": {"date": 1}},
-            ]
-        )
-        .to_list(length=None)
-    )
-    df = pd.DataFrame(result)
+        # The events are stored on the session documents
+        main_filter["events.event_name"] = {"$in": filters.event_name}
+    return main_filter
 
-    if not df.empty:
-        # If start and end date are not provided, we take the first and last task date
-        if filters.created_at_start is None:
-            filters.created_at_start = df["created_at"].min()
-    else:
-        if filters.created_at_start is None:
-            filters.created_at_start = datetime.datetime.now().timestamp()
-
-    if filters.created_at_end is None:
-        filters.created_at_end = datetime.datetime.now().timestamp()
 
-    complete_date_range = pd.date_range(
-        datetime.datetime.fromtimestamp(
-            filters.created_at_start, datetime.timezone.utc
-        ),
-        datetime.datetime.fromtimestamp(filters.created_at_end, datetime.timezone.utc),
-        freq="D",
-    )
-    complete_df = pd.DataFrame({"date": complete_date_range})
-    complete_df["date"] = pd.to_datetime(complete_df["date"]).dt.date
+async def get_nb_sessions_per_day(
+    project_id: str,
+    filters: ProjectDataFilters,
+) -> List[dict]:
+    """
+    Get the nb of sessions per day of a project.
 
-    if not df.empty:
-        df["date"] = pd.to_datetime(df["created_at"], unit="s", utc=True).dt.date
-        # Group by date and count
-        nb_sessions_per_day = (
-            df.groupby(["date"])
-            .count()
-            .reset_index()[["date", "created_at"]]
-            .rename(columns={"created_at": "nb_sessions"})
+    Read from the rollups if the project has them and events are not filtered.
+    """
+    daily_counts = None
+    if filters.event_name is None:
+        daily_counts = await get_daily_counts(
+            project_id, "sessions", filters.created_at_start, filters.created_at_end
         )
-
-        # Add missing days
-        nb_sessions_per_day = pd.merge(
-            complete_df, nb_sessions_per_day, on="date", how="left"
-        ).fillna(0)
+    if daily_counts is not None:
+        df = _daily_counts_to_df(daily_counts, None, "nb_sessions")
     else:
-        nb_sessions_per_day = complete_df
-        nb_sessions_per_day["nb_sessions"] = 0
-
-    return nb_sessions_per_day[["date", "nb_sessions"]].to_dict(orient="records")
+        mongo_db = await get_mongo_db()
+        result = (
+            await mongo_db["sessions"]
+            .aggregate(
+                [{"$match": sessions_filtering_match(project_id, filters)}]
+                + DAILY_SESSIONS_STAGES
+            )
+            .to_list(length=None)
+        )
+        df = _daily_groups_to_df(result, ["nb_sessions"])
+    return _fill_missing_days(df, "nb_sessions", filters)
 
 
 async def get_nb_sessions_histogram(
@@ -1022,7 +1083,17 @@ async def get_nb_sessions_histogram(
 ):
     """
     Get the number of sessions per session length
+
+    Read from the quantile sketches if the project has them and events are not
+    filtered.
     """
+    if event_name is None:
+        histogram = await get_session_length_histogram(
+            project_id, created_at_start, created_at_end
+        )
+        if histogram is not None:
+            return _format_sessions_histogram(histogram)
+
     mongo_db = await get_mongo_db()
     collection_name = "sessions"
     main_filter: Dict[str, object] = {"project_id": project_id}
@@ -1032,17 +1103,8 @@ async def get_nb_sessions_histogram(
         main_filter["created_at"] = {"$lte": created_at_end}
     pipeline: List[Dict[str, object]] = [{"$match": main_filter}]
     if event_name is not None:
-        collection_name = "sessions_with_events"
-        pipeline.append(
-            {
-                "$match": {
-                    "$and": [
-                        {"events": {"$ne": []}},
-                        {"events": {"$elemMatch": {"event_name": {"$in": event_name}}}},
-                    ]
-                },
-            },
-        )
+        # The events are stored on the session documents
+        pipeline.append({"$match": {"events.event_name": {"$in": event_name}}})
     result = (
         await mongo_db[collection_name]
         .aggregate(
@@ -1070,6 +1132,13 @@ async def get_nb_sessions_histogram(
         .to_list(length=None)
     )
 
+    return _format_sessions_histogram(result)
+
+
+def _format_sessions_histogram(result: List[dict]) -> List[dict]:
+    """
+    Add the missing session lengths to the number of sessions per session length.
+    """
     df = pd.DataFrame(result)
     if df.empty:
         return []
@@ -1088,17 +1157,65 @@ async def get_nb_sessions_histogram(
         return df[["session_length", "nb_sessions"]].to_dict(orient="records")
 
 
+def _sessions_facet_metrics(
+    filters: ProjectDataFilters, metrics: List[str], use_rollups: bool
+) -> Dict[str, dict]:
+    """
+    The metrics of the Sessions dashboard computed in the $facet over the sessions.
+
+    The session lengths are the ones maintained when the tasks are logged.
+    """
+    facet_metrics: Dict[str, dict] = {
+        "total_nb_sessions": {
+            "pipeline": [{"$count": "nb_sessions"}],
+            "format": _first_value("nb_sessions", default=0),
+        },
+        "average_session_length": {
+            "pipeline": [
+                {
+                    "$group": {
+                        "_id": None,
+                        "avg_session_length": {"$avg": "$session_length"},
+                    }
+                }
+            ],
+            "format": _first_value("avg_session_length", default=0),
+        },
+        "session_length_histogram": {
+            "pipeline": [
+                {"$match": {"session_length": {"$gt": 0}}},
+                {"$group": {"_id": "$session_length", "nb_sessions": {"$sum": 1}}},
+                {"$project": {"_id": 0, "session_length": "$_id", "nb_sessions": 1}},
+                {"$sort": {"session_length": 1}},
+            ],
+            "format": _format_sessions_histogram,
+        },
+    }
+    if not use_rollups:
+        facet_metrics["nb_sessions_per_day"] = {
+            "pipeline": DAILY_SESSIONS_STAGES,
+            "format": lambda result: _fill_missing_days(
+                _daily_groups_to_df(result, ["nb_sessions"]),
+                "nb_sessions",
+                filters.model_copy(),
+            ),
+        }
+    return {name: facet_metrics[name] for name in metrics if name in facet_metrics}
+
+
 async def get_sessions_aggregated_metrics(
     project_id: str,
     quantile_filter: Optional[float] = None,
     metrics: Optional[List[str]] = None,
     filters: Optional[ProjectDataFilters] = None,
+    include_timings: bool = False,
 ) -> Dict[str, object]:
     """
     Compute aggregated metrics for the sessions of a project. Used for the Sessions dashboard.
-    """
-    # TODO : Make the return keys parameters and optional (to avoid returning useless data)
 
+    The metrics over the filtered sessions are computed in a single $facet query,
+    concurrently with the metrics that need the tasks of the sessions.
+    """
     if await project_has_tasks(project_id) is False:
         return {}
     if await project_has_sessions(project_id) is False:
@@ -1117,49 +1234,43 @@ async def get_sessions_aggregated_metrics(
     if filters is None:
         filters = ProjectDataFilters()
 
-    # Get timestamps
-    today_datetime = datetime.datetime.now(datetime.timezone.utc)
-    today_timestamp = int(today_datetime.timestamp())
-    seven_days_ago_datetime = today_datetime - datetime.timedelta(days=6)
-    # Round to the beginning of the day
-    seven_days_ago_datetime = seven_days_ago_datetime.replace(
-        hour=0, minute=0, second=0, microsecond=0
-    )
-    seven_days_ago_timestamp = int(seven_days_ago_datetime.timestamp())
-
-    output: Dict[str, object] = {}
+    # The sessions per day are read from the rollups when possible
+    use_rollups = filters.event_name is None and await has_rollups(project_id)
+    facet_metrics = _sessions_facet_metrics(filters, metrics, use_rollups)
 
-    if "total_nb_sessions" in metrics:
-        output["total_nb_sessions"] = await get_total_nb_of_sessions(
-            project_id=project_id,
-            **filters.model_dump(),
-        )
-    if "average_session_length" in metrics:
-        output["average_session_length"] = await get_global_average_session_length(
-            project_id=project_id,
-            **filters.model_dump(),
-        )
+    standalone_metrics: StandaloneMetrics = {}
     if "last_task_success_rate" in metrics:
-        output["last_task_success_rate"] = await get_last_message_success_rate(
-            project_id=project_id,
-            **filters.model_dump(),
+        standalone_metrics["last_task_success_rate"] = (
+            lambda: get_last_message_success_rate(
+                project_id=project_id,
+                **filters.model_dump(),
+            )
         )
-    if "nb_sessions_per_day" in metrics:
-        output["nb_sessions_per_day"] = await get_nb_sessions_per_day(
-            project_id=project_id, filters=filters
-        )
-    if "session_length_histogram" in metrics:
-        output["session_length_histogram"] = await get_nb_sessions_histogram(
-            project_id=project_id,
-            **filters.model_dump(),
+    if use_rollups and "nb_sessions_per_day" in metrics:
+        standalone_metrics["nb_sessions_per_day"] = lambda: get_nb_sessions_per_day(
+            project_id=project_id, filters=filters.model_copy()
         )
     if "success_rate_per_task_position" in metrics:
-        output[
-            "success_rate_per_task_position"
-        ] = await get_success_rate_per_task_position(
-            project_id=project_id, quantile_filter=quantile_filter, filters=filters
+        standalone_metrics["success_rate_per_task_position"] = (
+            lambda: get_success_rate_per_task_position(
+                project_id=project_id,
+                quantile_filter=quantile_filter,
+                filters=filters.model_copy(),
+            )
         )
 
+    output, timings = await compute_metrics(
+        [
+            (
+                "sessions",
+                sessions_filtering_match(project_id, filters),
+                facet_metrics,
+            )
+        ],
+        standalone_metrics,
+    )
+    if include_timings:
+        output["timings"] = timings
     return output
 
 
@@ -1334,7 +1445,15 @@ async def compute_successrate_metadata_quantiles(
 ) -> Tuple[float, float, float]:
     """
     Get the success rate of items in a collection that have a specific metadata field value.
+
+    The success rate per user is read from the user stats, when they're built.
     """
+    if (
+        collection_name == "tasks"
+        and metadata_field == "user_id"
+        and await has_user_stats(project_id)
+    ):
+        return await compute_users_success_rate_quantiles(project_id, quantile_value)
 
     mongo_db = await get_mongo_db()
 
@@ -1633,22 +1752,33 @@ async def get_events_aggregated_metrics(
     project_id: str,
     metrics: Optional[List[str]] = None,
     filters: Optional[ProjectDataFilters] = None,
+    include_timings: bool = False,
 ) -> Dict[str, object]:
+    """
+    Compute aggregated metrics for the events of a project. Used for the Events dashboard.
+
+    The metrics are computed concurrently.
+    """
     if filters is None:
         filters = ProjectDataFilters()
     if metrics is None:
         metrics = [
             "success_rate_by_event_name",
         ]
-    output: Dict[str, object] = {}
+    standalone_metrics: StandaloneMetrics = {}
     if "success_rate_by_event_name" in metrics:
-        output["success_rate_by_event_name"] = await get_success_rate_by_event_name(
-            project_id=project_id, filters=filters
+        standalone_metrics["success_rate_by_event_name"] = (
+            lambda: get_success_rate_by_event_name(
+                project_id=project_id, filters=filters.model_copy()
+            )
         )
     if "total_nb_events" in metrics:
-        output["total_nb_events"] = await get_total_nb_of_detections(
-            project_id=project_id, filters=filters
+        standalone_metrics["total_nb_events"] = lambda: get_total_nb_of_detections(
+            project_id=project_id, **filters.model_dump()
         )
+    output, timings = await compute_metrics([], standalone_metrics)
+    if include_timings:
+        output["timings"] = timings
     return output
 
 
@@ -1661,6 +1791,10 @@ async def graph_number_of_daily_tasks(project_id: str):
     mongo_db = await get_mongo_db()
     seven_days_ago_timestamp, today_timestamp = get_last_week_timestamps()
 
+    daily_tasks = await get_daily_counts(
+        project_id, "tasks", seven_days_ago_timestamp, today_timestamp
+    )
+
     # Aggregation pipeline
     pipeline = [
         {
@@ -1703,8 +1837,27 @@ async def graph_number_of_daily_tasks(project_id: str):
             }
         },
     ]
-    # Query Mongo
-    result = await mongo_db["tasks"].aggregate(pipeline).to_list(length=None)
+    if daily_tasks is not None:
+        daily_flags = await get_daily_counts(
+            project_id, "flag", seven_days_ago_timestamp, today_timestamp
+        )
+        result = []
+        for date, counts in sorted(daily_tasks.items()):
+            flags = (daily_flags or {}).get(date, {})
+            total = counts.get(None, 0)
+            success = flags.get("success", 0)
+            failure = flags.get("failure", 0)
+            result.append(
+                {
+                    "date": date.isoformat(),
+                    "success": success,
+                    "failure": failure,
+                    "undefined": total - success - failure,
+                }
+            )
+    else:
+        # Query Mongo
+        result = await mongo_db["tasks"].aggregate(pipeline).to_list(length=None)
     # Add missing days to the result, and set the missing values to 0
     result = pd.DataFrame(result)
     complete_date_range = pd.date_range(
@@ -1746,6 +1899,10 @@ async def get_events_per_day(project_id: str):
     mongo_db = await get_mongo_db()
     seven_days_ago_timestamp, today_timestamp = get_last_week_timestamps()
 
+    daily_events = await get_daily_counts(
+        project_id, "event_name", seven_days_ago_timestamp, today_timestamp
+    )
+
     pipeline = [
         # Filter tasks of the last week
         {
@@ -1799,7 +1956,14 @@ async def get_events_per_day(project_id: str):
             }
         },
     ]
-    result = await mongo_db["tasks"].aggregate(pipeline).to_list(length=None)
+    if daily_events is not None:
+        result = [
+            {"date": date.isoformat(), "event_name": event_name, "count": count}
+            for date, counts in sorted(daily_events.items())
+            for event_name, count in counts.items()
+        ]
+    else:
+        result = await mongo_db["tasks"].aggregate(pipeline).to_list(length=None)
     result = pd.DataFrame(result)
 
     # Get the list of event names
@@ -1890,48 +2054,19 @@ async def fetch_flattened_tasks(
         "session_id": "$session_id",
     }
     if with_events:
-        pipeline.extend(
-            [
-                # Deduplicate events based on event_name
-                {
-                    "$set": {
-                        "events": {
-                            "$reduce": {
-                                "input": "$events",
-                                "initialValue": [],
-                                "in": {
-                                    "$concatArrays": [
-                                        "$$value",
-                                        {
-                                            "$cond": [
-                                                {
-                                                    "$in": [
-                                                        "$$this.event_name",
-                                                        "$$value.event_name",
-                                                    ]
-                                                },
-                                                [],
-                                                ["$$this"],
-                                            ]
-                                        },
-                                    ]
-                                },
-                            }
-                        },
-                    }
-                },
-                {
-                    "$unwind": {
-                        "path": "$events",
-                        "preserveNullAndEmptyArrays": True,
-                    }
-                },
-            ]
+        # The events are stored on the task documents, deduplicated by event_name
+        pipeline.append(
+            {
+                "$unwind": {
+                    "path": "$events",
+                    "preserveNullAndEmptyArrays": True,
+                }
+            },
         )
         return_columns = {
             **return_columns,
-            "event_name": "$event_name",
-            "event_created_at": "$event_created_at",
+            "event_name": "$events.event_name",
+            "event_created_at": "$events.created_at",
         }
     if with_sessions:
         pipeline.extend(
@@ -1960,7 +2095,7 @@ async def fetch_flattened_tasks(
     )
     # Query Mongo
     flattened_tasks = (
-        await mongo_db["tasks_with_events"].aggregate(pipeline).to_list(length=limit)
+        await mongo_db["tasks"].aggregate(pipeline).to_list(length=limit)
     )
     # Ignore _id field
     flattened_tasks = [
@@ -2059,5 +2194,6 @@ async def update_from_flattened_tasks(
         tasks_results = await mongo_db["tasks"].bulk_write(tasks_update_statements)
     if eval_create_statements:
         eval_results = await mongo_db["evals"].bulk_write(eval_create_statements)
+    await bump_data_version([project_id])
 
     return tasks_results.modified_count > 0 or eval_results.inserted_count > 0
@@ -0,0 +1,377 @@
+"""
+Export the tasks of a project to files or to a stream
+
+The tasks are read page by page with a cursor and appended to a CSV file and
+to a Parquet file (one row group per page), so that the memory used doesn't
+depend on the size of the project.
+
+The files are written in config.EXPORTS_DIR/<export_id>/ and downloaded with a
+link containing the random export_id. They are deleted after
+config.EXPORTS_EXPIRATION_DAYS.
+
+The tasks can also be streamed as NDJSON or as an Arrow IPC stream, batch by
+batch from a Mongo cursor.
+"""
+
+import asyncio
+import datetime
+import io
+import json
+import os
+import shutil
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import resend
+from fastapi import HTTPException
+from loguru import logger
+
+from app.api.platform.models import Pagination
+from app.core import config
+from app.db.models import ProjectDataFilters, Task
+from app.db.mongo import get_mongo_db
+from app.security.authentification import propelauth
+from app.services.mongo.pagination import get_next_cursor
+from app.services.mongo.projects import get_all_tasks
+from app.services.mongo.tasks import task_filtering_pipeline_match
+from app.services.slack import slack_notification
+from app.utils import generate_uuid
+
+EXPORT_FILENAMES = ["tasks.csv", "tasks.parquet"]
+# The other columns are exported as strings, and the dicts and lists as JSON
+INTEGER_COLUMNS = ["created_at", "task_position"]
+EXPORT_COLUMNS = list(Task.model_fields.keys())
+
+
+def get_export_schema(columns: List[str]) -> pa.Schema:
+    return pa.schema(
+        [
+            (column, pa.int64() if column in INTEGER_COLUMNS else pa.string())
+            for column in columns
+        ]
+    )
+
+
+EXPORT_SCHEMA = get_export_schema(EXPORT_COLUMNS)
+
+
+def flatten_row(document: Dict[str, Any], columns: List[str]) -> Dict[str, Any]:
+    """
+    Convert a task document to a row with the same columns and types for
+    every task (see get_export_schema).
+    """
+    row: Dict[str, Any] = {}
+    for column in columns:
+        value = document.get(column)
+        if value is None or column in INTEGER_COLUMNS:
+            row[column] = value
+        elif isinstance(value, (dict, list)):
+            row[column] = json.dumps(value, default=str)
+        else:
+            row[column] = str(value)
+    return row
+
+
+def flatten_task(task: Task) -> Dict[str, Any]:
+    return flatten_row(task.model_dump(), EXPORT_COLUMNS)
+
+
+async def iter_tasks_pages(
+    project_id: str, per_page: int = config.EXPORTS_PAGE_SIZE
+) -> AsyncIterator[List[Task]]:
+    """
+    Yield the tasks of a project, page by page, the most recent first.
+    """
+    pagination = Pagination(page=0, per_page=per_page)
+    while True:
+        tasks = await get_all_tasks(project_id=project_id, pagination=pagination)
+        if len(tasks) > 0:
+            yield tasks
+        cursor = get_next_cursor(tasks, pagination)
+        if cursor is None:
+            return
+        pagination = Pagination(page=0, per_page=per_page, cursor=cursor)
+
+
+def get_stream_fields(fields: Optional[List[str]]) -> List[str]:
+    """
+    The fields of the streamed tasks. Raise a 400 if a field doesn't exist.
+    """
+    if fields is None or len(fields) == 0:
+        return EXPORT_COLUMNS
+    unknown_fields = [field for field in fields if field not in EXPORT_COLUMNS]
+    if len(unknown_fields) > 0:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown task fields: {unknown_fields}. Available fields: {EXPORT_COLUMNS}",
+        )
+    return fields
+
+
+async def iter_tasks_batches(
+    project_id: str,
+    fields: List[str],
+    filters: Optional[ProjectDataFilters] = None,
+    batch_size: int = config.EXPORTS_PAGE_SIZE,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Yield the tasks of a project, batch by batch, the most recent first.
+
+    The tasks are read from a single cursor, and only the fields are returned
+    by Mongo.
+    """
+    mongo_db = await get_mongo_db()
+    main_filter, collection = task_filtering_pipeline_match(
+        project_id=project_id, filters=filters, collection="tasks"
+    )
+    main_filter["test_id"] = None
+    pipeline: List[Dict[str, object]] = [
+        {"$match": main_filter},
+        {"$sort": {"created_at": -1, "id": -1}},
+        {"$project": {"_id": 0, **{field: 1 for field in fields}}},
+    ]
+    cursor = mongo_db[collection].aggregate(
+        pipeline, batchSize=batch_size, allowDiskUse=True
+    )
+    batch: List[Dict[str, Any]] = []
+    async for document in cursor:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+async def stream_tasks_ndjson(
+    project_id: str,
+    fields: List[str],
+    filters: Optional[ProjectDataFilters] = None,
+    batch_size: int = config.EXPORTS_PAGE_SIZE,
+) -> AsyncIterator[bytes]:
+    """
+    Stream the tasks of a project as NDJSON: one JSON task per line.
+    """
+    async for batch in iter_tasks_batches(project_id, fields, filters, batch_size):
+        yield "".join(
+            json.dumps(document, default=str) + "\n" for document in batch
+        ).encode()
+
+
+async def stream_tasks_arrow(
+    project_id: str,
+    fields: List[str],
+    filters: Optional[ProjectDataFilters] = None,
+    batch_size: int = config.EXPORTS_PAGE_SIZE,
+) -> AsyncIterator[bytes]:
+    """
+    Stream the tasks of a project as an Arrow IPC stream, one record batch per
+    batch of tasks. The schema is the same as the Parquet export.
+    """
+    schema = get_export_schema(fields)
+    sink = io.BytesIO()
+
+    def flush() -> bytes:
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    writer = pa.ipc.new_stream(sink, schema)
+    async for batch in iter_tasks_batches(project_id, fields, filters, batch_size):
+        writer.write_batch(
+            pa.RecordBatch.from_pylist(
+                [flatten_row(document, fields) for document in batch], schema=schema
+            )
+        )
+        yield flush()
+    writer.close()
+    yield flush()
+
+
+def get_export_dir(export_id: str) -> str:
+    return os.path.join(config.EXPORTS_DIR, export_id)
+
+
+def get_download_url(export_id: str, filename: str) -> str:
+    return f"{config.PHOSPHO_BACKEND_URL}/api/exports/{export_id}/{filename}"
+
+
+def write_tasks_page(
+    csv_file: io.TextIOBase,
+    parquet_writer: pq.ParquetWriter,
+    tasks: List[Task],
+    write_header: bool,
+) -> None:
+    """
+    Append a page of tasks to the CSV and Parquet files of an export.
+    """
+    df = pd.DataFrame([flatten_task(task) for task in tasks], columns=EXPORT_COLUMNS)
+    df.to_csv(csv_file, header=write_header, index=False)
+    parquet_writer.write_table(
+        pa.Table.from_pandas(df, schema=EXPORT_SCHEMA, preserve_index=False)
+    )
+
+
+def close_export_files(
+    csv_file: io.TextIOBase, parquet_writer: pq.ParquetWriter, nb_tasks: int
+) -> None:
+    if nb_tasks == 0:
+        # Write the header of an empty CSV
+        pd.DataFrame(columns=EXPORT_COLUMNS).to_csv(csv_file, index=False)
+    csv_file.close()
+    parquet_writer.close()
+
+
+async def export_project_tasks(project_id: str, uid: Optional[str] = None) -> dict:
+    """
+    Write the tasks of a project to a CSV and a Parquet file.
+
+    The files are written in a thread, to not block the event loop.
+    Returns the export, with the download urls of the files.
+    """
+    mongo_db = await get_mongo_db()
+    export_id = generate_uuid()
+    export_dir = get_export_dir(export_id)
+    await asyncio.to_thread(os.makedirs, export_dir, exist_ok=True)
+    csv_path = os.path.join(export_dir, "tasks.csv")
+    parquet_path = os.path.join(export_dir, "tasks.parquet")
+
+    nb_tasks = 0
+    try:
+        csv_file = await asyncio.to_thread(open, csv_path, "w", newline="")
+        parquet_writer = await asyncio.to_thread(
+            pq.ParquetWriter, parquet_path, EXPORT_SCHEMA
+        )
+        try:
+            async for tasks in iter_tasks_pages(project_id):
+                await asyncio.to_thread(
+                    write_tasks_page, csv_file, parquet_writer, tasks, nb_tasks == 0
+                )
+                nb_tasks += len(tasks)
+        finally:
+            await asyncio.to_thread(
+                close_export_files, csv_file, parquet_writer, nb_tasks
+            )
+    except Exception:
+        await asyncio.to_thread(shutil.rmtree, export_dir, ignore_errors=True)
+        raise
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    export = {
+        "id": export_id,
+        "project_id": project_id,
+        "uid": uid,
+        "nb_tasks": nb_tasks,
+        "files": EXPORT_FILENAMES,
+        "created_at": int(now.timestamp()),
+        # Removed by the TTL index. The files are deleted by delete_expired_exports
+        "expires_at": now + datetime.timedelta(days=config.EXPORTS_EXPIRATION_DAYS),
+    }
+    await mongo_db["exports"].insert_one({**export})
+    logger.info(f"Exported {nb_tasks} tasks of project {project_id} in {export_dir}")
+    return {
+        **export,
+        "urls": {
+            filename: get_download_url(export_id, filename)
+            for filename in EXPORT_FILENAMES
+        },
+    }
+
+
+async def get_export_file_path(export_id: str, filename: str) -> str:
+    """
+    The path of an exported file. Raise a 404 if it doesn't exist or expired.
+    """
+    mongo_db = await get_mongo_db()
+    export = await mongo_db["exports"].find_one({"id": export_id})
+    if (
+        export is None
+        or filename not in export["files"]
+        or export["expires_at"].replace(tzinfo=datetime.timezone.utc)
+        < datetime.datetime.now(datetime.timezone.utc)
+    ):
+        raise HTTPException(status_code=404, detail="Export not found or expired")
+    path = os.path.join(get_export_dir(export_id), filename)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Export not found or expired")
+    return path
+
+
+def delete_expired_exports() -> None:
+    """
+    Delete the exported files older than the expiration delay.
+    """
+    if not os.path.isdir(config.EXPORTS_DIR):
+        return
+    expiration = (
+        datetime.datetime.now().timestamp() - config.EXPORTS_EXPIRATION_DAYS * 86400
+    )
+    for export_id in os.listdir(config.EXPORTS_DIR):
+        export_dir = get_export_dir(export_id)
+        if os.path.getmtime(export_dir) < expiration:
+            shutil.rmtree(export_dir, ignore_errors=True)
+
+
+async def email_project_tasks(
+    project_id: str,
+    uid: str,
+):
+    def send_error_message():
+        # Send an error message to the user
+        params = {
+            "from": "phospho <contact@phospho.ai>",
+            "to": [user.get("email")],
+            "subject": "Error exporting your tasks",
+            "html": f"""<p>Hello!<br><br>We could not export your tasks for the project with id {project_id} (timestamp: {datetime.datetime.now().isoformat()})</p>
+            <p><br>Please contact the support at contact@phospho.ai</p>
+            <p>Best,<br>
+            The Phospho Team</p>
+            """,
+        }
+
+        email = resend.Emails.send(params)
+        logger.debug(f"Sent error message to user: {user.get('email')}")
+
+    if config.ENVIRONMENT != "preview":
+        # Get the user email
+        user = propelauth.fetch_user_metadata_by_user_id(uid, include_orgs=False)
+
+        # Use Resend to send the email
+        resend.api_key = config.RESEND_API_KEY
+
+        try:
+            export = await export_project_tasks(project_id=project_id, uid=uid)
+        except Exception as e:
+            error_message = f"Error exporting tasks for {user.get('email')} project id {project_id}: {e}"
+            logger.error(error_message)
+            await slack_notification(error_message)
+            send_error_message()
+            return
+
+        links = "".join(
+            f'<li><a href="{url}">{filename}</a></li>'
+            for filename, url in export["urls"].items()
+        )
+        params = {
+            "from": "phospho <contact@phospho.ai>",
+            "to": [user.get("email")],
+            "subject": "Your exported tasks are ready",
+            "html": f"""<p>Hello!<br><br>Your {export["nb_tasks"]} exported tasks for the project with id {project_id} are ready (timestamp: {datetime.datetime.now().isoformat()})</p>
+            <ul>{links}</ul>
+            <p>The links expire in {config.EXPORTS_EXPIRATION_DAYS} days.</p>
+            <p><br>So, what do you think about phospho for now? Feel free to respond to this email address and share your toughts !</p>
+            <p>Enjoy,<br>
+            The Phospho Team</p>
+            """,
+        }
+
+        try:
+            resend.Emails.send(params)
+            logger.info(f"Successfully sent tasks by email to {user.get('email')}")
+        except Exception as e:
+            error_message = f"Error sending email to {user.get('email')} project_id {project_id}: {e}"
+            logger.error(error_message)
+            await slack_notification(error_message)
@@ -299,6 +299,50 @@ async def run_recipe_on_tasks(
             logger.error(error_message)
 
 
+async def run_recipe_on_task_ids(
+    task_ids: List[str],
+    recipe: Recipe,
+    org_id: str,
+) -> Optional[int]:
+    """
+    Run a recipe on tasks. Only the task ids are sent: the extractor fetches
+    the tasks, and responds once they are processed.
+
+    Returns the number of job results billed, or None if the call failed.
+    """
+    if len(task_ids) == 0:
+        return 0
+
+    async with httpx.AsyncClient() as client:
+        try:
+            response = await client.post(
+                f"{config.EXTRACTOR_URL}/v1/pipelines/recipes",  # WARNING: hardcoded API version
+                json={
+                    "task_ids": task_ids,
+                    "recipe": recipe.model_dump(),
+                },
+                headers={
+                    "Authorization": f"Bearer {config.EXTRACTOR_SECRET_KEY}",
+                    "Content-Type": "application/json",
+                },
+                timeout=config.BACKFILL_CHUNK_TIMEOUT,
+            )
+        except Exception as e:
+            error_id = generate_uuid()
+            logger.error(
+                f"Caught error while calling run recipe on task ids (error_id: {error_id}): {e}\n{traceback.format_exception(e)}"
+            )
+            return None
+    if response.status_code != 200:
+        logger.error(
+            f"Error returned when calling run recipe on task ids (status code: {response.status_code}): {response.text}"
+        )
+        return None
+    nb_job_results = response.json().get("nb_job_results", 0)
+    await bill_on_stripe(org_id=org_id, nb_credits_used=nb_job_results)
+    return nb_job_results
+
+
 async def store_open_telemetry_data(
     open_telemetry_data: dict, project_id: str, org_id: str
 ):
@@ -1,18 +1,27 @@
+import csv
+import os
+import shutil
+from collections import Counter
+
 from app.api.v2.models.log import LogEvent
 from app.core import config
-from app.security.authorization import get_quota
+from app.security.authorization import get_quota, record_usage
 from app.services.mongo.emails import send_quota_exceeded_email
 from app.services.mongo.extractor import run_log_process
+import openpyxl
 import pandas as pd
 from loguru import logger
-from typing import List
+from typing import BinaryIO, Iterator, List, Optional, Tuple
 from pydantic import ValidationError
 
 from app.db.models import DatasetRow
 
 from app.db.mongo import get_mongo_db
 from app.core.config import CSV_UPLOAD_MAX_ROWS
-from app.utils import generate_uuid
+from app.utils import generate_timestamp, generate_uuid
+
+# The optional columns of an uploaded task file read as strings
+STRING_COLUMNS = ["user_id", "version_id", "step_id"]
 
 
 async def process_csv_file_as_df(
@@ -111,82 +120,240 @@ async def process_and_save_examples(examples: List[dict], org_id: str) -> str:
     return file_id
 
 
-async def process_file_upload_into_log_events(
-    tasks_df: pd.DataFrame, project_id: str, org_id: str
-):
+def save_upload_to_disk(file: BinaryIO, file_extension: str) -> str:
     """
-    Used for uploading tasks.
+    Copy an uploaded file to UPLOADS_DIR, so that it can be read in chunks
+    after the response. Returns its path.
+    """
+    os.makedirs(config.UPLOADS_DIR, exist_ok=True)
+    file_path = os.path.join(config.UPLOADS_DIR, f"{generate_uuid()}.{file_extension}")
+    with open(file_path, "wb") as f:
+        shutil.copyfileobj(file, f)
+    return file_path
 
-    Columns: input, output
 
-    Optional columns: session_id, created_at, task_id
+def sniff_csv_separator(file_path: str) -> str:
+    """
+    Detect the separator of a csv file from its first lines
+    """
+    with open(file_path, newline="", encoding="utf-8", errors="replace") as f:
+        sample = f.read(64 * 1024)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+    except csv.Error:
+        return ","
+
+
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    # Strip and lowercase the columns
+    df.columns = df.columns.astype(str).str.strip().str.lower()
+    return df
+
+
+def read_upload_columns(file_path: str, file_extension: str) -> List[str]:
+    if file_extension == "csv":
+        df = pd.read_csv(file_path, sep=sniff_csv_separator(file_path), nrows=0)
+    else:
+        df = pd.read_excel(file_path, nrows=0)
+    return list(normalize_columns(df).columns)
+
+
+def count_upload_rows(file_path: str, file_extension: str) -> Optional[int]:
+    """
+    Count the rows of an uploaded file without loading it. None if unknown.
+    """
+    if file_extension == "csv":
+        chunks = pd.read_csv(
+            file_path,
+            sep=sniff_csv_separator(file_path),
+            usecols=[0],
+            chunksize=config.UPLOAD_BATCH_SIZE * 100,
+        )
+        return sum(len(chunk) for chunk in chunks)
+    # Read from the dimensions of the sheet
+    workbook = openpyxl.load_workbook(file_path, read_only=True)
+    try:
+        max_row = workbook.active.max_row
+    finally:
+        workbook.close()
+    return max_row - 1 if max_row is not None else None
+
+
+def read_upload_in_chunks(
+    file_path: str, file_extension: str, chunksize: int
+) -> Iterator[pd.DataFrame]:
+    if file_extension == "csv":
+        for chunk in pd.read_csv(
+            file_path, sep=sniff_csv_separator(file_path), chunksize=chunksize
+        ):
+            yield normalize_columns(chunk)
+    else:
+        # Excel files can't be read in chunks
+        df = normalize_columns(pd.read_excel(file_path))
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start : start + chunksize]
+
+
+def to_timestamps(column: pd.Series, default: int) -> pd.Series:
+    """
+    Convert dates, or UNIX timestamps in seconds, to UNIX timestamps. The
+    invalid values are replaced with default.
+    """
+    if pd.api.types.is_numeric_dtype(column):
+        dates = pd.to_datetime(column, unit="s", errors="coerce", utc=True)
+    else:
+        dates = pd.to_datetime(column, errors="coerce", utc=True, format="mixed")
+    timestamps = (dates - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)
+    return timestamps.fillna(default).astype("int64")
+
+
+def prefix_ids(column: pd.Series, project_id: str, upload_id: str) -> pd.Series:
+    """
+    Make the ids of a file unique across the project: <project_id>_<id>_<upload_id>
+    """
+    return project_id + "_" + column.astype(str) + "_" + upload_id
+
+
+def prepare_log_events_df(
+    tasks_df: pd.DataFrame,
+    project_id: str,
+    upload_id: str,
+    seen_task_ids: Counter,
+) -> pd.DataFrame:
+    """
+    Validate and convert the columns of a chunk of uploaded tasks to the fields
+    of a LogEvent. The rows without input are dropped.
+
+    seen_task_ids counts the task ids of the previous chunks of the file.
     """
+    tasks_df = tasks_df[tasks_df["input"].notna()].copy()
+    tasks_df["project_id"] = project_id
+    tasks_df["input"] = tasks_df["input"].astype(str)
+    if "output" in tasks_df.columns:
+        tasks_df["output"] = (
+            tasks_df["output"].astype(str).where(tasks_df["output"].notna(), None)
+        )
 
     # session_id: if provided, concatenate with project_id to avoid collisions
     if "session_id" in tasks_df.columns:
-        try:
-            tasks_df["session_id"] = tasks_df["session_id"].apply(
-                lambda x: f"{project_id}_{x}_{generate_uuid()}"
-            )
-        except Exception as e:
-            logger.error(f"Error concatenating session_id: {e}")
-            tasks_df.drop("session_id", axis=1, inplace=True)
+        tasks_df["session_id"] = prefix_ids(
+            tasks_df["session_id"], project_id, upload_id
+        ).where(tasks_df["session_id"].notna(), None)
 
     if "task_id" in tasks_df.columns:
-        try:
-            tasks_df["task_id"] = tasks_df["task_id"].apply(
-                lambda x: f"{project_id}_{x}_{generate_uuid()}"
-            )
-        except Exception as e:
-            logger.error(f"Error concatenating task_id: {e}")
-            tasks_df.drop("task_id", axis=1, inplace=True)
+        task_ids = prefix_ids(tasks_df["task_id"], project_id, upload_id)
+        # The tasks must have distinct ids: suffix the duplicates with their
+        # number of previous occurrences in the file
+        duplicates = task_ids.groupby(task_ids).cumcount() + task_ids.map(
+            seen_task_ids
+        ).fillna(0).astype(int)
+        seen_task_ids.update(task_ids.value_counts().to_dict())
+        task_ids = task_ids.where(
+            duplicates == 0, task_ids + "_" + duplicates.astype(str)
+        )
+        tasks_df["task_id"] = task_ids.where(
+            tasks_df["task_id"].notna(),
+            [generate_uuid() for _ in range(len(tasks_df))],
+        )
+    else:
+        tasks_df["task_id"] = [generate_uuid() for _ in range(len(tasks_df))]
 
     # created_at: if provided, convert to datetime, then to timestamp
     if "created_at" in tasks_df.columns:
-        try:
-            tasks_df["created_at"] = pd.to_datetime(
-                tasks_df["created_at"], errors="coerce"
-            )
-            tasks_df["created_at"] = tasks_df["created_at"].astype(int) // 10**9
-            # Fill NaN values with current timestamp
-            tasks_df["created_at"].fillna(
-                int(pd.Timestamp.now().timestamp()), inplace=True
+        tasks_df["created_at"] = to_timestamps(
+            tasks_df["created_at"], default=generate_timestamp()
+        )
+
+    if "flag" in tasks_df.columns:
+        flags = tasks_df["flag"].astype(str).str.strip().str.lower()
+        tasks_df["flag"] = flags.where(flags.isin(["success", "failure"]), None)
+
+    # Eg: numeric user ids
+    for column in STRING_COLUMNS:
+        if column in tasks_df.columns:
+            tasks_df[column] = (
+                tasks_df[column].astype(str).where(tasks_df[column].notna(), None)
             )
-        except Exception as e:
-            logger.error(f"Error converting created_at to timestamp: {e}")
-            tasks_df.drop("created_at", axis=1, inplace=True)
 
-    logs_to_process: List[LogEvent] = []
-    extra_logs_to_save: List[LogEvent] = []
+    # The missing values are None, not NaN
+    return tasks_df.astype(object).where(tasks_df.notna(), None)
+
+
+def to_log_events(tasks_df: pd.DataFrame) -> Tuple[List[LogEvent], int]:
+    """
+    Build the LogEvents of a dataframe prepared by prepare_log_events_df.
+
+    The invalid rows (eg: a metadata column that isn't a dict) are dropped, so
+    that they don't make the extractor reject the whole batch. Returns the
+    LogEvents and the number of dropped rows.
+    """
+    log_events: List[LogEvent] = []
+    nb_invalid = 0
+    for record in tasks_df.to_dict(orient="records"):
+        try:
+            log_events.append(LogEvent.model_validate(record))
+        except ValidationError:
+            nb_invalid += 1
+    return log_events, nb_invalid
+
+
+async def process_file_upload_into_log_events(
+    file_path: str, file_extension: str, project_id: str, org_id: str
+):
+    """
+    Used for uploading tasks.
+
+    Columns: input, output
+
+    Optional columns: session_id, created_at, task_id, flag
+
+    The file is read and sent to the extractor in batches of UPLOAD_BATCH_SIZE
+    rows, then deleted. The quota is checked once for the whole file.
+    """
+    upload_id = generate_uuid()
+    seen_task_ids: Counter = Counter()
 
     org_plan = await get_quota(project_id)
     current_usage = org_plan.get("current_usage", 0)
     max_usage = org_plan.get("max_usage", config.PLAN_HOBBY_MAX_NB_DETECTIONS)
-
-    for _, row in tasks_df.iterrows():
-        # Create a task for each row
-        try:
-            valid_log_event = LogEvent(
+    remaining_usage = None if max_usage is None else max(max_usage - current_usage, 0)
+    nb_processed = 0
+    nb_extra = 0
+    nb_invalid = 0
+
+    try:
+        for tasks_df in read_upload_in_chunks(
+            file_path, file_extension, chunksize=config.UPLOAD_BATCH_SIZE
+        ):
+            log_events, nb_invalid_in_chunk = to_log_events(
+                prepare_log_events_df(tasks_df, project_id, upload_id, seen_task_ids)
+            )
+            nb_invalid += nb_invalid_in_chunk
+            nb_to_process = len(log_events)
+            if remaining_usage is not None:
+                nb_to_process = min(nb_to_process, remaining_usage)
+                remaining_usage -= nb_to_process
+            logs_to_process = log_events[:nb_to_process]
+            extra_logs_to_save = log_events[nb_to_process:]
+            nb_processed += len(logs_to_process)
+            nb_extra += len(extra_logs_to_save)
+            record_usage(org_id, len(logs_to_process))
+
+            # Send tasks to the extractor
+            await run_log_process(
+                logs_to_process=logs_to_process,
+                extra_logs_to_save=extra_logs_to_save,
                 project_id=project_id,
-                **row.to_dict(),
+                org_id=org_id,
             )
-
-            if max_usage is None or (
-                max_usage is not None and current_usage < max_usage
-            ):
-                logs_to_process.append(valid_log_event)
-                current_usage += 1
-            else:
-                logger.warning(f"Max usage quota reached for project: {project_id}")
-                await send_quota_exceeded_email(project_id)
-                extra_logs_to_save.append(valid_log_event)
-        except ValidationError as e:
-            logger.error(f"Error when uploading csv and LogEvent creation: {e}")
-
-    # Send tasks to the extractor
-    await run_log_process(
-        logs_to_process=logs_to_process,
-        extra_logs_to_save=extra_logs_to_save,
-        project_id=project_id,
-        org_id=org_id,
+    except Exception as e:
+        logger.error(f"Error processing the uploaded file {file_path}: {e}")
+    finally:
+        os.remove(file_path)
+
+    if nb_extra > 0:
+        logger.warning(f"Max usage quota reached for project: {project_id}")
+        await send_quota_exceeded_email(org_id)
+    logger.info(
+        f"Uploaded file processed for project {project_id}: {nb_processed} tasks processed, {nb_extra} extra tasks saved, {nb_invalid} invalid rows dropped"
     )
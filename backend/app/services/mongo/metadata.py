@@ -3,9 +3,18 @@ from app.api.v2.models.projects import UserMetadata
 from app.services.mongo.tasks import task_filtering_pipeline_match
 from fastapi import HTTPException
 from loguru import logger
-from app.services.mongo.sessions import compute_session_length, compute_task_position
+from app.services.mongo.sessions import compute_session_length, refresh_task_positions
 
 from app.db.mongo import get_mongo_db
+from app.services.mongo.metadata_catalog import get_metadata_catalog
+from app.services.mongo.quantile_sketches import get_metric_quantiles
+from app.services.mongo.user_stats import (
+    count_users,
+    get_nb_tasks_of_user_at,
+    get_user_metadata_from_stats,
+    has_user_stats,
+    list_users_metadata,
+)
 from phospho.models import ProjectDataFilters
 
 
@@ -50,9 +59,31 @@ async def calculate_average_for_metadata(
     return average
 
 
+async def _can_use_user_stats(
+    project_id: str, collection_name: str, metadata_field: str
+) -> bool:
+    """
+    The number of tasks per user is read from the user stats, when they're built
+    """
+    return (
+        collection_name == "tasks"
+        and metadata_field == "user_id"
+        and await has_user_stats(project_id)
+    )
+
+
 async def calculate_top10_percent(
     project_id: str, collection_name: str, metadata_field: str
 ) -> int:
+    if await _can_use_user_stats(project_id, collection_name, metadata_field):
+        total_users = await count_users(project_id)
+        if total_users == 0:
+            raise HTTPException(status_code=404, detail="No data found")
+        nb_tasks = await get_nb_tasks_of_user_at(
+            project_id, max(int(total_users * 0.1) - 1, 0), descending=True
+        )
+        return nb_tasks or 0
+
     mongo_db = await get_mongo_db()
 
     # Define the pipeline
@@ -105,6 +136,15 @@ async def calculate_top10_percent(
 async def calculate_bottom10_percent(
     project_id: str, collection_name: str, metadata_field: str
 ) -> int:
+    if await _can_use_user_stats(project_id, collection_name, metadata_field):
+        total_users = await count_users(project_id)
+        if total_users == 0:
+            raise HTTPException(status_code=404, detail="No data found")
+        nb_tasks = await get_nb_tasks_of_user_at(
+            project_id, min(int(total_users * 0.1), total_users - 1), descending=False
+        )
+        return nb_tasks or 0
+
     mongo_db = await get_mongo_db()
 
     # Define the pipeline with ascending sort order
@@ -149,6 +189,77 @@ async def calculate_bottom10_percent(
         return 0
 
 
+async def calculate_metadata_quantiles(
+    project_id: str,
+    metadata_field: str,
+    quantiles: List[float],
+    created_at_start: Optional[int] = None,
+    created_at_end: Optional[int] = None,
+) -> dict:
+    """
+    Estimate the quantiles and the average of a number metadata field of the tasks
+
+    Read from the quantile sketches if the project has them. Otherwise, the
+    quantiles are computed from the tasks.
+    """
+    result = await get_metric_quantiles(
+        project_id,
+        f"metadata.{metadata_field}",
+        quantiles,
+        created_at_start,
+        created_at_end,
+    )
+    if result is not None:
+        return result
+
+    mongo_db = await get_mongo_db()
+    main_filter: Dict[str, object] = {
+        "project_id": project_id,
+        "$expr": {"$isNumber": f"$metadata.{metadata_field}"},
+    }
+    created_at_filter: Dict[str, int] = {}
+    if created_at_start is not None:
+        created_at_filter["$gte"] = created_at_start
+    if created_at_end is not None:
+        created_at_filter["$lte"] = created_at_end
+    if len(created_at_filter) > 0:
+        main_filter["created_at"] = created_at_filter
+    pipeline: List[Dict[str, object]] = [
+        {"$match": main_filter},
+        {
+            "$group": {
+                "_id": None,
+                "count": {"$sum": 1},
+                "average": {"$avg": f"$metadata.{metadata_field}"},
+                "quantiles": {
+                    "$percentile": {
+                        "input": f"$metadata.{metadata_field}",
+                        "p": quantiles,
+                        "method": "approximate",
+                    }
+                },
+            }
+        },
+    ]
+    groups = await mongo_db["tasks"].aggregate(pipeline).to_list(length=None)
+    if len(groups) == 0:
+        return {
+            "count": 0,
+            "average": None,
+            "quantiles": [
+                {"quantile": quantile, "value": None} for quantile in quantiles
+            ],
+        }
+    return {
+        "count": groups[0]["count"],
+        "average": groups[0]["average"],
+        "quantiles": [
+            {"quantile": quantile, "value": value}
+            for quantile, value in zip(quantiles, groups[0]["quantiles"])
+        ],
+    }
+
+
 async def fetch_user_metadata(
     project_id: str,
     user_id: Optional[str] = None,
@@ -165,7 +276,18 @@ async def fetch_user_metadata(
         events: List[Event]
         tasks_id: List[str]
         sessions: List[Session]
+
+    Read from the user stats if the project has them. Otherwise, the tasks are
+    grouped by user.
     """
+    if await has_user_stats(project_id):
+        if user_id is None:
+            return await list_users_metadata(project_id)
+        user_metadata = await get_user_metadata_from_stats(project_id, user_id)
+        if user_metadata is None:
+            raise HTTPException(status_code=404, detail="No user found")
+        return [user_metadata]
+
     mongo_db = await get_mongo_db()
 
     match_pipeline: List[Dict[str, object]] = []
@@ -364,6 +486,10 @@ async def collect_unique_metadata_fields(
     """
     Get the unique metadata keys for a project
     """
+    catalog = await get_metadata_catalog(project_id)
+    if catalog is not None:
+        return [entry["field"] for entry in catalog if entry["types"].get(type, 0) > 0]
+
     mongo_db = await get_mongo_db()
     pipeline = await _build_unique_metadata_fields_pipeline(project_id, type)
     pipeline += [
@@ -397,6 +523,15 @@ async def collect_unique_metadata_field_values(
     if type not in ["string"]:
         raise NotImplementedError("Only string metadata values are supported")
 
+    # The catalog only keeps the most frequent values of each field
+    catalog = await get_metadata_catalog(project_id)
+    if catalog is not None:
+        return {
+            entry["field"]: sorted(value["value"] for value in entry["top_values"])
+            for entry in catalog
+            if entry["field"] != "task_id" and len(entry.get("top_values", [])) > 0
+        }
+
     mongo_db = await get_mongo_db()
     pipeline = await _build_unique_metadata_fields_pipeline(project_id, type)
 
@@ -509,7 +644,7 @@ async def breakdown_by_sum_of_metadata_field(
         breakdown_by_col = "events.event_name"
 
     if breakdown_by == "task_position":
-        await compute_task_position(project_id=project_id, filters=filters)
+        await refresh_task_positions(project_id=project_id)
         breakdown_by_col = "task_position"
 
     if metric.lower() == "nb tasks":
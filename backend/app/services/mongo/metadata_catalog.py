@@ -0,0 +1,141 @@
+"""
+Catalog of the metadata fields of the projects
+
+The metadata_catalog collection stores one document per project and metadata field,
+with the number of tasks per type of value, the min and max of the number values,
+HyperLogLog registers to estimate the number of distinct values, and the most
+frequent string values (see phospho.lab.metadata_catalog).
+
+The extractor updates the catalog when tasks are logged. The catalog of the
+projects created before it is built here, from the tasks, and the catalog of a
+project is only used once it's built (see metadata_catalog_status).
+"""
+
+from typing import Dict, List, Optional, Union
+
+from loguru import logger
+from pymongo import DeleteMany, UpdateOne
+
+from app.core import config
+from app.db.mongo import get_mongo_db
+from app.utils import generate_timestamp
+from phospho.lab.metadata_catalog import (
+    TOP_VALUES_SIZE,
+    add_value_to_summary,
+    estimate_cardinality,
+    new_field_summary,
+)
+
+
+async def has_metadata_catalog(project_id: str) -> bool:
+    mongo_db = await get_mongo_db()
+    status = await mongo_db["metadata_catalog_status"].find_one(
+        {"project_id": project_id}
+    )
+    return status is not None
+
+
+async def get_metadata_catalog(project_id: str) -> Optional[List[dict]]:
+    """
+    Get the catalog of the metadata fields of a project, the most used fields first.
+
+    Returns None if the catalog of the project is not built yet. The caller
+    should then compute the result from the tasks.
+    """
+    if not await has_metadata_catalog(project_id):
+        return None
+    mongo_db = await get_mongo_db()
+    catalog = (
+        await mongo_db["metadata_catalog"]
+        .find({"project_id": project_id}, {"_id": 0})
+        .sort("count", -1)
+        .to_list(length=None)
+    )
+    for entry in catalog:
+        entry["cardinality"] = estimate_cardinality(entry.pop("registers", None))
+    return catalog
+
+
+async def build_project_metadata_catalog(project_id: str) -> None:
+    """
+    Build the catalog of a project from its tasks, and replace the current one.
+    """
+    mongo_db = await get_mongo_db()
+    pipeline = [
+        {"$match": {"project_id": project_id, "metadata": {"$type": "object"}}},
+        {"$project": {"_id": 0, "metadata": {"$objectToArray": "$metadata"}}},
+        {"$unwind": "$metadata"},
+        {
+            "$group": {
+                "_id": {"field": "$metadata.k", "value": "$metadata.v"},
+                "count": {"$sum": 1},
+            }
+        },
+    ]
+    summaries: Dict[str, dict] = {}
+    async for group in mongo_db["tasks"].aggregate(pipeline, allowDiskUse=True):
+        field = group["_id"]["field"]
+        summary = summaries.get(field)
+        if summary is None:
+            summary = new_field_summary()
+            summaries[field] = summary
+        add_value_to_summary(summary, group["_id"].get("value"), group["count"])
+
+    now = generate_timestamp()
+    catalog = [
+        {
+            "project_id": project_id,
+            "field": field,
+            "count": summary["count"],
+            "types": dict(summary["types"]),
+            "min": summary["min"],
+            "max": summary["max"],
+            "registers": summary["registers"],
+            "top_values": [
+                {"value": value, "count": count}
+                for value, count in summary["values"].most_common(TOP_VALUES_SIZE)
+            ],
+            "updated_at": now,
+        }
+        for field, summary in summaries.items()
+    ]
+    # Replace the entries one by one, and delete the fields no longer used, so
+    # that the catalog is never empty while it's rebuilt
+    updates: List[Union[UpdateOne, DeleteMany]] = [
+        UpdateOne(
+            {"project_id": project_id, "field": entry["field"]},
+            {"$set": entry},
+            upsert=True,
+        )
+        for entry in catalog
+    ]
+    updates.append(
+        DeleteMany({"project_id": project_id, "field": {"$nin": list(summaries)}})
+    )
+    await mongo_db["metadata_catalog"].bulk_write(updates, ordered=False)
+    await mongo_db["metadata_catalog_status"].update_one(
+        {"project_id": project_id},
+        {"$set": {"built_at": now}},
+        upsert=True,
+    )
+
+
+async def backfill_metadata_catalogs() -> None:
+    """
+    Build the catalog of the projects that don't have one yet.
+    """
+    mongo_db = await get_mongo_db()
+    built_project_ids = set(
+        await mongo_db["metadata_catalog_status"].distinct("project_id")
+    )
+    project_ids_to_build = [
+        project_id
+        for project_id in await mongo_db["projects"].distinct("id")
+        if project_id not in built_project_ids
+    ][: config.METADATA_CATALOG_MAX_BUILDS_PER_RUN]
+    for project_id in project_ids_to_build:
+        try:
+            await build_project_metadata_catalog(project_id)
+        except Exception as e:
+            logger.error(f"Error building the metadata catalog of {project_id}: {e}")
+    logger.info(f"Metadata catalog: built {len(project_ids_to_build)} projects")
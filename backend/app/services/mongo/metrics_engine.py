@@ -0,0 +1,91 @@
+"""
+Compute several dashboard metrics in a few queries
+
+The metrics computed on the same collection with the same filters are compiled
+into a single $facet pipeline, so that the filtered documents are scanned once.
+The metrics that need their own pipeline (eg: a $lookup on another collection)
+run concurrently with it.
+
+A facet metric is a dict with:
+- pipeline: the stages applied to the matched documents
+- format: a function converting the result of the stages to the metric value
+
+The duration of each metric is returned in seconds. For facet metrics, this is
+the duration of the whole $facet query plus the formatting of the metric.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.db.mongo import get_mongo_db
+
+FacetMetrics = Dict[str, dict]
+StandaloneMetrics = Dict[str, Callable[[], Awaitable[object]]]
+
+
+async def run_facet_metrics(
+    collection: str,
+    match: Dict[str, object],
+    metrics: FacetMetrics,
+) -> Tuple[Dict[str, object], Dict[str, float]]:
+    """
+    Compute the facet metrics with a single aggregation on the collection.
+    """
+    mongo_db = await get_mongo_db()
+    start = time.perf_counter()
+    pipeline: List[Dict[str, object]] = [
+        {"$match": match},
+        {"$facet": {name: metric["pipeline"] for name, metric in metrics.items()}},
+    ]
+    result = await mongo_db[collection].aggregate(pipeline).to_list(length=1)
+    query_duration = time.perf_counter() - start
+    facets = result[0] if len(result) > 0 else {}
+
+    output: Dict[str, object] = {}
+    timings: Dict[str, float] = {}
+    for name, metric in metrics.items():
+        format_start = time.perf_counter()
+        output[name] = metric["format"](facets.get(name, []))
+        timings[name] = query_duration + time.perf_counter() - format_start
+    return output, timings
+
+
+async def _run_standalone_metric(
+    name: str, compute: Callable[[], Awaitable[object]]
+) -> Tuple[Dict[str, object], Dict[str, float]]:
+    start = time.perf_counter()
+    value = await compute()
+    return {name: value}, {name: time.perf_counter() - start}
+
+
+async def compute_metrics(
+    facet_groups: List[Tuple[str, Dict[str, object], FacetMetrics]],
+    standalone_metrics: Optional[StandaloneMetrics] = None,
+) -> Tuple[Dict[str, object], Dict[str, float]]:
+    """
+    Compute the metrics concurrently: one query per facet group
+    (collection, match, facet metrics) and one per standalone metric.
+
+    Returns the metrics and the duration of each metric.
+    """
+    queries = [
+        run_facet_metrics(collection, match, metrics)
+        for collection, match, metrics in facet_groups
+        if len(metrics) > 0
+    ]
+    if standalone_metrics is not None:
+        queries += [
+            _run_standalone_metric(name, compute)
+            for name, compute in standalone_metrics.items()
+        ]
+
+    output: Dict[str, object] = {}
+    timings: Dict[str, float] = {}
+    for group_output, group_timings in await asyncio.gather(*queries):
+        output.update(group_output)
+        timings.update(group_timings)
+    logger.debug(f"Metrics timings (s): {timings}")
+    return output, timings
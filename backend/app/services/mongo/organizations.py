@@ -1,14 +1,18 @@
 from typing import List, Optional
 
 from phospho.models import Recipe
+from phospho.utils import get_billing_period
 import pydantic
 from fastapi import HTTPException
 from loguru import logger
+from pymongo.errors import DuplicateKeyError
 
 from app.db.models import Project
 from app.db.mongo import get_mongo_db
 from app.core import config
 from app.security.authentification import propelauth
+from app.security.cache import invalidate_org
+from app.utils import generate_timestamp
 
 
 async def get_projects_from_org_id(org_id: str, limit: int = 1000) -> List[Project]:
@@ -87,15 +91,138 @@ async def create_project_by_org(org_id: str, user_id: str, **kwargs) -> Project:
     return project
 
 
+async def increment_org_usage(org_id: str, nb_job_results: int) -> None:
+    """
+    Increment the usage counters of an organization, when job results are saved.
+
+    The counters are stored in the org_usage collection: the total number of
+    job results of the org and the number per billing period.
+    """
+    if nb_job_results <= 0:
+        return
+    mongo_db = await get_mongo_db()
+    await mongo_db["org_usage"].update_one(
+        {"org_id": org_id},
+        {
+            "$inc": {
+                "nb_job_results": nb_job_results,
+                f"periods.{get_billing_period()}": nb_job_results,
+            }
+        },
+        upsert=True,
+    )
+
+
+async def reconcile_org_usage(org_id: str) -> int:
+    """
+    Recompute the usage counters of an organization from the job_results collection.
+    Returns the number of job results of the organization.
+
+    The extractor increments the counters concurrently, so they are not
+    overwritten: the difference with the recomputed counters is added, only if
+    the counters didn't change since they were read. Otherwise, the
+    reconciliation is skipped until the next run.
+    """
+    mongo_db = await get_mongo_db()
+    previous_usage = await mongo_db["org_usage"].find_one(
+        {"org_id": org_id}, {"_id": 0, "nb_job_results": 1, "periods": 1}
+    )
+    usage_per_period = await (
+        mongo_db["job_results"]
+        .aggregate(
+            [
+                {"$match": {"org_id": org_id}},
+                {
+                    "$group": {
+                        "_id": {
+                            "$dateToString": {
+                                "format": "%Y-%m",
+                                "date": {
+                                    "$toDate": {"$multiply": ["$created_at", 1000]}
+                                },
+                            }
+                        },
+                        "count": {"$sum": 1},
+                    }
+                },
+            ]
+        )
+        .to_list(length=None)
+    )
+    nb_job_results = sum(period["count"] for period in usage_per_period)
+    periods = {
+        period["_id"]: period["count"]
+        for period in usage_per_period
+        if period["_id"] is not None
+    }
+    if previous_usage is None:
+        try:
+            await mongo_db["org_usage"].insert_one(
+                {
+                    "org_id": org_id,
+                    "nb_job_results": nb_job_results,
+                    "periods": periods,
+                    "reconciled_at": generate_timestamp(),
+                }
+            )
+        except DuplicateKeyError:
+            logger.info(f"Usage of org {org_id} created concurrently, not reconciled")
+        return nb_job_results
+
+    previous_periods = previous_usage.get("periods") or {}
+    increments = {
+        "nb_job_results": nb_job_results - previous_usage.get("nb_job_results", 0)
+    }
+    for period in set(periods) | set(previous_periods):
+        delta = periods.get(period, 0) - previous_periods.get(period, 0)
+        if delta != 0:
+            increments[f"periods.{period}"] = delta
+    result = await mongo_db["org_usage"].update_one(
+        {
+            "org_id": org_id,
+            "nb_job_results": previous_usage.get("nb_job_results"),
+        },
+        {"$inc": increments, "$set": {"reconciled_at": generate_timestamp()}},
+    )
+    if result.matched_count == 0:
+        logger.info(f"Usage of org {org_id} changed while reconciling, not reconciled")
+    return nb_job_results
+
+
+async def reconcile_usage_counters() -> None:
+    """
+    Recompute the usage counters of all the organizations. Run periodically to
+    correct the drift of the counters (eg: failed increments).
+    """
+    mongo_db = await get_mongo_db()
+    org_ids = await mongo_db["job_results"].distinct("org_id")
+    for org_id in org_ids:
+        if org_id is None:
+            continue
+        try:
+            await reconcile_org_usage(org_id)
+        except Exception as e:
+            logger.error(f"Error reconciling the usage of org {org_id}: {e}")
+    logger.info(f"Reconciled the usage counters of {len(org_ids)} organizations")
+
+
 async def get_usage_quota(org_id: str, plan: str) -> dict:
     """
     Calculate the usage quota of an organization.
-    The usage quota is the number of tasks logged by the organization.
+    The usage quota is the number of tasks logged by the organization, read
+    from the usage counters of the organization.
     """
     mongo_db = await get_mongo_db()
 
     # Get usage info for the orgnization
-    nb_tasks_logged = await mongo_db["job_results"].count_documents({"org_id": org_id})
+    usage = await mongo_db["org_usage"].find_one(
+        {"org_id": org_id}, {"_id": 0, "nb_job_results": 1, "reconciled_at": 1}
+    )
+    if usage is None or usage.get("reconciled_at") is None:
+        # The counters were never computed from the job_results of the org
+        nb_tasks_logged = await reconcile_org_usage(org_id)
+    else:
+        nb_tasks_logged = usage.get("nb_job_results", 0)
 
     # These orgs are exempted from the quota
     EXEMPTED_ORG_IDS = [
@@ -174,6 +301,7 @@ def change_organization_plan(
         propelauth.update_org_metadata(
             org_id, max_users=config.PLAN_PRO_MAX_USERS, metadata=org_metadata
         )
+        invalidate_org(org_id)
         return org_metadata
     except Exception as e:
         logger.error(f"Error upgrading organization {org_id} to pro plan: {e}")
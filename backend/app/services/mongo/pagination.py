@@ -0,0 +1,154 @@
+"""
+Keyset (cursor) pagination
+
+Skipping page * per_page documents gets slower as the page number grows, because
+the skipped documents are still read. Instead, a cursor stores the sort values of
+the last item of a page, and the next page starts right after it. With an index
+on the sort keys, page 1000 is as fast as page 1.
+
+The id is always added as the last sort key, so that items with the same sort
+values have a stable order. The cursor is opaque to the clients: it's the
+base64 encoded JSON of the sort values of the last item.
+
+MongoDB sorts the null and missing values before all the other values, so they
+come first in ascending order and last in descending order. The cursor $match
+follows the same order, so that these items are not skipped.
+"""
+
+import base64
+import json
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from app.api.platform.models.explore import Pagination, Sorting
+
+# Sort keys always set on the items, that don't need the null handling
+NON_NULL_SORT_KEYS = {"created_at", "id"}
+
+
+def get_sorting_dict(sorting: Optional[List[Sorting]] = None) -> Dict[str, int]:
+    """
+    The $sort of a listing. By default, the most recent items first.
+    """
+    if sorting is None or len(sorting) == 0:
+        sorting_dict = {"created_at": -1}
+    else:
+        sorting_dict = {sort.id: 1 if sort.desc else -1 for sort in sorting}
+    if "id" not in sorting_dict:
+        # Tie-breaker, in the direction of the last sort key
+        sorting_dict["id"] = list(sorting_dict.values())[-1]
+    return sorting_dict
+
+
+def encode_cursor(values: Dict[str, Any]) -> str:
+    payload = json.dumps(values, separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str, sorting_dict: Dict[str, int]) -> Dict[str, Any]:
+    """
+    Decode a cursor. Raise a 400 if it's invalid or if it was created with
+    another sorting.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    if not isinstance(values, dict) or list(values.keys()) != list(sorting_dict.keys()):
+        raise HTTPException(
+            status_code=400,
+            detail="The pagination cursor doesn't match the sorting of the query",
+        )
+    return values
+
+
+def _after_value(key: str, direction: int, value: Any) -> Optional[Dict[str, Any]]:
+    """
+    The condition on a sort key selecting the values after value, in the order
+    of the sort. None if no value is after it.
+    """
+    if key in NON_NULL_SORT_KEYS:
+        return {key: {"$gt" if direction == 1 else "$lt": value}}
+    if direction == 1:
+        # The nulls are first: all the other values are after a null
+        if value is None:
+            return {key: {"$ne": None}}
+        return {key: {"$gt": value}}
+    # The nulls are last: nothing is after a null, and they are after the others
+    if value is None:
+        return None
+    return {"$or": [{key: {"$lt": value}}, {key: None}]}
+
+
+def build_cursor_match(sorting_dict: Dict[str, int], cursor: str) -> Dict[str, Any]:
+    """
+    The $match selecting the items after the cursor, in the order of the sort:
+
+    (k1 > v1) or (k1 == v1 and k2 > v2) or ...
+
+    with < instead of > for the descending keys. A null value is equal to the
+    null and missing values, and lower than the others.
+    """
+    values = decode_cursor(cursor, sorting_dict)
+    conditions: List[Dict[str, Any]] = []
+    equalities: Dict[str, Any] = {}
+    for key, direction in sorting_dict.items():
+        after_value = _after_value(key, direction, values[key])
+        if after_value is not None:
+            conditions.append({**equalities, **after_value})
+        equalities[key] = values[key]
+    return {"$or": conditions}
+
+
+def _get_value(item: Union[BaseModel, dict], key: str) -> Any:
+    value: Any = item.model_dump() if isinstance(item, BaseModel) else item
+    for part in key.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def get_next_cursor(
+    items: Sequence[Union[BaseModel, dict]],
+    pagination: Optional[Pagination],
+    sorting: Optional[List[Sorting]] = None,
+) -> Optional[str]:
+    """
+    The cursor of the page after items. None if items is the last page.
+    """
+    if pagination is None or len(items) < pagination.per_page or len(items) == 0:
+        return None
+    last_item = items[-1]
+    return encode_cursor(
+        {key: _get_value(last_item, key) for key in get_sorting_dict(sorting).keys()}
+    )
+
+
+def get_pagination_stages(pagination: Optional[Pagination]) -> List[Dict[str, object]]:
+    """
+    The stages selecting a page, after the $sort. With a cursor, the $match on
+    the sort keys is added before the $sort by get_cursor_match_stages.
+    """
+    if pagination is None:
+        return []
+    if pagination.cursor is not None:
+        return [{"$limit": pagination.per_page}]
+    return [
+        {"$skip": pagination.page * pagination.per_page},
+        {"$limit": pagination.per_page},
+    ]
+
+
+def get_cursor_match_stages(
+    pagination: Optional[Pagination], sorting_dict: Dict[str, int]
+) -> List[Dict[str, object]]:
+    """
+    The $match selecting the items after the cursor of the pagination, if any.
+    Add it right after the first $match, so that both use the same index.
+    """
+    if pagination is None or pagination.cursor is None:
+        return []
+    return [{"$match": build_cursor_match(sorting_dict, pagination.cursor)}]
@@ -1,17 +1,17 @@
 import datetime
-import io
 from typing import Dict, List, Optional, Union
 
 from app.api.platform.models.explore import Sorting
-from app.services.mongo.tasks import (
-    get_total_nb_of_tasks,
-    task_filtering_pipeline_match,
+from app.services.mongo.pagination import (
+    build_cursor_match,
+    get_cursor_match_stages,
+    get_pagination_stages,
+    get_sorting_dict,
 )
-import pandas as pd
+from app.services.mongo.tasks import task_filtering_pipeline_match
 from phospho.models import Threshold
-import resend
 from app.api.platform.models import UserMetadata, Pagination
-from app.core import config
+from app.api.v2.models.projects import BackfillJob
 from app.db.models import (
     Event,
     EventDefinition,
@@ -23,15 +23,26 @@ from app.db.models import (
     ProjectDataFilters,
 )
 from app.db.mongo import get_mongo_db
-from app.security.authentification import propelauth
+from app.services.mongo.backfills import (
+    check_nb_running_backfill_jobs,
+    create_backfill_job,
+)
+from app.services.mongo.event_summaries import remove_event_definition_from_summaries
+from app.services.mongo.results_cache import bump_data_version
+from app.services.mongo.sessions import decrement_session_events
+from app.security.cache import invalidate_project
 from app.services.mongo.metadata import fetch_user_metadata
+from app.services.mongo.user_stats import (
+    has_user_stats,
+    list_users_metadata,
+    paginate_users,
+)
 from app.services.slack import slack_notification
 from app.utils import generate_timestamp
 from fastapi import HTTPException
 from loguru import logger
 from propelauth_fastapi import User
 
-from app.services.mongo.extractor import run_recipe_on_tasks
 from app.services.mongo.tasks import label_sentiment_analysis
 
 from phospho.utils import filter_nonjsonable_keys
@@ -152,6 +163,7 @@ async def delete_project_from_id(project_id: str) -> bool:
     mongo_db = await get_mongo_db()
     delete_result = await mongo_db["projects"].delete_one({"id": project_id})
     status = delete_result.deleted_count > 0
+    invalidate_project(project_id)
     return status
 
 
@@ -258,12 +270,17 @@ async def update_project(project: Project, **kwargs) -> Project:
                     logger.error(f"Error disabling recipe for event {event_name}: {e}")
                 # Remove all historical events
                 try:
-                    mongo_db["events"].update_many(
-                        {
-                            "project_id": project.id,
-                            "event_definition.id": event_definition.id,
-                        },
-                        {"$set": {"removed": True}},
+                    events_filter = {
+                        "project_id": project.id,
+                        "event_definition.id": event_definition.id,
+                    }
+                    await decrement_session_events(events_filter)
+                    await mongo_db["events"].update_many(
+                        events_filter, {"$set": {"removed": True}}
+                    )
+                    await remove_event_definition_from_summaries(
+                        project_id=project.id,
+                        event_definition_id=event_definition.id,
                     )
                     logger.debug(
                         f"Removing all historical events for event {event_definition.id}"
@@ -277,6 +294,8 @@ async def update_project(project: Project, **kwargs) -> Project:
         _ = await mongo_db["projects"].update_one(
             {"id": project.id}, {"$set": updated_project.model_dump()}
         )
+        # The events and settings of the project are shown in the dashboards
+        await bump_data_version([project.id])
 
     updated_project = await get_project_by_id(project.id)
     return updated_project
@@ -328,6 +347,9 @@ async def get_all_tasks(
 ) -> List[Task]:
     """
     Get all the tasks of a project.
+
+    If pagination has a cursor, the page starts after it (see pagination.py).
+    If sample_rate is set, each task is kept with this probability.
     """
 
     mongo_db = await get_mongo_db()
@@ -342,8 +364,15 @@ async def get_all_tasks(
     if not get_tests:
         main_filter["test_id"] = None
 
+    if sample_rate is not None:
+        # Random sampling while reading the matched tasks, instead of a $sample
+        # on the whole result
+        main_filter["$sampleRate"] = sample_rate
+
+    sorting_dict = get_sorting_dict(sorting)
     pipeline: List[Dict[str, object]] = [
         {"$match": main_filter},
+        *get_cursor_match_stages(pagination, sorting_dict),
     ]
 
     # Get rid of the raw_input and raw_output fields
@@ -356,14 +385,7 @@ async def get_all_tasks(
         }
     )
 
-    if not get_events:
-        collection = "tasks"
-
     # To avoid the sort to OOM on Serverless MongoDB executor, we restrain the pipeline to the necessary fields...
-    if sorting is None:
-        sorting_dict = {"created_at": -1}
-    else:
-        sorting_dict = {sort.id: 1 if sort.desc else -1 for sort in sorting}
     pipeline.extend(
         [
             {
@@ -378,20 +400,15 @@ async def get_all_tasks(
 
     # Add pagination
     if pagination:
-        pipeline.extend(
-            [
-                {"$skip": pagination.page * pagination.per_page},
-                {"$limit": pagination.per_page},
-            ]
-        )
+        pipeline.extend(get_pagination_stages(pagination))
         limit = None
 
-    # ... and then we add the lookup and the deduplication
+    # ... and then we add the lookup. The events are stored on the task documents
     pipeline.extend(
         [
             {
                 "$lookup": {
-                    "from": "tasks_with_events",
+                    "from": "tasks",
                     "localField": "id",
                     "foreignField": "id",
                     "as": "tasks",
@@ -403,46 +420,8 @@ async def get_all_tasks(
             {"$replaceRoot": {"newRoot": "$tasks"}},
         ]
     )
-
-    # Deduplicate events names. We want the unique event_names of the task
-    pipeline.append(
-        {
-            "$addFields": {
-                "events": {
-                    "$reduce": {
-                        "input": "$events",
-                        "initialValue": [],
-                        "in": {
-                            "$concatArrays": [
-                                "$$value",
-                                {
-                                    "$cond": [
-                                        {
-                                            "$in": [
-                                                "$$this.event_name",
-                                                "$$value.event_name",
-                                            ]
-                                        },
-                                        [],
-                                        ["$$this"],
-                                    ]
-                                },
-                            ]
-                        },
-                    }
-                }
-            }
-        },
-    )
-
-    if sample_rate is not None:
-        total_nb_tasks = await get_total_nb_of_tasks(
-            project_id=project_id,
-            filters=filters,
-        )
-        if total_nb_tasks is not None:
-            sample_size = int(total_nb_tasks * sample_rate)
-            pipeline.append({"$sample": {"size": sample_size}})
+    if not get_events:
+        pipeline.append({"$project": {"events": 0}})
 
     tasks = await mongo_db[collection].aggregate(pipeline).to_list(length=limit)
 
@@ -458,128 +437,18 @@ async def get_all_tasks(
     return valid_tasks
 
 
-async def email_project_tasks(
-    project_id: str,
-    uid: str,
-    limit: Optional[int] = 1000,
-):
-    def send_error_message():
-        # Send an error message to the user
-        params = {
-            "from": "phospho <contact@phospho.ai>",
-            "to": [user.get("email")],
-            "subject": "Error exporting your tasks",
-            "html": f"""<p>Hello!<br><br>We could not export your tasks for the project with id {project_id} (timestamp: {datetime.datetime.now().isoformat()})</p>
-            <p><br>Please contact the support at contact@phospho.ai</p>
-            <p>Best,<br>
-            The Phospho Team</p>
-            """,
-        }
-
-        email = resend.Emails.send(params)
-        logger.debug(f"Sent error message to user: {user.get('email')}")
-
-    if config.ENVIRONMENT != "preview":
-        tasks_list = await get_all_tasks(project_id=project_id)
-
-        # Get the user email
-        user = propelauth.fetch_user_metadata_by_user_id(uid, include_orgs=False)
-
-        # Use Resend to send the email
-        resend.api_key = config.RESEND_API_KEY
-
-        try:
-            # Convert task list to Pandas DataFrame
-            df = pd.DataFrame([task.model_dump() for task in tasks_list])
-        except Exception as e:
-            error_message = f"Error converting tasks to DataFrame for {user.get('email')} project id {project_id}: {e}"
-            logger.error(error_message)
-            await slack_notification(error_message)
-
-        exports = []
-        # Convert the DataFrame to a CSV string, then to bytes
-        try:
-            csv_string = df.to_csv(index=False)
-            csv_bytes = csv_string.encode()
-            exports.append(
-                {
-                    "filename": "tasks.csv",
-                    "content": list(csv_bytes),
-                }
-            )
-        except Exception as e:
-            error_message = f"Error converting tasks to CSV for {user.get('email')} project id {project_id}: {e}"
-            logger.error(error_message)
-            await slack_notification(error_message)
-
-        # Get the excel file buffer
-        try:
-            excel_buffer = io.BytesIO()
-            df.to_excel(excel_buffer, index=False)
-            excel_data = excel_buffer.getvalue()
-            # encoded_excel = base64.b64encode(excel_data).decode()
-            exports.append(
-                {
-                    "filename": "tasks.xlsx",
-                    "content": list(excel_data),
-                }
-            )
-        except Exception as e:
-            error_message = f"Error converting tasks to Excel for {user.get('email')} project id {project_id}: {e}"
-            logger.error(error_message)
-            await slack_notification(error_message)
-
-        # TODO : Add .parquet file export for large datasets
-        try:
-            parquet_buffer = io.BytesIO()
-            df.to_parquet(parquet_buffer, index=False)
-            parquet_data = parquet_buffer.getvalue()
-            exports.append(
-                {
-                    "filename": "tasks.parquet",
-                    "content": list(parquet_data),
-                }
-            )
-        except Exception as e:
-            error_message = f"Error converting tasks to Parquet for {user.get('email')} project id {project_id}: {e}"
-            logger.error(error_message)
-            await slack_notification(error_message)
-
-        # If no exports, send an error message
-        if not exports:
-            send_error_message()
-            return
-
-        params = {
-            "from": "phospho <contact@phospho.ai>",
-            "to": [user.get("email")],
-            "subject": "Your exported tasks are ready",
-            "html": f"""<p>Hello!<br><br>Here are attached your exported tasks for the project with id {project_id} (timestamp: {datetime.datetime.now().isoformat()})</p>
-            <p><br>So, what do you think about phospho for now? Feel free to respond to this email address and share your toughts !</p>
-            <p>Enjoy,<br>
-            The Phospho Team</p>
-            """,
-            "attachments": exports,
-        }
-
-        try:
-            resend.Emails.send(params)
-            logger.info(f"Successfully sent tasks by email to {user.get('email')}")
-        except Exception as e:
-            error_message = f"Error sending email to {user.get('email')} project_id {project_id}: {e}"
-            logger.error(error_message)
-            await slack_notification(error_message)
-    else:
-        logger.warning("Preview environment: emails disabled")
-
-
 async def get_all_events(
     project_id: str,
     limit: Optional[int] = None,
     filters: Optional[ProjectDataFilters] = None,
     include_removed: bool = False,
     unique: bool = False,
+    cursor: Optional[str] = None,
 ) -> List[Event]:
+    """
+    Get the events of a project, the most recent first. If cursor is set,
+    the events start after it (see pagination.py).
+    """
     mongo_db = await get_mongo_db()
     additional_event_filters: Dict[str, object] = {}
     pipeline: List[Dict[str, object]] = []
@@ -624,7 +493,10 @@ async def get_all_events(
             ]
         )
 
-    pipeline.append({"$sort": {"created_at": -1}})
+    sorting_dict = get_sorting_dict()
+    if cursor is not None:
+        pipeline.append({"$match": build_cursor_match(sorting_dict, cursor)})
+    pipeline.append({"$sort": sorting_dict})
 
     events = await mongo_db["events"].aggregate(pipeline).to_list(length=limit)
 
@@ -666,6 +538,13 @@ async def get_all_sessions(
             for key, value in filters.metadata.items():
                 additional_sessions_filter[f"metadata.{key}"] = value
 
+        if filters.event_name is not None:
+            # The events are stored on the session documents
+            additional_sessions_filter["events.event_name"] = {
+                "$in": filters.event_name
+            }
+
+    sorting_dict = get_sorting_dict(sorting)
     pipeline: List[Dict[str, object]] = [
         {
             "$match": {
@@ -673,29 +552,8 @@ async def get_all_sessions(
                 **additional_sessions_filter,
             }
         },
+        *get_cursor_match_stages(pagination, sorting_dict),
     ]
-    if get_events or (filters is not None and filters.event_name is not None):
-        collection_name = "sessions_with_events"
-        if filters is not None and filters.event_name is not None:
-            pipeline.extend(
-                [
-                    {
-                        "$match": {
-                            "$and": [
-                                {"events": {"$ne": []}},
-                                {
-                                    "events": {
-                                        "$elemMatch": {
-                                            "event_name": {"$in": filters.event_name}
-                                        }
-                                    }
-                                },
-                            ]
-                        },
-                    },
-                ]
-            )
-
     if get_tasks or (filters is not None and filters.user_id is not None):
         pipeline.extend(
             [
@@ -725,10 +583,6 @@ async def get_all_sessions(
             )
 
     # To avoid the sort to OOM on Serverless MongoDB executor, we restrain the pipeline to the necessary fields...
-    if sorting is None:
-        sorting_dict = {"created_at": -1}
-    else:
-        sorting_dict = {sort.id: 1 if sort.desc else -1 for sort in sorting}
     pipeline.extend(
         [
             {
@@ -743,19 +597,14 @@ async def get_all_sessions(
 
     # Add pagination
     if pagination:
-        pipeline.extend(
-            [
-                {"$skip": pagination.page * pagination.per_page},
-                {"$limit": pagination.per_page},
-            ]
-        )
+        pipeline.extend(get_pagination_stages(pagination))
 
-    # ... and then we add the lookup and the deduplication
+    # ... and then we add the lookup
     pipeline.extend(
         [
             {
                 "$lookup": {
-                    "from": "sessions_with_events",
+                    "from": "sessions",
                     "localField": "id",
                     "foreignField": "id",
                     "as": "sessions",
@@ -767,6 +616,8 @@ async def get_all_sessions(
             {"$replaceRoot": {"newRoot": "$sessions"}},
         ]
     )
+    if not get_events:
+        pipeline.append({"$project": {"events": 0}})
 
     sessions = await mongo_db[collection_name].aggregate(pipeline).to_list(length=limit)
 
@@ -806,11 +657,15 @@ async def store_onboarding_survey(project_id: str, user: User, survey: dict):
     return
 
 
-async def get_all_users_metadata(project_id: str) -> List[UserMetadata]:
+async def get_all_users_metadata(
+    project_id: str, pagination: Optional[Pagination] = None
+) -> List[UserMetadata]:
     """
     Get metadata about the end-users of a project
 
-    Groups the tasks by user_id and return a list of UserMetadata.
+    Read from the user stats, the most active users first, page by page if a
+    pagination is given. If the stats of the project are not built yet, groups
+    the tasks by user_id.
     Every UserMetadata contains:
         user_id: str
         nb_tasks: int
@@ -820,37 +675,28 @@ async def get_all_users_metadata(project_id: str) -> List[UserMetadata]:
         tasks: List[Task]
         sessions: List[Session]
     """
+    if await has_user_stats(project_id):
+        return await list_users_metadata(project_id, pagination)
     try:
         users = await fetch_user_metadata(project_id=project_id, user_id=None)
     except Exception as e:
         logger.error(f"Error fetching users metadata: {e}")
         users = []
-    return users
+    return paginate_users(users, pagination)
 
 
-async def backcompute_recipe(job_id: str, tasks: List[Task]) -> None:
+async def get_project_recipe(project_id: str, recipe_id: str) -> Recipe:
     """
-    Run predictions for a job on all the tasks of a project that have not been processed yet.
+    Get a recipe of a project. Raise a 404 if it doesn't exist or belongs to
+    another project.
     """
     mongo_db = await get_mongo_db()
-
-    recipe = await mongo_db["recipes"].find_one({"id": job_id})
-    recipe = Recipe.model_validate(recipe)
-
-    # For each task, check if a prediction has a job_id and a task_id matching the task
-    tasks_to_process = []
-
-    for task in tasks:
-        prediction = await mongo_db["job_results"].find_one(
-            {"task_id": task.id, "job_metadata.recipe_id": recipe.id}
-        )
-        if prediction is None:
-            tasks_to_process.append(task)
-
-    # Send the task to the job pipeline of the extractor
-    await run_recipe_on_tasks(
-        tasks=tasks_to_process, recipe=recipe, org_id=recipe.org_id
+    recipe = await mongo_db["recipes"].find_one(
+        {"id": recipe_id, "project_id": project_id}
     )
+    if recipe is None:
+        raise HTTPException(status_code=404, detail=f"Job {recipe_id} not found")
+    return Recipe.model_validate(recipe)
 
 
 async def backcompute_recipes(
@@ -858,9 +704,13 @@ async def backcompute_recipes(
     recipe_ids: List[str],
     filters: ProjectDataFilters,
     limit: int = 10000,
-) -> None:
+) -> List[BackfillJob]:
     """
-    Run predictions for a list of jobs on all the tasks of a project that match the filters and that have not been processed yet.
+    Create the backfill jobs running a list of jobs on all the tasks of a project that match the filters and that have not been processed yet.
+    Run them with run_backfill_job.
+
+    No job is created if a recipe isn't found in the project, or if the
+    project can't run all the jobs.
     """
 
     # Filter the tasks from the filters
@@ -870,11 +720,14 @@ async def backcompute_recipes(
     if filters.user_id:
         logger.warning("Filter on user_id is not implemented")
 
-    tasks = await get_all_tasks(project_id=project_id, limit=limit, filters=filters)
-
-    # For each job, run the job on the tasks
-    for recipe_id in recipe_ids:
-        await backcompute_recipe(recipe_id, tasks)
+    recipes = [
+        await get_project_recipe(project_id, recipe_id) for recipe_id in recipe_ids
+    ]
+    await check_nb_running_backfill_jobs(project_id, nb_new_jobs=len(recipes))
+    return [
+        await create_backfill_job(recipe, filters=filters, limit=limit)
+        for recipe in recipes
+    ]
 
 
 async def collect_languages(
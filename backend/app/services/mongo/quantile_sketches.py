@@ -0,0 +1,315 @@
+"""
+Daily quantile sketches of the numeric metadata and of the session lengths
+
+The quantile_sketches collection stores one document per project, day and
+metric ("metadata.<field>" or "session_length"), with the number of values
+counted in logarithmic buckets (see phospho.lab.quantile_sketches). The sketches of a date range are merged by adding their buckets,
+and a quantile is estimated with a relative error of at most RELATIVE_ACCURACY.
+
+The extractor updates the sketches when tasks are logged. The sketches of the
+projects created before them are built here, from the tasks and sessions, and
+the sketches of a project are only used once they're built (see
+quantile_sketches_status).
+
+The date filters are applied per day (UTC): the days overlapping the range are
+included.
+"""
+
+from collections import Counter
+from typing import Dict, List, Optional, Tuple, Union
+
+from loguru import logger
+from pymongo import DeleteOne, UpdateOne
+
+from app.core import config
+from app.db.mongo import get_mongo_db
+from app.utils import generate_timestamp
+from phospho.lab.quantile_sketches import (
+    LOG_GAMMA,
+    get_bucket_key,
+    get_bucket_value,
+)
+
+DAY = 86400
+
+
+def merge_sketches(sketches: List[dict]) -> dict:
+    count = 0
+    total = 0.0
+    buckets: Counter = Counter()
+    for sketch in sketches:
+        count += sketch.get("count", 0)
+        total += sketch.get("sum", 0.0)
+        buckets.update(sketch.get("buckets", {}))
+    return {"count": count, "sum": total, "buckets": buckets}
+
+
+def get_sorted_buckets(buckets: Dict[str, int]) -> List[tuple]:
+    """
+    The (value, count) of the non empty buckets, by increasing value
+    """
+    return sorted(
+        (get_bucket_value(key), count) for key, count in buckets.items() if count > 0
+    )
+
+
+def get_sketch_quantile(buckets: Dict[str, int], quantile: float) -> Optional[float]:
+    sorted_buckets = get_sorted_buckets(buckets)
+    count = sum(bucket_count for _, bucket_count in sorted_buckets)
+    if count == 0:
+        return None
+    rank = quantile * (count - 1)
+    cumulative_count = 0
+    for value, bucket_count in sorted_buckets:
+        cumulative_count += bucket_count
+        if cumulative_count > rank:
+            return value
+    return sorted_buckets[-1][0]
+
+
+async def has_quantile_sketches(project_id: str) -> bool:
+    mongo_db = await get_mongo_db()
+    status = await mongo_db["quantile_sketches_status"].find_one(
+        {"project_id": project_id}
+    )
+    return status is not None
+
+
+async def get_merged_sketch(
+    project_id: str,
+    metric: str,
+    created_at_start: Optional[int] = None,
+    created_at_end: Optional[int] = None,
+) -> Optional[dict]:
+    """
+    Merge the daily sketches of a metric. Returns None if the sketches of the
+    project are not built yet.
+    """
+    if not await has_quantile_sketches(project_id):
+        return None
+    mongo_db = await get_mongo_db()
+    query: Dict[str, object] = {"project_id": project_id, "metric": metric}
+    day_filter: Dict[str, int] = {}
+    if created_at_start is not None:
+        day_filter["$gte"] = created_at_start - created_at_start % DAY
+    if created_at_end is not None:
+        day_filter["$lte"] = created_at_end
+    if len(day_filter) > 0:
+        query["day"] = day_filter
+    sketches = (
+        await mongo_db["quantile_sketches"]
+        .find(query, {"_id": 0, "count": 1, "sum": 1, "buckets": 1})
+        .to_list(length=None)
+    )
+    return merge_sketches(sketches)
+
+
+async def get_metric_quantiles(
+    project_id: str,
+    metric: str,
+    quantiles: List[float],
+    created_at_start: Optional[int] = None,
+    created_at_end: Optional[int] = None,
+) -> Optional[dict]:
+    """
+    Estimate the quantiles and the average of a metric, eg: metadata.total_tokens.
+    Returns None if the sketches of the project are not built yet.
+    """
+    sketch = await get_merged_sketch(
+        project_id, metric, created_at_start, created_at_end
+    )
+    if sketch is None:
+        return None
+    return {
+        "count": sketch["count"],
+        "average": sketch["sum"] / sketch["count"] if sketch["count"] > 0 else None,
+        "quantiles": [
+            {
+                "quantile": quantile,
+                "value": get_sketch_quantile(sketch["buckets"], quantile),
+            }
+            for quantile in quantiles
+        ],
+    }
+
+
+async def get_session_length_histogram(
+    project_id: str,
+    created_at_start: Optional[int] = None,
+    created_at_end: Optional[int] = None,
+) -> Optional[List[dict]]:
+    """
+    The number of sessions per session length. The lengths above 50 are
+    rounded to the value of their bucket. Returns None if the sketches of the
+    project are not built yet.
+    """
+    sketch = await get_merged_sketch(
+        project_id, "session_length", created_at_start, created_at_end
+    )
+    if sketch is None:
+        return None
+    nb_sessions: Counter = Counter()
+    for value, count in get_sorted_buckets(sketch["buckets"]):
+        nb_sessions[round(value)] += count
+    return [
+        {"session_length": session_length, "nb_sessions": count}
+        for session_length, count in sorted(nb_sessions.items())
+        if session_length > 0
+    ]
+
+
+def _bucket_key_expression(value: str) -> dict:
+    """
+    get_bucket_key in an aggregation pipeline
+    """
+
+    def index(absolute_value: object) -> dict:
+        return {
+            "$toString": {
+                "$toLong": {"$ceil": {"$divide": [{"$ln": absolute_value}, LOG_GAMMA]}}
+            }
+        }
+
+    return {
+        "$switch": {
+            "branches": [
+                {"case": {"$gt": [value, 0]}, "then": {"$concat": ["p", index(value)]}},
+                {
+                    "case": {"$lt": [value, 0]},
+                    "then": {"$concat": ["n", index({"$abs": value})]},
+                },
+            ],
+            "default": "z",
+        }
+    }
+
+
+async def build_project_quantile_sketches(project_id: str) -> None:
+    """
+    Build the sketches of a project from its tasks and sessions, and replace
+    the current ones.
+    """
+    mongo_db = await get_mongo_db()
+    sketches: Dict[Tuple[int, str], dict] = {}
+
+    def add(day: int, metric: str, key: str, count: int, total: float) -> None:
+        sketch = sketches.setdefault(
+            (day, metric), {"count": 0, "sum": 0.0, "buckets": {}}
+        )
+        sketch["count"] += count
+        sketch["sum"] += total
+        sketch["buckets"][key] = sketch["buckets"].get(key, 0) + count
+
+    metadata_pipeline: List[Dict[str, object]] = [
+        {"$match": {"project_id": project_id, "metadata": {"$type": "object"}}},
+        {
+            "$project": {
+                "_id": 0,
+                "day": {"$subtract": ["$created_at", {"$mod": ["$created_at", DAY]}]},
+                "metadata": {"$objectToArray": "$metadata"},
+            }
+        },
+        {"$unwind": "$metadata"},
+        # $isNumber is false for the booleans
+        {"$match": {"$expr": {"$isNumber": "$metadata.v"}}},
+        {
+            "$group": {
+                "_id": {
+                    "day": "$day",
+                    "field": "$metadata.k",
+                    "key": _bucket_key_expression("$metadata.v"),
+                },
+                "count": {"$sum": 1},
+                "sum": {"$sum": "$metadata.v"},
+            }
+        },
+    ]
+    async for group in mongo_db["tasks"].aggregate(
+        metadata_pipeline, allowDiskUse=True
+    ):
+        field = group["_id"]["field"]
+        if "." in field or field.startswith("$"):
+            continue
+        add(
+            group["_id"]["day"],
+            f"metadata.{field}",
+            group["_id"]["key"],
+            group["count"],
+            group["sum"],
+        )
+
+    sessions_pipeline: List[Dict[str, object]] = [
+        {"$match": {"project_id": project_id, "session_length": {"$gt": 0}}},
+        {
+            "$group": {
+                "_id": {
+                    "day": {
+                        "$subtract": ["$created_at", {"$mod": ["$created_at", DAY]}]
+                    },
+                    "session_length": "$session_length",
+                },
+                "count": {"$sum": 1},
+            }
+        },
+    ]
+    async for group in mongo_db["sessions"].aggregate(
+        sessions_pipeline, allowDiskUse=True
+    ):
+        session_length = group["_id"]["session_length"]
+        add(
+            group["_id"]["day"],
+            "session_length",
+            get_bucket_key(session_length),
+            group["count"],
+            session_length * group["count"],
+        )
+
+    # The sketches are replaced one by one, and the sketches that no longer
+    # exist are deleted, so that no sketch is missing while they're rebuilt
+    previous_keys = [
+        (sketch["day"], sketch["metric"])
+        for sketch in await mongo_db["quantile_sketches"]
+        .find({"project_id": project_id}, {"_id": 0, "day": 1, "metric": 1})
+        .to_list(length=None)
+    ]
+    updates: List[Union[UpdateOne, DeleteOne]] = [
+        UpdateOne(
+            {"project_id": project_id, "day": day, "metric": metric},
+            {"$set": sketch},
+            upsert=True,
+        )
+        for (day, metric), sketch in sketches.items()
+    ]
+    updates.extend(
+        DeleteOne({"project_id": project_id, "day": day, "metric": metric})
+        for day, metric in previous_keys
+        if (day, metric) not in sketches
+    )
+    if len(updates) > 0:
+        await mongo_db["quantile_sketches"].bulk_write(updates, ordered=False)
+    await mongo_db["quantile_sketches_status"].update_one(
+        {"project_id": project_id},
+        {"$set": {"built_at": generate_timestamp()}},
+        upsert=True,
+    )
+
+
+async def backfill_quantile_sketches() -> None:
+    """
+    Build the sketches of the projects that don't have them yet.
+    """
+    mongo_db = await get_mongo_db()
+    built_project_ids = set(
+        await mongo_db["quantile_sketches_status"].distinct("project_id")
+    )
+    project_ids_to_build = [
+        project_id
+        for project_id in await mongo_db["projects"].distinct("id")
+        if project_id not in built_project_ids
+    ][: config.QUANTILE_SKETCHES_MAX_BUILDS_PER_RUN]
+    for project_id in project_ids_to_build:
+        try:
+            await build_project_quantile_sketches(project_id)
+        except Exception as e:
+            logger.error(f"Error building the quantile sketches of {project_id}: {e}")
+    logger.info(f"Quantile sketches: built {len(project_ids_to_build)} projects")
@@ -0,0 +1,245 @@
+"""
+Cache of the results of the explore and metadata services
+
+Opening a dashboard or toggling a filter back recomputes the same aggregations.
+The results are cached, keyed by the project, the service and its normalized
+parameters (eg: the ProjectDataFilters).
+
+Each project has a data version, incremented when its data changes (tasks logged
+by the extractor, flags and events edited in the platform...). A cached result
+computed with an older data version is stale:
+- if it's recent enough, it's returned and recomputed in the background
+  (stale-while-revalidate)
+- otherwise, it's recomputed before returning
+
+The data versions are bumped on the write paths of the backend and of the
+extractor. A write that doesn't bump the version is picked up after at most
+RESULTS_CACHE_TTL, plus one stale result.
+
+The results are cached in memory (LRU), and optionally in the results_cache
+collection to share them between the instances of the backend. A copy of the
+cached value is returned, so that the callers can modify it.
+"""
+
+import asyncio
+import copy
+import datetime
+import hashlib
+import json
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+from fastapi.encoders import jsonable_encoder
+from loguru import logger
+from pydantic import BaseModel
+
+from app.core import config
+from app.db.mongo import get_mongo_db
+from app.security.cache import TTLCache
+
+# cache key -> {"value", "data_version", "computed_at"}
+_results: "OrderedDict[str, dict]" = OrderedDict()
+# project_id -> data version, to avoid reading it on every request
+_data_versions = TTLCache(ttl=config.RESULTS_CACHE_VERSION_TTL)
+# cache keys being recomputed in the background
+_refreshing: Set[str] = set()
+_background_tasks: Set[asyncio.Task] = set()
+# (namespace, outcome) -> count
+_stats: Counter = Counter()
+
+
+def normalize_params(value: Any) -> Any:
+    """
+    Normalize the parameters of a service, so that equivalent parameters
+    have the same cache key: None values are dropped, datetimes are converted
+    to timestamps and lists of strings are sorted.
+    """
+    if isinstance(value, BaseModel):
+        value = value.model_dump()
+    if isinstance(value, dict):
+        return {
+            key: normalize_params(item)
+            for key, item in sorted(value.items())
+            if item is not None
+        }
+    if isinstance(value, (list, tuple, set)):
+        items = [normalize_params(item) for item in value]
+        if all(isinstance(item, str) for item in items):
+            return sorted(items)
+        return items
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp())
+    return value
+
+
+def get_cache_key(namespace: str, project_id: str, params: Dict[str, Any]) -> str:
+    payload = json.dumps(
+        {
+            "namespace": namespace,
+            "project_id": project_id,
+            "params": normalize_params(params),
+            # Some results depend on the current day (eg: last 7 days)
+            "day": datetime.datetime.now(datetime.timezone.utc).date().isoformat(),
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def get_data_version(project_id: str) -> int:
+    is_cached, version = _data_versions.get(project_id)
+    if is_cached:
+        return version
+    mongo_db = await get_mongo_db()
+    doc = await mongo_db["projects_data_versions"].find_one(
+        {"project_id": project_id}, {"version": 1}
+    )
+    version = doc["version"] if doc is not None else 0
+    _data_versions.set(project_id, version)
+    return version
+
+
+async def bump_data_version(project_ids: Iterable[str]) -> None:
+    """
+    Mark the cached results of the projects as stale. Call this when the data
+    of the projects changes.
+    """
+    mongo_db = await get_mongo_db()
+    for project_id in set(project_ids):
+        _data_versions.invalidate(project_id)
+        try:
+            await mongo_db["projects_data_versions"].update_one(
+                {"project_id": project_id}, {"$inc": {"version": 1}}, upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Error bumping the data version of {project_id}: {e}")
+
+
+def _set_local(key: str, entry: dict) -> None:
+    _results.pop(key, None)
+    _results[key] = entry
+    while len(_results) > config.RESULTS_CACHE_MAX_SIZE:
+        _results.popitem(last=False)
+
+
+async def _get_entry(key: str) -> Optional[dict]:
+    entry = _results.get(key)
+    if entry is not None:
+        _results.move_to_end(key)
+        return entry
+    if not config.RESULTS_CACHE_SHARED:
+        return None
+    mongo_db = await get_mongo_db()
+    try:
+        entry = await mongo_db["results_cache"].find_one(
+            {"key": key}, {"_id": 0, "value": 1, "data_version": 1, "computed_at": 1}
+        )
+    except Exception as e:
+        logger.error(f"Error reading the shared results cache: {e}")
+        return None
+    if entry is not None:
+        _set_local(key, entry)
+    return entry
+
+
+async def _compute_and_store(
+    key: str,
+    project_id: str,
+    data_version: int,
+    compute: Callable[[], Awaitable[Any]],
+) -> Any:
+    value = await compute()
+    entry = {
+        "value": value,
+        "data_version": data_version,
+        "computed_at": time.time(),
+    }
+    _set_local(key, entry)
+    if config.RESULTS_CACHE_SHARED:
+        mongo_db = await get_mongo_db()
+        try:
+            await mongo_db["results_cache"].update_one(
+                {"key": key},
+                {
+                    "$set": {
+                        **entry,
+                        "value": jsonable_encoder(value),
+                        "project_id": project_id,
+                        # Removed by the TTL index
+                        "expires_at": datetime.datetime.now(datetime.timezone.utc)
+                        + datetime.timedelta(seconds=config.RESULTS_CACHE_MAX_STALE),
+                    }
+                },
+                upsert=True,
+            )
+        except Exception as e:
+            # Eg: the result is bigger than the maximum size of a document
+            logger.error(f"Error writing the shared results cache: {e}")
+    return value
+
+
+async def _refresh(
+    namespace: str,
+    key: str,
+    project_id: str,
+    data_version: int,
+    compute: Callable[[], Awaitable[Any]],
+) -> None:
+    try:
+        await _compute_and_store(key, project_id, data_version, compute)
+    except Exception as e:
+        _stats[(namespace, "errors")] += 1
+        logger.error(f"Error refreshing the cached {namespace} of {project_id}: {e}")
+    finally:
+        _refreshing.discard(key)
+
+
+async def cached_result(
+    namespace: str,
+    project_id: str,
+    compute: Callable[[], Awaitable[Any]],
+    **params: Any,
+) -> Any:
+    """
+    Return the cached result of compute() for these parameters, or compute it.
+
+    namespace identifies the service (eg: "tasks_metrics") and params are all the
+    parameters of the service that change its result, other than project_id.
+    """
+    if not config.RESULTS_CACHE_ENABLED:
+        return await compute()
+
+    key = get_cache_key(namespace, project_id, params)
+    data_version = await get_data_version(project_id)
+    entry = await _get_entry(key)
+    if entry is not None:
+        age = time.time() - entry["computed_at"]
+        if entry["data_version"] == data_version and age < config.RESULTS_CACHE_TTL:
+            _stats[(namespace, "hits")] += 1
+            return copy.deepcopy(entry["value"])
+        if age < config.RESULTS_CACHE_MAX_STALE:
+            _stats[(namespace, "stale_hits")] += 1
+            if key not in _refreshing:
+                _refreshing.add(key)
+                task = asyncio.create_task(
+                    _refresh(namespace, key, project_id, data_version, compute)
+                )
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+            return copy.deepcopy(entry["value"])
+
+    _stats[(namespace, "misses")] += 1
+    value = await _compute_and_store(key, project_id, data_version, compute)
+    return copy.deepcopy(value)
+
+
+def get_results_cache_stats() -> Dict[str, Any]:
+    """
+    Hits, stale hits, misses and refresh errors per service since the start.
+    """
+    stats: Dict[str, Dict[str, int]] = {}
+    for (namespace, outcome), count in _stats.items():
+        stats.setdefault(namespace, {})[outcome] = count
+    return {"size": len(_results), "namespaces": stats}
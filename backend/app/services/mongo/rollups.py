@@ -0,0 +1,464 @@
+"""
+Hourly and daily counters of the projects, used by the dashboards
+
+The rollups collection stores one document per project, period and value:
+
+{
+    "project_id": "...",
+    "granularity": "hour",  # or "day"
+    "period_start": 1715000400,  # UNIX timestamp of the start of the period
+    "dimension": "flag",  # tasks, sessions, flag, event_name, language, sentiment, version_id
+    "value": "success",  # None for the tasks and sessions totals
+    "count": 12,
+}
+
+The counters are incremented by the extractor when tasks are logged and enriched,
+and by the backend when tasks are edited. Every hour, the recent periods of the
+active projects are recomputed from the tasks and sessions to correct any drift.
+Projects that were never compacted are backfilled from the start and don't
+use the rollups until then (see rollups_status).
+"""
+
+import datetime
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from pymongo import UpdateOne
+
+from app.core import config
+from app.db.models import Task
+from app.db.mongo import get_mongo_db
+from app.utils import generate_timestamp
+from phospho.models import ProjectDataFilters
+
+HOUR = 3600
+DAY = 86400
+
+RollupKey = Tuple[str, Optional[str]]
+# The fields identifying a counter, in the unique index of the rollups
+ROLLUP_KEY_FIELDS = ["project_id", "dimension", "granularity", "period_start", "value"]
+
+
+def get_periods(timestamp: int) -> List[Tuple[str, int]]:
+    """
+    The start of the hour and of the day (UTC) of a timestamp
+    """
+    return [
+        ("hour", timestamp - timestamp % HOUR),
+        ("day", timestamp - timestamp % DAY),
+    ]
+
+
+def build_rollup_updates(
+    project_id: str, increments: Dict[Tuple[int, RollupKey], int]
+) -> List[UpdateOne]:
+    """
+    Build the upserts incrementing the hourly and daily counters.
+
+    increments maps (timestamp, (dimension, value)) to the increment.
+    """
+    counts: Counter = Counter()
+    for (timestamp, key), increment in increments.items():
+        for granularity, period_start in get_periods(timestamp):
+            counts[(granularity, period_start, key)] += increment
+    return [
+        UpdateOne(
+            {
+                "project_id": project_id,
+                "granularity": granularity,
+                "period_start": period_start,
+                "dimension": dimension,
+                "value": value,
+            },
+            {"$inc": {"count": increment}},
+            upsert=True,
+        )
+        for (granularity, period_start, (dimension, value)), increment in counts.items()
+        if increment != 0
+    ]
+
+
+async def increment_rollups(
+    project_id: str, increments: Dict[Tuple[int, RollupKey], int]
+) -> None:
+    updates = build_rollup_updates(project_id, increments)
+    if len(updates) == 0:
+        return
+    mongo_db = await get_mongo_db()
+    try:
+        await mongo_db["rollups"].bulk_write(updates, ordered=False)
+    except Exception as e:
+        # The rollups are recomputed regularly, so we don't fail the request
+        logger.error(f"Error incrementing the rollups of project {project_id}: {e}")
+
+
+async def move_task_rollup(
+    task: Task, dimension: str, previous: Optional[str], new: Optional[str]
+) -> None:
+    """
+    Move a task from a value to another in the counters of a dimension,
+    eg: when a task is flagged again. None values are not counted.
+    """
+    if previous == new:
+        return
+    increments: Dict[Tuple[int, RollupKey], int] = {}
+    if previous is not None:
+        increments[(task.created_at, (dimension, previous))] = -1
+    if new is not None:
+        increments[(task.created_at, (dimension, new))] = 1
+    await increment_rollups(task.project_id, increments)
+
+
+def can_use_rollups(filters: Optional[ProjectDataFilters]) -> bool:
+    """
+    The rollups are only split by date, so they can't be used with other filters.
+    """
+    if filters is None:
+        return True
+    other_filters = filters.model_dump(exclude={"created_at_start", "created_at_end"})
+    return all(value is None for value in other_filters.values())
+
+
+def _to_timestamp(value) -> Optional[int]:
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp())
+    if value is None:
+        return None
+    return int(value)
+
+
+async def has_rollups(project_id: str) -> bool:
+    """
+    Check if the rollups of a project were computed at least once.
+    """
+    mongo_db = await get_mongo_db()
+    status = await mongo_db["rollups_status"].find_one({"project_id": project_id})
+    return status is not None
+
+
+async def get_daily_counts(
+    project_id: str,
+    dimension: str,
+    created_at_start=None,
+    created_at_end=None,
+) -> Optional[Dict[datetime.date, Dict[Optional[str], int]]]:
+    """
+    Get the counts per day (UTC) and per value of a dimension.
+
+    Full days are read from the daily counters, and the first and last days of
+    the range from the hourly counters, so the range is rounded to the hour.
+
+    Returns None if the rollups of the project are not computed yet. The caller
+    should then compute the metric from the tasks.
+    """
+    if not await has_rollups(project_id):
+        return None
+    mongo_db = await get_mongo_db()
+
+    start = _to_timestamp(created_at_start) or 0
+    end = _to_timestamp(created_at_end)
+    if end is None:
+        end = generate_timestamp()
+
+    # Days fully included in [start, end]
+    first_full_day = start + (-start) % DAY
+    end_full_days = (end + 1) - (end + 1) % DAY
+    period_filters: List[Dict[str, object]] = []
+    if first_full_day < end_full_days:
+        period_filters.append(
+            {
+                "granularity": "day",
+                "period_start": {"$gte": first_full_day, "$lt": end_full_days},
+            }
+        )
+        hour_ranges = [(start, first_full_day), (end_full_days, end + 1)]
+    else:
+        hour_ranges = [(start, end + 1)]
+    for range_start, range_end in hour_ranges:
+        if range_start < range_end:
+            period_filters.append(
+                {
+                    "granularity": "hour",
+                    "period_start": {
+                        "$gte": range_start - range_start % HOUR,
+                        "$lt": range_end,
+                    },
+                }
+            )
+
+    rollups = (
+        await mongo_db["rollups"]
+        .find(
+            {"project_id": project_id, "dimension": dimension, "$or": period_filters},
+            {"_id": 0, "period_start": 1, "value": 1, "count": 1},
+        )
+        .to_list(length=None)
+    )
+    daily_counts: Dict[datetime.date, Dict[Optional[str], int]] = {}
+    for rollup in rollups:
+        if rollup["count"] <= 0:
+            continue
+        date = datetime.datetime.fromtimestamp(
+            rollup["period_start"], datetime.timezone.utc
+        ).date()
+        counts = daily_counts.setdefault(date, {})
+        counts[rollup["value"]] = counts.get(rollup["value"], 0) + rollup["count"]
+    return daily_counts
+
+
+def _hourly_facet(match: Dict[str, object], value: Optional[str]) -> List[dict]:
+    group_id: Dict[str, object] = {"period_start": "$period_start"}
+    if value is not None:
+        group_id["value"] = value
+    return [
+        {"$match": match},
+        {"$group": {"_id": group_id, "count": {"$sum": 1}}},
+    ]
+
+
+def _period_filter(since: int, until: Optional[int]) -> Dict[str, int]:
+    period_filter = {"$gte": since}
+    if until is not None:
+        period_filter["$lt"] = until
+    return period_filter
+
+
+async def compute_hourly_rollups(
+    project_id: str, since: int, until: Optional[int] = None
+) -> List[dict]:
+    """
+    Recompute the hourly counters of a project from the tasks and sessions
+    created between since and until.
+    """
+    mongo_db = await get_mongo_db()
+    created_at_filter = _period_filter(since, until)
+    period_start = {"$subtract": ["$created_at", {"$mod": ["$created_at", HOUR]}]}
+    tasks_pipeline = [
+        {"$match": {"project_id": project_id, "created_at": created_at_filter}},
+        {
+            "$project": {
+                "_id": 0,
+                "period_start": period_start,
+                "flag": 1,
+                "language": 1,
+                "sentiment": "$sentiment.label",
+                "version_id": {"$toString": "$metadata.version_id"},
+                # Events are deduplicated per task
+                "event_name": {
+                    "$setUnion": [{"$ifNull": ["$events.event_name", []]}, []]
+                },
+            }
+        },
+        {
+            "$facet": {
+                "tasks": _hourly_facet({}, None),
+                "flag": _hourly_facet({"flag": {"$ne": None}}, "$flag"),
+                "language": _hourly_facet({"language": {"$ne": None}}, "$language"),
+                "sentiment": _hourly_facet({"sentiment": {"$ne": None}}, "$sentiment"),
+                "version_id": _hourly_facet(
+                    {"version_id": {"$ne": None}}, "$version_id"
+                ),
+                "event_name": [{"$unwind": "$event_name"}]
+                + _hourly_facet({}, "$event_name"),
+            }
+        },
+    ]
+    sessions_pipeline = [
+        {"$match": {"project_id": project_id, "created_at": created_at_filter}},
+        {"$project": {"_id": 0, "period_start": period_start}},
+    ] + _hourly_facet({}, None)
+
+    tasks_result = (
+        await mongo_db["tasks"]
+        .aggregate(tasks_pipeline, allowDiskUse=True)
+        .to_list(None)
+    )
+    groups_per_dimension = tasks_result[0] if tasks_result else {}
+    groups_per_dimension["sessions"] = (
+        await mongo_db["sessions"]
+        .aggregate(sessions_pipeline, allowDiskUse=True)
+        .to_list(None)
+    )
+
+    hourly_rollups: List[dict] = []
+    for dimension, groups in groups_per_dimension.items():
+        for group in groups:
+            hourly_rollups.append(
+                {
+                    "project_id": project_id,
+                    "granularity": "hour",
+                    "period_start": group["_id"]["period_start"],
+                    "dimension": dimension,
+                    "value": group["_id"].get("value"),
+                    "count": group["count"],
+                }
+            )
+    return hourly_rollups
+
+
+def build_daily_rollups(hourly_rollups: List[dict]) -> List[dict]:
+    """
+    Sum the hourly counters per day
+    """
+    counts: Counter = Counter()
+    for rollup in hourly_rollups:
+        day_start = rollup["period_start"] - rollup["period_start"] % DAY
+        counts[
+            (rollup["project_id"], day_start, rollup["dimension"], rollup["value"])
+        ] += rollup["count"]
+    return [
+        {
+            "project_id": project_id,
+            "granularity": "day",
+            "period_start": period_start,
+            "dimension": dimension,
+            "value": value,
+            "count": count,
+        }
+        for (project_id, period_start, dimension, value), count in counts.items()
+    ]
+
+
+async def get_first_created_at(project_id: str, since: int) -> Optional[int]:
+    """
+    The created_at of the first task or session of a project after since
+    """
+    mongo_db = await get_mongo_db()
+    first_created_at = None
+    for collection in ["tasks", "sessions"]:
+        first = await mongo_db[collection].find_one(
+            {"project_id": project_id, "created_at": {"$gte": since}},
+            {"_id": 0, "created_at": 1},
+            sort=[("created_at", 1)],
+        )
+        if first is not None and (
+            first_created_at is None or first["created_at"] < first_created_at
+        ):
+            first_created_at = first["created_at"]
+    return first_created_at
+
+
+async def compact_rollups_page(
+    project_id: str, since: int, until: Optional[int]
+) -> None:
+    """
+    Correct the counters of a project between since and until (both rounded
+    to the day) with counters recomputed from the tasks and sessions.
+
+    Each counter is incremented by the difference between the recomputed and
+    the stored value, so that the increments done concurrently by the
+    extractor are kept. The counters that no longer exist are brought to 0
+    and deleted. An increment done between the aggregation and the read of
+    the counters is lost, and corrected by the next compaction.
+    """
+    mongo_db = await get_mongo_db()
+    hourly_rollups = await compute_hourly_rollups(project_id, since, until)
+    rollups = hourly_rollups + build_daily_rollups(hourly_rollups)
+
+    period_filter = {
+        "project_id": project_id,
+        "period_start": _period_filter(since, until),
+    }
+    previous_counts = {
+        tuple(rollup.get(field) for field in ROLLUP_KEY_FIELDS): rollup.get("count", 0)
+        for rollup in await mongo_db["rollups"]
+        .find(
+            period_filter,
+            {"_id": 0, "count": 1, **{field: 1 for field in ROLLUP_KEY_FIELDS}},
+        )
+        .to_list(length=None)
+    }
+    counts = {
+        tuple(rollup[field] for field in ROLLUP_KEY_FIELDS): rollup["count"]
+        for rollup in rollups
+    }
+    for key in previous_counts:
+        counts.setdefault(key, 0)
+
+    updates = [
+        UpdateOne(
+            dict(zip(ROLLUP_KEY_FIELDS, key)),
+            {"$inc": {"count": count - previous_counts.get(key, 0)}},
+            upsert=True,
+        )
+        for key, count in counts.items()
+        if count != previous_counts.get(key, 0)
+    ]
+    if len(updates) > 0:
+        await mongo_db["rollups"].bulk_write(updates, ordered=False)
+        await mongo_db["rollups"].delete_many({**period_filter, "count": 0})
+
+
+async def compact_project_rollups(project_id: str, since: int) -> None:
+    """
+    Correct the counters of a project after since (rounded to the day), page
+    by page of ROLLUPS_PAGE_DAYS days of tasks.
+    """
+    mongo_db = await get_mongo_db()
+    now = generate_timestamp()
+    since = since - since % DAY
+    # There are no tasks before the first one, eg: when the project is
+    # backfilled, so these days are compacted with the first page
+    first_created_at = await get_first_created_at(project_id, since)
+    if first_created_at is None:
+        first_page_start = now
+    else:
+        first_page_start = max(since, first_created_at - first_created_at % DAY)
+
+    page_start = since
+    page_end: Optional[int] = first_page_start + config.ROLLUPS_PAGE_DAYS * DAY
+    while True:
+        if page_end is not None and page_end > now:
+            # The last page also counts the tasks created during the compaction
+            page_end = None
+        await compact_rollups_page(project_id, page_start, page_end)
+        if page_end is None:
+            break
+        page_start = page_end
+        page_end = page_start + config.ROLLUPS_PAGE_DAYS * DAY
+
+    await mongo_db["rollups_status"].update_one(
+        {"project_id": project_id},
+        {"$set": {"last_compacted_at": now}},
+        upsert=True,
+    )
+
+
+async def compact_rollups() -> None:
+    """
+    Recompute the recent counters of the active projects, and backfill the
+    counters of the projects that were never compacted.
+    """
+    mongo_db = await get_mongo_db()
+    recompute_since = generate_timestamp() - config.ROLLUPS_RECOMPUTE_DAYS * DAY
+
+    compacted_project_ids = set(await mongo_db["rollups_status"].distinct("project_id"))
+    project_ids_to_backfill = [
+        project_id
+        for project_id in await mongo_db["projects"].distinct("id")
+        if project_id not in compacted_project_ids
+    ][: config.ROLLUPS_MAX_BACKFILLS_PER_RUN]
+    active_project_ids = await mongo_db["tasks"].distinct(
+        "project_id", {"created_at": {"$gte": recompute_since}}
+    )
+
+    for project_id in project_ids_to_backfill:
+        try:
+            await compact_project_rollups(project_id, since=0)
+        except Exception as e:
+            logger.error(f"Error backfilling the rollups of project {project_id}: {e}")
+    # The projects never compacted are backfilled above or in a next run
+    active_project_ids = [
+        project_id
+        for project_id in active_project_ids
+        if project_id in compacted_project_ids
+    ]
+    for project_id in active_project_ids:
+        try:
+            await compact_project_rollups(project_id, since=recompute_since)
+        except Exception as e:
+            logger.error(f"Error compacting the rollups of project {project_id}: {e}")
+    logger.info(
+        f"Rollups: backfilled {len(project_ids_to_backfill)} projects, compacted {len(active_project_ids)} active projects"
+    )
@@ -1,97 +1,317 @@
-from typing import List, Tuple
+"""
+Semantic search in the tasks of a project
 
-import openai
+The query is embedded with config.EMBEDDING_MODEL, the model used by the
+extractor to embed the tasks (the embeddings of the recent queries are cached in
+memory), and the most similar tasks are found in Qdrant, by cosine similarity.
+
+With keyword_prefilter, the tasks are first filtered with the text index of the
+tasks (input and output), and the candidates are ranked by a weighted sum of
+their vector similarity and of their keyword score, normalized by the best
+keyword score. The text index slows down the inserts of tasks, so this is only
+available with SEARCH_KEYWORD_PREFILTER_ENABLED.
+
+The vectors are in Qdrant, or in the local index of phospho.lab.vector_index
+(see app.db.qdrant). The search results are built from the payloads of the
+vectors (task id, session id, previews of the input and output), so that the
+tasks are only read from MongoDB when the full tasks are needed. The vectors
+stored before the previews were added to the payloads get their previews from
+MongoDB.
+"""
+
+import time
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from loguru import logger
+
+from app.api.v2.models import SearchResult
+from app.core import config
 from app.db.models import Session, Task
 from app.db.mongo import get_mongo_db
 from app.db.qdrant import get_qdrant, models
-from loguru import logger
+from app.security.cache import TTLCache
+from phospho.lab.embeddings import get_configured_embedding_provider
+
+# (model, query) -> embedding of the query
+query_embeddings_cache = TTLCache(
+    ttl=config.SEARCH_EMBEDDING_CACHE_TTL,
+    max_size=config.SEARCH_EMBEDDING_CACHE_MAX_SIZE,
+)
+
+
+def get_query_cache_key(search_query: str) -> Tuple[str, str]:
+    return (config.EMBEDDING_MODEL, " ".join(search_query.split()).lower())
+
+
+async def embed_query(search_query: str) -> Optional[List[float]]:
+    """
+    Embed a search query. Returns None if the query can't be embedded.
+    """
+    key = get_query_cache_key(search_query)
+    is_cached, embedding = query_embeddings_cache.get(key)
+    if is_cached:
+        # Set it again to keep the most used queries in the cache
+        query_embeddings_cache.set(key, embedding)
+        return embedding
+    # Same model as the extractor, which embeds the tasks
+    embedding_provider = get_configured_embedding_provider(
+        config.EMBEDDING_MODEL,
+        max_workers=config.EMBEDDING_LOCAL_MAX_WORKERS,
+        batch_size=config.EMBEDDING_LOCAL_BATCH_SIZE,
+    )
+    embedding = (await embedding_provider.embed([search_query]))[0]
+    if embedding is None:
+        # If the query is too short, we can't embed it
+        logger.warning("Could not embed the query")
+        return None
+    query_embeddings_cache.set(key, embedding)
+    return embedding
+
+
+async def get_keyword_scores(project_id: str, search_query: str) -> Dict[str, float]:
+    """
+    The keyword scores of the tasks of the project matching the query, with
+    the text index on their input and output. Only the best
+    SEARCH_MAX_KEYWORD_CANDIDATES tasks are returned.
+    """
+    mongo_db = await get_mongo_db()
+    tasks = (
+        await mongo_db["tasks"]
+        .find(
+            {"project_id": project_id, "$text": {"$search": search_query}},
+            {"_id": 0, "id": 1, "score": {"$meta": "textScore"}},
+        )
+        .sort([("score", {"$meta": "textScore"})])
+        .limit(config.SEARCH_MAX_KEYWORD_CANDIDATES)
+        .to_list(length=None)
+    )
+    return {task["id"]: task["score"] for task in tasks}
+
+
+def merge_scores(
+    vector_scores: Dict[str, float],
+    keyword_scores: Dict[str, float],
+    vector_weight: float = config.SEARCH_VECTOR_WEIGHT,
+) -> Dict[str, float]:
+    """
+    Weighted sum of the vector scores and of the keyword scores divided by the
+    best keyword score. Only the tasks with a vector score are kept.
+    """
+    max_keyword_score = max(keyword_scores.values(), default=0.0)
+    return {
+        task_id: vector_weight * vector_score
+        + (1 - vector_weight)
+        * (
+            keyword_scores.get(task_id, 0.0) / max_keyword_score
+            if max_keyword_score > 0
+            else 0.0
+        )
+        for task_id, vector_score in vector_scores.items()
+    }
 
-openai_client = openai.AsyncClient()
+
+def to_search_result(
+    point: models.ScoredPoint,
+    score: float,
+    keyword_score: Optional[float] = None,
+) -> SearchResult:
+    payload = point.payload or {}
+    return SearchResult(
+        task_id=payload["task_id"],
+        session_id=payload.get("session_id"),
+        created_at=payload.get("created_at"),
+        score=score,
+        vector_score=point.score,
+        keyword_score=keyword_score,
+        input_preview=payload.get("input_preview"),
+        output_preview=payload.get("output_preview"),
+        metadata=payload.get("metadata"),
+    )
+
+
+async def fill_missing_previews(results: List[SearchResult]) -> None:
+    """
+    Read the previews of the results without previews in their payload (the
+    tasks vectorized before the previews were stored) from MongoDB.
+    """
+    task_ids = [result.task_id for result in results if result.input_preview is None]
+    if len(task_ids) == 0:
+        return
+
+    def preview(field: str) -> dict:
+        return {
+            "$cond": [
+                {"$eq": [{"$type": field}, "string"]},
+                {"$substrCP": [field, 0, config.SEARCH_PREVIEW_LENGTH]},
+                None,
+            ]
+        }
+
+    mongo_db = await get_mongo_db()
+    tasks = (
+        await mongo_db["tasks"]
+        .aggregate(
+            [
+                {"$match": {"id": {"$in": task_ids}}},
+                {
+                    "$project": {
+                        "_id": 0,
+                        "id": 1,
+                        "input_preview": preview("$input"),
+                        "output_preview": preview("$output"),
+                    }
+                },
+            ]
+        )
+        .to_list(length=None)
+    )
+    tasks_by_id = {task["id"]: task for task in tasks}
+    for result in results:
+        task = tasks_by_id.get(result.task_id)
+        if result.input_preview is None and task is not None:
+            result.input_preview = task.get("input_preview")
+            result.output_preview = task.get("output_preview")
 
 
-async def search_tasks_in_project(
+async def search_in_project(
     project_id: str,
     search_query: str,
-) -> List[Task]:
-    mongo_db = await get_mongo_db()
+    limit: int = config.SEARCH_DEFAULT_LIMIT,
+    offset: int = 0,
+    keyword_prefilter: bool = False,
+) -> List[SearchResult]:
+    """
+    The tasks of the project the most relevant to the query, from the best,
+    built from the payloads of the vectors.
+    """
+    if keyword_prefilter and not config.SEARCH_KEYWORD_PREFILTER_ENABLED:
+        raise HTTPException(
+            status_code=400,
+            detail="Keyword search is not enabled (SEARCH_KEYWORD_PREFILTER_ENABLED)",
+        )
     qdrant_db = await get_qdrant()
     if qdrant_db is None:
         return []
-    # Embed the query
-    try:
-        query_embedding = await openai_client.embeddings.create(
-            input=search_query, model="text-embedding-3-small"
-        )
-    except openai.APIError as e:
-        # If the query is too short, we can't embed it
-        # In this case, we just return an empty list
-        logger.warning(f"Error while embedding the query: {e}")
+    query_embedding = await embed_query(search_query)
+    if query_embedding is None:
         return []
 
-    # Search in the project
+    must: List[models.Condition] = [
+        models.FieldCondition(
+            key="project_id", match=models.MatchValue(value=project_id)
+        )
+    ]
+    keyword_scores: Dict[str, float] = {}
+    if keyword_prefilter:
+        keyword_scores = await get_keyword_scores(project_id, search_query)
+        if len(keyword_scores) == 0:
+            return []
+        # The ids of the points are the ids of the tasks
+        must.append(models.HasIdCondition(has_id=list(keyword_scores.keys())))
+
+    start_time = time.perf_counter()
     found_vectors = await qdrant_db.search(
-        collection_name="tasks",
-        query_vector=query_embedding.data[0].embedding,
-        query_filter=models.Filter(
-            must=[
-                models.FieldCondition(
-                    key="project_id", match=models.MatchValue(value=project_id)
-                )
-            ]
-        ),
-        limit=5,
-        # score_threshold=0.5,
+        collection_name=config.QDRANT_COLLECTION_NAME,
+        query_vector=query_embedding,
+        query_filter=models.Filter(must=must),
+        # The candidates of a hybrid search are reranked before paginating
+        limit=len(keyword_scores) if keyword_prefilter else limit,
+        offset=0 if keyword_prefilter else offset,
+        with_payload=True,
+        with_vectors=False,
+    )
+    # To compare the latency of the vector indexes (config.VECTOR_INDEX)
+    logger.debug(
+        f"{config.VECTOR_INDEX} vector search: {len(found_vectors)} results in {(time.perf_counter() - start_time) * 1000:.1f} ms"
     )
-    foud_vectors_mapping = {
-        vector.payload.get("task_id"): vector
+    found_vectors = [
+        vector
         for vector in found_vectors
-        if vector.payload is not None
-        and vector.payload.get("task_id", None) is not None
-    }
+        if vector.payload is not None and vector.payload.get("task_id") is not None
+    ]
+    if not keyword_prefilter:
+        results = [
+            to_search_result(vector, score=vector.score) for vector in found_vectors
+        ]
+        await fill_missing_previews(results)
+        return results
 
-    # Get the tasks
-    tasks = (
-        await mongo_db["tasks"]
-        .find({"id": {"$in": list(foud_vectors_mapping.keys())}})
-        .to_list(length=None)
+    scores = merge_scores(
+        {vector.payload["task_id"]: vector.score for vector in found_vectors},
+        keyword_scores,
     )
+    results = [
+        to_search_result(
+            vector,
+            score=scores[vector.payload["task_id"]],
+            keyword_score=keyword_scores.get(vector.payload["task_id"]),
+        )
+        for vector in found_vectors
+    ]
+    results = sorted(results, key=lambda result: result.score, reverse=True)
+    results = results[offset : offset + limit]
+    await fill_missing_previews(results)
+    return results
 
-    # Sort the tasks by the order of the found_vectors
-    tasks = sorted(
-        tasks,
-        key=lambda task: foud_vectors_mapping[task["id"]].score,
-        reverse=True,
-    )
 
-    # Return the tasks
-    tasks = [Task.model_validate(task) for task in tasks]
-    return tasks
+def get_next_offset(
+    results: List[SearchResult], limit: int, offset: int
+) -> Optional[int]:
+    """
+    The offset of the next page of results, None if this is the last page
+    """
+    if len(results) < limit:
+        return None
+    return offset + limit
 
 
-async def search_sessions_in_project(
-    project_id: str,
-    search_query: str,
-) -> Tuple[
-    List[Task],
-    List[Session],
-]:
-    relevant_tasks = await search_tasks_in_project(
-        project_id=project_id,
-        search_query=search_query,
+def get_session_ids(results: List[SearchResult]) -> List[str]:
+    """
+    The ids of the sessions of the search results, without duplicates, in the
+    order of the results
+    """
+    session_ids: Dict[str, None] = {}
+    for result in results:
+        if result.session_id is not None:
+            session_ids[result.session_id] = None
+    return list(session_ids.keys())
+
+
+async def get_tasks_of_results(results: List[SearchResult]) -> List[Task]:
+    """
+    The tasks of the search results, in the same order
+    """
+    mongo_db = await get_mongo_db()
+    tasks = (
+        await mongo_db["tasks"]
+        .find({"id": {"$in": [result.task_id for result in results]}})
+        .to_list(length=None)
     )
-    # Find the sessions that contain the relevant tasks
+    tasks_by_id = {task["id"]: task for task in tasks}
+    return [
+        Task.model_validate(tasks_by_id[result.task_id])
+        for result in results
+        if result.task_id in tasks_by_id
+    ]
+
+
+async def get_sessions_of_results(
+    project_id: str, results: List[SearchResult]
+) -> List[Session]:
+    """
+    The sessions of the search results, in the order of the results
+    """
+    session_ids = get_session_ids(results)
     mongo_db = await get_mongo_db()
-    relevant_sessions = (
+    sessions = (
         await mongo_db["sessions"]
-        .find(
-            {
-                "project_id": project_id,
-                "id": {"$in": [task.session_id for task in relevant_tasks]},
-            }
-        )
+        .find({"project_id": project_id, "id": {"$in": session_ids}})
         .to_list(length=None)
     )
-    relevant_sessions = [
-        Session.model_validate(session) for session in relevant_sessions
+    sessions_by_id = {session["id"]: session for session in sessions}
+    return [
+        Session.model_validate(sessions_by_id[session_id])
+        for session_id in session_ids
+        if session_id in sessions_by_id
     ]
-    return relevant_tasks, relevant_sessions
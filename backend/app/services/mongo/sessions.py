@@ -1,13 +1,21 @@
 from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
 from app.db.models import Session, Project, Task
 from app.db.mongo import get_mongo_db
 
-from app.services.mongo.tasks import task_filtering_pipeline_match
+from app.services.mongo.event_summaries import (
+    add_events_to_summaries,
+    remove_session_event_from_summaries,
+)
+from phospho.lab.event_summaries import get_event_summary
+from app.services.mongo.results_cache import bump_data_version
+from app.utils import generate_timestamp
 from loguru import logger
 from fastapi import HTTPException
 from app.db.models import Session, Event, EventDefinition
 
-from phospho.models import ProjectDataFilters
 from phospho.utils import is_jsonable
 
 
@@ -20,21 +28,14 @@ async def create_session(
     mongo_db = await get_mongo_db()
     new_session = Session(project_id=project_id, org_id=org_id, data=data)
     mongo_db["sessions"].insert_one(new_session.model_dump())
+    await bump_data_version([project_id])
     return new_session
 
 
 async def get_session_by_id(session_id: str) -> Session:
     mongo_db = await get_mongo_db()
-    # session = await mongo_db["sessions"].find_one({"id": session_id})
-    # Merge events from the session
-    found_session = (
-        await mongo_db["sessions_with_events"]
-        .find(
-            {"id": session_id},
-        )
-        .to_list(length=1)
-    )
-    session = found_session[0] if found_session else None
+    # The events are stored on the session document
+    session = await mongo_db["sessions"].find_one({"id": session_id})
 
     if session is None:
         raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
@@ -99,27 +100,50 @@ async def edit_session_metadata(session_data: Session, **kwargs) -> Session:
     _ = await mongo_db["sessions"].update_one(
         {"id": session_data.id}, {"$set": session_data.model_dump()}
     )
+    await bump_data_version([session_data.project_id])
     updated_session = await get_session_by_id(session_data.id)
     return updated_session
 
 
-async def compute_session_length(project_id: str):
+def _updated_sessions_filter(
+    project_id: str, updated_since: Optional[int]
+) -> Dict[str, object]:
+    """
+    The sessions of a project whose tasks changed since updated_since.
+    If updated_since is None, all the sessions of the project.
+    """
+    main_filter: Dict[str, object] = {"project_id": project_id}
+    if updated_since is not None:
+        main_filter["tasks_updated_at"] = {"$gte": updated_since}
+    return main_filter
+
+
+async def compute_session_length(
+    project_id: str,
+    only_legacy_sessions: bool = True,
+    updated_since: Optional[int] = None,
+):
     """
     Executes an aggregation pipeline to compute the length of each session for a given project.
 
-    This can be made smarter by:
-    1. Storing the latest update time of a session
-    2. Fetching the session_id in the tasks collection that were created_at after the latest update time
-    3. Updating the session length only for those sessions
+    The extractor maintains session_length incrementally at ingestion time. Sessions
+    created this way have a last_task_created_at field. By default, only the sessions
+    without it (created before the incremental aggregates) are recomputed.
+
+    If updated_since is set, only the sessions whose tasks changed since then are recomputed.
     """
     mongo_db = await get_mongo_db()
+    main_filter = _updated_sessions_filter(project_id, updated_since)
+    if only_legacy_sessions:
+        main_filter["last_task_created_at"] = None
     session_pipeline = [
-        {"$match": {"project_id": project_id}},
+        {"$match": main_filter},
         {
             "$lookup": {
                 "from": "tasks",
                 "localField": "id",
                 "foreignField": "session_id",
+                "pipeline": [{"$project": {"_id": 1}}],
                 "as": "tasks",
             }
         },
@@ -146,50 +170,28 @@ async def compute_session_length(project_id: str):
     await mongo_db["sessions"].aggregate(session_pipeline).to_list(length=None)
 
 
-async def compute_task_position(
-    project_id: str, filters: Optional[ProjectDataFilters] = None
-):
+async def compute_task_position(project_id: str, updated_since: Optional[int] = None):
     """
-    Executes an aggregation pipeline to compute the task position for each task.
+    Executes an aggregation pipeline to compute the position of each task in its session.
+
+    If updated_since is set, only the sessions whose tasks changed since then are recomputed.
     """
     mongo_db = await get_mongo_db()
-
-    if filters is None:
-        filters = ProjectDataFilters()
-
-    main_filter: Dict[str, object] = {"project_id": project_id}
-    if filters.created_at_start is not None:
-        main_filter["created_at"] = {"$gte": filters.created_at_start}
-    if filters.created_at_end is not None:
-        main_filter["created_at"] = {
-            **main_filter.get("created_at", {}),
-            "$lte": filters.created_at_end,
-        }
-
-    tasks_filter, task_collection = task_filtering_pipeline_match(
-        project_id=project_id, filters=filters, collection="tasks", prefix="tasks"
-    )
     pipeline = [
-        {"$match": main_filter},
+        {"$match": _updated_sessions_filter(project_id, updated_since)},
         {
             "$lookup": {
-                "from": task_collection,
+                "from": "tasks",
                 "localField": "id",
                 "foreignField": "session_id",
+                # Same order as the positions assigned at ingestion
+                "pipeline": [
+                    {"$sort": {"created_at": 1, "_id": 1}},
+                    {"$project": {"_id": 0, "id": 1}},
+                ],
                 "as": "tasks",
             }
         },
-        {"$match": tasks_filter},
-        {
-            "$set": {
-                "tasks": {
-                    "$sortArray": {
-                        "input": "$tasks",
-                        "sortBy": {"tasks.created_at": 1},
-                    },
-                }
-            }
-        },
         # Transform to get 1 doc = 1 task. We also add the task position.
         {"$unwind": {"path": "$tasks", "includeArrayIndex": "task_position"}},
         {
@@ -212,6 +214,30 @@ async def compute_task_position(
     await mongo_db["sessions"].aggregate(pipeline).to_list(length=None)
 
 
+async def refresh_task_positions(project_id: str) -> None:
+    """
+    Recompute the task positions of the sessions whose tasks changed since the
+    last refresh of the project.
+
+    The extractor assigns the task positions at ingestion, but they may be wrong
+    if tasks are logged out of order or concurrently in the same session. The
+    first refresh of a project recomputes all its sessions.
+    """
+    mongo_db = await get_mongo_db()
+    status = await mongo_db["task_positions_status"].find_one(
+        {"project_id": project_id}
+    )
+    updated_since = status["updated_until"] if status is not None else None
+    # The sessions updated during the refresh are recomputed next time
+    updated_until = generate_timestamp()
+    await compute_task_position(project_id=project_id, updated_since=updated_since)
+    await mongo_db["task_positions_status"].update_one(
+        {"project_id": project_id},
+        {"$set": {"updated_until": updated_until}},
+        upsert=True,
+    )
+
+
 async def get_project_id_from_session(session_id: str) -> str:
     """
     Fetches the project_id from a session_id.
@@ -314,6 +340,83 @@ async def event_suggestion(
         return ["Error", "An error occured while trying to suggest an event."]
 
 
+async def increment_session_stats(
+    session_id: Optional[str],
+    nb_success: int = 0,
+    nb_failure: int = 0,
+    nb_events: int = 0,
+) -> None:
+    """
+    Update the running counts of a session (Session.stats) when a flag or an
+    event is edited in the platform. The extractor updates them at ingestion.
+    """
+    if session_id is None:
+        return
+    increments = {
+        f"stats.{key}": value
+        for key, value in [
+            ("nb_success", nb_success),
+            ("nb_failure", nb_failure),
+            ("nb_events", nb_events),
+        ]
+        if value != 0
+    }
+    if len(increments) == 0:
+        return
+    mongo_db = await get_mongo_db()
+    await mongo_db["sessions"].update_one({"id": session_id}, {"$inc": increments})
+
+
+async def move_session_flag(
+    session_id: Optional[str], previous_flag: Optional[str], flag: Optional[str]
+) -> None:
+    """
+    Update the flag counts of a session when the flag of one of its tasks changes
+    """
+    if previous_flag == flag:
+        return
+    await increment_session_stats(
+        session_id,
+        nb_success=int(flag == "success") - int(previous_flag == "success"),
+        nb_failure=int(flag == "failure") - int(previous_flag == "failure"),
+    )
+
+
+async def decrement_session_events(events_filter: dict) -> None:
+    """
+    Decrement the event counts of the sessions of the events matching the
+    filter. Call this before marking the events as removed.
+    """
+    mongo_db = await get_mongo_db()
+    counts = (
+        await mongo_db["events"]
+        .aggregate(
+            [
+                {
+                    "$match": {
+                        **events_filter,
+                        "removed": {"$ne": True},
+                        "session_id": {"$ne": None},
+                    }
+                },
+                {"$group": {"_id": "$session_id", "count": {"$sum": 1}}},
+            ]
+        )
+        .to_list(length=None)
+    )
+    if len(counts) == 0:
+        return
+    await mongo_db["sessions"].bulk_write(
+        [
+            UpdateOne(
+                {"id": count["_id"]}, {"$inc": {"stats.nb_events": -count["count"]}}
+            )
+            for count in counts
+        ],
+        ordered=False,
+    )
+
+
 async def add_event_to_session(
     session: Session, event: EventDefinition, event_source: str = "owner"
 ) -> Session:
@@ -341,13 +444,12 @@ async def add_event_to_session(
 
     if session.events is None:
         session.events = []
-    session.events.append(detected_event_data)
+    session.events.append(Event.model_validate(get_event_summary(detected_event_data)))
 
     # Update the session object
-    _ = await mongo_db["sessions"].update_many(
-        {"id": session.id, "project_id": session.project_id},
-        {"$set": session.model_dump()},
-    )
+    await add_events_to_summaries([detected_event_data])
+    await increment_session_stats(session.id, nb_events=1)
+    await bump_data_version([session.project_id])
 
     return session
 
@@ -362,19 +464,18 @@ async def remove_event_from_session(session: Session, event_name: str) -> Sessio
         e.event_name for e in session.events
     ]:
         # Mark the event as removed in the events database
-        _ = await mongo_db["events"].update_many(
+        event_ref = await mongo_db["events"].update_many(
             {"session_id": session.id, "event_name": event_name},
             {"$set": {"removed": True}},
         )
+        await increment_session_stats(session.id, nb_events=-event_ref.modified_count)
 
         # Remove the event from the session
         session.events = [e for e in session.events if e.event_name != event_name]
 
-        # Update the session object
-        _ = await mongo_db["sessions"].update_one(
-            {"id": session.id, "project_id": session.project_id},
-            {"$set": session.model_dump()},
-        )
+        # Update the session object and its tasks
+        await remove_session_event_from_summaries(session.id, event_name)
+        await bump_data_version([session.project_id])
         return session
     else:
         raise HTTPException(
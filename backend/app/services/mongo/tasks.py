@@ -6,6 +6,15 @@ from phospho.utils import filter_nonjsonable_keys
 import pydantic
 from app.db.models import Eval, EventDefinition, Task, Event
 from app.db.mongo import get_mongo_db
+from app.services.mongo.event_summaries import (
+    add_events_to_summaries,
+    remove_event_from_summaries,
+)
+from phospho.lab.event_summaries import get_event_summary
+from app.services.mongo.results_cache import bump_data_version
+from app.services.mongo.rollups import increment_rollups, move_task_rollup
+from app.services.mongo.sessions import increment_session_stats, move_session_flag
+from app.services.mongo.user_stats import move_user_flag
 from fastapi import HTTPException
 
 from app.utils import generate_uuid
@@ -46,6 +55,7 @@ async def create_task(
     doc_creation = await mongo_db["tasks"].insert_one(task_data.model_dump())
     if not doc_creation:
         raise Exception("Failed to insert the task in database")
+    await bump_data_version([project_id])
     return task_data
 
 
@@ -107,6 +117,10 @@ async def flag_task(
             {"id": task_model.id},
             {"$set": update_payload},
         )
+        await move_task_rollup(task_model, "flag", task_model.flag, flag)
+        await move_user_flag(task_model, task_model.flag, flag)
+        await move_session_flag(task_model.session_id, task_model.flag, flag)
+        await bump_data_version([task_model.project_id])
         task_model.flag = flag
         task_model.notes = notes
         task_model.last_eval = eval_data
@@ -127,6 +141,7 @@ async def update_task(
     flag_source: Optional[str] = None,
 ) -> Task:
     mongo_db = await get_mongo_db()
+    previous_flag = task_model.flag
 
     # Update the task object if the fields are not None
     if metadata is not None:
@@ -163,6 +178,10 @@ async def update_task(
         raise HTTPException(
             status_code=500, detail=f"Failed to update Task {task_model.id}: {e}"
         )
+    await move_task_rollup(task_model, "flag", previous_flag, task_model.flag)
+    await move_user_flag(task_model, previous_flag, task_model.flag)
+    await move_session_flag(task_model.session_id, previous_flag, task_model.flag)
+    await bump_data_version([task_model.project_id])
 
     return task_model
 
@@ -195,12 +214,15 @@ async def add_event_to_task(
 
     if task.events is None:
         task.events = []
-    task.events.append(detected_event_data)
+    task.events.append(Event.model_validate(get_event_summary(detected_event_data)))
 
-    # Update the task object
-    _ = await mongo_db["tasks"].update_many(
-        {"id": task.id, "project_id": task.project_id}, {"$set": task.model_dump()}
+    # Update the task and session objects
+    await add_events_to_summaries([detected_event_data])
+    await increment_rollups(
+        task.project_id, {(task.created_at, ("event_name", event.event_name)): 1}
     )
+    await increment_session_stats(task.session_id, nb_events=1)
+    await bump_data_version([task.project_id])
 
     return task
 
@@ -220,10 +242,17 @@ async def remove_event_from_task(task: Task, event_name: str) -> Task:
         # Remove the event from the task
         task.events = [e for e in task.events if e.event_name != event_name]
 
-        # Update the task object
-        task_ref = await mongo_db["tasks"].update_one(
-            {"id": task.id, "project_id": task.project_id}, {"$set": task.model_dump()}
+        # Update the task and session objects
+        await remove_event_from_summaries(
+            event_name, task_id=task.id, session_id=task.session_id
+        )
+        await increment_rollups(
+            task.project_id, {(task.created_at, ("event_name", event_name)): -1}
         )
+        await increment_session_stats(
+            task.session_id, nb_events=-event_ref.modified_count
+        )
+        await bump_data_version([task.project_id])
 
     return task
 
@@ -291,15 +320,8 @@ def task_filtering_pipeline_match(
         match[f"{prefix}flag"] = filters.flag
 
     if filters.event_name is not None:
-        collection = "tasks_with_events"
-        match["$and"] = [
-            {f"{prefix}events": {"$ne": []}},
-            {
-                f"{prefix}events": {
-                    "$elemMatch": {"event_name": {"$in": filters.event_name}}
-                }
-            },
-        ]
+        # The events are stored on the task documents
+        match[f"{prefix}events.event_name"] = {"$in": filters.event_name}
 
     if filters.has_notes is not None and filters.has_notes:
         match["$and"] = [
@@ -407,5 +429,6 @@ async def label_sentiment_analysis(
             "$set": {"sentiment.label": "mixed"},
         },
     )
+    await bump_data_version([project_id])
 
     return None
@@ -0,0 +1,344 @@
+"""
+Stats of the end-users of the projects (metadata.user_id)
+
+The user_stats collection stores one document per project and user, with the
+number of tasks, of tasks flagged success and failure, the sum of the tokens,
+the first sessions and one event per event_name of the user (see
+app.services.user_stats in the extractor).
+
+The extractor updates the stats when tasks are logged, flagged and when events
+are detected. The stats of the projects created before them are built here,
+from the tasks, and the stats of a project are only used once they're built
+(see user_stats_status).
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from pymongo import UpdateOne
+
+from app.api.platform.models.explore import Pagination
+from app.api.v2.models.projects import UserMetadata
+from app.core import config
+from app.db.models import Session, Task
+from app.db.mongo import get_mongo_db
+from app.services.mongo.pagination import (
+    build_cursor_match,
+    decode_cursor,
+    encode_cursor,
+)
+from app.utils import generate_timestamp
+
+USER_STATS_MAX_SESSIONS = 1000
+USER_STATS_BUILD_BATCH_SIZE = 1000
+# The most active users first
+USERS_SORTING = {"nb_tasks": -1, "user_id": -1}
+
+
+async def has_user_stats(project_id: str) -> bool:
+    mongo_db = await get_mongo_db()
+    status = await mongo_db["user_stats_status"].find_one({"project_id": project_id})
+    return status is not None
+
+
+def to_user_metadata(user_stats: dict) -> UserMetadata:
+    """
+    Convert the stats of a user to a UserMetadata, without its tasks and sessions.
+
+    The average session length is the number of tasks per session, so it's an
+    estimate when the user has more than USER_STATS_MAX_SESSIONS sessions.
+    """
+    nb_tasks = user_stats.get("nb_tasks", 0)
+    nb_sessions = len(user_stats.get("session_ids", []))
+    return UserMetadata(
+        user_id=user_stats["user_id"],
+        nb_tasks=nb_tasks,
+        avg_success_rate=(
+            user_stats.get("nb_success", 0) / nb_tasks if nb_tasks > 0 else None
+        ),
+        avg_session_length=nb_tasks / nb_sessions if nb_sessions > 0 else None,
+        total_tokens=user_stats.get("total_tokens", 0),
+        events=user_stats.get("events", []),
+        tasks_id=[],
+        sessions=[],
+    )
+
+
+def get_users_next_cursor(
+    users: List[UserMetadata], pagination: Optional[Pagination]
+) -> Optional[str]:
+    """
+    The cursor of the page after users. None if users is the last page.
+    """
+    if pagination is None or len(users) == 0 or len(users) < pagination.per_page:
+        return None
+    return encode_cursor({key: getattr(users[-1], key) for key in USERS_SORTING})
+
+
+def paginate_users(
+    users: List[UserMetadata], pagination: Optional[Pagination]
+) -> List[UserMetadata]:
+    """
+    Sort and paginate users in memory, like list_users_metadata. Used when the
+    stats of the project are not built yet.
+    """
+    users = sorted(users, key=lambda user: (user.nb_tasks, user.user_id), reverse=True)
+    if pagination is None:
+        return users
+    if pagination.cursor is not None:
+        values = decode_cursor(pagination.cursor, USERS_SORTING)
+        after = (values["nb_tasks"], values["user_id"])
+        users = [user for user in users if (user.nb_tasks, user.user_id) < after]
+    else:
+        users = users[pagination.page * pagination.per_page :]
+    return users[: pagination.per_page]
+
+
+async def list_users_metadata(
+    project_id: str, pagination: Optional[Pagination] = None
+) -> List[UserMetadata]:
+    """
+    List the users of a project from their stats, the most active first.
+    """
+    mongo_db = await get_mongo_db()
+    query: Dict[str, object] = {"project_id": project_id}
+    if pagination is not None and pagination.cursor is not None:
+        query.update(build_cursor_match(USERS_SORTING, pagination.cursor))
+    cursor = (
+        mongo_db["user_stats"].find(query, {"_id": 0}).sort(list(USERS_SORTING.items()))
+    )
+    if pagination is not None:
+        if pagination.cursor is None:
+            cursor = cursor.skip(pagination.page * pagination.per_page)
+        cursor = cursor.limit(pagination.per_page)
+    return [to_user_metadata(user_stats) async for user_stats in cursor]
+
+
+async def get_user_metadata_from_stats(
+    project_id: str, user_id: str
+) -> Optional[UserMetadata]:
+    """
+    Get the stats of a user, with the ids of their tasks and their sessions.
+    """
+    mongo_db = await get_mongo_db()
+    user_stats = await mongo_db["user_stats"].find_one(
+        {"project_id": project_id, "user_id": user_id}, {"_id": 0}
+    )
+    if user_stats is None:
+        return None
+    user_metadata = to_user_metadata(user_stats)
+    user_metadata.tasks_id = await mongo_db["tasks"].distinct(
+        "id", {"project_id": project_id, "metadata.user_id": user_id}
+    )
+    sessions = await (
+        mongo_db["sessions"]
+        .find({"id": {"$in": user_stats.get("session_ids", [])}}, {"_id": 0})
+        .to_list(length=None)
+    )
+    user_metadata.sessions = [Session.model_validate(session) for session in sessions]
+    session_lengths = [
+        session.session_length
+        for session in user_metadata.sessions
+        if session.session_length is not None
+    ]
+    if len(session_lengths) > 0:
+        user_metadata.avg_session_length = sum(session_lengths) / len(session_lengths)
+    return user_metadata
+
+
+async def count_users(project_id: str) -> int:
+    mongo_db = await get_mongo_db()
+    return await mongo_db["user_stats"].count_documents({"project_id": project_id})
+
+
+async def get_nb_tasks_of_user_at(
+    project_id: str, index: int, descending: bool = True
+) -> Optional[int]:
+    """
+    The number of tasks of the user at this index, when the users are sorted
+    by number of tasks. Reads the index entries up to it only.
+    """
+    mongo_db = await get_mongo_db()
+    direction = -1 if descending else 1
+    users_stats = (
+        await mongo_db["user_stats"]
+        .find({"project_id": project_id}, {"_id": 0, "nb_tasks": 1})
+        .sort([("nb_tasks", direction), ("user_id", direction)])
+        .skip(index)
+        .limit(1)
+        .to_list(length=1)
+    )
+    if len(users_stats) == 0:
+        return None
+    return users_stats[0]["nb_tasks"]
+
+
+async def compute_users_success_rate_quantiles(
+    project_id: str, quantile_value: float
+) -> Tuple[float, float, float]:
+    """
+    The bottom quantile, average and top quantile of the success rate of the
+    users with flagged tasks.
+    """
+    mongo_db = await get_mongo_db()
+    nb_flagged = {"$add": ["$nb_success", "$nb_failure"]}
+    pipeline: List[Dict[str, object]] = [
+        {"$match": {"project_id": project_id}},
+        {"$match": {"$expr": {"$gt": [nb_flagged, 0]}}},
+        {"$project": {"success_rate": {"$divide": ["$nb_success", nb_flagged]}}},
+        {
+            "$group": {
+                "_id": None,
+                "quantiles": {
+                    "$percentile": {
+                        "input": "$success_rate",
+                        "p": [quantile_value, 1 - quantile_value],
+                        "method": "approximate",
+                    }
+                },
+                "average": {"$avg": "$success_rate"},
+            }
+        },
+    ]
+    result = await mongo_db["user_stats"].aggregate(pipeline).to_list(length=None)
+    if len(result) == 0:
+        return 0.0, 0.0, 0.0
+    bottom_quantile, top_quantile = result[0]["quantiles"]
+    return bottom_quantile, result[0]["average"], top_quantile
+
+
+async def move_user_flag(
+    task: Task, previous: Optional[str], new: Optional[str]
+) -> None:
+    """
+    Move a task from a flag to another in the stats of its user, eg: when it's
+    flagged again in the platform.
+    """
+    if previous == new or task.metadata is None:
+        return
+    user_id = task.metadata.get("user_id")
+    if user_id is None:
+        return
+    increments = {}
+    if previous in ["success", "failure"]:
+        increments[f"nb_{previous}"] = -1
+    if new in ["success", "failure"]:
+        increments[f"nb_{new}"] = 1
+    if len(increments) == 0:
+        return
+    mongo_db = await get_mongo_db()
+    await mongo_db["user_stats"].update_one(
+        {"project_id": task.project_id, "user_id": str(user_id)},
+        {"$inc": increments},
+    )
+
+
+async def build_project_user_stats(project_id: str) -> None:
+    """
+    Build the stats of the users of a project from its tasks, and replace the
+    current ones.
+    """
+    mongo_db = await get_mongo_db()
+    match = {"project_id": project_id, "metadata.user_id": {"$ne": None}}
+    stats_pipeline: List[Dict[str, object]] = [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": {"$toString": "$metadata.user_id"},
+                "nb_tasks": {"$sum": 1},
+                "nb_success": {
+                    "$sum": {"$cond": [{"$eq": ["$flag", "success"]}, 1, 0]}
+                },
+                "nb_failure": {
+                    "$sum": {"$cond": [{"$eq": ["$flag", "failure"]}, 1, 0]}
+                },
+                "total_tokens": {
+                    "$sum": {
+                        "$cond": [
+                            {"$isNumber": "$metadata.total_tokens"},
+                            "$metadata.total_tokens",
+                            0,
+                        ]
+                    }
+                },
+                "session_ids": {"$addToSet": "$session_id"},
+                "first_seen_at": {"$min": "$created_at"},
+                "last_seen_at": {"$max": "$created_at"},
+            }
+        },
+    ]
+    # The first event of each event_name, per user
+    events_pipeline: List[Dict[str, object]] = [
+        {"$match": {**match, "events.0": {"$exists": True}}},
+        {"$project": {"user_id": {"$toString": "$metadata.user_id"}, "events": 1}},
+        {"$unwind": "$events"},
+        {"$match": {"events.removed": {"$ne": True}}},
+        {
+            "$group": {
+                "_id": {"user_id": "$user_id", "event_name": "$events.event_name"},
+                "event": {"$first": "$events"},
+            }
+        },
+    ]
+    events_per_user: Dict[str, List[dict]] = {}
+    async for group in mongo_db["tasks"].aggregate(events_pipeline, allowDiskUse=True):
+        events_per_user.setdefault(group["_id"]["user_id"], []).append(group["event"])
+
+    now = generate_timestamp()
+    # The stats are replaced user by user, so that they are never missing
+    # while they're rebuilt
+    updates: List[UpdateOne] = []
+    async for group in mongo_db["tasks"].aggregate(stats_pipeline, allowDiskUse=True):
+        user_id = group.pop("_id")
+        session_ids = [
+            session_id for session_id in group.pop("session_ids") if session_id
+        ]
+        updates.append(
+            UpdateOne(
+                {"project_id": project_id, "user_id": user_id},
+                {
+                    "$set": {
+                        **group,
+                        "total_tokens": int(group["total_tokens"]),
+                        "session_ids": session_ids[:USER_STATS_MAX_SESSIONS],
+                        "events": events_per_user.get(user_id, []),
+                        "updated_at": now,
+                    }
+                },
+                upsert=True,
+            )
+        )
+        if len(updates) >= USER_STATS_BUILD_BATCH_SIZE:
+            await mongo_db["user_stats"].bulk_write(updates, ordered=False)
+            updates = []
+    if len(updates) > 0:
+        await mongo_db["user_stats"].bulk_write(updates, ordered=False)
+    # The users without tasks anymore. The users updated by the extractor
+    # during the build have a more recent updated_at.
+    await mongo_db["user_stats"].delete_many(
+        {"project_id": project_id, "updated_at": {"$lt": now}}
+    )
+    await mongo_db["user_stats_status"].update_one(
+        {"project_id": project_id},
+        {"$set": {"built_at": now}},
+        upsert=True,
+    )
+
+
+async def backfill_user_stats() -> None:
+    """
+    Build the user stats of the projects that don't have them yet.
+    """
+    mongo_db = await get_mongo_db()
+    built_project_ids = set(await mongo_db["user_stats_status"].distinct("project_id"))
+    project_ids_to_build = [
+        project_id
+        for project_id in await mongo_db["projects"].distinct("id")
+        if project_id not in built_project_ids
+    ][: config.USER_STATS_MAX_BUILDS_PER_RUN]
+    for project_id in project_ids_to_build:
+        try:
+            await build_project_user_stats(project_id)
+        except Exception as e:
+            logger.error(f"Error building the user stats of {project_id}: {e}")
+    logger.info(f"User stats: built {len(project_ids_to_build)} projects")
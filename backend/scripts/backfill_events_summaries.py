@@ -0,0 +1,100 @@
+"""
+Migration script: store the events of the tasks and sessions on their documents.
+
+The tasks_with_events and sessions_with_events views are replaced by the `events`
+field of the task and session documents. This script recomputes this field from
+the events collection: removed events are dropped and the events are deduplicated
+on (task_id, event_name).
+
+Usage:
+    python scripts/backfill_events_summaries.py [project_id]
+
+If no project_id is given, all the projects are migrated.
+"""
+
+import os
+import sys
+from typing import Dict, List, Optional, Tuple
+
+import pymongo
+from dotenv import load_dotenv
+from loguru import logger
+from pymongo import UpdateOne
+from tqdm import tqdm
+
+from phospho.lab.event_summaries import EVENT_SUMMARY_EXCLUDED_FIELDS
+
+load_dotenv()
+
+assert (
+    os.getenv("MONGODB_URL") is not None
+), "MONGODB_URL is missing from the environment variables"
+assert (
+    os.getenv("MONGODB_NAME") is not None
+), "MONGODB_NAME is missing from the environment variables"
+
+BATCH_SIZE = 1000
+
+EXCLUDED_FIELDS = {"_id": 0, **{field: 0 for field in EVENT_SUMMARY_EXCLUDED_FIELDS}}
+
+mongo_db = pymongo.MongoClient(os.getenv("MONGODB_URL"))[os.getenv("MONGODB_NAME")]
+
+
+def group_events(project_id: str, key: str) -> Dict[str, List[dict]]:
+    """
+    Group the active events of a project by task_id or session_id,
+    deduplicated on (task_id, event_name).
+    """
+    events_per_document: Dict[str, List[dict]] = {}
+    seen: Dict[str, set] = {}
+    cursor = (
+        mongo_db["events"]
+        .find(
+            {"project_id": project_id, "removed": {"$ne": True}, key: {"$ne": None}},
+            EXCLUDED_FIELDS,
+        )
+        .sort("created_at", 1)
+    )
+    for event in cursor:
+        document_id = event[key]
+        dedup_key: Tuple[Optional[str], str] = (
+            event.get("task_id"),
+            event["event_name"],
+        )
+        if dedup_key in seen.setdefault(document_id, set()):
+            continue
+        seen[document_id].add(dedup_key)
+        events_per_document.setdefault(document_id, []).append(event)
+    return events_per_document
+
+
+def backfill_collection(project_id: str, collection: str, key: str) -> None:
+    events_per_document = group_events(project_id, key)
+
+    updates = [
+        UpdateOne({"id": document_id}, {"$set": {"events": events}})
+        for document_id, events in events_per_document.items()
+    ]
+    # The documents with events that don't exist anymore
+    documents_without_events = mongo_db[collection].find(
+        {"project_id": project_id, "events": {"$nin": [[], None]}}, {"id": 1}
+    )
+    for document in documents_without_events:
+        if document["id"] not in events_per_document:
+            updates.append(UpdateOne({"id": document["id"]}, {"$set": {"events": []}}))
+
+    for i in range(0, len(updates), BATCH_SIZE):
+        mongo_db[collection].bulk_write(updates[i : i + BATCH_SIZE], ordered=False)
+    logger.info(f"Project {project_id}: updated {len(updates)} {collection}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        project_ids = sys.argv[1:]
+    else:
+        project_ids = mongo_db["projects"].distinct("id")
+
+    logger.info(f"Backfilling the events of {len(project_ids)} projects")
+    for project_id in tqdm(project_ids):
+        backfill_collection(project_id, "tasks", "task_id")
+        backfill_collection(project_id, "sessions", "session_id")
@@ -1,5 +1,8 @@
+import json
+
 import app.core.config as config
-from app.api.v2.models import Project
+import pyarrow as pa
+from app.api.v2.models import Project, Task
 from app.main import app as router
 from app.utils import generate_uuid
 from fastapi.testclient import TestClient
@@ -205,6 +208,68 @@ def test_create_and_update_task(
     cleanup(mongo_db, {"tasks": [task["id"]]})
 
 
+def test_update_task_flag_moves_counters(
+    dummy_project,
+    mongo_db,
+    api_key,
+):
+    task = Task(
+        project_id=dummy_project.id,
+        org_id=dummy_project.org_id,
+        session_id=generate_uuid(),
+        input="test",
+        output="test",
+        flag="failure",
+        metadata={"user_id": generate_uuid()},
+    )
+    mongo_db["tasks"].insert_one(task.model_dump())
+    mongo_db["sessions"].insert_one(
+        {
+            "id": task.session_id,
+            "project_id": dummy_project.id,
+            "stats": {"nb_success": 0, "nb_failure": 1},
+        }
+    )
+    mongo_db["user_stats"].insert_one(
+        {
+            "project_id": dummy_project.id,
+            "user_id": task.metadata["user_id"],
+            "nb_success": 0,
+            "nb_failure": 1,
+        }
+    )
+
+    with TestClient(router) as client:
+        response = client.post(
+            f"/v2/tasks/{task.id}",
+            json={"flag": "success"},
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        assert response.status_code == 200, response.text
+        assert response.json()["flag"] == "success"
+
+    session = mongo_db["sessions"].find_one({"id": task.session_id})
+    assert session["stats"]["nb_success"] == 1
+    assert session["stats"]["nb_failure"] == 0
+    user_stats = mongo_db["user_stats"].find_one(
+        {"project_id": dummy_project.id, "user_id": task.metadata["user_id"]}
+    )
+    assert user_stats["nb_success"] == 1
+    assert user_stats["nb_failure"] == 0
+    rollups = {
+        rollup["value"]: rollup["count"]
+        for rollup in mongo_db["rollups"].find(
+            {"project_id": dummy_project.id, "dimension": "flag", "granularity": "day"}
+        )
+    }
+    # The task was inserted without its rollups
+    assert rollups == {"success": 1, "failure": -1}
+
+    cleanup(mongo_db, {"tasks": [task.id], "sessions": [task.session_id]})
+    mongo_db["user_stats"].delete_many({"project_id": dummy_project.id})
+    mongo_db["rollups"].delete_many({"project_id": dummy_project.id})
+
+
 # API v2 tests
 
 
@@ -246,3 +311,48 @@ def test_log(
             ]
         },
     )
+
+
+def test_stream_tasks(
+    dummy_project,
+    mongo_db,
+    api_key,
+):
+    tasks = [
+        Task(
+            project_id=dummy_project.id,
+            org_id=dummy_project.org_id,
+            input=f"input {i}",
+            output="test",
+            created_at=1715000000 + i,
+        )
+        for i in range(5)
+    ]
+    mongo_db["tasks"].insert_many([task.model_dump() for task in tasks])
+    # The most recent first
+    expected_ids = [task.id for task in reversed(tasks)]
+
+    with TestClient(router) as client:
+        # Several batches of 2 tasks
+        response = client.post(
+            f"/v2/projects/{dummy_project.id}/tasks/stream",
+            json={"fields": ["id", "created_at"], "batch_size": 2},
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        assert response.status_code == 200, response.text
+        streamed = [json.loads(line) for line in response.iter_lines() if line]
+        assert [task["id"] for task in streamed] == expected_ids
+        assert set(streamed[0].keys()) == {"id", "created_at"}
+
+        response = client.post(
+            f"/v2/projects/{dummy_project.id}/tasks/stream",
+            json={"fields": ["id"], "batch_size": 2, "format": "arrow"},
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        assert response.status_code == 200, response.text
+        reader = pa.ipc.open_stream(response.content)
+        batches = list(reader)
+        assert [batch.num_rows for batch in batches] == [2, 2, 1]
+        assert pa.Table.from_batches(batches).column("id").to_pylist() == expected_ids
+
+    cleanup(mongo_db, {"tasks": [task.id for task in tasks]})
@@ -0,0 +1,26 @@
+import time
+
+from app.security.cache import TTLCache
+
+
+def test_ttl_cache():
+    cache = TTLCache(ttl=60, max_size=2)
+
+    assert cache.get("a") == (False, None)
+    # Negative results are cached too
+    cache.set("a", None)
+    assert cache.get("a") == (True, None)
+
+    cache.set("b", "org_b")
+    cache.set("c", "org_c")
+    # The oldest entry is evicted
+    assert len(cache) == 2
+    assert cache.get("a") == (False, None)
+    assert cache.get("c") == (True, "org_c")
+
+    cache.set("d", "org_d", ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("d") == (False, None)
+
+    cache.invalidate("c")
+    assert cache.get("c") == (False, None)
@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+
+from app.core import config
+from app.services.mongo import backfills
+from app.services.mongo.backfills import (
+    chunk,
+    claim_backfill_job,
+    get_tasks_per_second,
+    resume_backfill_jobs,
+    run_backfill_job,
+)
+from app.utils import generate_timestamp, generate_uuid
+
+
+def test_chunk():
+    assert chunk(["a", "b", "c", "d", "e"], 2) == [["a", "b"], ["c", "d"], ["e"]]
+    assert chunk(["a", "b"], 2) == [["a", "b"]]
+    assert chunk([], 2) == []
+
+
+def test_get_tasks_per_second():
+    assert get_tasks_per_second(nb_scanned=100, running_time=4.0) == 25
+    assert get_tasks_per_second(nb_scanned=0, running_time=0.0) is None
+
+
+def insert_backfill_job(mongo_db, project_id: str, **fields) -> str:
+    backfill_job = {
+        "id": generate_uuid(),
+        "project_id": project_id,
+        "recipe_id": generate_uuid(),
+        "status": "running",
+        "max_tasks_per_minute": config.BACKFILL_MAX_TASKS_PER_MINUTE,
+        "nb_tasks": 0,
+        "nb_attempts": 0,
+        "updated_at": generate_timestamp(),
+        **fields,
+    }
+    mongo_db["backfill_jobs"].insert_one(backfill_job)
+    return backfill_job["id"]
+
+
+@pytest.mark.asyncio
+async def test_claim_backfill_job(db, mongo_db):
+    async for _ in db:
+        project_id = generate_uuid()
+        running_job_id = insert_backfill_job(mongo_db, project_id)
+        paused_job_id = insert_backfill_job(mongo_db, project_id, status="paused")
+
+        job = await claim_backfill_job(running_job_id, run_id="run")
+        assert job["run_id"] == "run"
+        assert job["nb_attempts"] == 1
+        # Only running and failed jobs can be claimed
+        assert await claim_backfill_job(paused_job_id, run_id="run") is None
+
+        mongo_db["backfill_jobs"].delete_many({"project_id": project_id})
+
+
+@pytest.mark.asyncio
+async def test_resume_backfill_jobs(db, mongo_db, monkeypatch):
+    async for _ in db:
+        project_id = generate_uuid()
+        stale_at = generate_timestamp() - config.BACKFILL_STALE_AFTER - 1
+        stale_job_id = insert_backfill_job(
+            mongo_db, project_id, updated_at=stale_at, nb_attempts=1
+        )
+        failed_job_id = insert_backfill_job(mongo_db, project_id, status="failed")
+        # Recent progress: still running
+        running_job_id = insert_backfill_job(mongo_db, project_id)
+        exhausted_job_id = insert_backfill_job(
+            mongo_db,
+            project_id,
+            updated_at=stale_at,
+            nb_attempts=config.BACKFILL_MAX_ATTEMPTS,
+        )
+
+        resumed_job_ids = []
+
+        async def run_backfill_job(backfill_job_id: str) -> None:
+            resumed_job_ids.append(backfill_job_id)
+
+        monkeypatch.setattr(backfills, "run_backfill_job", run_backfill_job)
+        await resume_backfill_jobs()
+        await asyncio.gather(*backfills.running_backfill_tasks)
+
+        assert sorted(resumed_job_ids) == sorted([stale_job_id, failed_job_id])
+        # The job without progress is failed, it doesn't count as running
+        exhausted_job = mongo_db["backfill_jobs"].find_one({"id": exhausted_job_id})
+        assert exhausted_job["status"] == "failed"
+        running_job_ids = [
+            job["id"]
+            for job in mongo_db["backfill_jobs"].find(
+                {"project_id": project_id, "status": "running"}
+            )
+        ]
+        assert sorted(running_job_ids) == sorted([stale_job_id, running_job_id])
+
+        mongo_db["backfill_jobs"].delete_many({"project_id": project_id})
+
+
+@pytest.mark.asyncio
+async def test_run_backfill_job_resets_attempts(db, mongo_db, monkeypatch):
+    async for _ in db:
+        project_id = generate_uuid()
+        recipe_id = generate_uuid()
+        mongo_db["recipes"].insert_one(
+            {
+                "id": recipe_id,
+                "project_id": project_id,
+                "org_id": "org",
+                "recipe_type": "event_detection",
+            }
+        )
+        task_ids = [generate_uuid() for _ in range(2)]
+        mongo_db["tasks"].insert_many(
+            [
+                {
+                    "id": task_id,
+                    "project_id": project_id,
+                    "input": "test",
+                    "created_at": generate_timestamp(),
+                    "test_id": None,
+                }
+                for task_id in task_ids
+            ]
+        )
+        backfill_job_id = insert_backfill_job(
+            mongo_db,
+            project_id,
+            recipe_id=recipe_id,
+            nb_attempts=config.BACKFILL_MAX_ATTEMPTS - 1,
+        )
+
+        async def run_recipe_on_task_ids(task_ids, recipe, org_id):
+            return len(task_ids)
+
+        monkeypatch.setattr(backfills, "run_recipe_on_task_ids", run_recipe_on_task_ids)
+        await run_backfill_job(backfill_job_id)
+
+        backfill_job = mongo_db["backfill_jobs"].find_one({"id": backfill_job_id})
+        assert backfill_job["status"] == "done"
+        assert backfill_job["nb_scanned"] == 2
+        # The attempts are reset when a chunk is processed
+        assert backfill_job["nb_attempts"] == 0
+
+        mongo_db["backfill_jobs"].delete_many({"project_id": project_id})
+        mongo_db["recipes"].delete_many({"project_id": project_id})
+        mongo_db["tasks"].delete_many({"project_id": project_id})
@@ -0,0 +1,21 @@
+from app.db.models import Task
+from app.services.mongo.exports import EXPORT_COLUMNS, flatten_task
+
+
+def test_flatten_task():
+    task = Task(
+        project_id="p",
+        input="hello",
+        created_at=10,
+        metadata={"user_id": "u", "tokens": 3},
+        topics=["a"],
+    )
+
+    row = flatten_task(task)
+
+    # Same columns for every task, so that the Parquet row groups share a schema
+    assert list(row.keys()) == EXPORT_COLUMNS
+    assert row["created_at"] == 10
+    assert row["metadata"] == '{"user_id": "u", "tokens": 3}'
+    assert row["topics"] == '["a"]'
+    assert row["flag"] is None
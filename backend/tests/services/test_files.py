@@ -0,0 +1,68 @@
+from collections import Counter
+
+import pandas as pd
+
+from app.services.mongo.files import prepare_log_events_df, to_log_events, to_timestamps
+
+
+def test_prepare_log_events_df():
+    tasks_df = pd.DataFrame(
+        {
+            "input": ["hello", "hi", None, 3],
+            "output": ["world", None, "ignored", "three"],
+            "task_id": ["a", "a", "b", None],
+            "session_id": ["s1", "s1", "s2", None],
+            "created_at": ["2024-05-01T00:00:00Z", "invalid", None, "2024-05-02"],
+            "flag": ["Success", "bad", None, "failure"],
+        }
+    )
+    seen_task_ids: Counter = Counter()
+    prepared_df = prepare_log_events_df(tasks_df, "p", "u", seen_task_ids)
+
+    # The row without input is dropped
+    assert len(prepared_df) == 3
+    assert list(prepared_df["input"]) == ["hello", "hi", "3"]
+    assert list(prepared_df["output"]) == ["world", None, "three"]
+    # The sessions with the same id stay together
+    assert list(prepared_df["session_id"]) == ["p_s1_u", "p_s1_u", None]
+    # The task ids are distinct
+    task_ids = list(prepared_df["task_id"])
+    assert task_ids[:2] == ["p_a_u", "p_a_u_1"]
+    assert task_ids[2] is not None and len(set(task_ids)) == 3
+    assert prepared_df["created_at"].iloc[0] == 1714521600
+    assert list(prepared_df["flag"]) == ["success", None, "failure"]
+
+    # The duplicates are detected across the chunks of a file
+    next_df = prepare_log_events_df(
+        pd.DataFrame({"input": ["again"], "task_id": ["a"]}), "p", "u", seen_task_ids
+    )
+    assert list(next_df["task_id"]) == ["p_a_u_2"]
+
+    log_events, nb_invalid = to_log_events(prepared_df)
+    assert nb_invalid == 0
+    assert log_events[0].input == "hello"
+    assert log_events[0].project_id == "p"
+    assert log_events[1].output is None
+
+
+def test_to_log_events_drops_invalid_rows():
+    tasks_df = pd.DataFrame(
+        {
+            "input": ["hello", "hi"],
+            "user_id": [12, 13],
+            "metadata": [{"plan": "pro"}, "not a dict"],
+        }
+    )
+    prepared_df = prepare_log_events_df(tasks_df, "p", "u", Counter())
+
+    log_events, nb_invalid = to_log_events(prepared_df)
+
+    # The numeric user ids are read as strings, the invalid metadata is dropped
+    assert nb_invalid == 1
+    assert [log_event.user_id for log_event in log_events] == ["12"]
+    assert log_events[0].metadata == {"plan": "pro"}
+
+
+def test_to_timestamps():
+    timestamps = to_timestamps(pd.Series([1714521600, None]), default=0)
+    assert list(timestamps) == [1714521600, 0]
@@ -0,0 +1,105 @@
+import pytest
+
+from app.api.platform.models.explore import Pagination, Sorting
+from app.services.mongo.pagination import (
+    build_cursor_match,
+    encode_cursor,
+    get_next_cursor,
+    get_sorting_dict,
+)
+
+
+def test_cursor_pagination():
+    sorting = [Sorting(id="flag", desc=True)]
+    sorting_dict = get_sorting_dict(sorting)
+    assert sorting_dict == {"flag": 1, "id": 1}
+
+    items = [{"id": "a", "flag": "failure"}, {"id": "b", "flag": "success"}]
+    # No next page if the page is not full
+    assert get_next_cursor(items, Pagination(per_page=3), sorting) is None
+
+    cursor = get_next_cursor(items, Pagination(per_page=2), sorting)
+    assert cursor is not None
+    assert build_cursor_match(sorting_dict, cursor) == {
+        "$or": [
+            {"flag": {"$gt": "success"}},
+            {"flag": "success", "id": {"$gt": "b"}},
+        ]
+    }
+
+    # The most recent first by default
+    default_cursor = get_next_cursor(
+        [{"id": "c", "created_at": 10}], Pagination(per_page=1)
+    )
+    assert build_cursor_match(get_sorting_dict(), default_cursor) == {
+        "$or": [
+            {"created_at": {"$lt": 10}},
+            {"created_at": 10, "id": {"$lt": "c"}},
+        ]
+    }
+
+
+def test_cursor_pagination_null_values():
+    sorting_dict = {"flag": 1, "id": 1}
+    # The nulls are first in ascending order: all the flags are after
+    assert build_cursor_match(
+        sorting_dict, encode_cursor({"flag": None, "id": "a"})
+    ) == {
+        "$or": [
+            {"flag": {"$ne": None}},
+            {"flag": None, "id": {"$gt": "a"}},
+        ]
+    }
+    # The nulls are last in descending order: the nulls are after any flag
+    descending = {"flag": -1, "id": -1}
+    assert build_cursor_match(
+        descending, encode_cursor({"flag": "success", "id": "b"})
+    ) == {
+        "$or": [
+            {"$or": [{"flag": {"$lt": "success"}}, {"flag": None}]},
+            {"flag": "success", "id": {"$lt": "b"}},
+        ]
+    }
+    assert build_cursor_match(descending, encode_cursor({"flag": None, "id": "b"})) == {
+        "$or": [{"flag": None, "id": {"$lt": "b"}}]
+    }
+
+
+@pytest.mark.parametrize("direction", [1, -1])
+def test_cursor_pagination_across_nulls(mongo_db, direction):
+    collection = mongo_db["test_cursor_pagination"]
+    collection.delete_many({})
+    collection.insert_many(
+        [
+            {"id": "a", "flag": "success"},
+            {"id": "b", "flag": None},
+            {"id": "c"},
+            {"id": "d", "flag": "failure"},
+            {"id": "e", "flag": None},
+            {"id": "f", "flag": "success"},
+        ]
+    )
+    sorting = [Sorting(id="flag", desc=direction == 1)]
+    sorting_dict = get_sorting_dict(sorting)
+    pagination = Pagination(per_page=2)
+
+    expected = [
+        item["id"]
+        for item in collection.find({}, {"_id": 0}).sort(list(sorting_dict.items()))
+    ]
+    paged: list = []
+    query: dict = {}
+    while True:
+        items = list(
+            collection.find(query, {"_id": 0})
+            .sort(list(sorting_dict.items()))
+            .limit(pagination.per_page)
+        )
+        paged.extend(item["id"] for item in items)
+        cursor = get_next_cursor(items, pagination, sorting)
+        if cursor is None:
+            break
+        query = build_cursor_match(sorting_dict, cursor)
+
+    assert paged == expected
+    collection.drop()
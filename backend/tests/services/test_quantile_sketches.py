@@ -0,0 +1,30 @@
+import random
+
+from app.services.mongo.quantile_sketches import get_sketch_quantile, merge_sketches
+from phospho.lab.quantile_sketches import RELATIVE_ACCURACY, get_bucket_key
+
+
+def test_sketch_quantiles():
+    random.seed(0)
+    values = [random.lognormvariate(5, 2) for _ in range(10000)] + [0, -3.5]
+    # Two daily sketches of the values
+    sketches = []
+    for day_values in [values[:5000], values[5000:]]:
+        buckets: dict = {}
+        for value in day_values:
+            key = get_bucket_key(value)
+            buckets[key] = buckets.get(key, 0) + 1
+        sketches.append(
+            {"count": len(day_values), "sum": sum(day_values), "buckets": buckets}
+        )
+
+    sketch = merge_sketches(sketches)
+    assert sketch["count"] == len(values)
+
+    sorted_values = sorted(values)
+    for quantile in [0.1, 0.5, 0.9, 0.99]:
+        expected = sorted_values[int(quantile * (len(values) - 1))]
+        estimate = get_sketch_quantile(sketch["buckets"], quantile)
+        assert abs(estimate - expected) <= RELATIVE_ACCURACY * abs(expected) + 1e-9
+    assert get_sketch_quantile(sketch["buckets"], 0) < 0
+    assert get_sketch_quantile({}, 0.5) is None
@@ -0,0 +1,31 @@
+import pytest
+
+from app.services.mongo import results_cache
+
+
+@pytest.mark.asyncio
+async def test_cached_result_returns_copies(monkeypatch):
+    async def get_data_version(project_id: str) -> int:
+        return 0
+
+    nb_computations = 0
+
+    async def compute():
+        nonlocal nb_computations
+        nb_computations += 1
+        return {"nb_tasks": 10, "flags": ["success"]}
+
+    monkeypatch.setattr(results_cache, "get_data_version", get_data_version)
+    monkeypatch.setattr(results_cache.config, "RESULTS_CACHE_ENABLED", True)
+    monkeypatch.setattr(results_cache.config, "RESULTS_CACHE_SHARED", False)
+
+    result = await results_cache.cached_result(
+        "test_namespace", "test_project", compute, filters=None
+    )
+    # Modifying a result doesn't modify the cached value
+    result["flags"].append("failure")
+    cached = await results_cache.cached_result(
+        "test_namespace", "test_project", compute, filters=None
+    )
+    assert cached == {"nb_tasks": 10, "flags": ["success"]}
+    assert nb_computations == 1
@@ -0,0 +1,142 @@
+import asyncio
+
+from phospho.lab.vector_index import LocalVectorIndex
+
+from app.api.v2.models import SearchResult
+from app.core import config
+from app.db.qdrant import models
+from app.services.mongo import search
+from app.services.mongo.search import (
+    embed_query,
+    get_next_offset,
+    get_session_ids,
+    merge_scores,
+    search_in_project,
+)
+
+
+class FakeEmbeddingProvider:
+    def __init__(self):
+        self.calls = []
+
+    async def embed(self, texts):
+        self.calls.extend(texts)
+        return [[0.1, 0.2] for _ in texts]
+
+
+def test_embed_query_is_cached(monkeypatch):
+    embedding_provider = FakeEmbeddingProvider()
+    monkeypatch.setattr(
+        search,
+        "get_configured_embedding_provider",
+        lambda model, **kwargs: embedding_provider,
+    )
+    search.query_embeddings_cache.clear()
+
+    assert asyncio.run(embed_query("How to cancel?")) == [0.1, 0.2]
+    # Same query, up to the case and the spaces
+    assert asyncio.run(embed_query("  how to  CANCEL? ")) == [0.1, 0.2]
+    assert embedding_provider.calls == ["How to cancel?"]
+
+
+def test_merge_scores():
+    scores = merge_scores(
+        {"a": 0.8, "b": 0.6, "c": 0.5},
+        {"a": 1.0, "b": 4.0},
+        vector_weight=0.5,
+    )
+    assert scores == {"a": 0.525, "b": 0.8, "c": 0.25}
+
+
+def test_pagination_and_session_ids():
+    results = [
+        SearchResult(task_id="t1", session_id="s1", score=0.9, vector_score=0.9),
+        SearchResult(task_id="t2", session_id="s2", score=0.8, vector_score=0.8),
+        SearchResult(task_id="t3", session_id="s1", score=0.7, vector_score=0.7),
+        SearchResult(task_id="t4", score=0.6, vector_score=0.6),
+    ]
+    assert get_session_ids(results) == ["s1", "s2"]
+    assert get_next_offset(results, limit=4, offset=8) == 12
+    assert get_next_offset(results, limit=10, offset=0) is None
+
+
+def test_search_in_project_with_local_vector_index(monkeypatch, tmp_path):
+    index = LocalVectorIndex(str(tmp_path))
+
+    async def get_qdrant():
+        return index
+
+    monkeypatch.setattr(search, "get_qdrant", get_qdrant)
+    monkeypatch.setattr(
+        search,
+        "get_configured_embedding_provider",
+        lambda model, **kwargs: FakeEmbeddingProvider(),
+    )
+    search.query_embeddings_cache.clear()
+
+    async def run():
+        await index.create_collection(
+            config.QDRANT_COLLECTION_NAME,
+            vectors_config=models.VectorParams(size=2, distance=models.Distance.COSINE),
+        )
+        await index.upsert(
+            config.QDRANT_COLLECTION_NAME,
+            points=[
+                models.PointStruct(
+                    id=task_id,
+                    vector=vector,
+                    payload={
+                        "task_id": task_id,
+                        "project_id": project_id,
+                        "session_id": "s1",
+                        "input_preview": "hello",
+                    },
+                )
+                for task_id, vector, project_id in [
+                    ("9c5b94b1-35ad-49bb-b118-8e8fc24abf80", [0.1, 0.2], "p1"),
+                    ("2b0e3b8a-5f0a-4f1e-9a7e-4d3c2b1a0f9e", [1.0, 0.0], "p1"),
+                    ("6f1c2d3e-4b5a-4c6d-8e7f-9a0b1c2d3e4f", [0.1, 0.2], "p2"),
+                ]
+            ],
+        )
+        return await search_in_project("p1", "hello", limit=1)
+
+    results = asyncio.run(run())
+    assert [result.task_id for result in results] == [
+        "9c5b94b1-35ad-49bb-b118-8e8fc24abf80"
+    ]
+    assert results[0].input_preview == "hello"
+
+
+def test_fill_missing_previews(monkeypatch):
+    class FakeCursor:
+        def __init__(self, documents):
+            self.documents = documents
+
+        async def to_list(self, length=None):
+            return self.documents
+
+    class FakeCollection:
+        def __init__(self):
+            self.pipelines = []
+
+        def aggregate(self, pipeline):
+            self.pipelines.append(pipeline)
+            return FakeCursor(
+                [{"id": "old", "input_preview": "hi", "output_preview": None}]
+            )
+
+    tasks_collection = FakeCollection()
+
+    async def get_mongo_db():
+        return {"tasks": tasks_collection}
+
+    monkeypatch.setattr(search, "get_mongo_db", get_mongo_db)
+    results = [
+        SearchResult(task_id="new", score=1.0, vector_score=1.0, input_preview="hey"),
+        SearchResult(task_id="old", score=0.5, vector_score=0.5),
+    ]
+    asyncio.run(search.fill_missing_previews(results))
+    # Only the tasks without previews in their payload are read
+    assert tasks_collection.pipelines[0][0] == {"$match": {"id": {"$in": ["old"]}}}
+    assert [result.input_preview for result in results] == ["hey", "hi"]
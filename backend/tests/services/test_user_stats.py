@@ -0,0 +1,37 @@
+from app.api.platform.models.explore import Pagination
+from app.services.mongo.user_stats import (
+    get_users_next_cursor,
+    paginate_users,
+    to_user_metadata,
+)
+
+
+def test_paginate_users():
+    users = [
+        to_user_metadata(
+            {
+                "user_id": user_id,
+                "nb_tasks": nb_tasks,
+                "nb_success": 1,
+                "session_ids": ["s1", "s2"],
+            }
+        )
+        for user_id, nb_tasks in [("a", 2), ("b", 4), ("c", 2), ("d", 1)]
+    ]
+    assert users[0].avg_success_rate == 0.5
+    assert users[0].avg_session_length == 1
+
+    pagination = Pagination(page=0, per_page=2)
+    first_page = paginate_users(users, pagination)
+    assert [user.user_id for user in first_page] == ["b", "c"]
+
+    cursor = get_users_next_cursor(first_page, pagination)
+    assert cursor is not None
+    pagination = Pagination(page=0, per_page=2, cursor=cursor)
+    second_page = paginate_users(users, pagination)
+    assert [user.user_id for user in second_page] == ["a", "d"]
+
+    pagination = Pagination(
+        page=0, per_page=2, cursor=get_users_next_cursor(second_page, pagination)
+    )
+    assert paginate_users(users, pagination) == []
@@ -1,56 +1,44 @@
 """
 Example script to push historical data to Phospho
 """
-import phospho
+
+import ast
+
 import pandas as pd
+import phospho
 from dotenv import load_dotenv
 
 load_dotenv()
 
 phospho.init()
 
-# The exact conversion script depends on the file format
-# We assume that the data is stored in a .csv file
-# with the following columns:
-# - created_at: timestamp in seconds
-# - raw_input: string of a json with the input to an OpenAI completion
-# - raw_output: string of a json with the output of an OpenAI completion
+# phospho.bulk_import reads CSV, Parquet and JSONL files, or a pandas DataFrame.
+# The columns of the file are:
+# - input: the input of the task
+# - (optional) output: the output of the task
+# - (optional) created_at: timestamp in seconds, or a date
 # - (optional) metadata: string of a json with metadata about the task
 # - (optional) session_id: string with the session id
-
-# Load the data
-df = pd.read_csv(
-    "/Users/nicolasoulianov/phospho/phospho/examples/push_data/example.csv", sep=";"
+# The other columns are added to the metadata of the tasks.
+#
+# A file with these columns is read and uploaded in chunks, so it doesn't need to
+# fit in memory:
+#
+# phospho.bulk_import("history.csv", checkpoint_path="history.checkpoint.json")
+
+# Here, the example file stores the raw input and output of OpenAI completions,
+# so we convert them first
+df = pd.read_csv("example.csv", sep=";")
+df["input"] = df["raw_input"].map(lambda x: ast.literal_eval(x)["prompt"])
+df["output"] = df["raw_output"].map(
+    lambda x: ast.literal_eval(x)["choices"][0]["text"]
 )
+df = df.drop(columns=["raw_input", "raw_output"])
 
-# Convert the created_at column to int
-df["created_at"] = df["created_at"].astype(int)
-
-# Convert the raw_input and raw_output columns to dicts
-df["raw_input"] = df["raw_input"].apply(lambda x: eval(x))
-df["raw_output"] = df["raw_output"].apply(lambda x: eval(x))
-
-# Convert the metadata column to dicts
-df["metadata"] = df["metadata"].apply(lambda x: eval(x) if not pd.isna(x) else {})
-
-# Where session_id is NA, replace with a random uuid
-# (or any other unique string)
-df["session_id"] = df["session_id"].apply(
-    lambda x: phospho.generate_uuid() if pd.isna(x) else x
+# If the import fails, run the script again: it resumes from the checkpoint.
+report = phospho.bulk_import(
+    df, import_id="example", checkpoint_path="example.checkpoint.json"
+)
+print(
+    f"Imported {report.nb_sent} tasks in {report.duration:.0f}s ({report.rows_per_second:.0f} rows/s)"
 )
-
-# Iterate over the lines and do phospho.log
-# This will create the sessions and tasks in the database
-# and trigger the event detection pipeline
-for _, row in df.iterrows():
-    phospho.log(
-        row["raw_input"],
-        row["raw_output"],
-        created_at=row["created_at"],
-        metadata=row["metadata"],
-        session_id=row["session_id"],
-        # This is how to customize the input/output to string conversion
-        # The input and output will be logged in raw_input and raw_output
-        input_to_str_function=lambda x: x["prompt"],
-        output_to_str_function=lambda x: x["choices"][0]["text"],
-    )
@@ -23,6 +23,7 @@ from app.services.pipelines import (
     encrypt_and_store_langsmith_credentials,
 )
 from app.services.projects import get_project_by_id
+from app.services.tasks import get_tasks_by_ids
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 from loguru import logger
 from app.api.v1.models import LogEvent
@@ -109,6 +110,11 @@ async def post_run_job_on_task(
     request: RunRecipeOnTaskRequest,
     is_request_authenticated: bool = Depends(authenticate_key),
 ):
+    if request.task_ids is not None:
+        request.tasks = await get_tasks_by_ids(
+            task_ids=request.task_ids, project_id=request.recipe.project_id
+        )
+
     # If there is no tasks to process, return
     if len(request.tasks) == 0:
         logger.debug("No tasks to process.")
@@ -118,11 +124,16 @@ async def post_run_job_on_task(
         logger.info(
             f"Running job {request.recipe.recipe_type} on {len(request.tasks)} tasks."
         )
-        background_tasks.add_task(
-            recipe_pipeline,
-            tasks=request.tasks,
-            recipe=request.recipe,
-        )
+        if request.task_ids is not None:
+            # Chunk of a backfill job: the backend checkpoints the job when
+            # the response is received, so the chunk is processed first
+            await recipe_pipeline(tasks=request.tasks, recipe=request.recipe)
+        else:
+            background_tasks.add_task(
+                recipe_pipeline,
+                tasks=request.tasks,
+                recipe=request.recipe,
+            )
         return {"status": "ok", "nb_job_results": len(request.tasks)}
 
     else:
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Literal
 
 from app.db.models import Task, Event, Recipe
@@ -23,7 +23,9 @@ class PipelineResults(BaseModel):
 
 
 class RunRecipeOnTaskRequest(BaseModel):
-    tasks: List[Task]
+    tasks: List[Task] = Field(default_factory=list)
+    # Alternative to tasks: the tasks are fetched by the extractor
+    task_ids: Optional[List[str]] = None
     recipe: Recipe
 
 
@@ -3,6 +3,7 @@ App configuration file
 """
 
 import os
+import re
 from dotenv import load_dotenv
 from loguru import logger
 
@@ -44,20 +45,74 @@ OPENAI_MODEL_ID_FOR_EVENTS = "gpt-3.5-turbo-16k"
 EVALUATION_SOURCE = "phospho-4"  # If phospho
 FEW_SHOT_MIN_NUMBER_OF_EXAMPLES = 10  # Make it even
 FEW_SHOT_MAX_NUMBER_OF_EXAMPLES = 50  # Imposed by Cohere API
+FEW_SHOT_EXAMPLES_CACHE_TTL = 600  # in seconds
+# in seconds, the examples of a project without new tasks are dropped after this time
+FEW_SHOT_EXAMPLES_CACHE_MAX_AGE = 3600
+FEW_SHOT_EXAMPLES_CACHE_MAX_SIZE = 1000  # number of projects kept in memory
 
 ### COHERE ###
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
 
+### SENTIMENT ANALYSIS ###
+# "google" uses the Google Natural Language API, "local" uses a CPU model
+# (requires the vaderSentiment package). Falls back to "local" if Google is not configured.
+SENTIMENT_ANALYSIS_BACKEND = os.getenv("SENTIMENT_ANALYSIS_BACKEND", "google")
+SENTIMENT_ANALYSIS_MAX_CONCURRENCY = int(
+    os.getenv("SENTIMENT_ANALYSIS_MAX_CONCURRENCY", 8)
+)
+
 ### SENTRY ###
 EXTRACTOR_SENTRY_DSN = os.getenv("EXTRACTOR_SENTRY_DSN")
 
 ### Vector Search ###
 QDRANT_URL = os.getenv("QDRANT_URL")
-if QDRANT_URL is None:
-    raise Exception("QDRANT_URL is missing from the environment variables")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
-if QDRANT_API_KEY is None:
-    raise Exception("QDRANT_API_KEY is missing from the environment variables")
+# "qdrant", or "local" for the in-process index of phospho.lab.vector_index.
+# Defaults to "local" if QDRANT_URL is not set.
+# "local" supports exactly one extractor replica, with the index on a local
+# disk (not NFS nor Cloud Storage FUSE): the extractor fails at startup
+# otherwise. Use Qdrant to run several replicas.
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "qdrant" if QDRANT_URL else "local")
+if VECTOR_INDEX == "qdrant":
+    if QDRANT_URL is None:
+        raise Exception("QDRANT_URL is missing from the environment variables")
+    if QDRANT_API_KEY is None:
+        raise Exception("QDRANT_API_KEY is missing from the environment variables")
+# Directory of the local index. Set the same directory in the backend and in
+# the extractor to search the tasks vectorized by the extractor. If not set, the
+# index is in a temporary directory.
+LOCAL_VECTOR_INDEX_PATH = os.getenv("LOCAL_VECTOR_INDEX_PATH")
+if VECTOR_INDEX == "local" and LOCAL_VECTOR_INDEX_PATH is None:
+    if ENVIRONMENT in ["production", "staging"]:
+        raise Exception(
+            "QDRANT_URL or LOCAL_VECTOR_INDEX_PATH is missing from the environment variables"
+        )
+    logger.warning(
+        "LOCAL_VECTOR_INDEX_PATH is not set: the local vector index is in a temporary directory and the tasks vectorized can't be searched by the backend"
+    )
+QDRANT_UPSERT_BATCH_SIZE = 256
+# Number of characters of the input and output stored in the payload of a task
+QDRANT_PAYLOAD_PREVIEW_LENGTH = 200
+
+### EMBEDDINGS ###
+# "provider:model", see phospho.lab.embeddings. Must be the same in the backend
+# and in the extractor.
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "openai:text-embedding-3-small")
+# The vectors of different models can't be compared, so each model has its own
+# Qdrant collection. The tasks embedded with the default model are in "tasks".
+QDRANT_COLLECTION_NAME = (
+    "tasks"
+    if EMBEDDING_MODEL == "openai:text-embedding-3-small"
+    else "tasks_" + re.sub(r"[^a-zA-Z0-9]+", "_", EMBEDDING_MODEL)
+)
+# Local models: number of processes and batch size of the inference
+EMBEDDING_LOCAL_MAX_WORKERS = int(os.getenv("EMBEDDING_LOCAL_MAX_WORKERS", 2))
+EMBEDDING_LOCAL_BATCH_SIZE = 64
+EMBEDDING_MAX_TOKENS_PER_TEXT = 8191  # Longer texts are truncated
+EMBEDDING_MAX_TOKENS_PER_REQUEST = 250_000  # OpenAI limit is 300k
+EMBEDDING_MAX_INPUTS_PER_REQUEST = 2048
+EMBEDDING_MAX_CONCURRENT_REQUESTS = 4
+EMBEDDING_MAX_RETRIES = 3
 
 ### Hardcoded Jobs object ###
 
@@ -1,6 +1,8 @@
 from qdrant_client import AsyncQdrantClient
 from qdrant_client.http import models
 from app.core import config
+from phospho.lab.vector_index import LocalVectorIndex
+from phospho.lab.embeddings import get_configured_embedding_provider
 from loguru import logger
 
 
@@ -19,22 +21,39 @@ async def get_qdrant():
 async def init_qdrant():
     global qdrant_db
 
-    qdrant_db = AsyncQdrantClient(url=config.QDRANT_URL, api_key=config.QDRANT_API_KEY)
+    if config.VECTOR_INDEX == "local":
+        # Same interface as AsyncQdrantClient, without a Qdrant server
+        qdrant_db = LocalVectorIndex(path=config.LOCAL_VECTOR_INDEX_PATH)
+        logger.info(f"Using the local vector index in {qdrant_db.path}")
+        # The extractor is the only writer of the local index: fail at startup
+        # if another replica already writes to it or if it's on a network volume
+        qdrant_db.acquire_writer_lock()
+    else:
+        qdrant_db = AsyncQdrantClient(
+            url=config.QDRANT_URL, api_key=config.QDRANT_API_KEY
+        )
     try:
         existing_collections = await qdrant_db.get_collections()
         logger.info(f"Existing collections: {existing_collections}")
         # /!\ Once the collection is created, it cannot be updated
         # To change the underlying embedding model, we need to create a new collection
         # And re-embed all the tasks
-        if "tasks" in [
+        if config.QDRANT_COLLECTION_NAME in [
             collection.name for collection in existing_collections.collections
         ]:
-            logger.info("Collection tasks already exists")
+            logger.info(f"Collection {config.QDRANT_COLLECTION_NAME} already exists")
         else:
+            # The size of the vectors depends on the embedding model
+            embedding_provider = get_configured_embedding_provider(
+                config.EMBEDDING_MODEL,
+                max_workers=config.EMBEDDING_LOCAL_MAX_WORKERS,
+                batch_size=config.EMBEDDING_LOCAL_BATCH_SIZE,
+            )
             await qdrant_db.create_collection(
-                collection_name="tasks",
+                collection_name=config.QDRANT_COLLECTION_NAME,
                 vectors_config=models.VectorParams(
-                    size=1536, distance=models.Distance.COSINE
+                    size=await embedding_provider.get_dimension(),
+                    distance=models.Distance.COSINE,
                 ),
             )
         logger.info("Qdrant initialized")
@@ -6,6 +6,7 @@ from app.api.v1.endpoints import health, pipelines
 from app.core import config
 from app.db.mongo import close_mongo_db, connect_and_init_db
 from app.db.qdrant import close_qdrant, init_qdrant
+from phospho.lab.embeddings import close_embedding_providers
 
 if config.ENVIRONMENT == "production":
     sentry_sdk.init(
@@ -24,6 +25,8 @@ app.add_event_handler("shutdown", close_mongo_db)
 if config.ENVIRONMENT != "preview":
     app.add_event_handler("startup", init_qdrant)
     app.add_event_handler("shutdown", close_qdrant)
+    # Stop the worker processes of the local embedding models
+    app.add_event_handler("shutdown", close_embedding_providers)
 else:
     logger.info("Qdrant is not initialized in preview mode")
 
@@ -0,0 +1,52 @@
+"""
+In-memory cache with a time to live, used to keep per project values that
+change rarely (eg: the few shot examples) without growing with the number of
+projects. Same behaviour as app.security.cache.TTLCache in the backend.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """
+    A simple dict with a time to live on each entry and a maximum size.
+    When the cache is full, the least recently set entry is evicted.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Returns (True, value) if the key is in the cache and not expired,
+        (False, None) otherwise.
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return False, None
+        return True, value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if ttl is None:
+            ttl = self.ttl
+        self._data.pop(key, None)
+        self._data[key] = (time.monotonic() + ttl, value)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,24 @@
+"""
+Data versions of the projects
+
+The backend caches the results of the dashboards per project and data version
+(see app.services.mongo.results_cache in the backend). The version of a project
+is incremented when its data changes, so that the cached results are recomputed.
+"""
+
+from typing import Iterable
+
+from loguru import logger
+
+from app.db.mongo import get_mongo_db
+
+
+async def bump_data_version(project_ids: Iterable[str]) -> None:
+    mongo_db = await get_mongo_db()
+    for project_id in set(project_ids):
+        try:
+            await mongo_db["projects_data_versions"].update_one(
+                {"project_id": project_id}, {"$inc": {"version": 1}}, upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Error bumping the data version of {project_id}: {e}")
@@ -0,0 +1,162 @@
+"""
+Embedding pipeline: pack texts into requests by token budget,
+embed them concurrently and retry the failed batches.
+
+The model is config.EMBEDDING_MODEL. The OpenAI models go through this
+pipeline, the other providers (eg: local models) through their
+phospho.lab.embeddings provider.
+"""
+
+import asyncio
+from typing import Any, List, Optional, Tuple
+
+import openai
+from loguru import logger
+
+from app.core import config
+from phospho.lab.embeddings import (
+    get_configured_embedding_provider,
+    get_embedding_provider_and_model,
+)
+from phospho.lab.utils import get_tokenizer
+
+
+def get_embedding_model_name() -> str:
+    return get_embedding_provider_and_model(config.EMBEDDING_MODEL)[1]
+
+
+def truncate_to_max_tokens(
+    text: str, max_tokens: int, tokenizer: Any
+) -> Tuple[str, int]:
+    """
+    Truncate a text so that it fits in max_tokens.
+    Returns the (possibly truncated) text and its number of tokens.
+    """
+    tokens = tokenizer.encode(text)
+    if len(tokens) <= max_tokens:
+        return text, len(tokens)
+    return tokenizer.decode(tokens[:max_tokens]), max_tokens
+
+
+def pack_texts_by_token_budget(
+    texts: List[str],
+    max_tokens_per_text: int = config.EMBEDDING_MAX_TOKENS_PER_TEXT,
+    max_tokens_per_request: int = config.EMBEDDING_MAX_TOKENS_PER_REQUEST,
+    max_inputs_per_request: int = config.EMBEDDING_MAX_INPUTS_PER_REQUEST,
+    tokenizer: Any = None,
+) -> List[List[Tuple[int, str]]]:
+    """
+    Split the texts into batches that each fit in a single embedding request.
+
+    Every text is truncated to max_tokens_per_text. Returns a list of batches,
+    where each batch is a list of (index in texts, truncated text).
+    """
+    if tokenizer is None:
+        tokenizer = get_tokenizer(get_embedding_model_name())
+
+    batches: List[List[Tuple[int, str]]] = []
+    current_batch: List[Tuple[int, str]] = []
+    current_batch_tokens = 0
+    for index, text in enumerate(texts):
+        # The OpenAI API rejects empty strings
+        if not text:
+            text = " "
+        text, nb_tokens = truncate_to_max_tokens(text, max_tokens_per_text, tokenizer)
+        if current_batch and (
+            current_batch_tokens + nb_tokens > max_tokens_per_request
+            or len(current_batch) >= max_inputs_per_request
+        ):
+            batches.append(current_batch)
+            current_batch = []
+            current_batch_tokens = 0
+        current_batch.append((index, text))
+        current_batch_tokens += nb_tokens
+
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+
+async def _embed_batch(
+    openai_client: openai.AsyncClient,
+    batch: List[Tuple[int, str]],
+    semaphore: asyncio.Semaphore,
+    embeddings: List[Optional[List[float]]],
+    max_retries: int = config.EMBEDDING_MAX_RETRIES,
+) -> None:
+    """
+    Embed a batch and write the vectors in embeddings, at the index of each text.
+
+    The batch is retried with exponential backoff. If it still fails, it is split
+    in two halves which are retried separately, so that a single bad text doesn't
+    fail the whole batch.
+    """
+    for attempt in range(max_retries):
+        try:
+            async with semaphore:
+                response = await openai_client.embeddings.create(
+                    input=[text for _, text in batch],
+                    model=get_embedding_model_name(),
+                )
+            for (index, _), embedding in zip(batch, response.data):
+                embeddings[index] = embedding.embedding
+            return
+        except openai.BadRequestError as e:
+            # Retrying the same request won't help
+            logger.warning(f"Embedding request of {len(batch)} texts rejected: {e}")
+            break
+        except openai.APIError as e:
+            logger.warning(
+                f"Error while embedding {len(batch)} texts (attempt {attempt + 1}/{max_retries}): {e}"
+            )
+            await asyncio.sleep(2**attempt)
+
+    if len(batch) > 1:
+        middle = len(batch) // 2
+        await asyncio.gather(
+            _embed_batch(
+                openai_client, batch[:middle], semaphore, embeddings, max_retries
+            ),
+            _embed_batch(
+                openai_client, batch[middle:], semaphore, embeddings, max_retries
+            ),
+        )
+    else:
+        logger.error(f"Could not embed text at index {batch[0][0]}")
+
+
+async def embed_texts(
+    texts: List[str],
+    max_concurrent_requests: int = config.EMBEDDING_MAX_CONCURRENT_REQUESTS,
+) -> List[Optional[List[float]]]:
+    """
+    Compute the embeddings of a list of texts.
+
+    Returns a list of the same length as texts. The embedding is None for the
+    texts that couldn't be embedded.
+    """
+    embeddings: List[Optional[List[float]]] = [None] * len(texts)
+    if len(texts) == 0:
+        return embeddings
+
+    provider, _ = get_embedding_provider_and_model(config.EMBEDDING_MODEL)
+    if provider != "openai":
+        embedding_provider = get_configured_embedding_provider(
+            config.EMBEDDING_MODEL,
+            max_workers=config.EMBEDDING_LOCAL_MAX_WORKERS,
+            batch_size=config.EMBEDDING_LOCAL_BATCH_SIZE,
+        )
+        return await embedding_provider.embed(texts)
+
+    batches = pack_texts_by_token_budget(texts)
+    logger.debug(f"Embedding {len(texts)} texts in {len(batches)} requests")
+
+    openai_client = openai.AsyncClient()
+    semaphore = asyncio.Semaphore(max_concurrent_requests)
+    await asyncio.gather(
+        *[
+            _embed_batch(openai_client, batch, semaphore, embeddings)
+            for batch in batches
+        ]
+    )
+    return embeddings
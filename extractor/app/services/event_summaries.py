@@ -0,0 +1,129 @@
+"""
+Events stored on the task and session documents
+
+The summaries of the events are built with phospho.lab.event_summaries, shared
+with the backend. An event is added with a pipeline update that skips it if
+the document already has an event with the same task_id and event_name.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from pymongo import UpdateOne
+
+from app.db.models import Event
+from app.db.mongo import get_mongo_db
+from phospho.lab.event_summaries import get_event_summary
+
+
+def build_add_event_summary_update(event_summary: dict) -> List[Dict[str, object]]:
+    """
+    Pipeline update appending an event to the events of a document, unless
+    the document already has an event with the same task_id and event_name.
+    """
+    events = {"$ifNull": ["$events", []]}
+    same_events = {
+        "$filter": {
+            "input": events,
+            "as": "event",
+            "cond": {
+                "$and": [
+                    {"$eq": ["$$event.event_name", event_summary["event_name"]]},
+                    {
+                        "$eq": [
+                            {"$ifNull": ["$$event.task_id", None]},
+                            event_summary.get("task_id"),
+                        ]
+                    },
+                ]
+            },
+        }
+    }
+    return [
+        {
+            "$set": {
+                "events": {
+                    "$cond": [
+                        {"$gt": [{"$size": same_events}, 0]},
+                        events,
+                        {"$concatArrays": [events, [{"$literal": event_summary}]]},
+                    ]
+                }
+            }
+        }
+    ]
+
+
+def build_add_events_updates(
+    events: List[Event],
+) -> Tuple[List[Tuple[dict, list]], List[Tuple[dict, list]]]:
+    """
+    The (filter, update) of the tasks and of the sessions to add the events
+    to. Removed events are skipped.
+    """
+    task_updates: List[Tuple[dict, list]] = []
+    session_updates: List[Tuple[dict, list]] = []
+    for event in events:
+        if event.removed:
+            continue
+        update = build_add_event_summary_update(get_event_summary(event))
+        if event.task_id is not None:
+            task_updates.append(({"id": event.task_id}, update))
+        if event.session_id is not None:
+            session_updates.append(({"id": event.session_id}, update))
+    return task_updates, session_updates
+
+
+async def add_events_to_summaries(events: List[Event]) -> List[Event]:
+    """
+    Add detected events to the events of their task and session documents.
+
+    Returns the events added, without the ones their task already had, to
+    count each event once.
+    """
+    _, session_updates = build_add_events_updates(events)
+    mongo_db = await get_mongo_db()
+    added_events: List[Event] = []
+    try:
+        for event in events:
+            if event.removed:
+                continue
+            if event.task_id is None:
+                added_events.append(event)
+                continue
+            # The update doesn't modify the task if it already has the event
+            task_update = await mongo_db["tasks"].update_one(
+                {"id": event.task_id},
+                build_add_event_summary_update(get_event_summary(event)),
+            )
+            if task_update.modified_count == 1:
+                added_events.append(event)
+        if len(session_updates) > 0:
+            await mongo_db["sessions"].bulk_write(
+                [UpdateOne(*session_update) for session_update in session_updates],
+                ordered=False,
+            )
+    except Exception as e:
+        logger.error(f"Error adding events to the tasks and sessions: {e}")
+    return added_events
+
+
+async def remove_event_from_summaries(
+    event_name: str,
+    task_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+) -> None:
+    """
+    Remove an event from the events of a task and its session.
+    """
+    mongo_db = await get_mongo_db()
+    event_filter: Dict[str, object] = {"event_name": event_name}
+    if task_id is not None:
+        event_filter["task_id"] = task_id
+        await mongo_db["tasks"].update_one(
+            {"id": task_id}, {"$pull": {"events": event_filter}}
+        )
+    if session_id is not None:
+        await mongo_db["sessions"].update_one(
+            {"id": session_id}, {"$pull": {"events": event_filter}}
+        )
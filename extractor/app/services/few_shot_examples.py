@@ -0,0 +1,185 @@
+"""
+Cache of the few shot examples used to evaluate the tasks of a project.
+
+The examples are the latest tasks evaluated by the user (non-phospho evals).
+They change rarely, so they are fetched once per project and kept in memory.
+After FEW_SHOT_EXAMPLES_CACHE_TTL, we check if new evals were written and
+refresh the examples only if there are. The projects that are not used for
+FEW_SHOT_EXAMPLES_CACHE_MAX_AGE are dropped from the cache.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from app.core import config
+from app.db.mongo import get_mongo_db
+from app.services.cache import TTLCache
+
+PHOSPHO_EVAL_MODELS_NAMES = ["phospho", "phospho-4"]
+
+
+class FewShotExamples(BaseModel):
+    successful_examples: List[dict] = Field(default_factory=list)
+    unsuccessful_examples: List[dict] = Field(default_factory=list)
+    # created_at of the latest non-phospho eval when the examples were fetched
+    last_eval_created_at: Optional[int] = None
+    fetched_at: float = Field(default_factory=time.time)
+
+
+# project_id -> FewShotExamples
+few_shot_examples_cache = TTLCache(
+    ttl=config.FEW_SHOT_EXAMPLES_CACHE_MAX_AGE,
+    max_size=config.FEW_SHOT_EXAMPLES_CACHE_MAX_SIZE,
+)
+# project_id -> lock, only kept while tasks of the project use or wait for it
+few_shot_examples_locks: Dict[str, asyncio.Lock] = {}
+few_shot_examples_lock_users: Dict[str, int] = {}
+
+
+@asynccontextmanager
+async def project_lock(project_id: str) -> AsyncIterator[None]:
+    """
+    Lock the examples of a project. The lock is removed when it is released
+    and no other task waits for it.
+    """
+    lock = few_shot_examples_locks.setdefault(project_id, asyncio.Lock())
+    few_shot_examples_lock_users[project_id] = (
+        few_shot_examples_lock_users.get(project_id, 0) + 1
+    )
+    try:
+        async with lock:
+            yield
+    finally:
+        few_shot_examples_lock_users[project_id] -= 1
+        if few_shot_examples_lock_users[project_id] == 0:
+            del few_shot_examples_lock_users[project_id]
+            del few_shot_examples_locks[project_id]
+
+
+def format_example(example: dict) -> dict:
+    """
+    Precompute the text prompt of an example, used by the few shot classifier.
+    """
+    example["text_prompt"] = f"User: {example['input']}\nAssistant: {example['output']}"
+    return example
+
+
+def examples_pipeline(project_id: str, value: str, limit: int) -> List[dict]:
+    """
+    Latest user evals of a project with this value, joined with their task.
+    Uses the (project_id, value, created_at) index of the evals.
+    """
+    return [
+        {
+            "$match": {
+                "project_id": project_id,
+                "source": {"$nin": PHOSPHO_EVAL_MODELS_NAMES},
+                "value": value,
+            }
+        },
+        {"$sort": {"created_at": -1}},
+        {"$limit": limit},
+        {
+            "$lookup": {
+                "from": "tasks",
+                "localField": "task_id",
+                "foreignField": "id",
+                "as": "task",
+            }
+        },
+        {"$unwind": "$task"},
+        {
+            "$addFields": {
+                "flag": "$value",
+                "output": "$task.output",
+                "input": "$task.input",
+            }
+        },
+        {"$project": {"_id": 0, "input": 1, "output": 1, "flag": 1}},
+    ]
+
+
+async def fetch_last_user_eval_created_at(project_id: str) -> Optional[int]:
+    mongo_db = await get_mongo_db()
+    last_eval = await mongo_db["evals"].find_one(
+        {
+            "project_id": project_id,
+            "source": {"$nin": PHOSPHO_EVAL_MODELS_NAMES},
+            "value": {"$in": ["success", "failure"]},
+        },
+        {"_id": 0, "created_at": 1},
+        sort=[("created_at", -1)],
+    )
+    if last_eval is None:
+        return None
+    return last_eval.get("created_at")
+
+
+async def fetch_examples(project_id: str, value: str, limit: int) -> List[dict]:
+    mongo_db = await get_mongo_db()
+    examples = (
+        await mongo_db["evals"]
+        .aggregate(examples_pipeline(project_id, value, limit))
+        .to_list(length=limit)
+    )
+    return [format_example(example) for example in examples]
+
+
+async def fetch_few_shot_examples(project_id: str) -> FewShotExamples:
+    """
+    Fetch the latest success and failure examples of a project. Each class is
+    queried with its own limit, so that one class can't starve the other.
+    """
+    # We want 50/50 success and failure examples
+    nb_success = int(config.FEW_SHOT_MAX_NUMBER_OF_EXAMPLES / 2)
+    nb_failure = int(config.FEW_SHOT_MAX_NUMBER_OF_EXAMPLES / 2)
+
+    (
+        successful_examples,
+        unsuccessful_examples,
+        last_eval_created_at,
+    ) = await asyncio.gather(
+        fetch_examples(project_id, "success", nb_success),
+        fetch_examples(project_id, "failure", nb_failure),
+        fetch_last_user_eval_created_at(project_id),
+    )
+    few_shot_examples = FewShotExamples(
+        successful_examples=successful_examples,
+        unsuccessful_examples=unsuccessful_examples,
+        last_eval_created_at=last_eval_created_at,
+    )
+    logger.debug(
+        f"Project {project_id}: fetched {len(few_shot_examples.successful_examples)} successful"
+        + f" and {len(few_shot_examples.unsuccessful_examples)} failure examples"
+    )
+    return few_shot_examples
+
+
+async def get_few_shot_examples(project_id: str) -> FewShotExamples:
+    """
+    Get the few shot examples of a project from the cache, or fetch them.
+    """
+    # The lock prevents concurrent tasks of the same project to fetch the examples
+    async with project_lock(project_id):
+        is_cached, cached_examples = few_shot_examples_cache.get(project_id)
+        if is_cached:
+            if (
+                time.time() - cached_examples.fetched_at
+                < config.FEW_SHOT_EXAMPLES_CACHE_TTL
+            ):
+                return cached_examples
+            # The TTL expired: refresh only if new evals were written
+            last_eval_created_at = await fetch_last_user_eval_created_at(project_id)
+            if last_eval_created_at == cached_examples.last_eval_created_at:
+                cached_examples.fetched_at = time.time()
+                few_shot_examples_cache.set(project_id, cached_examples)
+                return cached_examples
+
+        few_shot_examples = await fetch_few_shot_examples(project_id)
+        few_shot_examples_cache.set(project_id, few_shot_examples)
+        return few_shot_examples
@@ -1,16 +1,26 @@
-from typing import Any, Dict, List, Optional, Tuple, Union
+import asyncio
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
-import openai
 from loguru import logger
 
 from app.core import config
 
 # DB
 from app.api.v1.models import LogEvent
-from app.db.models import Session, Task
+from app.db.models import Task
 from app.db.mongo import get_mongo_db
 from app.db.qdrant import get_qdrant, models
-from app.services.pipelines import task_main_pipeline
+from app.services.data_versions import bump_data_version
+from app.services.embeddings import embed_texts
+from app.services.metadata_catalog import update_metadata_catalog
+from app.services.pipelines import (
+    sentiment_and_language_analysis_batch_pipeline,
+    task_main_pipeline,
+)
+from app.services.quantile_sketches import update_metadata_sketches
+from app.services.rollups import increment_tasks_rollups
+from app.services.sessions import assign_task_positions, update_sessions_aggregates
+from app.services.user_stats import update_user_stats
 
 # Service
 from app.services.tasks import get_task_by_id
@@ -187,58 +197,117 @@ def collect_metadata(log_event: LogEvent) -> Optional[dict]:
     return metadata
 
 
+async def get_already_vectorized_task_ids(tasks_id: List[str]) -> Set[str]:
+    """
+    Return the ids of the tasks that already have a vector in Qdrant
+    """
+    qdrant_db = await get_qdrant()
+    if qdrant_db is None or len(tasks_id) == 0:
+        return set()
+    try:
+        points = await qdrant_db.retrieve(
+            collection_name=config.QDRANT_COLLECTION_NAME,
+            ids=tasks_id,
+            with_payload=["task_id"],
+            with_vectors=False,
+        )
+    except Exception as e:
+        logger.warning(f"Error while fetching the existing vectors from Qdrant: {e}")
+        return set()
+    return {point.payload["task_id"] for point in points if point.payload}
+
+
 async def add_vectorized_tasks(tasks_id: List[str]):
     """
     Compute the vector representation of the tasks and add them to Qdrant database
+
+    Tasks that are already in Qdrant are skipped. The texts are embedded in
+    batches packed by token budget (see app.services.embeddings) and the points
+    are upserted in parallel chunks.
     """
     if config.ENVIRONMENT == "preview":
         logger.info("Vectorization is disabled in preview")
         return
 
-    logger.info(f"Vectorizing {len(tasks_id)} tasks and adding them to Qdrant")
-    mongo_db = await get_mongo_db()
     qdrant_db = await get_qdrant()
     if qdrant_db is None:
         return
+
+    already_vectorized_ids = await get_already_vectorized_task_ids(tasks_id)
+    tasks_id = [
+        task_id for task_id in tasks_id if task_id not in already_vectorized_ids
+    ]
+    if len(tasks_id) == 0:
+        logger.debug("All the tasks are already vectorized")
+        return
+
+    logger.info(f"Vectorizing {len(tasks_id)} tasks and adding them to Qdrant")
+    mongo_db = await get_mongo_db()
     # Get tasks
-    tasks = await mongo_db["tasks"].find({"id": {"$in": tasks_id}}).to_list(length=None)
+    tasks = (
+        await mongo_db["tasks"]
+        .find(
+            {"id": {"$in": tasks_id}},
+            {
+                "_id": 0,
+                "id": 1,
+                "project_id": 1,
+                "session_id": 1,
+                "created_at": 1,
+                "org_id": 1,
+                "metadata": 1,
+                "input": 1,
+                "output": 1,
+            },
+        )
+        .to_list(length=None)
+    )
     tasks = [Task.model_validate(task) for task in tasks]
 
-    openai_client = openai.AsyncClient()
-
     # Create tasks_text representations
     tasks_text = [f"{task.input} {task.output}" for task in tasks]
-    try:
-        # TODO : count the number of token for each task_text and if it's too big, do something smart
-        embedding = await openai_client.embeddings.create(
-            input=tasks_text, model="text-embedding-3-small"
+    embeddings = await embed_texts(tasks_text)
+
+    points = [
+        models.PointStruct(
+            id=task.id,
+            vector=embedding,
+            payload={
+                "task_id": task.id,
+                "project_id": task.project_id,
+                "session_id": task.session_id,
+                "created_at": task.created_at,
+                "org_id": task.org_id,
+                "metadata": task.metadata,
+                # Previews returned by the search without reading the tasks
+                "input_preview": task.input[: config.QDRANT_PAYLOAD_PREVIEW_LENGTH],
+                "output_preview": (
+                    task.output[: config.QDRANT_PAYLOAD_PREVIEW_LENGTH]
+                    if task.output is not None
+                    else None
+                ),
+            },
         )
-    except openai.APIError as e:
-        logger.warning(f"Error while embedding the tasks: {e}")
-        return
+        for task, embedding in zip(tasks, embeddings)
+        if embedding is not None
+    ]
+    if len(points) < len(tasks):
+        logger.warning(f"Could not vectorize {len(tasks) - len(points)} tasks")
 
-    try:
-        await qdrant_db.upsert(
-            collection_name="tasks",
-            points=[
-                models.PointStruct(
-                    id=task.id,
-                    vector=embedding.embedding,
-                    payload={
-                        "task_id": task.id,
-                        "project_id": task.project_id,
-                        "session_id": task.session_id,
-                        "created_at": task.created_at,
-                        "org_id": task.org_id,
-                        "metadata": task.metadata,
-                    },
-                )
-                for task, embedding in zip(tasks, embedding.data)
-            ],
-        )
-    except Exception as e:
-        logger.warning(f"Error while adding the tasks to Qdrant: {e}")
-        return
+    async def upsert_chunk(chunk: List[models.PointStruct]) -> None:
+        try:
+            await qdrant_db.upsert(
+                collection_name=config.QDRANT_COLLECTION_NAME, points=chunk
+            )
+        except Exception as e:
+            logger.warning(f"Error while adding {len(chunk)} tasks to Qdrant: {e}")
+
+    await asyncio.gather(
+        *[
+            upsert_chunk(points[i : i + config.QDRANT_UPSERT_BATCH_SIZE])
+            for i in range(0, len(points), config.QDRANT_UPSERT_BATCH_SIZE)
+        ]
+    )
 
 
 def create_task_from_logevent(
@@ -273,34 +342,90 @@ def create_task_from_logevent(
     return task
 
 
+def merge_duplicate_tasks(
+    tasks_to_create: List[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """
+    Merge the tasks of a batch that share the same id.
+
+    This happens when a task is streamed: the same task_id is logged several times,
+    each time with a more complete output. The last occurrence wins, except for
+    created_at which is the earliest one. The metadata are merged, the latest
+    values overriding the previous ones. The order of first occurrence is kept.
+    """
+    merged_tasks: Dict[str, Dict[str, Any]] = {}
+    for task in tasks_to_create:
+        task_id = task["id"]
+        previous_task = merged_tasks.get(task_id)
+        if previous_task is None:
+            merged_tasks[task_id] = task
+            continue
+        merged_task = {**previous_task, **task}
+        merged_task["created_at"] = min(previous_task["created_at"], task["created_at"])
+        merged_task["metadata"] = {
+            **(previous_task.get("metadata") or {}),
+            **(task.get("metadata") or {}),
+        }
+        merged_tasks[task_id] = merged_task
+    return list(merged_tasks.values())
+
+
 async def ignore_existing_tasks(
-    tasks_to_create: List[Dict[str, object]],
+    tasks_to_create: List[Dict[str, Any]],
     tasks_id_to_process: List[str],
-) -> Tuple[List[Dict[str, object]], List[str]]:
+) -> Tuple[List[Dict[str, Any]], List[str]]:
     """
-    Filter out tasks that already exist in the database
+    Filter out tasks that already exist in the database, and merge the tasks
+    of the batch that share the same id (see merge_duplicate_tasks).
     """
     mongo_db = await get_mongo_db()
+    tasks_to_create = merge_duplicate_tasks(tasks_to_create)
     existing_tasks = (
         await mongo_db["tasks"]
-        .find({"id": {"$in": [task["id"] for task in tasks_to_create]}})
+        .find(
+            {"id": {"$in": [task["id"] for task in tasks_to_create]}},
+            {"_id": 0, "id": 1},
+        )
         .to_list(length=len(tasks_to_create))
     )
-    existing_task_ids = [task["id"] for task in existing_tasks]
-    new_tasks_to_create = []
-    for task in tasks_to_create:
-        if (
-            task["id"] not in existing_task_ids
-            and task["id"] not in new_tasks_to_create
-        ):
-            new_tasks_to_create.append(task)
-
-    # Filter tasks_id_to_process
-    tasks_id_to_process = [
-        task_id for task_id in tasks_id_to_process if task_id not in existing_task_ids
+    existing_task_ids: Set[str] = {task["id"] for task in existing_tasks}
+    new_tasks_to_create = [
+        task for task in tasks_to_create if task["id"] not in existing_task_ids
     ]
 
-    return new_tasks_to_create, tasks_id_to_process
+    # Filter tasks_id_to_process, without duplicates
+    seen_task_ids: Set[str] = set()
+    filtered_tasks_id_to_process: List[str] = []
+    for task_id in tasks_id_to_process:
+        if task_id in existing_task_ids or task_id in seen_task_ids:
+            continue
+        seen_task_ids.add(task_id)
+        filtered_tasks_id_to_process.append(task_id)
+
+    return new_tasks_to_create, filtered_tasks_id_to_process
+
+
+async def trigger_main_pipeline(project_id: str, tasks_id: List[str]) -> None:
+    """
+    Vectorize the new tasks and run the main pipeline on them.
+    The sentiment analysis is run on the whole batch at once.
+    """
+    # Vectorize them
+    await add_vectorized_tasks(tasks_id)
+
+    # Fetch the task data from the database
+    # For now it's a double call to the database, but it's not a big deal
+    tasks = [await get_task_by_id(task_id) for task_id in tasks_id]
+    sentiment_results = await sentiment_and_language_analysis_batch_pipeline(
+        [task for task in tasks if task.test_id is None]
+    )
+
+    # Trigger the pipeline
+    for task in tasks:
+        logger.info(f"Project {project_id}: pipeline triggered for task {task.id}")
+        await task_main_pipeline(
+            task, sentiment_and_language=sentiment_results.get(task.id)
+        )
 
 
 async def process_log_without_session_id(
@@ -321,7 +446,7 @@ async def process_log_without_session_id(
     mongo_db = await get_mongo_db()
 
     tasks_id_to_process: List[str] = []
-    tasks_to_create: List[Dict[str, object]] = []
+    tasks_to_create: List[Dict[str, Any]] = []
     for log_event in list_of_log_event:
         task = create_task_from_logevent(
             org_id=org_id,
@@ -344,21 +469,18 @@ async def process_log_without_session_id(
     if len(tasks_to_create) > 0:
         try:
             await mongo_db["tasks"].insert_many(tasks_to_create, ordered=False)
+            new_tasks = [Task.model_validate(task) for task in tasks_to_create]
+            await increment_tasks_rollups(new_tasks)
+            await update_metadata_catalog(new_tasks)
+            await update_user_stats(new_tasks)
+            await update_metadata_sketches(new_tasks)
+            await bump_data_version([project_id])
         except Exception as e:
             error_mesagge = f"Error saving tasks to the database: {e}"
             logger.error(error_mesagge)
 
     if trigger_pipeline:
-        # Vectorize them
-        await add_vectorized_tasks(tasks_id_to_process)
-
-        # Trigger the pipeline
-        for task_id in tasks_id_to_process:
-            # Fetch the task data from the database
-            # For now it's a double call to the database, but it's not a big deal
-            task_data = await get_task_by_id(task_id)
-            logger.info(f"Project {project_id}: pipeline triggered for task {task_id}")
-            await task_main_pipeline(task_data)
+        await trigger_main_pipeline(project_id, tasks_id_to_process)
 
     return None
 
@@ -371,6 +493,10 @@ async def process_log_with_session_id(
 ) -> None:
     """
     Process a list of log events with session_id
+
+    The new tasks are positioned after the tasks already in their session. Then,
+    the sessions aggregates (length, first and last task timestamps, preview,
+    flag counts) are updated incrementally with the new tasks of the batch.
     """
     if len(list_of_log_event) == 0:
         logger.debug("No log event with session_id to process")
@@ -379,69 +505,14 @@ async def process_log_with_session_id(
         f"Project {project_id}: processing {len(list_of_log_event)} log events with session_id"
     )
     tasks_id_to_process: List[str] = []
-    tasks_to_create: List[Dict[str, object]] = []
-    sessions_to_create: Dict[str, Dict[str, Any]] = {}
-    sessions_to_earliest_task: Dict[str, Task] = {}
+    tasks_to_create: List[Dict[str, Any]] = []
 
     mongo_db = await get_mongo_db()
 
-    sessions_id_already_in_db = (
-        await mongo_db["sessions"]
-        .aggregate(
-            [
-                {
-                    "$match": {
-                        "id": {
-                            "$in": [
-                                log_event.session_id for log_event in list_of_log_event
-                            ]
-                        }
-                    }
-                },
-                {"$project": {"id": 1}},
-            ]
-        )
-        .to_list(length=len(list_of_log_event))
-    )
-    sessions_id_already_in_db = [
-        str(session["id"]) for session in sessions_id_already_in_db
-    ]
-
     for log_event in list_of_log_event:
         if log_event.project_id is None:
             log_event.project_id = project_id
 
-        # Only create a new session if the session doesn't exist in db
-        existing_session = log_event.session_id in sessions_id_already_in_db
-
-        session_project_id = project_id
-        if log_event.project_id is not None:
-            session_project_id = log_event.project_id
-
-        if not existing_session and log_event.session_id is not None:
-            # Add to sessions to create
-            session_data: Dict[str, Any] = {
-                "id": log_event.session_id,
-                "project_id": session_project_id,
-                # Note: there is no metadata and data
-                "metadata": {},
-                "data": {},
-            }
-            # The sessions will be created later, once we know the earliest task creation time
-            sessions_to_create[log_event.session_id] = session_data
-        else:
-            if log_event.session_id is not None:
-                # Fetch the session data from the database and increment the session length
-                if log_event.session_id is not None:
-                    await mongo_db["sessions"].update_one(
-                        {"id": log_event.session_id},
-                        {"$inc": {"session_length": 1}},
-                    )
-            else:
-                logger.info(
-                    "Log event: session with no session_id, skipping session creation"
-                )
-
         task = create_task_from_logevent(
             org_id=org_id,
             project_id=log_event.project_id,
@@ -451,83 +522,32 @@ async def process_log_with_session_id(
         tasks_id_to_process.append(task.id)
         tasks_to_create.append(task.model_dump())
 
-        # Update the session creation time if needed
-        if log_event.session_id is not None:
-            if log_event.session_id not in sessions_to_earliest_task.keys():
-                sessions_to_earliest_task[log_event.session_id] = task
-            else:
-                # Update it if lower
-                if (
-                    task.created_at
-                    < sessions_to_earliest_task[log_event.session_id].created_at
-                ):
-                    sessions_to_earliest_task[log_event.session_id] = task
-
     # Create the tasks
     tasks_to_create, tasks_id_to_process = await ignore_existing_tasks(
         tasks_to_create, tasks_id_to_process
     )
+    # Before the sessions lengths are updated with the new tasks
+    await assign_task_positions(tasks_to_create)
     if len(tasks_to_create) > 0:
         try:
             await mongo_db["tasks"].insert_many(tasks_to_create, ordered=False)
+            new_tasks = [Task.model_validate(task) for task in tasks_to_create]
+            await increment_tasks_rollups(new_tasks)
+            await update_metadata_catalog(new_tasks)
+            await update_user_stats(new_tasks)
+            await update_metadata_sketches(new_tasks)
+            await bump_data_version([project_id])
         except Exception as e:
             error_mesagge = f"Error saving tasks to the database: {e}"
             logger.error(error_mesagge)
 
-    # Add sessions to database
-    if len(sessions_to_create) > 0:
-        sessions_to_create_dump: List[dict] = []
-        for session_id, session_data in sessions_to_create.items():
-            # logger.info(
-            #     f"Logevent: creating session with session_id {session_id} from log event"
-            # )
-            # Verify if the session already exists
-            existing_session = session_id in sessions_id_already_in_db
-            if existing_session:
-                # Fetch the session data from the database and increment the session length
-
-                await mongo_db["sessions"].update_one(
-                    {"id": session_id},
-                    {"$inc": {"session_length": 1}},
-                )
-            else:
-                session = Session(
-                    id=session_id,
-                    created_at=sessions_to_earliest_task[session_id].created_at,
-                    project_id=session_data["project_id"],
-                    org_id=org_id,
-                    metadata=session_data["metadata"],
-                    data=session_data["data"],
-                    preview=sessions_to_earliest_task[session_id].preview(),
-                    session_length=1,
-                )
-                sessions_to_create_dump.append(session.model_dump())
-
-        if len(sessions_to_create_dump) > 0:
-            logger.info(
-                f"Creating sessions: {' '.join([session_id for session_id in sessions_to_create.keys()])}"
-            )
-            try:
-                insert_result = await mongo_db["sessions"].insert_many(
-                    sessions_to_create_dump, ordered=False
-                )
-            except Exception as e:
-                error_mesagge = f"Error saving sessions to the database: {e}"
-                logger.error(error_mesagge)
-            logger.info(f"Created {len(insert_result.inserted_ids)} sessions")
-    else:
-        logger.info("Logevent: no session to create")
+    # Create or update the sessions with the new tasks only
+    await update_sessions_aggregates(
+        [Task.model_validate(task) for task in tasks_to_create]
+    )
 
     if trigger_pipeline:
-        # Vectorize them
-        await add_vectorized_tasks(tasks_id_to_process)
-
-        # Trigger the pipeline
-        for task_id in tasks_id_to_process:
-            # Fetch the task data from the database
-            # For now it's a double call to the database, but it's not a big deal
-            task_data = await get_task_by_id(task_id)
-            await task_main_pipeline(task_data)
+        await trigger_main_pipeline(project_id, tasks_id_to_process)
 
 
 async def process_log(
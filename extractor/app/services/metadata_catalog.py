@@ -0,0 +1,180 @@
+"""
+Catalog of the metadata fields of the projects, maintained at ingestion time
+
+The metadata_catalog collection stores one document per project and metadata field:
+
+{
+    "project_id": "...",
+    "field": "user_id",
+    "count": 1200,  # number of tasks with this field
+    "types": {"string": 1200},  # number of tasks per type of value
+    "min": None,  # min and max of the number values
+    "max": None,
+    "registers": [...],  # HyperLogLog registers, to estimate the number of distinct values
+    "top_values": [{"value": "alice", "count": 40}, ...],  # most frequent string values
+}
+
+The sketches are bounded: the catalog doesn't grow with the number of tasks or
+of distinct values. top_values keeps the TOP_VALUES_SIZE most frequent values
+seen when merging, so the counts of the rarest values are approximate. The
+summaries are computed with phospho.lab.metadata_catalog.
+
+The backend builds the catalog of the projects created before the catalog.
+"""
+
+from typing import Dict, List, Tuple
+
+from loguru import logger
+from pymongo import UpdateOne
+
+from app.db.models import Task
+from app.db.mongo import get_mongo_db
+from app.utils import generate_timestamp
+from phospho.lab.metadata_catalog import (
+    HLL_REGISTERS,
+    TOP_VALUES_SIZE,
+    add_value_to_summary,
+    new_field_summary,
+)
+
+
+def compute_metadata_summaries(tasks: List[Task]) -> Dict[Tuple[str, str], dict]:
+    """
+    Summarize the metadata of a batch of tasks per project and field
+    """
+    summaries: Dict[Tuple[str, str], dict] = {}
+    for task in tasks:
+        if not task.metadata:
+            continue
+        for field, value in task.metadata.items():
+            summary = summaries.get((task.project_id, field))
+            if summary is None:
+                summary = new_field_summary()
+                summaries[(task.project_id, field)] = summary
+            add_value_to_summary(summary, value)
+    return summaries
+
+
+def build_catalog_update(project_id: str, field: str, summary: dict) -> UpdateOne:
+    """
+    Build the upsert merging the summary of a batch into the catalog of a field.
+
+    This is a pipeline update, so that the sketches are merged atomically.
+    """
+    batch_values = [
+        {"value": value, "count": count}
+        for value, count in summary["values"].most_common(TOP_VALUES_SIZE)
+    ]
+    all_values: Dict[str, object] = {
+        "$concatArrays": [
+            {"$ifNull": ["$top_values", []]},
+            {"$literal": batch_values},
+        ]
+    }
+    merged_values = {
+        "$map": {
+            "input": {"$setUnion": ["$$all_values.value"]},
+            "as": "value",
+            "in": {
+                "value": "$$value",
+                "count": {
+                    "$sum": {
+                        "$map": {
+                            "input": {
+                                "$filter": {
+                                    "input": "$$all_values",
+                                    "cond": {"$eq": ["$$this.value", "$$value"]},
+                                }
+                            },
+                            "in": "$$this.count",
+                        }
+                    }
+                },
+            },
+        }
+    }
+    return UpdateOne(
+        {"project_id": project_id, "field": field},
+        [
+            {
+                "$set": {
+                    "count": {"$add": [{"$ifNull": ["$count", 0]}, summary["count"]]},
+                    **{
+                        f"types.{value_type}": {
+                            "$add": [{"$ifNull": [f"$types.{value_type}", 0]}, count]
+                        }
+                        for value_type, count in summary["types"].items()
+                    },
+                    # $min and $max ignore null values
+                    "min": {"$min": ["$min", summary["min"]]},
+                    "max": {"$max": ["$max", summary["max"]]},
+                    "registers": {
+                        "$map": {
+                            "input": {"$range": [0, HLL_REGISTERS]},
+                            "as": "i",
+                            "in": {
+                                "$max": [
+                                    {
+                                        "$arrayElemAt": [
+                                            {
+                                                "$ifNull": [
+                                                    "$registers",
+                                                    [0] * HLL_REGISTERS,
+                                                ]
+                                            },
+                                            "$$i",
+                                        ]
+                                    },
+                                    {
+                                        "$arrayElemAt": [
+                                            {"$literal": summary["registers"]},
+                                            "$$i",
+                                        ]
+                                    },
+                                ]
+                            },
+                        }
+                    },
+                    "top_values": {
+                        "$let": {
+                            "vars": {"all_values": all_values},
+                            "in": {
+                                "$slice": [
+                                    {
+                                        "$sortArray": {
+                                            "input": merged_values,
+                                            "sortBy": {"count": -1},
+                                        }
+                                    },
+                                    TOP_VALUES_SIZE,
+                                ]
+                            },
+                        }
+                    },
+                    "updated_at": generate_timestamp(),
+                }
+            }
+        ],
+        upsert=True,
+    )
+
+
+async def update_metadata_catalog(tasks: List[Task]) -> None:
+    """
+    Merge the metadata of a batch of new tasks into the catalog of their projects.
+    """
+    summaries = compute_metadata_summaries(tasks)
+    if len(summaries) == 0:
+        return
+    mongo_db = await get_mongo_db()
+    try:
+        await mongo_db["metadata_catalog"].bulk_write(
+            [
+                build_catalog_update(project_id, field, summary)
+                for (project_id, field), summary in summaries.items()
+            ],
+            ordered=False,
+        )
+    except Exception as e:
+        # The catalog is not critical, so we don't fail the ingestion
+        logger.error(f"Error updating the metadata catalog: {e}")
@@ -1,13 +1,25 @@
 import time
-from typing import Dict, List, Literal, Optional
+from collections import Counter, defaultdict
+from typing import Dict, List, Literal, Optional, Tuple
 
 from loguru import logger
+from pymongo import UpdateOne
 
 from app.core import config
 from app.db.models import Eval, Event, EventDefinition, Recipe, LlmCall, Task
 from app.db.mongo import get_mongo_db
 from app.services.data import fetch_previous_tasks
+from app.services.data_versions import bump_data_version
+from app.services.event_summaries import (
+    add_events_to_summaries,
+    remove_event_from_summaries,
+)
+from app.services.few_shot_examples import get_few_shot_examples
 from app.services.projects import get_project_by_id
+from app.services.rollups import increment_rollups, increment_task_rollup
+from app.services.sessions import increment_session_stats
+from app.services.usage import save_job_results
+from app.services.user_stats import add_events_to_user_stats, increment_user_flag
 
 # from app.services.topics import extract_topics  # TODO
 from app.services.webhook import trigger_webhook
@@ -16,7 +28,7 @@ from phospho.models import ResultType, ScoreRange, SentimentObject, JobResult
 
 from app.api.v1.models.pipelines import PipelineResults
 
-from app.services.sentiment_analysis import run_sentiment_and_language_analysis
+from app.services.sentiment_analysis import run_sentiment_and_language_analysis_batch
 
 from phospho.models import Project
 from Crypto.Cipher import AES
@@ -108,15 +120,8 @@ async def run_event_detection_pipeline(
                     score_range=result.metadata.get("score_range", None),
                 )
 
-                # Update the task object with the event
-                await mongo_db["tasks"].update_one(
-                    {
-                        "id": message.metadata["task"].id,
-                        "project_id": message.metadata["task"].project_id,
-                    },
-                    # Add the event to the list of events
-                    {"$addToSet": {"events": detected_event_data.model_dump()}},
-                )
+                # Update the task and session objects with the event
+                added_events = await add_events_to_summaries([detected_event_data])
                 if webhook_url is not None:
                     await trigger_webhook(
                         url=webhook_url,
@@ -124,8 +129,22 @@ async def run_event_detection_pipeline(
                         headers=webhook_headers,
                     )
 
-                # Update the Events collection with the new event
-                await mongo_db["events"].insert_one(detected_event_data.model_dump())
+                # The counters are only incremented if the task didn't have
+                # the event yet, eg: when the pipeline runs again
+                if len(added_events) > 0:
+                    await add_events_to_user_stats(
+                        message.metadata["task"], added_events
+                    )
+                    await increment_task_rollup(
+                        message.metadata["task"], "event_name", event_name
+                    )
+                    # Update the Events collection with the new event
+                    await mongo_db["events"].insert_one(
+                        detected_event_data.model_dump()
+                    )
+                    await increment_session_stats(
+                        message.metadata["task"].session_id, nb_events=1
+                    )
 
                 events_per_task[message.metadata["task"].id].append(detected_event_data)
 
@@ -136,26 +155,32 @@ async def run_event_detection_pipeline(
                 # Handle the case where the event is not detected, but was previously detected
                 # We need to remove the event from the task document
 
-                await mongo_db["tasks"].update_one(
-                    {
-                        "id": message.metadata["task"].id,
-                        "project_id": message.metadata["task"].project_id,
-                    },
-                    # Remove the event from the list of events
-                    {"$pull": {"events": {"event_name": event_name}}},
+                await remove_event_from_summaries(
+                    event_name,
+                    task_id=message.metadata["task"].id,
+                    session_id=message.metadata["task"].session_id,
                 )
 
                 # Try to delete the event from the Event collection
-                await mongo_db["events"].delete_one(
+                delete_result = await mongo_db["events"].delete_one(
                     {"task_id": message.metadata["task"].id, "event_name": event_name}
                 )
+                await increment_session_stats(
+                    message.metadata["task"].session_id,
+                    nb_events=-delete_result.deleted_count,
+                )
+                if delete_result.deleted_count > 0:
+                    await increment_task_rollup(
+                        message.metadata["task"], "event_name", event_name, -1
+                    )
 
             # Save the prediction
             result.task_id = message.metadata["task"].id
             if result.job_metadata.get("recipe_id") is None:
                 logger.error(f"No recipe_id found for event {event_name}.")
-            mongo_db["job_results"].insert_one(result.model_dump())
+            await save_job_results([result.model_dump()])
 
+    await bump_data_version([task.project_id for task in tasks])
     return events_per_task
 
 
@@ -237,13 +262,6 @@ async def task_event_detection_pipeline(
                 score_range=result.metadata.get("score_range", None),
             )
             detected_events.append(detected_event_data)
-            # Update the task object with the event
-            if save_task:
-                mongo_db["tasks"].update_many(
-                    {"id": task.id, "project_id": task.project_id},
-                    # Add the event to the list of events
-                    {"$push": {"events": detected_event_data.model_dump()}},
-                )
             # Trigger the webhook if it exists
             if event_definition.webhook is not None:
                 await trigger_webhook(
@@ -256,13 +274,25 @@ async def task_event_detection_pipeline(
         if result.job_metadata.get("recipe_id") is None:
             logger.error(f"No recipe_id found for event {event_name}")
 
-        mongo_db["job_results"].insert_one(result.model_dump())
+        await save_job_results([result.model_dump()])
 
     if len(detected_events) > 0:
         try:
-            mongo_db["events"].insert_many(
-                [event.model_dump() for event in detected_events]
-            )
+            new_events = detected_events
+            if save_task:
+                # Update the task and session objects with the events. The
+                # events the task already had are not added nor counted again.
+                new_events = await add_events_to_summaries(detected_events)
+                await add_events_to_user_stats(task_data, new_events)
+                await increment_session_stats(
+                    task_data.session_id, nb_events=len(new_events)
+                )
+                for event_name in {event.event_name for event in new_events}:
+                    await increment_task_rollup(task_data, "event_name", event_name)
+            if len(new_events) > 0:
+                await mongo_db["events"].insert_many(
+                    [event.model_dump() for event in new_events]
+                )
         except Exception as e:
             error_mesagge = f"Error saving detected events to the database: {e}"
             logger.error(error_mesagge)
@@ -279,84 +309,11 @@ async def task_scoring_pipeline(
     logger.debug(f"Run the task scoring pipeline for task {task.id}")
     mongo_db = await get_mongo_db()
 
-    # We want 50/50 success and failure examples
-    nb_success = int(config.FEW_SHOT_MAX_NUMBER_OF_EXAMPLES / 2)
-    nb_failure = int(config.FEW_SHOT_MAX_NUMBER_OF_EXAMPLES / 2)
-
-    PHOSPHO_EVAL_MODELS_NAMES = ["phospho", "phospho-4"]
-
-    # Get the user evals from the db
-    successful_examples_tasks = (
-        await mongo_db["evals"]
-        .aggregate(
-            [
-                {
-                    "$match": {
-                        "project_id": task.project_id,
-                        "source": {"$nin": PHOSPHO_EVAL_MODELS_NAMES},
-                        "value": "success",
-                    }
-                },
-                {"$sort": {"created_at": -1}},
-                {"$limit": nb_success},
-                {
-                    "$lookup": {
-                        "from": "tasks",
-                        "localField": "task_id",
-                        "foreignField": "id",
-                        "as": "task",
-                    }
-                },
-                {"$unwind": "$task"},
-                {
-                    "$addFields": {
-                        "flag": "$value",
-                        "output": "$task.output",
-                        "input": "$task.input",
-                    }
-                },
-                {"$project": {"input": 1, "output": 1, "flag": 1}},
-            ]
-        )
-        .to_list(length=None)
-    )
+    # The examples are cached per project
+    few_shot_examples = await get_few_shot_examples(task.project_id)
+    successful_examples_tasks = few_shot_examples.successful_examples
+    unsuccessful_examples_tasks = few_shot_examples.unsuccessful_examples
     logger.debug(f"Nb of successful examples: {len(successful_examples_tasks)}")
-
-    # Get the failure examples
-    unsuccessful_examples_tasks = (
-        await mongo_db["evals"]
-        .aggregate(
-            [
-                {
-                    "$match": {
-                        "project_id": task.project_id,
-                        "source": {"$nin": PHOSPHO_EVAL_MODELS_NAMES},
-                        "value": "failure",
-                    }
-                },
-                {"$sort": {"created_at": -1}},
-                {"$limit": nb_failure},
-                {
-                    "$lookup": {
-                        "from": "tasks",
-                        "localField": "task_id",
-                        "foreignField": "id",
-                        "as": "task",
-                    }
-                },
-                {"$unwind": "$task"},
-                {
-                    "$addFields": {
-                        "flag": "$value",
-                        "output": "$task.output",
-                        "input": "$task.input",
-                    }
-                },
-                {"$project": {"input": 1, "output": 1, "flag": 1}},
-            ]
-        )
-        .to_list(length=None)
-    )
     logger.debug(f"Nb of failure examples: {len(unsuccessful_examples_tasks)}")
 
     # Get the Task's system prompt
@@ -428,22 +385,30 @@ async def task_scoring_pipeline(
     mongo_db["evals"].insert_one(evaluation_data.model_dump())
     # Save the prediction
     job_result.task_id = task.id
-    mongo_db["job_results"].insert_one(job_result.model_dump())
+    await save_job_results([job_result.model_dump()])
 
     # Update the task object if the flag is None (no previous evaluation)
     if save_task:
-        task_in_db = await mongo_db["tasks"].find_one({"id": task.id})
-        if task_in_db.get("flag") is None:
-            mongo_db["tasks"].update_one(
-                {"id": task.id},
-                {
-                    "$set": {
-                        "flag": flag,
-                        "last_eval": evaluation_data.model_dump(),
-                        "evaluation_source": config.EVALUATION_SOURCE,
-                    }
-                },
+        # The filter on the flag makes the check and the update atomic, so
+        # that the counters are only incremented once
+        task_update = await mongo_db["tasks"].update_one(
+            {"id": task.id, "flag": None},
+            {
+                "$set": {
+                    "flag": flag,
+                    "last_eval": evaluation_data.model_dump(),
+                    "evaluation_source": config.EVALUATION_SOURCE,
+                }
+            },
+        )
+        if task_update.modified_count == 1:
+            await increment_session_stats(
+                task.session_id,
+                nb_success=int(flag == "success"),
+                nb_failure=int(flag == "failure"),
             )
+            await increment_task_rollup(task, "flag", flag)
+            await increment_user_flag(task, flag)
     return flag
 
 
@@ -486,13 +451,20 @@ async def task_scoring_pipeline(
 #         logger.info(f"Detected topics for task {task_id} saved in the database")
 
 
-async def task_main_pipeline(task: Task, save_task: bool = True) -> PipelineResults:
+async def task_main_pipeline(
+    task: Task,
+    save_task: bool = True,
+    sentiment_and_language: Optional[Tuple[SentimentObject, Optional[str]]] = None,
+) -> PipelineResults:
     """
     Main pipeline to run on a task.
     - Event detection
     - Evaluate task success/failure
     - Language detection
     - Sentiment analysis
+
+    If sentiment_and_language is passed, the sentiment analysis was already run on the
+    task (see sentiment_and_language_analysis_batch_pipeline) and is skipped.
     """
 
     # Get the starting time of the pipeline
@@ -500,15 +472,19 @@ async def task_main_pipeline(task: Task, save_task: bool = True) -> PipelineResu
     logger.info(f"Starting main pipeline for task {task.id}")
 
     # For now, do things sequentially
+    events: List[Event] = []
+    sentiment_object, language = SentimentObject(), None
 
     # Do the event detection
     if task.test_id is None:
         # Run the event detection pipeline
         events = await task_event_detection_pipeline(task, save_task=save_task)
         # Run sentiment analysis on the user input
-        sentiment_object, language = await sentiment_and_language_analysis_pipeline(
-            task
-        )
+        if sentiment_and_language is None:
+            sentiment_and_language = await sentiment_and_language_analysis_pipeline(
+                task
+            )
+        sentiment_object, language = sentiment_and_language
 
     # Do the session scoring -> success, failure
     mongo_db = await get_mongo_db()
@@ -531,6 +507,8 @@ async def task_main_pipeline(task: Task, save_task: bool = True) -> PipelineResu
     logger.info(
         f"Main pipeline completed in {time.time() - start_time:.2f} seconds for task {task.id}"
     )
+    if save_task:
+        await bump_data_version([task.project_id])
 
     return PipelineResults(
         events=events,
@@ -595,7 +573,7 @@ async def messages_main_pipeline(
         if result.job_metadata.get("recipe_id") is None:
             logger.error(f"No recipe_id found for event {event_name}")
 
-        mongo_db["job_results"].insert_one(result.model_dump())
+        await save_job_results([result.model_dump()])
 
     # Push the events to the database
     if len(events) > 0:
@@ -634,14 +612,13 @@ async def recipe_pipeline(tasks: List[Task], recipe: Recipe):
         raise ValueError(f"Job type {recipe.recipe_type} not supported")
 
 
-async def sentiment_and_language_analysis_pipeline(
-    task: Task,
-) -> tuple[SentimentObject, Optional[str]]:
+async def get_sentiment_thresholds(project_id: str) -> Tuple[float, float]:
     """
-    Run the sentiment analysis on the input of a task
+    Get the sentiment score and magnitude thresholds of a project.
+    Store the default values in the project settings if they are missing.
     """
     mongo_db = await get_mongo_db()
-    project = await get_project_by_id(task.project_id)
+    project = await get_project_by_id(project_id)
 
     # Default values
     score_threshold = 0.3
@@ -652,7 +629,7 @@ async def sentiment_and_language_analysis_pipeline(
             score_threshold = project.settings.sentiment_threshold.score
         else:
             mongo_db["projects"].update_one(
-                {"id": task.project_id},
+                {"id": project_id},
                 {
                     "$set": {
                         "settings.sentiment_threshold.score": 0.3,
@@ -664,7 +641,7 @@ async def sentiment_and_language_analysis_pipeline(
             magnitude_threshold = project.settings.sentiment_threshold.magnitude
         else:
             mongo_db["projects"].update_one(
-                {"id": task.project_id},
+                {"id": project_id},
                 {
                     "$set": {
                         "settings.sentiment_threshold.magnitude": 0.6,
@@ -673,7 +650,7 @@ async def sentiment_and_language_analysis_pipeline(
             )
     else:
         mongo_db["projects"].update_one(
-            {"id": task.project_id},
+            {"id": project_id},
             {
                 "$set": {
                     "settings.sentiment_threshold": {
@@ -683,44 +660,107 @@ async def sentiment_and_language_analysis_pipeline(
                 }
             },
         )
+    return score_threshold, magnitude_threshold
 
-    sentiment_object, language = await run_sentiment_and_language_analysis(
-        task.input, score_threshold, magnitude_threshold
-    )
 
-    await mongo_db["tasks"].update_one(
-        {
-            "id": task.id,
-            "project_id": task.project_id,
-        },
-        {
-            "$set": {
-                "sentiment": sentiment_object.model_dump(),
-                "language": language,
-                "metadata.sentiment_score": sentiment_object.score,
-                "metadata.sentiment_magnitude": sentiment_object.magnitude,
-                "metadata.sentiment_label": sentiment_object.label,
-                "metadata.language": language,
-            }
-        },
-    )
+async def sentiment_and_language_analysis_batch_pipeline(
+    tasks: List[Task],
+) -> Dict[str, Tuple[SentimentObject, Optional[str]]]:
+    """
+    Run the sentiment analysis on the input of a batch of tasks.
 
-    jobresult = JobResult(
-        org_id=task.org_id,
-        project_id=task.project_id,
-        job_id="sentiment_analysis",
-        value=sentiment_object.model_dump(),
-        result_type=ResultType.dict,
-        metadata={
-            "input": task.input,
-        },
-    )
+    The project thresholds are fetched once per project and the results are
+    saved with a single bulk_write. Returns a mapping {task_id: (sentiment, language)}
+    """
+    if len(tasks) == 0:
+        return {}
+    mongo_db = await get_mongo_db()
+
+    tasks_per_project: Dict[str, List[Task]] = defaultdict(list)
+    for task in tasks:
+        tasks_per_project[task.project_id].append(task)
+
+    results: Dict[str, Tuple[SentimentObject, Optional[str]]] = {}
+    for project_id, project_tasks in tasks_per_project.items():
+        score_threshold, magnitude_threshold = await get_sentiment_thresholds(
+            project_id
+        )
+        project_results = await run_sentiment_and_language_analysis_batch(
+            [task.input for task in project_tasks],
+            score_threshold,
+            magnitude_threshold,
+        )
+        for task, result in zip(project_tasks, project_results):
+            results[task.id] = result
 
-    mongo_db["job_results"].insert_one(jobresult.model_dump())
+    task_updates = []
+    jobresults = []
+    for task in tasks:
+        sentiment_object, language = results[task.id]
+        task_updates.append(
+            UpdateOne(
+                {
+                    "id": task.id,
+                    "project_id": task.project_id,
+                },
+                {
+                    "$set": {
+                        "sentiment": sentiment_object.model_dump(),
+                        "language": language,
+                        "metadata.sentiment_score": sentiment_object.score,
+                        "metadata.sentiment_magnitude": sentiment_object.magnitude,
+                        "metadata.sentiment_label": sentiment_object.label,
+                        "metadata.language": language,
+                    }
+                },
+            )
+        )
+        jobresults.append(
+            JobResult(
+                org_id=task.org_id,
+                project_id=task.project_id,
+                job_id="sentiment_analysis",
+                value=sentiment_object.model_dump(),
+                result_type=ResultType.dict,
+                metadata={
+                    "input": task.input,
+                },
+            ).model_dump()
+        )
+        logger.info(f"Sentiment analysis for task {task.id} : {sentiment_object}")
+
+    await mongo_db["tasks"].bulk_write(task_updates, ordered=False)
+    await save_job_results(jobresults)
+
+    # Move the tasks to their new language and sentiment in the rollups
+    for project_id, project_tasks in tasks_per_project.items():
+        increments: Counter = Counter()
+        for task in project_tasks:
+            sentiment_object, language = results[task.id]
+            previous_label = task.sentiment.label if task.sentiment else None
+            for dimension, previous, new in [
+                ("language", task.language, language),
+                ("sentiment", previous_label, sentiment_object.label),
+            ]:
+                if previous != new:
+                    if previous is not None:
+                        increments[(task.created_at, (dimension, previous))] -= 1
+                    if new is not None:
+                        increments[(task.created_at, (dimension, new))] += 1
+        await increment_rollups(project_id, increments)
+    await bump_data_version(tasks_per_project.keys())
+
+    return results
 
-    logger.info(f"Sentiment analysis for task {task.id} : {sentiment_object}")
 
-    return sentiment_object, language
+async def sentiment_and_language_analysis_pipeline(
+    task: Task,
+) -> Tuple[SentimentObject, Optional[str]]:
+    """
+    Run the sentiment analysis on the input of a task
+    """
+    results = await sentiment_and_language_analysis_batch_pipeline([task])
+    return results[task.id]
 
 
 async def store_opentelemetry_data_in_db(
@@ -0,0 +1,163 @@
+"""
+Daily quantile sketches of the numeric metadata and of the session lengths
+
+The quantile_sketches collection stores one document per project, day and metric:
+
+{
+    "project_id": "...",
+    "day": 1715040000,  # UNIX timestamp of the start of the day (UTC)
+    "metric": "metadata.total_tokens",  # or "session_length"
+    "count": 1200,
+    "sum": 53000.0,
+    "buckets": {"p345": 12, "p346": 40, "z": 3, "n12": 1},
+}
+
+The values are counted in logarithmic buckets (DDSketch, see
+phospho.lab.quantile_sketches): any quantile is estimated with a relative error
+of at most RELATIVE_ACCURACY, the number of buckets is bounded by the range of
+the values, and the sketches of several days are merged by adding their buckets.
+
+The buckets are incremented with $inc, so a value can also be removed, eg: when
+a session gets longer. The backend builds the sketches of the projects created
+before them.
+"""
+
+import math
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from loguru import logger
+from pymongo import UpdateOne
+
+from app.db.models import Task
+from app.db.mongo import get_mongo_db
+from phospho.lab.quantile_sketches import get_bucket_key
+
+DAY = 86400
+
+# (project_id, day, metric) -> (bucket key -> increment, sum of the values)
+SketchIncrements = Dict[Tuple[str, int, str], Tuple[Counter, float]]
+
+
+def is_sketched_value(value: object) -> bool:
+    return (
+        isinstance(value, (int, float))
+        and not isinstance(value, bool)
+        and math.isfinite(value)
+    )
+
+
+def add_to_increments(
+    increments: SketchIncrements,
+    project_id: str,
+    timestamp: int,
+    metric: str,
+    value: float,
+    increment: int = 1,
+) -> None:
+    key = (project_id, timestamp - timestamp % DAY, metric)
+    buckets, total = increments.get(key, (Counter(), 0.0))
+    buckets[get_bucket_key(value)] += increment
+    increments[key] = (buckets, total + value * increment)
+
+
+def compute_metadata_sketch_increments(tasks: List[Task]) -> SketchIncrements:
+    """
+    Count the numeric metadata values of a batch of new tasks
+    """
+    increments: SketchIncrements = {}
+    for task in tasks:
+        if not task.metadata:
+            continue
+        for field, value in task.metadata.items():
+            # The field is part of the name of the metric
+            if not is_sketched_value(value) or "." in field or field.startswith("$"):
+                continue
+            add_to_increments(
+                increments,
+                task.project_id,
+                task.created_at,
+                f"metadata.{field}",
+                value,
+            )
+    return increments
+
+
+def build_sketch_updates(increments: SketchIncrements) -> List[UpdateOne]:
+    updates = []
+    for (project_id, day, metric), (buckets, total) in increments.items():
+        buckets = Counter(
+            {key: increment for key, increment in buckets.items() if increment != 0}
+        )
+        if len(buckets) == 0 and total == 0:
+            continue
+        updates.append(
+            UpdateOne(
+                {"project_id": project_id, "day": day, "metric": metric},
+                {
+                    "$inc": {
+                        "count": sum(buckets.values()),
+                        "sum": total,
+                        **{
+                            f"buckets.{key}": increment
+                            for key, increment in buckets.items()
+                        },
+                    }
+                },
+                upsert=True,
+            )
+        )
+    return updates
+
+
+async def increment_sketches(increments: SketchIncrements) -> None:
+    updates = build_sketch_updates(increments)
+    if len(updates) == 0:
+        return
+    mongo_db = await get_mongo_db()
+    try:
+        await mongo_db["quantile_sketches"].bulk_write(updates, ordered=False)
+    except Exception as e:
+        # The sketches are not critical, so we don't fail the ingestion
+        logger.error(f"Error incrementing the quantile sketches: {e}")
+
+
+async def update_metadata_sketches(tasks: List[Task]) -> None:
+    """
+    Add the numeric metadata of a batch of new tasks to the sketches.
+    """
+    await increment_sketches(compute_metadata_sketch_increments(tasks))
+
+
+def compute_session_length_increments(
+    sessions: List[dict], added_lengths: Dict[str, int]
+) -> SketchIncrements:
+    """
+    Move the sessions from their previous length to their new length.
+
+    sessions are the id, project_id, created_at and previous session_length of
+    the sessions. added_lengths is the number of tasks added to each session.
+    """
+    increments: SketchIncrements = {}
+    for session in sessions:
+        previous_length: int = session.get("session_length") or 0
+        added_length = added_lengths.get(session["id"], 0)
+        if added_length == 0:
+            continue
+        if previous_length > 0:
+            add_to_increments(
+                increments,
+                session["project_id"],
+                session["created_at"],
+                "session_length",
+                previous_length,
+                -1,
+            )
+        add_to_increments(
+            increments,
+            session["project_id"],
+            session["created_at"],
+            "session_length",
+            previous_length + added_length,
+        )
+    return increments
@@ -0,0 +1,122 @@
+"""
+Hourly and daily counters of the projects, used by the dashboards
+
+The rollups collection stores one document per project, period and value:
+
+{
+    "project_id": "...",
+    "granularity": "hour",  # or "day"
+    "period_start": 1715000400,  # UNIX timestamp of the start of the period
+    "dimension": "flag",  # tasks, sessions, flag, event_name, language, sentiment, version_id
+    "value": "success",  # None for the tasks and sessions totals
+    "count": 12,
+}
+
+The counters are incremented here, when tasks are logged and enriched. The
+backend recomputes the recent periods regularly to correct any drift.
+"""
+
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from pymongo import UpdateOne
+
+from app.db.models import Task
+from app.db.mongo import get_mongo_db
+
+HOUR = 3600
+DAY = 86400
+
+RollupKey = Tuple[str, Optional[str]]
+
+
+def get_periods(timestamp: int) -> List[Tuple[str, int]]:
+    """
+    The start of the hour and of the day (UTC) of a timestamp
+    """
+    return [
+        ("hour", timestamp - timestamp % HOUR),
+        ("day", timestamp - timestamp % DAY),
+    ]
+
+
+def get_task_rollup_keys(task: Task) -> List[RollupKey]:
+    """
+    The counters to increment when a task is logged
+    """
+    keys: List[RollupKey] = [("tasks", None)]
+    if task.flag is not None:
+        keys.append(("flag", task.flag))
+    if task.metadata is not None and task.metadata.get("version_id") is not None:
+        keys.append(("version_id", str(task.metadata["version_id"])))
+    return keys
+
+
+def build_rollup_updates(
+    project_id: str, increments: Dict[Tuple[int, RollupKey], int]
+) -> List[UpdateOne]:
+    """
+    Build the upserts incrementing the hourly and daily counters.
+
+    increments maps (timestamp, (dimension, value)) to the increment.
+    """
+    counts: Counter = Counter()
+    for (timestamp, key), increment in increments.items():
+        for granularity, period_start in get_periods(timestamp):
+            counts[(granularity, period_start, key)] += increment
+    return [
+        UpdateOne(
+            {
+                "project_id": project_id,
+                "granularity": granularity,
+                "period_start": period_start,
+                "dimension": dimension,
+                "value": value,
+            },
+            {"$inc": {"count": increment}},
+            upsert=True,
+        )
+        for (granularity, period_start, (dimension, value)), increment in counts.items()
+        if increment != 0
+    ]
+
+
+async def increment_rollups(
+    project_id: str, increments: Dict[Tuple[int, RollupKey], int]
+) -> None:
+    updates = build_rollup_updates(project_id, increments)
+    if len(updates) == 0:
+        return
+    mongo_db = await get_mongo_db()
+    try:
+        await mongo_db["rollups"].bulk_write(updates, ordered=False)
+    except Exception as e:
+        # The rollups are recomputed by the backend, so we don't fail the pipeline
+        logger.error(f"Error incrementing the rollups of project {project_id}: {e}")
+
+
+async def increment_tasks_rollups(tasks: List[Task]) -> None:
+    """
+    Increment the counters of newly logged tasks.
+    """
+    increments_per_project: Dict[str, Counter] = {}
+    for task in tasks:
+        increments = increments_per_project.setdefault(task.project_id, Counter())
+        for key in get_task_rollup_keys(task):
+            increments[(task.created_at, key)] += 1
+    for project_id, increments in increments_per_project.items():
+        await increment_rollups(project_id, increments)
+
+
+async def increment_task_rollup(
+    task: Task, dimension: str, value: Optional[str], increment: int = 1
+) -> None:
+    """
+    Increment a single counter of a task, eg: when it's flagged or an event is detected.
+    """
+    if value is None:
+        return
+    await increment_rollups(
+        task.project_id, {(task.created_at, (dimension, value)): increment}
+    )
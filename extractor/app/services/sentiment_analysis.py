@@ -1,12 +1,18 @@
-from typing import Optional
-from google.cloud import language_v2
-from phospho.models import SentimentObject
-from loguru import logger
-from google.oauth2 import service_account
-import os
+import asyncio
 import json
+import os
+import re
 from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from google.cloud import language_v2
+from google.oauth2 import service_account
 from langdetect import detect
+from loguru import logger
+
+from app.core import config
+from phospho.models import SentimentObject
 
 client = None
 
@@ -29,73 +35,172 @@ try:
 except Exception as e:
     logger.error(f"Error connecting to sentiment analysis: {e}")
 
+local_analyzer = None
 
-async def run_sentiment_and_language_analysis(
-    text: str, score_threshold: float, magnitude_threshold: float
-) -> tuple[SentimentObject, Optional[str]]:
-    """
-    Analyzes Sentiment and Language of a given text.
+try:
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+    local_analyzer = SentimentIntensityAnalyzer()
+    logger.info("Local sentiment analysis available")
+except ImportError as e:
+    if config.SENTIMENT_ANALYSIS_BACKEND == "local":
+        logger.error(
+            f"SENTIMENT_ANALYSIS_BACKEND is local but vaderSentiment can't be imported: {e}"
+        )
 
-    The sentiment object contains both a score and a magnitude.
-    - score: positive values indicate positive sentiment, negative values indicate negative sentiment.
-    - magnitude: the overall strength of emotion (both positive and negative) within the given text.
+# The clients are blocking: they run in this thread pool
+executor = ThreadPoolExecutor(max_workers=config.SENTIMENT_ANALYSIS_MAX_CONCURRENCY)
 
-    Args:
-      text_content: The text content to analyze.
+
+def label_sentiment(
+    sentiment: SentimentObject, score_threshold: float, magnitude_threshold: float
+) -> SentimentObject:
+    """
+    Set the label of a sentiment object based on its score and magnitude.
     """
-    if client is None:
-        logger.warning("No client available for sentiment analysis")
-        return SentimentObject(), None
+    if sentiment.score is None or sentiment.magnitude is None:
+        return sentiment
+    # We interpret the sentiment score as follows:
+    if sentiment.score > score_threshold:
+        sentiment.label = "positive"
+    elif sentiment.score < -score_threshold:
+        sentiment.label = "negative"
+    else:
+        if sentiment.magnitude < magnitude_threshold:
+            sentiment.label = "neutral"
+        else:
+            sentiment.label = "mixed"
+    return sentiment
 
+
+def detect_language(text: str) -> Optional[str]:
     try:
-        # Available types: PLAIN_TEXT, HTML
-        document_type_in_plain_text = language_v2.Document.Type.PLAIN_TEXT
+        return detect(text)
+    except Exception as e:
+        logger.info(f"Failed to detect language: {e}")
+        return None
 
-        # Optional. If not specified, the language is automatically detected.
-        # For list of supported languages:
-        # https://cloud.google.com/natural-language/docs/languages
 
-        document = {
-            "content": text,
-            "type_": document_type_in_plain_text,
-        }
+def analyze_with_google(text: str) -> Tuple[SentimentObject, Optional[str]]:
+    """
+    Blocking call to the Google Natural Language API
+    """
+    # Available types: PLAIN_TEXT, HTML
+    document_type_in_plain_text = language_v2.Document.Type.PLAIN_TEXT
 
-        # Available values: NONE, UTF8, UTF16, UTF32
-        # See https://cloud.google.com/natural-language/docs/reference/rest/v2/EncodingType.
+    # Optional. If not specified, the language is automatically detected.
+    # For list of supported languages:
+    # https://cloud.google.com/natural-language/docs/languages
 
-        encoding_type = language_v2.EncodingType.UTF8
+    document = {
+        "content": text,
+        "type_": document_type_in_plain_text,
+    }
 
-        response = client.analyze_sentiment(
-            request={"document": document, "encoding_type": encoding_type}
-        )
+    # Available values: NONE, UTF8, UTF16, UTF32
+    # See https://cloud.google.com/natural-language/docs/reference/rest/v2/EncodingType.
+
+    encoding_type = language_v2.EncodingType.UTF8
 
-        sentiment_response = SentimentObject(
-            score=response.document_sentiment.score,
-            magnitude=response.document_sentiment.magnitude,
+    response = client.analyze_sentiment(
+        request={"document": document, "encoding_type": encoding_type}
+    )
+
+    sentiment = SentimentObject(
+        score=response.document_sentiment.score,
+        magnitude=response.document_sentiment.magnitude,
+    )
+    language = response.language_code
+    if not language:
+        logger.info("Language not detected by Google API, falling back on langdetect")
+        language = detect_language(text)
+    return sentiment, language
+
+
+def analyze_locally(text: str) -> Tuple[SentimentObject, Optional[str]]:
+    """
+    Blocking CPU analysis with VADER and langdetect.
+
+    The score is the compound score of the text. Like in the Google API, the magnitude
+    is the sum of the absolute scores of the sentences.
+    """
+    sentences = [sentence for sentence in re.split(r"(?<=[.!?])\s+", text) if sentence]
+    magnitude = sum(
+        abs(local_analyzer.polarity_scores(sentence)["compound"])
+        for sentence in sentences
+    )
+    sentiment = SentimentObject(
+        score=local_analyzer.polarity_scores(text)["compound"],
+        magnitude=magnitude,
+    )
+    return sentiment, detect_language(text)
+
+
+def analyze_text(text: str) -> Tuple[SentimentObject, Optional[str]]:
+    """
+    Run the sentiment and language analysis of a text with the configured backend.
+    """
+    use_google = config.SENTIMENT_ANALYSIS_BACKEND == "google" and client is not None
+    if use_google:
+        return analyze_with_google(text)
+    if local_analyzer is not None:
+        return analyze_locally(text)
+    logger.warning("No client available for sentiment analysis")
+    return SentimentObject(), None
+
+
+async def run_sentiment_and_language_analysis_batch(
+    texts: List[str], score_threshold: float, magnitude_threshold: float
+) -> List[Tuple[SentimentObject, Optional[str]]]:
+    """
+    Analyzes Sentiment and Language of a list of texts.
+
+    Identical texts are analyzed only once. The blocking calls run in a thread pool,
+    with at most SENTIMENT_ANALYSIS_MAX_CONCURRENCY calls at the same time.
+    Returns a list of (sentiment, language) in the same order as texts.
+    """
+    semaphore = asyncio.Semaphore(config.SENTIMENT_ANALYSIS_MAX_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+
+    async def analyze(text: str) -> Tuple[SentimentObject, Optional[str]]:
+        try:
+            async with semaphore:
+                return await loop.run_in_executor(executor, analyze_text, text)
+        except Exception as e:
+            logger.error(f"Error in sentiment analysis: {e}")
+            return SentimentObject(), None
+
+    unique_texts = list(dict.fromkeys(texts))
+    results = await asyncio.gather(*[analyze(text) for text in unique_texts])
+    results_per_text: Dict[str, Tuple[SentimentObject, Optional[str]]] = dict(
+        zip(unique_texts, results)
+    )
+
+    output = []
+    for text in texts:
+        sentiment, language = results_per_text[text]
+        # Copy, as the same result can be shared by several texts
+        sentiment = label_sentiment(
+            sentiment.model_copy(), score_threshold, magnitude_threshold
         )
+        output.append((sentiment, language))
+    return output
 
-        # We interpret the sentiment score as follows:
-        if sentiment_response.score > score_threshold:
-            sentiment_response.label = "positive"
-        elif sentiment_response.score < -score_threshold:
-            sentiment_response.label = "negative"
-        else:
-            if sentiment_response.magnitude < magnitude_threshold:
-                sentiment_response.label = "neutral"
-            else:
-                sentiment_response.label = "mixed"
-
-        language = response.language_code
-        if language is None:
-            logger.info(
-                "Language not detected by Google API, falling back on langdetect"
-            )
-            language = await detect(text)
 
-    except Exception as e:
-        logger.error(f"Error in sentiment analysis: {e}")
+async def run_sentiment_and_language_analysis(
+    text: str, score_threshold: float, magnitude_threshold: float
+) -> Tuple[SentimentObject, Optional[str]]:
+    """
+    Analyzes Sentiment and Language of a given text.
 
-        sentiment_response = SentimentObject()
-        language = None
+    The sentiment object contains both a score and a magnitude.
+    - score: positive values indicate positive sentiment, negative values indicate negative sentiment.
+    - magnitude: the overall strength of emotion (both positive and negative) within the given text.
 
-    return sentiment_response, language
+    Args:
+      text_content: The text content to analyze.
+    """
+    results = await run_sentiment_and_language_analysis_batch(
+        [text], score_threshold, magnitude_threshold
+    )
+    return results[0]
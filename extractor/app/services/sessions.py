@@ -0,0 +1,298 @@
+"""
+Session aggregates maintained at ingestion time
+"""
+
+from collections import Counter
+from typing import Dict, List, Optional
+
+from loguru import logger
+from pymongo import UpdateOne
+
+from app.db.models import Session, Task
+from app.db.mongo import get_mongo_db
+from app.services.quantile_sketches import (
+    compute_session_length_increments,
+    increment_sketches,
+)
+from app.services.rollups import increment_rollups
+from app.utils import generate_timestamp
+
+# These fields are computed from the tasks of the session
+SESSION_AGGREGATE_FIELDS = [
+    "preview",
+    "session_length",
+    "first_task_created_at",
+    "last_task_created_at",
+    "stats",
+    "tasks_updated_at",
+]
+
+
+def compute_sessions_aggregates(tasks: List[Task]) -> Dict[str, dict]:
+    """
+    Group a batch of tasks by session_id and compute the aggregates of each session:
+    number of tasks, first and last task timestamps, preview of the earliest task
+    and flag counts.
+    """
+    aggregates: Dict[str, dict] = {}
+    for task in tasks:
+        if task.session_id is None:
+            continue
+        aggregate = aggregates.get(task.session_id)
+        if aggregate is None:
+            aggregate = {
+                "project_id": task.project_id,
+                "org_id": task.org_id,
+                "session_length": 0,
+                "first_task_created_at": task.created_at,
+                "last_task_created_at": task.created_at,
+                "preview": task.preview(),
+                "nb_success": 0,
+                "nb_failure": 0,
+            }
+            aggregates[task.session_id] = aggregate
+        aggregate["session_length"] += 1
+        if task.created_at < aggregate["first_task_created_at"]:
+            aggregate["first_task_created_at"] = task.created_at
+            aggregate["preview"] = task.preview()
+        if task.created_at > aggregate["last_task_created_at"]:
+            aggregate["last_task_created_at"] = task.created_at
+        if task.flag == "success":
+            aggregate["nb_success"] += 1
+        elif task.flag == "failure":
+            aggregate["nb_failure"] += 1
+    return aggregates
+
+
+def build_session_aggregate_update(session_id: str, aggregate: dict) -> UpdateOne:
+    """
+    Build the upsert merging the aggregates of a batch into the session document.
+
+    This is a pipeline update, so that the preview is only replaced if the batch
+    contains a task older than the first task of the session.
+    """
+    first_ts = aggregate["first_task_created_at"]
+    # Default values, used when the session is created
+    default_session = Session(
+        id=session_id,
+        project_id=aggregate["project_id"],
+        org_id=aggregate["org_id"],
+        created_at=first_ts,
+        metadata={},
+        data={},
+    ).model_dump()
+    defaults = {
+        key: {"$ifNull": [f"${key}", {"$literal": value}]}
+        for key, value in default_session.items()
+        if key not in SESSION_AGGREGATE_FIELDS
+    }
+    return UpdateOne(
+        {"id": session_id},
+        [
+            {"$set": defaults},
+            {
+                "$set": {
+                    "preview": {
+                        "$cond": [
+                            {
+                                "$or": [
+                                    {"$eq": [{"$ifNull": ["$preview", None]}, None]},
+                                    {"$lt": [first_ts, "$first_task_created_at"]},
+                                ]
+                            },
+                            {"$literal": aggregate["preview"]},
+                            "$preview",
+                        ]
+                    },
+                    "session_length": {
+                        "$add": [
+                            {"$ifNull": ["$session_length", 0]},
+                            aggregate["session_length"],
+                        ]
+                    },
+                    # $min and $max ignore null values
+                    "first_task_created_at": {
+                        "$min": ["$first_task_created_at", first_ts]
+                    },
+                    "last_task_created_at": {
+                        "$max": [
+                            "$last_task_created_at",
+                            aggregate["last_task_created_at"],
+                        ]
+                    },
+                    "stats.nb_success": {
+                        "$add": [
+                            {"$ifNull": ["$stats.nb_success", 0]},
+                            aggregate["nb_success"],
+                        ]
+                    },
+                    "stats.nb_failure": {
+                        "$add": [
+                            {"$ifNull": ["$stats.nb_failure", 0]},
+                            aggregate["nb_failure"],
+                        ]
+                    },
+                    "stats.nb_events": {"$ifNull": ["$stats.nb_events", 0]},
+                    # The backend recomputes the task positions of the sessions
+                    # updated since its last run
+                    "tasks_updated_at": generate_timestamp(),
+                }
+            },
+        ],
+        upsert=True,
+    )
+
+
+def compute_task_positions(tasks: List[dict], session_lengths: Dict[str, int]) -> None:
+    """
+    Set the task_position of a batch of new tasks, in place. The tasks are
+    appended after the tasks already in their session (session_lengths), in
+    the order of created_at.
+    """
+    next_positions = dict(session_lengths)
+    # The sort is stable, so tasks created at the same time keep the batch order
+    for task in sorted(tasks, key=lambda task: task["created_at"]):
+        session_id = task.get("session_id")
+        if session_id is None:
+            continue
+        position = next_positions.get(session_id, 0) + 1
+        task["task_position"] = position
+        next_positions[session_id] = position
+
+
+async def assign_task_positions(tasks: List[dict]) -> None:
+    """
+    Set the task_position of a batch of new tasks, before they are inserted,
+    from the current length of their sessions.
+
+    Tasks logged out of order, or concurrently in the same session, may get a
+    wrong position. The backend recomputes the positions of the sessions whose
+    tasks changed (see tasks_updated_at).
+    """
+    session_ids = list(
+        {task["session_id"] for task in tasks if task.get("session_id") is not None}
+    )
+    if len(session_ids) == 0:
+        return
+    mongo_db = await get_mongo_db()
+    try:
+        sessions = (
+            await mongo_db["sessions"]
+            .find(
+                {"id": {"$in": session_ids}},
+                {"_id": 0, "id": 1, "session_length": 1},
+            )
+            .to_list(length=None)
+        )
+    except Exception as e:
+        logger.error(f"Error fetching the sessions lengths: {e}")
+        return
+    session_lengths = {
+        session["id"]: session.get("session_length") or 0 for session in sessions
+    }
+    compute_task_positions(tasks, session_lengths)
+
+
+async def update_sessions_aggregates(tasks: List[Task]) -> None:
+    """
+    Create the sessions of a batch of new tasks, or update their aggregates
+    if they already exist, in a single bulk_write.
+    """
+    aggregates = compute_sessions_aggregates(tasks)
+    if len(aggregates) == 0:
+        logger.info("Logevent: no session to update")
+        return
+
+    mongo_db = await get_mongo_db()
+    session_aggregates = list(aggregates.values())
+    try:
+        # The previous lengths of the sessions, for the quantile sketches
+        previous_sessions = (
+            await mongo_db["sessions"]
+            .find(
+                {"id": {"$in": list(aggregates.keys())}},
+                {
+                    "_id": 0,
+                    "id": 1,
+                    "project_id": 1,
+                    "created_at": 1,
+                    "session_length": 1,
+                },
+            )
+            .to_list(length=None)
+        )
+        result = await mongo_db["sessions"].bulk_write(
+            [
+                build_session_aggregate_update(session_id, aggregate)
+                for session_id, aggregate in aggregates.items()
+            ],
+            ordered=False,
+        )
+        logger.info(
+            f"Sessions: created {result.upserted_count}, updated {result.modified_count}"
+        )
+    except Exception as e:
+        error_mesagge = f"Error saving sessions to the database: {e}"
+        logger.error(error_mesagge)
+        return
+
+    # Count the created sessions in the rollups. upserted_ids is keyed by the
+    # index of the operation in the bulk_write.
+    increments_per_project: Dict[str, Counter] = {}
+    for index in result.upserted_ids.keys():
+        aggregate = session_aggregates[index]
+        increments = increments_per_project.setdefault(
+            aggregate["project_id"], Counter()
+        )
+        increments[(aggregate["first_task_created_at"], ("sessions", None))] += 1
+    for project_id, increments in increments_per_project.items():
+        await increment_rollups(project_id, increments)
+
+    # The sessions that didn't exist are created with the first task timestamp
+    existing_session_ids = {session["id"] for session in previous_sessions}
+    new_sessions = [
+        {
+            "id": session_id,
+            "project_id": aggregate["project_id"],
+            "created_at": aggregate["first_task_created_at"],
+            "session_length": 0,
+        }
+        for session_id, aggregate in aggregates.items()
+        if session_id not in existing_session_ids
+    ]
+    await increment_sketches(
+        compute_session_length_increments(
+            previous_sessions + new_sessions,
+            {
+                session_id: aggregate["session_length"]
+                for session_id, aggregate in aggregates.items()
+            },
+        )
+    )
+
+
+async def increment_session_stats(
+    session_id: Optional[str],
+    nb_success: int = 0,
+    nb_failure: int = 0,
+    nb_events: int = 0,
+) -> None:
+    """
+    Update the running counts of a session, e.g. when a task is flagged or
+    when an event is detected.
+    """
+    if session_id is None:
+        return
+    increments = {
+        f"stats.{key}": value
+        for key, value in [
+            ("nb_success", nb_success),
+            ("nb_failure", nb_failure),
+            ("nb_events", nb_events),
+        ]
+        if value != 0
+    }
+    if len(increments) == 0:
+        return
+    mongo_db = await get_mongo_db()
+    await mongo_db["sessions"].update_one({"id": session_id}, {"$inc": increments})
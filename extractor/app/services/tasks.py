@@ -1,3 +1,5 @@
+from typing import List
+
 from app.db.mongo import get_mongo_db
 from app.db.models import Task
 import pydantic
@@ -29,6 +31,28 @@ async def get_task_by_id(task_id: str) -> Task:
     return task
 
 
+async def get_tasks_by_ids(task_ids: List[str], project_id: str) -> List[Task]:
+    """
+    Fetch a batch of tasks of a project in a single query. The missing and
+    invalid tasks are skipped.
+    """
+    mongo_db = await get_mongo_db()
+    tasks = (
+        await mongo_db["tasks"]
+        .find({"id": {"$in": task_ids}, "project_id": project_id}, {"_id": 0})
+        .to_list(length=None)
+    )
+    valid_tasks = []
+    for task in tasks:
+        if task.get("flag") == "undefined":
+            task["flag"] = None
+        try:
+            valid_tasks.append(Task.model_validate(task))
+        except pydantic.ValidationError as e:
+            logger.error(f"Failed to validate task {task.get('id')}: {e}")
+    return valid_tasks
+
+
 # Archived, we use Google Sentiment Analysis API to detect language
 # Doesn't work well with short texts, but strong on longer formats
 async def detect_language_pipeline(task: Task) -> str:
@@ -0,0 +1,66 @@
+"""
+Usage counters of the organizations
+
+The usage of an org is the number of job results it generated. Instead of
+counting the job_results collection, we keep a counter per org in the
+org_usage collection, incremented when job results are saved:
+
+{
+    "org_id": "...",
+    "nb_job_results": 1234,  # since the creation of the org
+    "periods": {"2024-05": 1000, "2024-06": 234},  # per billing period
+}
+
+The counters are reconciled with the job_results collection by the backend.
+"""
+
+from collections import Counter
+from typing import List
+
+from loguru import logger
+from pymongo import UpdateOne
+
+from app.db.mongo import get_mongo_db
+from phospho.utils import get_billing_period
+
+
+def build_usage_updates(job_results: List[dict]) -> List[UpdateOne]:
+    """
+    Group the job results by org and billing period, and build the $inc of the counters.
+    """
+    counts = Counter(
+        (job_result["org_id"], get_billing_period(job_result.get("created_at")))
+        for job_result in job_results
+        if job_result.get("org_id") is not None
+    )
+    increments_per_org: dict = {}
+    for (org_id, period), count in counts.items():
+        increments = increments_per_org.setdefault(org_id, {"nb_job_results": 0})
+        increments["nb_job_results"] += count
+        increments[f"periods.{period}"] = count
+    return [
+        UpdateOne({"org_id": org_id}, {"$inc": increments}, upsert=True)
+        for org_id, increments in increments_per_org.items()
+    ]
+
+
+async def save_job_results(job_results: List[dict]) -> None:
+    """
+    Save job results to the database and increment the usage of their orgs.
+    """
+    if len(job_results) == 0:
+        return
+    mongo_db = await get_mongo_db()
+    if len(job_results) == 1:
+        await mongo_db["job_results"].insert_one(job_results[0])
+    else:
+        await mongo_db["job_results"].insert_many(job_results, ordered=False)
+
+    usage_updates = build_usage_updates(job_results)
+    if len(usage_updates) == 0:
+        return
+    try:
+        await mongo_db["org_usage"].bulk_write(usage_updates, ordered=False)
+    except Exception as e:
+        # The counters are reconciled periodically, so we don't fail the pipeline
+        logger.error(f"Error incrementing the usage of orgs: {e}")
@@ -0,0 +1,222 @@
+"""
+Running stats of the end-users of the projects, maintained at ingestion time
+
+The user_stats collection stores one document per project and metadata.user_id:
+
+{
+    "project_id": "...",
+    "user_id": "alice",
+    "nb_tasks": 120,
+    "nb_success": 80,  # tasks flagged success
+    "nb_failure": 10,  # tasks flagged failure
+    "total_tokens": 5400,  # sum of metadata.total_tokens
+    "session_ids": [...],  # the first USER_STATS_MAX_SESSIONS sessions of the user
+    "events": [...],  # one event per event_name detected in the tasks of the user
+    "first_seen_at": 1715000000,
+    "last_seen_at": 1715990000,
+}
+
+The document doesn't grow with the number of tasks of the user. The backend
+builds the stats of the projects created before the collection.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from pymongo import UpdateOne
+
+from app.db.models import Event, Task
+from app.db.mongo import get_mongo_db
+from phospho.lab.event_summaries import get_event_summary
+from app.utils import generate_timestamp
+
+USER_STATS_MAX_SESSIONS = 1000
+
+
+def get_user_id(task: Task) -> Optional[str]:
+    if task.metadata is None or task.metadata.get("user_id") is None:
+        return None
+    return str(task.metadata["user_id"])
+
+
+def get_total_tokens(task: Task) -> int:
+    total_tokens = (task.metadata or {}).get("total_tokens")
+    if isinstance(total_tokens, bool) or not isinstance(total_tokens, (int, float)):
+        return 0
+    return int(total_tokens)
+
+
+def compute_user_stats_increments(tasks: List[Task]) -> Dict[Tuple[str, str], dict]:
+    """
+    Sum the stats of a batch of new tasks per project and user
+    """
+    increments: Dict[Tuple[str, str], dict] = {}
+    for task in tasks:
+        user_id = get_user_id(task)
+        if user_id is None:
+            continue
+        increment = increments.get((task.project_id, user_id))
+        if increment is None:
+            increment = {
+                "nb_tasks": 0,
+                "nb_success": 0,
+                "nb_failure": 0,
+                "total_tokens": 0,
+                "session_ids": [],
+                "first_seen_at": task.created_at,
+                "last_seen_at": task.created_at,
+            }
+            increments[(task.project_id, user_id)] = increment
+        increment["nb_tasks"] += 1
+        increment["nb_success"] += int(task.flag == "success")
+        increment["nb_failure"] += int(task.flag == "failure")
+        increment["total_tokens"] += get_total_tokens(task)
+        if (
+            task.session_id is not None
+            and task.session_id not in increment["session_ids"]
+        ):
+            increment["session_ids"].append(task.session_id)
+        increment["first_seen_at"] = min(increment["first_seen_at"], task.created_at)
+        increment["last_seen_at"] = max(increment["last_seen_at"], task.created_at)
+    return increments
+
+
+def build_user_stats_update(
+    project_id: str, user_id: str, increment: dict
+) -> UpdateOne:
+    """
+    Build the upsert adding the stats of a batch to the stats of a user.
+
+    This is a pipeline update, so that the bounded set of sessions is merged
+    atomically.
+    """
+    session_ids = {"$ifNull": ["$session_ids", []]}
+    return UpdateOne(
+        {"project_id": project_id, "user_id": user_id},
+        [
+            {
+                "$set": {
+                    **{
+                        key: {"$add": [{"$ifNull": [f"${key}", 0]}, increment[key]]}
+                        for key in [
+                            "nb_tasks",
+                            "nb_success",
+                            "nb_failure",
+                            "total_tokens",
+                        ]
+                    },
+                    "session_ids": {
+                        "$slice": [
+                            {
+                                "$concatArrays": [
+                                    session_ids,
+                                    {
+                                        "$setDifference": [
+                                            {"$literal": increment["session_ids"]},
+                                            session_ids,
+                                        ]
+                                    },
+                                ]
+                            },
+                            USER_STATS_MAX_SESSIONS,
+                        ]
+                    },
+                    "events": {"$ifNull": ["$events", []]},
+                    # $min and $max ignore missing values
+                    "first_seen_at": {
+                        "$min": ["$first_seen_at", increment["first_seen_at"]]
+                    },
+                    "last_seen_at": {
+                        "$max": ["$last_seen_at", increment["last_seen_at"]]
+                    },
+                    "updated_at": generate_timestamp(),
+                }
+            }
+        ],
+        upsert=True,
+    )
+
+
+async def update_user_stats(tasks: List[Task]) -> None:
+    """
+    Add a batch of new tasks to the stats of their users.
+    """
+    increments = compute_user_stats_increments(tasks)
+    if len(increments) == 0:
+        return
+    mongo_db = await get_mongo_db()
+    try:
+        await mongo_db["user_stats"].bulk_write(
+            [
+                build_user_stats_update(project_id, user_id, increment)
+                for (project_id, user_id), increment in increments.items()
+            ],
+            ordered=False,
+        )
+    except Exception as e:
+        # The stats are not critical, so we don't fail the ingestion
+        logger.error(f"Error updating the user stats: {e}")
+
+
+async def increment_user_flag(task: Task, flag: Optional[str]) -> None:
+    """
+    Count a task flagged for the first time in the stats of its user.
+    """
+    user_id = get_user_id(task)
+    if user_id is None or flag not in ["success", "failure"]:
+        return
+    mongo_db = await get_mongo_db()
+    await mongo_db["user_stats"].update_one(
+        {"project_id": task.project_id, "user_id": user_id},
+        {"$inc": {f"nb_{flag}": 1}},
+    )
+
+
+async def add_events_to_user_stats(task: Task, events: List[Event]) -> None:
+    """
+    Add the events detected in a task to the events of its user, one event
+    per event_name.
+    """
+    user_id = get_user_id(task)
+    if user_id is None:
+        return
+    updates: List[UpdateOne] = []
+    for event in events:
+        if event.removed:
+            continue
+        user_events = {"$ifNull": ["$events", []]}
+        updates.append(
+            UpdateOne(
+                {"project_id": task.project_id, "user_id": user_id},
+                [
+                    {
+                        "$set": {
+                            "events": {
+                                "$cond": [
+                                    {
+                                        "$in": [
+                                            event.event_name,
+                                            {"$ifNull": ["$events.event_name", []]},
+                                        ]
+                                    },
+                                    user_events,
+                                    {
+                                        "$concatArrays": [
+                                            user_events,
+                                            [{"$literal": get_event_summary(event)}],
+                                        ]
+                                    },
+                                ]
+                            }
+                        }
+                    }
+                ],
+            )
+        )
+    if len(updates) == 0:
+        return
+    mongo_db = await get_mongo_db()
+    try:
+        await mongo_db["user_stats"].bulk_write(updates, ordered=False)
+    except Exception as e:
+        logger.error(f"Error adding events to the user stats: {e}")
@@ -0,0 +1,38 @@
+from app.services.embeddings import pack_texts_by_token_budget
+
+
+class WhitespaceTokenizer:
+    def encode(self, text: str):
+        return text.split(" ")
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+def test_pack_texts_by_token_budget():
+    texts = ["a b c", "d e", "f g h i j k", "", "l"]
+
+    batches = pack_texts_by_token_budget(
+        texts,
+        max_tokens_per_text=4,
+        max_tokens_per_request=6,
+        max_inputs_per_request=10,
+        tokenizer=WhitespaceTokenizer(),
+    )
+
+    # Every text is in exactly one batch, in order
+    assert [index for batch in batches for index, _ in batch] == [0, 1, 2, 3, 4]
+    # The long text is truncated
+    assert batches[1][0] == (2, "f g h i")
+    # No batch exceeds the token budget
+    for batch in batches:
+        assert sum(len(text.split(" ")) for _, text in batch) <= 6
+
+    batches = pack_texts_by_token_budget(
+        texts,
+        max_tokens_per_text=4,
+        max_tokens_per_request=100,
+        max_inputs_per_request=2,
+        tokenizer=WhitespaceTokenizer(),
+    )
+    assert [len(batch) for batch in batches] == [2, 2, 1]
@@ -0,0 +1,47 @@
+from app.db.models import Event, Task
+from app.services.event_summaries import (
+    build_add_event_summary_update,
+    build_add_events_updates,
+)
+from phospho.lab.event_summaries import get_event_summary
+
+
+def test_add_event_summary_update():
+    task = Task(project_id="project", input="Hello")
+    event = Event(
+        event_name="greeting",
+        task_id=task.id,
+        session_id="session",
+        project_id="project",
+        source="phospho-unknown",
+        task=task,
+    )
+    summary = get_event_summary(event)
+    update = build_add_event_summary_update(summary)
+    # The event is appended as a literal, so that its fields are not interpreted
+    events = update[0]["$set"]["events"]["$cond"]
+    assert events[2]["$concatArrays"][1] == [{"$literal": summary}]
+
+
+def test_add_events_updates():
+    events = [
+        Event(
+            event_name="greeting",
+            task_id="task",
+            session_id="session",
+            project_id="project",
+            source="phospho-unknown",
+        ),
+        Event(
+            event_name="removed",
+            task_id="task",
+            project_id="project",
+            source="phospho-unknown",
+            removed=True,
+        ),
+    ]
+    task_updates, session_updates = build_add_events_updates(events)
+    assert [task_filter for task_filter, _ in task_updates] == [{"id": "task"}]
+    assert [session_filter for session_filter, _ in session_updates] == [
+        {"id": "session"}
+    ]
@@ -0,0 +1,43 @@
+import time
+
+from loguru import logger
+
+from app.services.log import merge_duplicate_tasks
+
+
+def test_merge_duplicate_tasks():
+    tasks = [
+        {"id": "a", "created_at": 10, "output": "Hel", "metadata": {"x": 1}},
+        {"id": "b", "created_at": 11, "output": "Hi", "metadata": {}},
+        {"id": "a", "created_at": 12, "output": "Hello", "metadata": {"y": 2}},
+    ]
+
+    merged_tasks = merge_duplicate_tasks(tasks)
+
+    assert [task["id"] for task in merged_tasks] == ["a", "b"]
+    # The last occurrence wins, but the task keeps its earliest creation time
+    assert merged_tasks[0]["output"] == "Hello"
+    assert merged_tasks[0]["created_at"] == 10
+    assert merged_tasks[0]["metadata"] == {"x": 1, "y": 2}
+
+
+def test_merge_duplicate_tasks_benchmark():
+    # 10k events per batch, a fifth of them being streamed updates of previous tasks
+    nb_events = 10_000
+    tasks = [
+        {
+            "id": f"task_{i - 1 if i % 5 == 4 else i}",
+            "created_at": i,
+            "output": f"output {i}",
+            "metadata": {"i": i},
+        }
+        for i in range(nb_events)
+    ]
+
+    start_time = time.perf_counter()
+    merged_tasks = merge_duplicate_tasks(tasks)
+    duration = time.perf_counter() - start_time
+    logger.info(f"Merged {nb_events} tasks in {duration * 1000:.1f} ms")
+
+    assert len(merged_tasks) == len({task["id"] for task in tasks})
+    assert duration < 1
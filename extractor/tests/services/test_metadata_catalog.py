@@ -0,0 +1,44 @@
+from app.db.models import Task
+from app.services.metadata_catalog import (
+    HLL_REGISTERS,
+    TOP_VALUES_SIZE,
+    compute_metadata_summaries,
+)
+
+
+def test_compute_metadata_summaries():
+    tasks = [
+        Task(project_id="p", input="a", metadata={"user_id": "alice", "tokens": 10}),
+        Task(project_id="p", input="b", metadata={"user_id": "bob", "tokens": 3}),
+        Task(project_id="p", input="c", metadata={"user_id": "alice", "ok": True}),
+        Task(project_id="q", input="d", metadata={"user_id": "carol"}),
+    ]
+
+    summaries = compute_metadata_summaries(tasks)
+
+    assert set(summaries.keys()) == {
+        ("p", "user_id"),
+        ("p", "tokens"),
+        ("p", "ok"),
+        ("q", "user_id"),
+    }
+    user_id = summaries[("p", "user_id")]
+    assert user_id["count"] == 3
+    assert user_id["types"] == {"string": 3}
+    assert user_id["values"] == {"alice": 2, "bob": 1}
+    assert len(user_id["registers"]) == HLL_REGISTERS
+    tokens = summaries[("p", "tokens")]
+    assert (tokens["min"], tokens["max"]) == (3, 10)
+    assert summaries[("p", "ok")]["types"] == {"boolean": 1}
+
+
+def test_metadata_summaries_are_bounded():
+    tasks = [
+        Task(project_id="p", input="a", metadata={"user_id": f"user_{i}"})
+        for i in range(20 * TOP_VALUES_SIZE)
+    ]
+
+    summaries = compute_metadata_summaries(tasks)
+
+    assert summaries[("p", "user_id")]["count"] == 20 * TOP_VALUES_SIZE
+    assert len(summaries[("p", "user_id")]["values"]) <= 10 * TOP_VALUES_SIZE
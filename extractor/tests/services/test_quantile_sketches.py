@@ -0,0 +1,47 @@
+from app.db.models import Task
+from app.services.quantile_sketches import (
+    DAY,
+    compute_metadata_sketch_increments,
+    compute_session_length_increments,
+    get_bucket_key,
+)
+
+
+def test_compute_metadata_sketch_increments():
+    tasks = [
+        Task(project_id="p", input="a", created_at=DAY + 10, metadata={"tokens": 10}),
+        Task(project_id="p", input="b", created_at=DAY + 20, metadata={"tokens": 10}),
+        Task(
+            project_id="p",
+            input="c",
+            created_at=2 * DAY,
+            metadata={"tokens": 0, "ok": True, "user_id": "alice"},
+        ),
+    ]
+
+    increments = compute_metadata_sketch_increments(tasks)
+
+    # Only the number values are counted, per day
+    assert set(increments.keys()) == {
+        ("p", DAY, "metadata.tokens"),
+        ("p", 2 * DAY, "metadata.tokens"),
+    }
+    buckets, total = increments[("p", DAY, "metadata.tokens")]
+    assert buckets == {get_bucket_key(10): 2}
+    assert total == 20
+    buckets, total = increments[("p", 2 * DAY, "metadata.tokens")]
+    assert buckets == {"z": 1}
+
+
+def test_compute_session_length_increments():
+    sessions = [
+        {"id": "s1", "project_id": "p", "created_at": DAY, "session_length": 2},
+        {"id": "s2", "project_id": "p", "created_at": DAY, "session_length": 0},
+    ]
+
+    increments = compute_session_length_increments(sessions, {"s1": 1, "s2": 2})
+
+    # s1 moves from 2 to 3 and s2 is counted with a length of 2
+    buckets, total = increments[("p", DAY, "session_length")]
+    assert buckets == {get_bucket_key(2): 0, get_bucket_key(3): 1}
+    assert total == 3
@@ -0,0 +1,43 @@
+from app.db.models import Task
+from app.services.rollups import build_rollup_updates, get_task_rollup_keys
+
+
+def test_build_rollup_updates():
+    day = 1715040000  # 2024-05-07 00:00 UTC
+    increments = {
+        (day + 10, ("tasks", None)): 1,
+        (day + 20, ("tasks", None)): 1,
+        (day + 3600, ("tasks", None)): 1,
+        (day + 10, ("flag", "success")): 1,
+        (day + 20, ("flag", "success")): -1,
+    }
+    updates = {
+        (
+            update._filter["granularity"],
+            update._filter["period_start"],
+            update._filter["dimension"],
+            update._filter["value"],
+        ): update._doc["$inc"]["count"]
+        for update in build_rollup_updates("project_1", increments)
+    }
+    # Increments that cancel out are not written
+    assert updates == {
+        ("hour", day, "tasks", None): 2,
+        ("hour", day + 3600, "tasks", None): 1,
+        ("day", day, "tasks", None): 3,
+    }
+
+
+def test_get_task_rollup_keys():
+    task = Task(
+        project_id="project_1",
+        org_id="org_1",
+        input="hello",
+        flag="failure",
+        metadata={"version_id": 2},
+    )
+    assert get_task_rollup_keys(task) == [
+        ("tasks", None),
+        ("flag", "failure"),
+        ("version_id", "2"),
+    ]
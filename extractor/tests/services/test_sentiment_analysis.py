@@ -0,0 +1,31 @@
+import pytest
+
+from app.services import sentiment_analysis
+from phospho.models import SentimentObject
+
+
+@pytest.mark.asyncio
+async def test_run_sentiment_and_language_analysis_batch(monkeypatch):
+    analyzed_texts = []
+
+    def fake_analyze_text(text: str):
+        analyzed_texts.append(text)
+        score = 0.9 if "love" in text else -0.9
+        return SentimentObject(score=score, magnitude=0.9), "en"
+
+    monkeypatch.setattr(sentiment_analysis, "analyze_text", fake_analyze_text)
+
+    results = await sentiment_analysis.run_sentiment_and_language_analysis_batch(
+        ["I love it", "I hate it", "I love it"],
+        score_threshold=0.3,
+        magnitude_threshold=0.6,
+    )
+
+    # Identical texts are analyzed once
+    assert sorted(analyzed_texts) == ["I hate it", "I love it"]
+    assert [sentiment.label for sentiment, _ in results] == [
+        "positive",
+        "negative",
+        "positive",
+    ]
+    assert all(language == "en" for _, language in results)
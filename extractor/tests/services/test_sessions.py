@@ -0,0 +1,38 @@
+from app.db.models import Task
+from app.services.sessions import compute_sessions_aggregates, compute_task_positions
+
+
+def test_compute_sessions_aggregates():
+    tasks = [
+        Task(project_id="p", input="b", session_id="s1", created_at=20),
+        Task(project_id="p", input="a", output="x", session_id="s1", created_at=10),
+        Task(project_id="p", input="c", session_id="s1", created_at=30, flag="success"),
+        Task(project_id="p", input="d", session_id="s2", created_at=5, flag="failure"),
+        Task(project_id="p", input="e", created_at=1),
+    ]
+
+    aggregates = compute_sessions_aggregates(tasks)
+
+    assert set(aggregates.keys()) == {"s1", "s2"}
+    assert aggregates["s1"]["session_length"] == 3
+    assert aggregates["s1"]["first_task_created_at"] == 10
+    assert aggregates["s1"]["last_task_created_at"] == 30
+    assert aggregates["s1"]["preview"] == "a -> x"
+    assert aggregates["s1"]["nb_success"] == 1
+    assert aggregates["s2"]["nb_failure"] == 1
+
+
+def test_compute_task_positions():
+    tasks = [
+        {"id": "b", "session_id": "s1", "created_at": 20},
+        {"id": "a", "session_id": "s1", "created_at": 10},
+        {"id": "c", "session_id": "s1", "created_at": 20},
+        {"id": "d", "session_id": "s2", "created_at": 5},
+        {"id": "e", "session_id": None, "created_at": 1},
+    ]
+
+    compute_task_positions(tasks, session_lengths={"s1": 3})
+
+    positions = {task["id"]: task.get("task_position") for task in tasks}
+    # Tasks created at the same time keep the batch order
+    assert positions == {"a": 4, "b": 5, "c": 6, "d": 1, "e": None}
@@ -0,0 +1,24 @@
+from app.services.usage import build_usage_updates, get_billing_period
+
+
+def test_build_usage_updates():
+    may = 1715000000  # 2024-05-06
+    june = 1718000000  # 2024-06-10
+    job_results = [
+        {"org_id": "org_1", "created_at": may},
+        {"org_id": "org_1", "created_at": may},
+        {"org_id": "org_1", "created_at": june},
+        {"org_id": "org_2", "created_at": june},
+        # Job results without org are not counted
+        {"org_id": None, "created_at": june},
+    ]
+    assert get_billing_period(may) == "2024-05"
+
+    updates = {
+        update._filter["org_id"]: update._doc["$inc"]
+        for update in build_usage_updates(job_results)
+    }
+    assert updates == {
+        "org_1": {"nb_job_results": 3, "periods.2024-05": 2, "periods.2024-06": 1},
+        "org_2": {"nb_job_results": 1, "periods.2024-06": 1},
+    }
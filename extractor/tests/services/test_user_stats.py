@@ -0,0 +1,37 @@
+from app.db.models import Task
+from app.services.user_stats import compute_user_stats_increments
+
+
+def test_compute_user_stats_increments():
+    tasks = [
+        Task(
+            project_id="p",
+            session_id="s1",
+            input="a",
+            flag="success",
+            created_at=10,
+            metadata={"user_id": "alice", "total_tokens": 100},
+        ),
+        Task(
+            project_id="p",
+            session_id="s1",
+            input="b",
+            created_at=5,
+            metadata={"user_id": "alice", "total_tokens": "unknown"},
+        ),
+        Task(project_id="p", session_id="s2", input="c", metadata={"user_id": 42}),
+        Task(project_id="p", input="d", metadata={"total_tokens": 10}),
+    ]
+
+    increments = compute_user_stats_increments(tasks)
+
+    # Tasks without user_id are not counted
+    assert set(increments.keys()) == {("p", "alice"), ("p", "42")}
+    alice = increments[("p", "alice")]
+    assert alice["nb_tasks"] == 2
+    assert alice["nb_success"] == 1
+    assert alice["nb_failure"] == 0
+    assert alice["total_tokens"] == 100
+    assert alice["session_ids"] == ["s1"]
+    assert alice["first_seen_at"] == 5
+    assert alice["last_seen_at"] == 10
@@ -20,6 +20,8 @@ import pydantic
 
 from . import config, integrations, models, utils
 from ._version import __version__ as __version__
+from .bulk_import import BulkImportReport
+from .bulk_import import bulk_import as _bulk_import
 from .client import Client as Client
 from .consumer import Consumer as Consumer
 from .extractor import (
@@ -887,6 +889,67 @@ def backfill(tasks: List[models.Task]) -> None:
     client.backfill(tasks)
 
 
+def bulk_import(
+    source: Union[str, Any],
+    file_format: Optional[Literal["csv", "parquet", "jsonl"]] = None,
+    import_id: Optional[str] = None,
+    checkpoint_path: Optional[str] = None,
+    chunk_size: int = 10_000,
+    batch_size: int = 500,
+    max_workers: int = 4,
+    max_retries: int = 3,
+    read_options: Optional[Dict[str, object]] = None,
+) -> BulkImportReport:
+    """
+    Import historical data in phospho, from a CSV, Parquet or JSONL file or a
+    pandas DataFrame. Requires pandas, and pyarrow for Parquet files.
+
+    The file is read in chunks of chunk_size rows. Each chunk is converted to log
+    events and uploaded in gzip compressed batches of batch_size log events, with
+    max_workers requests in parallel. The tasks go through the usual pipelines.
+
+    The columns input, output, task_id, session_id, user_id, version_id,
+    created_at (date or UNIX timestamp in seconds), metadata (dict or JSON string),
+    flag and environment are fields of the log events. The other columns are
+    added to the metadata. Only input is required.
+
+    ```
+    report = phospho.bulk_import("history.csv", checkpoint_path="history.checkpoint")
+    print(f"{report.nb_sent} tasks imported ({report.rows_per_second:.0f} rows/s)")
+    ```
+
+    :param source: The path to the file, or a pandas DataFrame.
+    :param file_format: The format of the file. By default, guessed from its extension.
+    :param import_id: The id of the import, used to generate stable task ids. Default:
+        the absolute path of the file. Required for a DataFrame.
+    :param checkpoint_path: A file where the progress of the import is saved after each
+        chunk. If the import fails, run it again with the same checkpoint_path to resume it.
+    :param chunk_size: The number of rows read at once.
+    :param batch_size: The number of log events per request.
+    :param max_workers: The number of requests sent in parallel.
+    :param max_retries: The number of retries of a failed request.
+    :param read_options: Options passed to the pandas (or pyarrow) reader, eg: {"sep": ";"}.
+    :returns: The number of rows imported, of log events sent and rejected, and the throughput.
+    """
+    global client
+
+    if client is None:
+        raise ValueError("Call phospho.init() before calling phospho.bulk_import()")
+
+    return _bulk_import(
+        client=client,
+        source=source,
+        file_format=file_format,
+        import_id=import_id,
+        checkpoint_path=checkpoint_path,
+        chunk_size=chunk_size,
+        batch_size=batch_size,
+        max_workers=max_workers,
+        max_retries=max_retries,
+        read_options=read_options,
+    )
+
+
 def train(
     model: str, examples: list, task_type: str = "binary-classification"
 ) -> Optional[Dict[str, object]]:
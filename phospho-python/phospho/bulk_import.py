@@ -0,0 +1,399 @@
+"""
+Import historical data in phospho
+
+`phospho.bulk_import` reads a CSV, Parquet or JSONL file in chunks, converts
+each chunk to log events by column, and uploads them in gzip compressed
+batches, with several requests in parallel. Only one chunk is in memory.
+
+The number of rows imported is saved in a checkpoint file after each chunk.
+If the import fails, run it again with the same checkpoint file to resume it.
+The ids of the tasks without a task_id column are derived from the import id
+and the row number, so that the rows sent again when resuming are not
+duplicated.
+"""
+
+import datetime
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Iterator, List, Literal, Optional, Union
+
+import pydantic
+
+from .client import Client
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+FileFormat = Literal["csv", "parquet", "jsonl"]
+
+# The columns that are fields of a log event. The other columns are added to
+# the metadata.
+LOG_EVENT_COLUMNS = [
+    "input",
+    "output",
+    "task_id",
+    "session_id",
+    "user_id",
+    "version_id",
+    "created_at",
+    "metadata",
+    "flag",
+    "environment",
+]
+STRING_COLUMNS = [
+    "input",
+    "output",
+    "task_id",
+    "session_id",
+    "user_id",
+    "version_id",
+    "environment",
+]
+
+
+class BulkImportReport(pydantic.BaseModel):
+    nb_rows: int = 0  # rows read, without the ones skipped when resuming
+    nb_skipped: int = 0  # rows already imported, skipped when resuming
+    nb_sent: int = 0  # log events sent
+    nb_rejected: int = 0  # log events rejected by phospho
+    duration: float = 0.0  # in seconds
+
+    @property
+    def rows_per_second(self) -> float:
+        if self.duration <= 0:
+            return 0.0
+        return self.nb_rows / self.duration
+
+
+def _import_pandas():
+    try:
+        import pandas as pd
+    except ImportError:
+        raise ImportError(
+            "Please install the `pandas` package to use `phospho.bulk_import`: pip install 'phospho[lab]'"
+        )
+    return pd
+
+
+def get_file_format(source: str) -> FileFormat:
+    extension = os.path.splitext(source)[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in [".parquet", ".pq"]:
+        return "parquet"
+    if extension in [".jsonl", ".ndjson"]:
+        return "jsonl"
+    raise ValueError(
+        f"Can't guess the format of {source}. Pass file_format='csv', 'parquet' or 'jsonl'."
+    )
+
+
+def read_chunks(
+    source: Union[str, "pd.DataFrame"],
+    file_format: Optional[FileFormat],
+    chunk_size: int,
+    read_options: Optional[Dict[str, object]] = None,
+) -> Iterator["pd.DataFrame"]:
+    """
+    Read a file, or a DataFrame, in chunks of chunk_size rows
+    """
+    pd = _import_pandas()
+    if read_options is None:
+        read_options = {}
+
+    if isinstance(source, pd.DataFrame):
+        for start in range(0, len(source), chunk_size):
+            yield source.iloc[start : start + chunk_size]
+        return
+
+    if file_format is None:
+        file_format = get_file_format(source)
+    if file_format == "csv":
+        yield from pd.read_csv(source, chunksize=chunk_size, **read_options)
+    elif file_format == "jsonl":
+        yield from pd.read_json(
+            source, lines=True, chunksize=chunk_size, **read_options
+        )
+    elif file_format == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(
+                "Please install the `pyarrow` package to import Parquet files: pip install pyarrow"
+            )
+        parquet_file = pq.ParquetFile(source, **read_options)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Unsupported file format: {file_format}")
+
+
+def _to_timestamps(column: "pd.Series") -> "pd.Series":
+    """
+    Convert dates, or UNIX timestamps in seconds, to UNIX timestamps
+    """
+    pd = _import_pandas()
+    if pd.api.types.is_numeric_dtype(column):
+        dates = pd.to_datetime(column, unit="s", errors="coerce", utc=True)
+    else:
+        dates = pd.to_datetime(column, errors="coerce", utc=True, format="mixed")
+    timestamps = (dates - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)
+    return timestamps.astype("Int64")
+
+
+def _parse_metadata(value: object) -> Optional[dict]:
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return None
+        return value if isinstance(value, dict) else None
+    return None
+
+
+def _drop_missing(record: dict) -> dict:
+    return {key: value for key, value in record.items() if value is not None}
+
+
+def _to_json_value(value: object) -> object:
+    """
+    Convert the pandas and numpy values of the metadata to JSON values: dates
+    to UNIX timestamps, numpy scalars and arrays to Python values
+    """
+    pd = _import_pandas()
+    if isinstance(value, pd.Timestamp):
+        if value.tzinfo is None:
+            value = value.tz_localize("UTC")
+        return int(value.timestamp())
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return int(value.timestamp())
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, pd.Timedelta):
+        return value.total_seconds()
+    if hasattr(value, "tolist"):
+        # numpy scalars and arrays
+        return value.tolist()
+    return value
+
+
+def _get_serialization_errors(batch: List[Dict[str, object]]) -> List[int]:
+    """
+    The indexes of the log events of the batch that can't be serialized to JSON
+    """
+    errors = []
+    for index, log_event in enumerate(batch):
+        try:
+            json.dumps(log_event)
+        except (TypeError, ValueError):
+            errors.append(index)
+    return errors
+
+
+def to_log_events(
+    df: "pd.DataFrame", import_id: str, first_row: int
+) -> List[Dict[str, object]]:
+    """
+    Convert a chunk of rows to log events, by column.
+
+    The rows without input are skipped. The columns that are not fields of a
+    log event are added to the metadata. first_row is the number of the first
+    row of the chunk in the file.
+    """
+    pd = _import_pandas()
+    if "input" not in df.columns:
+        raise ValueError(f"The column 'input' is required. Columns: {list(df.columns)}")
+
+    df = df.copy()
+    df.index = pd.RangeIndex(first_row, first_row + len(df))
+    df = df[df["input"].notna()]
+
+    for column in STRING_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype(str).where(df[column].notna(), None)
+    # The ids of the tasks are stable when the import is resumed
+    task_ids = pd.Series(
+        [str(uuid.uuid5(uuid.NAMESPACE_URL, f"{import_id}/{row}")) for row in df.index],
+        index=df.index,
+    )
+    if "task_id" in df.columns:
+        df["task_id"] = df["task_id"].where(df["task_id"].notna(), task_ids)
+    else:
+        df["task_id"] = task_ids
+    if "created_at" in df.columns:
+        df["created_at"] = _to_timestamps(df["created_at"])
+    if "flag" in df.columns:
+        flags = df["flag"].astype(str).str.strip().str.lower()
+        df["flag"] = flags.where(flags.isin(["success", "failure"]), None)
+
+    metadata_columns = [
+        column for column in df.columns if column not in LOG_EVENT_COLUMNS
+    ]
+    metadata: Optional[List[Dict[str, object]]] = None
+    if "metadata" in df.columns or len(metadata_columns) > 0:
+        base_metadata = (
+            df["metadata"].map(_parse_metadata)
+            if "metadata" in df.columns
+            else pd.Series([None] * len(df), index=df.index)
+        )
+        extra_metadata: List[Dict[str, object]] = [{}] * len(df)
+        if len(metadata_columns) > 0:
+            extra_metadata = (
+                df[metadata_columns]
+                .astype(object)
+                .where(df[metadata_columns].notna(), None)
+            ).to_dict(orient="records")
+        metadata = [
+            {
+                **(row_metadata or {}),
+                **{
+                    key: _to_json_value(value)
+                    for key, value in _drop_missing(row_extra_metadata).items()
+                },
+            }
+            for row_metadata, row_extra_metadata in zip(base_metadata, extra_metadata)
+        ]
+
+    columns = [column for column in LOG_EVENT_COLUMNS if column in df.columns]
+    df = df[[column for column in columns if column != "metadata"]]
+    records = df.astype(object).where(df.notna(), None).to_dict(orient="records")
+    log_events = [_drop_missing(record) for record in records]
+    if metadata is not None:
+        for log_event, row_metadata in zip(log_events, metadata):
+            log_event["metadata"] = row_metadata
+    return log_events
+
+
+def _upload_batch(
+    client: Client, batch: List[Dict[str, object]], max_retries: int
+) -> int:
+    """
+    Send a batch of log events, retrying with an exponential backoff.
+    Returns the number of log events rejected by phospho, or not sent because
+    they can't be serialized to JSON.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            response = client._post(
+                f"/log/{client._project_id()}",
+                {"batched_log_events": batch},
+                compress=True,
+            )
+            logged_events = response.json().get("logged_events", [])
+            return sum(1 for event in logged_events if "error_in_log" in event)
+        except TypeError as e:
+            # Raised by json.dumps: sending the batch again would fail the same
+            # way, so the log events that can't be serialized are rejected
+            errors = set(_get_serialization_errors(batch))
+            if len(errors) == 0:
+                raise e
+            logger.warning(
+                f"{len(errors)} log events can't be serialized to JSON and are rejected: {e}"
+            )
+            batch = [
+                log_event
+                for index, log_event in enumerate(batch)
+                if index not in errors
+            ]
+            if len(batch) == 0:
+                return len(errors)
+            return len(errors) + _upload_batch(client, batch, max_retries)
+        except Exception as e:
+            if attempt == max_retries:
+                raise e
+            wait_time = min(2**attempt, 60)
+            logger.warning(f"Error sending log events: {e}. Retrying in {wait_time}s")
+            time.sleep(wait_time)
+    return 0
+
+
+def _read_checkpoint(checkpoint_path: Optional[str], import_id: str) -> int:
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("import_id") != import_id:
+        raise ValueError(
+            f"The checkpoint {checkpoint_path} is for the import {checkpoint.get('import_id')}, not {import_id}"
+        )
+    return checkpoint.get("nb_rows", 0)
+
+
+def _write_checkpoint(
+    checkpoint_path: Optional[str], import_id: str, nb_rows: int
+) -> None:
+    if checkpoint_path is None:
+        return
+    with open(checkpoint_path, "w") as f:
+        json.dump({"import_id": import_id, "nb_rows": nb_rows}, f)
+
+
+def bulk_import(
+    client: Client,
+    source: Union[str, "pd.DataFrame"],
+    file_format: Optional[FileFormat] = None,
+    import_id: Optional[str] = None,
+    checkpoint_path: Optional[str] = None,
+    chunk_size: int = 10_000,
+    batch_size: int = 500,
+    max_workers: int = 4,
+    max_retries: int = 3,
+    read_options: Optional[Dict[str, object]] = None,
+) -> BulkImportReport:
+    """
+    Import historical data in phospho. See `phospho.bulk_import`.
+    """
+    if import_id is None:
+        if not isinstance(source, str):
+            raise ValueError("Pass an import_id to import a DataFrame")
+        import_id = os.path.abspath(source)
+    nb_rows_done = _read_checkpoint(checkpoint_path, import_id)
+
+    report = BulkImportReport(nb_skipped=nb_rows_done)
+    started_at = time.perf_counter()
+    first_row = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for chunk in read_chunks(source, file_format, chunk_size, read_options):
+            chunk_first_row = first_row
+            first_row += len(chunk)
+            # Skip the rows imported before the checkpoint
+            if first_row <= nb_rows_done:
+                continue
+            if chunk_first_row < nb_rows_done:
+                chunk = chunk.iloc[nb_rows_done - chunk_first_row :]
+                chunk_first_row = nb_rows_done
+
+            log_events = to_log_events(chunk, import_id, chunk_first_row)
+            batches = [
+                log_events[start : start + batch_size]
+                for start in range(0, len(log_events), batch_size)
+            ]
+            # Raises if a batch fails after max_retries: the import can be
+            # resumed from the last checkpoint
+            nb_rejected = sum(
+                executor.map(
+                    lambda batch: _upload_batch(client, batch, max_retries), batches
+                )
+            )
+
+            report.nb_rows += len(chunk)
+            report.nb_sent += len(log_events)
+            report.nb_rejected += nb_rejected
+            report.duration = time.perf_counter() - started_at
+            _write_checkpoint(checkpoint_path, import_id, first_row)
+            logger.info(
+                f"Imported {nb_rows_done + report.nb_rows} rows ({report.rows_per_second:.0f} rows/s)"
+            )
+
+    report.duration = time.perf_counter() - started_at
+    return report
@@ -2,6 +2,8 @@
 phospho client to interact with the phospho API
 """
 
+import gzip
+import json
 import os
 from typing import Dict, List, Literal, Optional
 
@@ -91,10 +93,25 @@ class Client:
                 )
 
     def _post(
-        self, path: str, payload: Optional[Dict[str, object]] = None
+        self,
+        path: str,
+        payload: Optional[Dict[str, object]] = None,
+        stream: bool = False,
+        compress: bool = False,
     ) -> requests.Response:
         url = f"{self.base_url}{path}"
-        response = requests.post(url, headers=self._headers(), json=payload)
+        if compress:
+            # Gzip the JSON body, for the large payloads
+            response = requests.post(
+                url,
+                headers={**self._headers(), "content-encoding": "gzip"},
+                data=gzip.compress(json.dumps(payload).encode()),
+                stream=stream,
+            )
+        else:
+            response = requests.post(
+                url, headers=self._headers(), json=payload, stream=stream
+            )
 
         if response.status_code >= 200 and response.status_code < 300:
             return response
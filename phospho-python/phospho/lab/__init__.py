@@ -3,3 +3,8 @@ from .models import JobResult, Message, JobConfig, EventConfig, ResultType
 from . import job_library as job_library
 from . import utils as utils
 from .language_models import get_provider_and_model, get_async_client, get_sync_client
+from .embeddings import (
+    EmbeddingProvider,
+    get_embedding_provider,
+    get_configured_embedding_provider,
+)
@@ -0,0 +1,250 @@
+"""
+Embedding providers
+
+An embedding model is a string in the format "provider:model", eg:
+- "openai:text-embedding-3-small" (default provider if no provider is specified)
+- "local:sentence-transformers/all-MiniLM-L6-v2", a sentence-transformers model
+  run on CPU, without network calls
+
+The same model must be used to embed the texts and the queries to compare
+them. Use get_embedding_provider to get the provider of a model, or
+get_configured_embedding_provider to also set the options of the local models.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# The dimensions of the OpenAI models, to avoid an API call
+OPENAI_EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+def get_embedding_provider_and_model(model: str) -> Tuple[str, str]:
+    """
+    Get the provider and model from a string in the format "provider:model"
+    If no provider is specified, it defaults to "openai".
+    """
+    if ":" not in model:
+        return "openai", model
+    provider, model_name = model.split(":", 1)
+    return provider, model_name
+
+
+class EmbeddingProvider:
+    """
+    Compute the embeddings of texts with a model
+    """
+
+    provider: str
+    model: str
+
+    def __init__(self, model: str) -> None:
+        self.model = model
+        self._dimension: Optional[int] = None
+
+    async def embed(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Returns a list of the same length as texts. The embedding is None for
+        the texts that couldn't be embedded.
+        """
+        raise NotImplementedError
+
+    async def get_dimension(self) -> int:
+        """
+        The size of the vectors of the model
+        """
+        if self._dimension is None:
+            embedding = (await self.embed(["dimension"]))[0]
+            if embedding is None:
+                raise ValueError(f"Can't get the dimension of the model {self.model}")
+            self._dimension = len(embedding)
+        return self._dimension
+
+    def close(self) -> None:
+        pass
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    provider = "openai"
+
+    def __init__(self, model: str, max_inputs_per_request: int = 2048) -> None:
+        super().__init__(model)
+        self.max_inputs_per_request = max_inputs_per_request
+        self._dimension = OPENAI_EMBEDDING_DIMENSIONS.get(model)
+        self._client: Any = None
+
+    async def embed(self, texts: List[str]) -> List[Optional[List[float]]]:
+        import openai
+
+        if self._client is None:
+            self._client = openai.AsyncClient()
+
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        for start in range(0, len(texts), self.max_inputs_per_request):
+            batch = texts[start : start + self.max_inputs_per_request]
+            try:
+                response = await self._client.embeddings.create(
+                    # The OpenAI API rejects empty strings
+                    input=[text or " " for text in batch],
+                    model=self.model,
+                )
+            except openai.APIError as e:
+                logger.warning(f"Error while embedding {len(batch)} texts: {e}")
+                continue
+            for index, embedding in enumerate(response.data):
+                embeddings[start + index] = embedding.embedding
+        return embeddings
+
+
+# The model loaded in each worker process of a LocalEmbeddingProvider
+_local_model: Any = None
+
+
+def load_sentence_transformer(model: str) -> Any:
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        raise ImportError(
+            "Please install the `sentence-transformers` package to use local embeddings: pip install 'phospho[embeddings]'"
+        )
+    return SentenceTransformer(model, device="cpu")
+
+
+def _init_worker(model: str, load_model: Callable[[str], Any], nb_threads: int) -> None:
+    global _local_model
+    try:
+        import torch
+
+        # Avoid that the workers compete for the same cores
+        torch.set_num_threads(nb_threads)
+    except ImportError:
+        pass
+    _local_model = load_model(model)
+
+
+def _encode(texts: List[str], batch_size: int) -> List[List[float]]:
+    embeddings = _local_model.encode(
+        texts, batch_size=batch_size, normalize_embeddings=True
+    )
+    return [list(map(float, embedding)) for embedding in embeddings]
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    Run a sentence-transformers model on CPU, in a pool of processes. Each
+    process loads the model once and embeds batches of batch_size texts.
+    """
+
+    provider = "local"
+
+    def __init__(
+        self,
+        model: str,
+        max_workers: Optional[int] = None,
+        batch_size: int = 64,
+        load_model: Callable[[str], Any] = load_sentence_transformer,
+    ) -> None:
+        super().__init__(model)
+        if max_workers is None:
+            max_workers = max(1, (os.cpu_count() or 1) // 2)
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.load_model = load_model
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            nb_threads = max(1, (os.cpu_count() or 1) // self.max_workers)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                # Forking a process that already uses threads is not safe
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model, self.load_model, nb_threads),
+            )
+        return self._executor
+
+    async def embed(self, texts: List[str]) -> List[Optional[List[float]]]:
+        if len(texts) == 0:
+            return []
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        batches = [
+            texts[start : start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        results = await asyncio.gather(
+            *[
+                loop.run_in_executor(executor, _encode, batch, self.batch_size)
+                for batch in batches
+            ],
+            return_exceptions=True,
+        )
+        embeddings: List[Optional[List[float]]] = []
+        for batch, result in zip(batches, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"Error while embedding {len(batch)} texts: {result}")
+                embeddings.extend([None] * len(batch))
+            else:
+                embeddings.extend(result)
+        return embeddings
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+_providers: Dict[str, EmbeddingProvider] = {}
+
+
+def get_embedding_provider(model: str, **kwargs: Any) -> EmbeddingProvider:
+    """
+    Get the provider of an embedding model, eg: "openai:text-embedding-3-small"
+    or "local:sentence-transformers/all-MiniLM-L6-v2". The providers are reused
+    (the local models are only loaded once). The kwargs are passed to the
+    provider when it's created.
+    """
+    if model in _providers:
+        return _providers[model]
+    provider, model_name = get_embedding_provider_and_model(model)
+    embedding_provider: EmbeddingProvider
+    if provider == "openai":
+        embedding_provider = OpenAIEmbeddingProvider(model_name, **kwargs)
+    elif provider == "local":
+        embedding_provider = LocalEmbeddingProvider(model_name, **kwargs)
+    else:
+        raise NotImplementedError(f"Embedding provider {provider} is not supported.")
+    _providers[model] = embedding_provider
+    return embedding_provider
+
+
+def get_configured_embedding_provider(
+    model: str, max_workers: Optional[int] = None, batch_size: int = 64
+) -> EmbeddingProvider:
+    """
+    Get the provider of an embedding model. max_workers and batch_size are the
+    options of the local models (see LocalEmbeddingProvider), ignored for the
+    other providers.
+    """
+    provider, _ = get_embedding_provider_and_model(model)
+    if provider == "local":
+        return get_embedding_provider(
+            model, max_workers=max_workers, batch_size=batch_size
+        )
+    return get_embedding_provider(model)
+
+
+def close_embedding_providers() -> None:
+    for embedding_provider in _providers.values():
+        embedding_provider.close()
+    _providers.clear()
@@ -0,0 +1,20 @@
+"""
+Events stored on the task and session documents
+
+The events of a task (and of a session) are denormalized in the `events` field
+of the document, so that listing and filtering tasks and sessions by event
+doesn't need to join the events collection. The backend and the extractor
+both store the summaries returned by get_event_summary in this field.
+
+The events are deduplicated on (task_id, event_name) and removed events are not
+kept. The `task` and `messages` fields of the events are not stored, as they
+duplicate the document itself.
+"""
+
+from phospho.models import Event
+
+EVENT_SUMMARY_EXCLUDED_FIELDS = {"task", "messages"}
+
+
+def get_event_summary(event: Event) -> dict:
+    return event.model_dump(exclude=EVENT_SUMMARY_EXCLUDED_FIELDS)
@@ -551,11 +551,20 @@ async def evaluate_task(
 
         # Format the examples
         examples = []
+        # The text_prompt of the examples may be precomputed
         for example in successful_examples:
-            text_prompt = f"User: {example['input']}\nAssistant: {example['output']}"
+            text_prompt = example.get("text_prompt")
+            if text_prompt is None:
+                text_prompt = (
+                    f"User: {example['input']}\nAssistant: {example['output']}"
+                )
             examples.append(Example(text_prompt, "success"))
         for example in unsuccessful_examples:
-            text_prompt = f"User: {example['input']}\nAssistant: {example['output']}"
+            text_prompt = example.get("text_prompt")
+            if text_prompt is None:
+                text_prompt = (
+                    f"User: {example['input']}\nAssistant: {example['output']}"
+                )
             examples.append(Example(text_prompt, "failure"))
 
         # Shuffle the examples
@@ -0,0 +1,96 @@
+"""
+Summaries of the metadata fields of the tasks, for the metadata catalog
+
+A field summary counts the values per type, keeps the min and max of the number
+values, HyperLogLog registers to estimate the number of distinct values, and
+the most frequent string values. The summaries are bounded: they don't grow
+with the number of values.
+
+The extractor merges the summaries of the logged tasks into the catalog, and
+the backend builds the catalog of the older projects with the same summaries.
+"""
+
+import hashlib
+import math
+from collections import Counter
+from typing import Any, List, Optional, Tuple
+
+TOP_VALUES_SIZE = 100
+# Number of HyperLogLog registers (2^HLL_PRECISION), ~9% error on the cardinality
+HLL_PRECISION = 7
+HLL_REGISTERS = 2**HLL_PRECISION
+
+
+def get_value_type(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, list):
+        return "array"
+    return "other"
+
+
+def get_hll_register(value: Any) -> Tuple[int, int]:
+    """
+    The HyperLogLog register of a value and its rank (position of the first 1 bit)
+    """
+    value_hash = int.from_bytes(
+        hashlib.sha1(str(value).encode()).digest()[:8], byteorder="big"
+    )
+    index = value_hash >> (64 - HLL_PRECISION)
+    remaining_bits = value_hash & ((1 << (64 - HLL_PRECISION)) - 1)
+    rank = (64 - HLL_PRECISION) - remaining_bits.bit_length() + 1
+    return index, rank
+
+
+def estimate_cardinality(registers: Optional[List[int]]) -> int:
+    """
+    Estimate the number of distinct values from the HyperLogLog registers
+    """
+    if not registers:
+        return 0
+    nb_registers = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / nb_registers)
+    estimate = alpha * nb_registers**2 / sum(2.0**-register for register in registers)
+    nb_empty_registers = registers.count(0)
+    if estimate <= 2.5 * nb_registers and nb_empty_registers > 0:
+        # Small range correction (linear counting)
+        estimate = nb_registers * math.log(nb_registers / nb_empty_registers)
+    return round(estimate)
+
+
+def new_field_summary() -> dict:
+    return {
+        "count": 0,
+        "types": Counter(),
+        "min": None,
+        "max": None,
+        "registers": [0] * HLL_REGISTERS,
+        "values": Counter(),
+    }
+
+
+def add_value_to_summary(summary: dict, value: Any, count: int = 1) -> None:
+    value_type = get_value_type(value)
+    summary["count"] += count
+    summary["types"][value_type] += count
+    if value_type == "number":
+        summary["min"] = value if summary["min"] is None else min(summary["min"], value)
+        summary["max"] = value if summary["max"] is None else max(summary["max"], value)
+    if value_type in ["number", "string", "boolean"]:
+        index, rank = get_hll_register(value)
+        summary["registers"][index] = max(summary["registers"][index], rank)
+    if value_type == "string":
+        summary["values"][value] += count
+        # Keep the summary bounded
+        if len(summary["values"]) > 10 * TOP_VALUES_SIZE:
+            summary["values"] = Counter(
+                dict(summary["values"].most_common(TOP_VALUES_SIZE))
+            )
@@ -0,0 +1,35 @@
+"""
+Logarithmic buckets of the quantile sketches (DDSketch)
+
+A positive value x is counted in the bucket p<i> with
+i = ceil(log(x) / log(GAMMA)), a negative value in n<i> and zero in z. Any
+quantile is estimated with a relative error of at most RELATIVE_ACCURACY.
+
+The extractor counts the values of the logged tasks in these buckets, and the
+backend builds the sketches of the older projects and estimates the quantiles
+with the same buckets.
+"""
+
+import math
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+
+def get_bucket_key(value: float) -> str:
+    if value > 0:
+        return f"p{math.ceil(math.log(value) / LOG_GAMMA)}"
+    if value < 0:
+        return f"n{math.ceil(math.log(-value) / LOG_GAMMA)}"
+    return "z"
+
+
+def get_bucket_value(key: str) -> float:
+    """
+    The value representing a bucket, within RELATIVE_ACCURACY of all its values
+    """
+    if key == "z":
+        return 0.0
+    value = 2 * GAMMA ** int(key[1:]) / (GAMMA + 1)
+    return value if key[0] == "p" else -value
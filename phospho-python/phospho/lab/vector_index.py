@@ -0,0 +1,463 @@
+"""
+In-process vector index, a fallback for Qdrant
+
+LocalVectorIndex implements the part of the AsyncQdrantClient interface used by
+the backend and the extractor (collections, upsert, retrieve and search with
+filters on payload values and ids), so that they can run without a Qdrant
+server, eg: small deployments and CI.
+
+The index is flat: a search computes the cosine similarity of the query with
+all the vectors matching the filter (exact search). The payload values used in
+filters, eg: project_id, are indexed in memory.
+
+Each collection is stored in a directory:
+- config.json: the size of the vectors
+- vectors.f32: the normalized vectors, as a float32 matrix (memory-mapped)
+- points.jsonl: the id, row and payload of the points, appended on each upsert
+
+Several processes can read the same directory (eg: the backend), they load the
+points appended since their last read before each operation. Only one process
+can write to it (eg: the extractor): the writer holds an exclusive lock on the
+writer.lock file of the directory until it's closed, and the upserts of the
+other processes raise an error. So with several replicas of the writer, use
+Qdrant instead.
+
+The lock relies on flock, which is not reliable on network filesystems (NFS,
+Cloud Storage FUSE...). The index must be on a local disk, shared by the
+processes of a single machine: acquire_writer_lock refuses network filesystems.
+
+The file reads and the similarity computations run in a thread, not to block
+the event loop.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+from types import SimpleNamespace
+from typing import IO, Any, Dict, List, Optional, Sequence, Set, Union
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the single writer is not enforced
+    fcntl = None  # type: ignore
+
+VECTOR_DTYPE = np.float32
+# Filesystems on which flock doesn't guarantee a single writer
+NETWORK_FILESYSTEM_TYPES = {
+    "nfs",
+    "nfs4",
+    "cifs",
+    "smb3",
+    "smbfs",
+    "9p",
+    "ceph",
+    "glusterfs",
+    "fuse.gcsfuse",
+    "fuse.s3fs",
+    "fuse.sshfs",
+    "fuse.rclone",
+}
+
+
+def get_filesystem_type(path: str) -> Optional[str]:
+    """
+    The type of the filesystem of a path, from /proc/mounts. None if unknown,
+    eg: not on Linux.
+    """
+    path = os.path.realpath(path)
+    filesystem_type = None
+    mount_point_length = -1
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace("\\040", " ")
+                if (
+                    path == mount_point
+                    or path.startswith(mount_point.rstrip("/") + "/")
+                ) and len(mount_point) > mount_point_length:
+                    filesystem_type = fields[2]
+                    mount_point_length = len(mount_point)
+    except OSError:
+        return None
+    return filesystem_type
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def _select_payload(
+    payload: Optional[dict], with_payload: Union[bool, Sequence[str]]
+) -> Optional[dict]:
+    if payload is None or with_payload is False:
+        return None
+    if with_payload is True:
+        return payload
+    return {key: payload[key] for key in with_payload if key in payload}
+
+
+class LocalCollection:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, "config.json")) as f:
+            self.size: int = json.load(f)["size"]
+        self.ids: List[str] = []
+        self.payloads: List[Optional[dict]] = []
+        self.rows_by_id: Dict[str, int] = {}
+        # key -> payload value -> rows
+        self.payload_indexes: Dict[str, Dict[Any, Set[int]]] = {}
+        self.vectors: np.ndarray = np.empty((0, self.size), dtype=VECTOR_DTYPE)
+        self._points_offset = 0
+        # The operations run in threads, see LocalVectorIndex
+        self._lock = threading.RLock()
+        self.refresh()
+
+    @property
+    def vectors_path(self) -> str:
+        return os.path.join(self.path, "vectors.f32")
+
+    @property
+    def points_path(self) -> str:
+        return os.path.join(self.path, "points.jsonl")
+
+    def refresh(self) -> None:
+        """
+        Load the points appended to the collection since the last refresh
+        """
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self) -> None:
+        if not os.path.exists(self.points_path):
+            return
+        if os.path.getsize(self.points_path) == self._points_offset:
+            return
+        with open(self.points_path, "rb") as f:
+            f.seek(self._points_offset)
+            data = f.read()
+        # The last line may be incomplete if the writer is appending to it
+        data = data[: data.rfind(b"\n") + 1]
+        self._points_offset += len(data)
+        for line in data.splitlines():
+            point = json.loads(line)
+            self._set_point(point["id"], point["row"], point["payload"])
+        if len(self.ids) > 0:
+            self.vectors = np.memmap(
+                self.vectors_path,
+                dtype=VECTOR_DTYPE,
+                mode="r",
+                shape=(len(self.ids), self.size),
+            )
+
+    def _set_point(self, point_id: str, row: int, payload: Optional[dict]) -> None:
+        if row == len(self.ids):
+            self.ids.append(point_id)
+            self.payloads.append(None)
+        previous_payload = self.payloads[row] or {}
+        for key, index in self.payload_indexes.items():
+            if key in previous_payload:
+                index.get(previous_payload[key], set()).discard(row)
+            if payload is not None and key in payload:
+                index.setdefault(payload[key], set()).add(row)
+        self.payloads[row] = payload
+        self.rows_by_id[point_id] = row
+
+    def get_rows(self, key: str, value: Any) -> Set[int]:
+        """
+        The rows whose payload[key] is value
+        """
+        if key not in self.payload_indexes:
+            index: Dict[Any, Set[int]] = {}
+            for row, payload in enumerate(self.payloads):
+                if payload is not None and key in payload:
+                    index.setdefault(payload[key], set()).add(row)
+            self.payload_indexes[key] = index
+        return self.payload_indexes[key].get(value, set())
+
+    def upsert(self, points: Sequence[Any]) -> None:
+        with self._lock:
+            self._upsert(points)
+
+    def _upsert(self, points: Sequence[Any]) -> None:
+        self._refresh()
+        # The last upsert of an id in the batch wins
+        points_by_id = {str(point.id): point for point in points}
+        next_row = len(self.ids)
+        lines = []
+        with open(
+            self.vectors_path, "r+b" if os.path.exists(self.vectors_path) else "w+b"
+        ) as f:
+            for point_id, point in points_by_id.items():
+                vector = np.asarray(point.vector, dtype=VECTOR_DTYPE)
+                if vector.shape != (self.size,):
+                    raise ValueError(
+                        f"Vector of size {vector.shape} for a collection of size {self.size}"
+                    )
+                row = self.rows_by_id.get(point_id)
+                if row is None:
+                    row = next_row
+                    next_row += 1
+                f.seek(row * self.size * VECTOR_DTYPE().itemsize)
+                f.write(_normalize(vector).astype(VECTOR_DTYPE).tobytes())
+                lines.append(
+                    json.dumps({"id": point_id, "row": row, "payload": point.payload})
+                )
+        # The vectors are written before the points referencing them
+        with open(self.points_path, "a") as f:
+            f.write("".join(f"{line}\n" for line in lines))
+        self._refresh()
+
+    def filter_rows(self, query_filter: Any) -> Optional[np.ndarray]:
+        """
+        The rows matching all the conditions of query_filter.must, None if
+        there is no condition
+        """
+        if query_filter is None or not query_filter.must:
+            return None
+        rows: Optional[Set[int]] = None
+        for condition in query_filter.must:
+            if getattr(condition, "has_id", None) is not None:
+                matching_rows = {
+                    self.rows_by_id[str(point_id)]
+                    for point_id in condition.has_id
+                    if str(point_id) in self.rows_by_id
+                }
+            elif getattr(condition, "match", None) is not None and hasattr(
+                condition.match, "value"
+            ):
+                matching_rows = self.get_rows(condition.key, condition.match.value)
+            else:
+                raise NotImplementedError(f"Unsupported filter condition: {condition}")
+            rows = matching_rows if rows is None else rows & matching_rows
+        return np.fromiter(sorted(rows or set()), dtype=np.int64)
+
+    def search(
+        self,
+        query_vector: Sequence[float],
+        query_filter: Any,
+        limit: int,
+        offset: int,
+        with_payload: Union[bool, Sequence[str]],
+        with_vectors: bool,
+    ) -> List[SimpleNamespace]:
+        with self._lock:
+            return self._search(
+                query_vector, query_filter, limit, offset, with_payload, with_vectors
+            )
+
+    def _search(
+        self,
+        query_vector: Sequence[float],
+        query_filter: Any,
+        limit: int,
+        offset: int,
+        with_payload: Union[bool, Sequence[str]],
+        with_vectors: bool,
+    ) -> List[SimpleNamespace]:
+        self._refresh()
+        rows = self.filter_rows(query_filter)
+        if rows is None:
+            rows = np.arange(len(self.ids))
+        if len(rows) == 0 or limit + offset == 0:
+            return []
+        query = _normalize(np.asarray(query_vector, dtype=VECTOR_DTYPE))
+        scores = self.vectors[rows] @ query
+        nb_results = min(limit + offset, len(rows))
+        best = np.argpartition(-scores, nb_results - 1)[:nb_results]
+        best = best[np.argsort(-scores[best], kind="stable")][offset:]
+        return [
+            SimpleNamespace(
+                id=self.ids[rows[index]],
+                version=0,
+                score=float(scores[index]),
+                payload=_select_payload(self.payloads[rows[index]], with_payload),
+                vector=self.vectors[rows[index]].tolist() if with_vectors else None,
+            )
+            for index in best
+        ]
+
+    def retrieve(
+        self,
+        ids: Sequence[Any],
+        with_payload: Union[bool, Sequence[str]],
+        with_vectors: bool,
+    ) -> List[SimpleNamespace]:
+        with self._lock:
+            self._refresh()
+            rows = [self.rows_by_id[str(i)] for i in ids if str(i) in self.rows_by_id]
+            return [
+                SimpleNamespace(
+                    id=self.ids[row],
+                    payload=_select_payload(self.payloads[row], with_payload),
+                    vector=self.vectors[row].tolist() if with_vectors else None,
+                )
+                for row in rows
+            ]
+
+
+class LocalVectorIndex:
+    """
+    An in-process vector index with the interface of AsyncQdrantClient.
+    If path is None, the index is stored in a temporary directory, removed on
+    close.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self._is_temporary = path is None
+        if path is None:
+            path = tempfile.mkdtemp(prefix="phospho_vector_index_")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._collections: Dict[str, LocalCollection] = {}
+        self._collections_lock = threading.Lock()
+        self._writer_lock: Optional[IO] = None
+
+    def _try_lock(self) -> Optional[IO]:
+        """
+        Take the writer lock of the index. Returns the locked file, None if
+        another process holds the lock.
+        """
+        lock_file = open(os.path.join(self.path, "writer.lock"), "a")
+        if fcntl is None:
+            return lock_file
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def acquire_writer_lock(self) -> None:
+        """
+        Become the writer of the index, until it's closed. Raise a RuntimeError
+        if another process is the writer, or if the index is on a network
+        filesystem, where the lock is not reliable.
+
+        The writer calls this on startup, so that a second writer fails early.
+        """
+        if self._writer_lock is not None:
+            return
+        filesystem_type = get_filesystem_type(self.path)
+        if filesystem_type in NETWORK_FILESYSTEM_TYPES:
+            raise RuntimeError(
+                f"The vector index {self.path} is on a network filesystem ({filesystem_type}). Use a local disk, or Qdrant."
+            )
+        self._writer_lock = self._try_lock()
+        if self._writer_lock is None:
+            raise RuntimeError(
+                f"Another process writes to the vector index {self.path}. Only one process can write to it."
+            )
+
+    def _get_collection(self, collection_name: str) -> LocalCollection:
+        with self._collections_lock:
+            if collection_name not in self._collections:
+                collection_path = os.path.join(self.path, collection_name)
+                if not os.path.exists(os.path.join(collection_path, "config.json")):
+                    raise ValueError(f"Collection {collection_name} not found")
+                self._collections[collection_name] = LocalCollection(collection_path)
+            return self._collections[collection_name]
+
+    async def get_collections(self) -> SimpleNamespace:
+        return SimpleNamespace(
+            collections=[
+                SimpleNamespace(name=name)
+                for name in sorted(os.listdir(self.path))
+                if os.path.exists(os.path.join(self.path, name, "config.json"))
+            ]
+        )
+
+    async def create_collection(
+        self, collection_name: str, vectors_config: Any, **kwargs: Any
+    ) -> bool:
+        if vectors_config.distance is not None and str(
+            getattr(vectors_config.distance, "value", vectors_config.distance)
+        ).lower() not in ["cosine"]:
+            raise NotImplementedError("Only the cosine distance is supported")
+        collection_path = os.path.join(self.path, collection_name)
+        # The collection can be created by a process that is not the writer,
+        # eg: on startup, as long as the writer doesn't hold the lock
+        lock_file = self._writer_lock or self._try_lock()
+        if lock_file is None:
+            if os.path.exists(os.path.join(collection_path, "config.json")):
+                # Created by the writer
+                return True
+            raise RuntimeError(
+                f"Another process writes to the vector index {self.path}. Only one process can write to it."
+            )
+        try:
+            os.makedirs(collection_path, exist_ok=True)
+            with open(os.path.join(collection_path, "config.json"), "w") as f:
+                json.dump({"size": vectors_config.size}, f)
+        finally:
+            if lock_file is not self._writer_lock:
+                lock_file.close()
+        self._collections.pop(collection_name, None)
+        return True
+
+    async def upsert(
+        self, collection_name: str, points: Sequence[Any], **kwargs: Any
+    ) -> None:
+        self.acquire_writer_lock()
+
+        def upsert() -> None:
+            self._get_collection(collection_name).upsert(points)
+
+        await asyncio.to_thread(upsert)
+
+    async def search(
+        self,
+        collection_name: str,
+        query_vector: Sequence[float],
+        query_filter: Any = None,
+        limit: int = 10,
+        offset: Optional[int] = None,
+        with_payload: Union[bool, Sequence[str]] = True,
+        with_vectors: bool = False,
+        **kwargs: Any,
+    ) -> List[SimpleNamespace]:
+        def search() -> List[SimpleNamespace]:
+            return self._get_collection(collection_name).search(
+                query_vector,
+                query_filter,
+                limit=limit,
+                offset=offset or 0,
+                with_payload=with_payload,
+                with_vectors=with_vectors,
+            )
+
+        return await asyncio.to_thread(search)
+
+    async def retrieve(
+        self,
+        collection_name: str,
+        ids: Sequence[Any],
+        with_payload: Union[bool, Sequence[str]] = True,
+        with_vectors: bool = False,
+        **kwargs: Any,
+    ) -> List[SimpleNamespace]:
+        def retrieve() -> List[SimpleNamespace]:
+            return self._get_collection(collection_name).retrieve(
+                ids, with_payload=with_payload, with_vectors=with_vectors
+            )
+
+        return await asyncio.to_thread(retrieve)
+
+    async def close(self) -> None:
+        self._collections.clear()
+        if self._writer_lock is not None:
+            # Closing the file releases the lock
+            self._writer_lock.close()
+            self._writer_lock = None
+        if self._is_temporary:
+            shutil.rmtree(self.path, ignore_errors=True)
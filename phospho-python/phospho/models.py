@@ -158,6 +158,13 @@ class Task(ProjectElementBaseModel):
         return json.loads(json.dumps(metadata, default=str))
 
 
+class SessionStats(BaseModel):
+    # Running counts, updated when tasks and events are added to the session
+    nb_success: int = 0
+    nb_failure: int = 0
+    nb_events: int = 0
+
+
 class Session(ProjectElementBaseModel):
     metadata: Optional[dict] = None
     data: Optional[dict] = None
@@ -171,6 +178,12 @@ class Session(ProjectElementBaseModel):
     tasks: Optional[List[Task]] = None
     # Session length is computed dynamically. It may be None if not computed
     session_length: int = 0
+    # Aggregates maintained at ingestion time
+    first_task_created_at: Optional[int] = None
+    last_task_created_at: Optional[int] = None
+    stats: SessionStats = Field(default_factory=SessionStats)
+    # Last time tasks were added to the session
+    tasks_updated_at: Optional[int] = None
 
     @field_serializer("metadata")
     def serialize_metadata(self, metadata: dict, _info):
@@ -1,7 +1,9 @@
+import json
+
 from phospho.collection import Collection
 
-from typing import Dict, Literal, Optional, List
-from phospho.models import Task
+from typing import Dict, Iterator, Literal, Optional, List
+from phospho.models import ProjectDataFilters, Task
 
 
 class TaskEntity:
@@ -103,16 +105,68 @@ class TaskCollection(Collection):
 
         return TaskEntity(self._client, response.json()["id"])
 
-    def get_all(self) -> List[TaskEntity]:
-        """Returns a list of all of the project tasks"""
+    def get_all(
+        self, limit: Optional[int] = None, per_page: int = 1000
+    ) -> List[TaskEntity]:
+        """
+        Returns a list of all of the project tasks, the most recent first.
+
+        The tasks are fetched page by page, per_page tasks at a time. Set limit
+        to stop after this number of tasks.
+        """
         # TODO : Filters
-        # TODO : Limit
-        # TODO : Pagination
+
+        tasks: List[TaskEntity] = []
+        cursor: Optional[str] = None
+        while limit is None or len(tasks) < limit:
+            if limit is not None:
+                per_page = min(per_page, limit - len(tasks))
+            response = self._client._post(
+                f"/projects/{self._client._project_id()}/tasks",
+                payload={
+                    "pagination": {"page": 0, "per_page": per_page, "cursor": cursor}
+                },
+            )
+            content = response.json()
+            tasks.extend(
+                TaskEntity(client=self._client, task_id=task["id"], _content=task)
+                for task in content["tasks"]
+            )
+            # The continuation token of the next page, None on the last page
+            cursor = content.get("next_cursor")
+            if cursor is None:
+                break
+        return tasks
+
+    def stream(
+        self,
+        filters: Optional[ProjectDataFilters] = None,
+        fields: Optional[List[str]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[dict]:
+        """
+        Iterate over all the tasks of the project matching the filters, the most
+        recent first.
+
+        The tasks are streamed by the server and read lazily, so that millions of
+        tasks can be exported without loading them all in memory.
+
+        :param filters: The filters to apply to the tasks.
+        :param fields: The fields of the tasks to return. Default: all the fields.
+        :param batch_size: The number of tasks read at once by the server.
+        """
+        payload: Dict[str, object] = {"format": "ndjson", "batch_size": batch_size}
+        if filters is not None:
+            payload["filters"] = filters.model_dump(mode="json", exclude_none=True)
+        if fields is not None:
+            payload["fields"] = fields
 
         response = self._client._post(
-            f"/projects/{self._client._project_id()}/tasks",
+            f"/projects/{self._client._project_id()}/tasks/stream",
+            payload=payload,
+            stream=True,
         )
-        return [
-            TaskEntity(client=self._client, task_id=task["id"], _content=task)
-            for task in response.json()["tasks"]
-        ]
+        with response:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
@@ -1,3 +1,4 @@
+import datetime
 import time
 import json
 import uuid
@@ -23,6 +24,17 @@ def generate_timestamp() -> int:
     return int(time.time())
 
 
+def get_billing_period(timestamp: Optional[int] = None) -> str:
+    """
+    The billing period of a timestamp, as YYYY-MM (UTC)
+    """
+    if timestamp is None:
+        date = datetime.datetime.now(datetime.timezone.utc)
+    else:
+        date = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+    return date.strftime("%Y-%m")
+
+
 def generate_uuid(prefix: str = "") -> str:
     """
     Add a prefiw if needed to the uuid
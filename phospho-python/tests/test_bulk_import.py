@@ -0,0 +1,128 @@
+import json
+
+import pandas as pd
+
+from phospho.bulk_import import (
+    _upload_batch,
+    bulk_import,
+    read_chunks,
+    to_log_events,
+)
+
+
+def test_to_log_events():
+    df = pd.DataFrame(
+        {
+            "input": ["hello", None, "hi"],
+            "output": ["world", "ignored", None],
+            "created_at": [1714521600, 1714521601, None],
+            "metadata": ['{"source": "csv"}', None, None],
+            "flag": ["Success", None, "bad"],
+            "model": ["gpt-4", None, None],
+        }
+    )
+    log_events = to_log_events(df, import_id="test", first_row=10)
+
+    # The row without input is skipped
+    assert len(log_events) == 2
+    assert log_events[0]["input"] == "hello"
+    assert log_events[0]["created_at"] == 1714521600
+    assert isinstance(log_events[0]["created_at"], int)
+    assert log_events[0]["flag"] == "success"
+    # The other columns are added to the metadata
+    assert log_events[0]["metadata"] == {"source": "csv", "model": "gpt-4"}
+    assert "output" not in log_events[1]
+    assert "created_at" not in log_events[1]
+    assert "flag" not in log_events[1]
+    assert log_events[1]["metadata"] == {}
+    # The task ids are stable
+    assert to_log_events(df, import_id="test", first_row=10) == log_events
+    assert log_events[0]["task_id"] != log_events[1]["task_id"]
+    json.dumps(log_events)
+
+    # Without other columns
+    log_events = to_log_events(df[["input", "metadata"]], import_id="test", first_row=0)
+    assert log_events[0]["metadata"] == {"source": "csv"}
+
+
+def test_to_log_events_metadata_types():
+    df = pd.DataFrame(
+        {
+            "input": ["a", "b"],
+            "ts": pd.to_datetime(["2024-01-01", None]),
+            "score": [1, 2],
+            "delay": pd.to_timedelta([1.5, 2], unit="s"),
+        }
+    )
+    log_events = to_log_events(df, import_id="test", first_row=0)
+    json.dumps(log_events)
+    assert log_events[0]["metadata"] == {"ts": 1704067200, "score": 1, "delay": 1.5}
+    assert log_events[1]["metadata"] == {"score": 2, "delay": 2.0}
+
+
+class MockClient:
+    def __init__(self, fail_after: int = -1):
+        self.batches = []
+        self.fail_after = fail_after
+
+    def _project_id(self):
+        return "project"
+
+    def _post(self, path, payload, compress=False):
+        if len(self.batches) == self.fail_after:
+            raise ValueError("Error")
+        json.dumps(payload)
+        self.batches.append(payload["batched_log_events"])
+
+        class Response:
+            def json(self):
+                return {"logged_events": payload["batched_log_events"]}
+
+        return Response()
+
+
+def test_bulk_import_resume(tmp_path):
+    source = tmp_path / "tasks.csv"
+    pd.DataFrame({"input": [f"input {i}" for i in range(10)]}).to_csv(
+        source, index=False
+    )
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    assert len(list(read_chunks(str(source), None, chunk_size=4))) == 3
+
+    client = MockClient(fail_after=1)
+    try:
+        bulk_import(
+            client,
+            str(source),
+            checkpoint_path=checkpoint_path,
+            chunk_size=4,
+            max_workers=1,
+            max_retries=0,
+        )
+        assert False, "The import should fail"
+    except ValueError:
+        pass
+    assert len(client.batches) == 1
+
+    client = MockClient()
+    report = bulk_import(
+        client,
+        str(source),
+        checkpoint_path=checkpoint_path,
+        chunk_size=4,
+        batch_size=3,
+    )
+    assert report.nb_skipped == 4
+    assert report.nb_rows == 6
+    assert report.nb_sent == 6
+    assert report.nb_rejected == 0
+    assert [len(batch) for batch in client.batches] == [3, 1, 2]
+    assert client.batches[0][0]["input"] == "input 4"
+
+
+def test_upload_batch_rejects_events_not_serializable():
+    client = MockClient()
+    batch = [{"input": "a"}, {"input": "b", "metadata": {"value": object()}}]
+    # Not retried
+    assert _upload_batch(client, batch, max_retries=0) == 1
+    assert client.batches == [[{"input": "a"}]]
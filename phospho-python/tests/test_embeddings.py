@@ -0,0 +1,85 @@
+import logging
+import time
+
+import pytest
+
+from phospho.lab.embeddings import (
+    LocalEmbeddingProvider,
+    get_configured_embedding_provider,
+    get_embedding_provider,
+    get_embedding_provider_and_model,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class FakeModel:
+    def encode(self, texts, batch_size, normalize_embeddings):
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+def load_fake_model(model: str) -> FakeModel:
+    return FakeModel()
+
+
+def test_get_embedding_provider_and_model():
+    assert get_embedding_provider_and_model("text-embedding-3-small") == (
+        "openai",
+        "text-embedding-3-small",
+    )
+    assert get_embedding_provider_and_model(
+        "local:sentence-transformers/all-MiniLM-L6-v2"
+    ) == ("local", "sentence-transformers/all-MiniLM-L6-v2")
+
+    embedding_provider = get_embedding_provider("openai:text-embedding-3-small")
+    assert embedding_provider.model == "text-embedding-3-small"
+    # The providers are reused
+    assert get_embedding_provider("openai:text-embedding-3-small") is embedding_provider
+    with pytest.raises(NotImplementedError):
+        get_embedding_provider("unknown:model")
+    # The options of the local models are ignored for the other providers
+    assert (
+        get_configured_embedding_provider(
+            "openai:text-embedding-3-small", max_workers=2, batch_size=8
+        )
+        is embedding_provider
+    )
+
+
+async def test_local_embedding_provider():
+    embedding_provider = LocalEmbeddingProvider(
+        "fake", max_workers=2, batch_size=2, load_model=load_fake_model
+    )
+    try:
+        texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+        embeddings = await embedding_provider.embed(texts)
+        # The embeddings are in the order of the texts
+        assert embeddings == [[float(len(text)), 1.0] for text in texts]
+        assert await embedding_provider.get_dimension() == 2
+    finally:
+        embedding_provider.close()
+
+
+async def test_local_embeddings_benchmark():
+    pytest.importorskip("sentence_transformers")
+    nb_tasks = 3000
+    texts = [
+        f"Question {i}: how do I reset my password? Answer {i}: go to the settings."
+        for i in range(nb_tasks)
+    ]
+    embedding_provider = LocalEmbeddingProvider(
+        "sentence-transformers/all-MiniLM-L6-v2"
+    )
+    try:
+        # Load the model in the worker processes
+        await embedding_provider.get_dimension()
+        start_time = time.perf_counter()
+        embeddings = await embedding_provider.embed(texts)
+        duration = time.perf_counter() - start_time
+    finally:
+        embedding_provider.close()
+
+    logger.info(
+        f"Embedded {nb_tasks} tasks in {duration:.1f}s ({nb_tasks / duration:.0f} tasks/s)"
+    )
+    assert all(embedding is not None for embedding in embeddings)
@@ -0,0 +1,18 @@
+from phospho.lab.event_summaries import get_event_summary
+from phospho.models import Event, Task
+
+
+def test_event_summary():
+    task = Task(project_id="project", input="Hello")
+    event = Event(
+        event_name="greeting",
+        task_id=task.id,
+        session_id="session",
+        project_id="project",
+        source="phospho-unknown",
+        task=task,
+    )
+    summary = get_event_summary(event)
+    assert "task" not in summary
+    assert "messages" not in summary
+    assert summary["event_name"] == "greeting"
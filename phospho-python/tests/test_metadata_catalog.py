@@ -0,0 +1,20 @@
+from phospho.lab.metadata_catalog import (
+    add_value_to_summary,
+    estimate_cardinality,
+    new_field_summary,
+)
+
+
+def test_estimate_cardinality():
+    assert estimate_cardinality(None) == 0
+    assert estimate_cardinality(new_field_summary()["registers"]) == 0
+
+    for nb_values in [10, 1000, 100000]:
+        summary = new_field_summary()
+        for i in range(nb_values):
+            add_value_to_summary(summary, f"user_{i}")
+        estimate = estimate_cardinality(summary["registers"])
+        # ~9% standard error with 128 registers
+        assert abs(estimate - nb_values) <= 0.3 * nb_values
+        # The most frequent values are kept, not all of them
+        assert len(summary["values"]) <= 1000
@@ -0,0 +1,83 @@
+import json
+
+from phospho.models import ProjectDataFilters
+from phospho.tasks import TaskCollection
+
+
+class StreamResponse:
+    def __init__(self, pages):
+        self.pages = pages
+        self.closed = False
+
+    def iter_lines(self):
+        for page in self.pages:
+            # The server sends a batch of tasks at once, the lines are split here
+            for line in page.split(b"\n"):
+                yield line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.closed = True
+
+
+class MockClient:
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+        self.responses = []
+
+    def _project_id(self):
+        return "project"
+
+    def _post(self, path, payload=None, stream=False, compress=False):
+        self.requests.append((path, payload, stream))
+        response = StreamResponse(self.pages)
+        self.responses.append(response)
+        return response
+
+
+def ndjson_page(tasks):
+    return "".join(json.dumps(task) + "\n" for task in tasks).encode()
+
+
+def test_stream_tasks():
+    tasks = [{"id": f"task_{i}", "created_at": 100 - i} for i in range(5)]
+    client = MockClient(
+        [ndjson_page(tasks[:2]), ndjson_page(tasks[2:4]), ndjson_page(tasks[4:])]
+    )
+    collection = TaskCollection(client)
+
+    streamed = list(
+        collection.stream(
+            filters=ProjectDataFilters(flag="success"),
+            fields=["id", "created_at"],
+            batch_size=2,
+        )
+    )
+    # All the pages, in the order of the server, and the stream is closed
+    assert streamed == tasks
+    assert client.responses[0].closed
+
+    path, payload, stream = client.requests[0]
+    assert path == "/projects/project/tasks/stream"
+    assert stream
+    assert payload == {
+        "format": "ndjson",
+        "batch_size": 2,
+        "filters": {"flag": "success"},
+        "fields": ["id", "created_at"],
+    }
+
+
+def test_stream_tasks_stopped_early():
+    tasks = [{"id": f"task_{i}"} for i in range(4)]
+    client = MockClient([ndjson_page(tasks[:2]), ndjson_page(tasks[2:])])
+    iterator = TaskCollection(client).stream()
+
+    assert next(iterator) == tasks[0]
+    assert next(iterator) == tasks[1]
+    # Stopping the iteration closes the response
+    iterator.close()
+    assert client.responses[0].closed
@@ -0,0 +1,141 @@
+import logging
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from phospho.lab import vector_index
+from phospho.lab.vector_index import LocalVectorIndex
+
+logger = logging.getLogger(__name__)
+
+COSINE = SimpleNamespace(value="Cosine")
+
+
+def point(point_id, vector, project_id):
+    return SimpleNamespace(
+        id=point_id,
+        vector=vector,
+        payload={"task_id": point_id, "project_id": project_id},
+    )
+
+
+def project_filter(project_id, ids=None):
+    must = [SimpleNamespace(key="project_id", match=SimpleNamespace(value=project_id))]
+    if ids is not None:
+        must.append(SimpleNamespace(has_id=ids))
+    return SimpleNamespace(must=must)
+
+
+async def test_local_vector_index(tmp_path):
+    index = LocalVectorIndex(str(tmp_path))
+    await index.create_collection(
+        "tasks", vectors_config=SimpleNamespace(size=2, distance=COSINE)
+    )
+    collections = await index.get_collections()
+    assert [collection.name for collection in collections.collections] == ["tasks"]
+
+    await index.upsert(
+        "tasks",
+        points=[
+            point("a", [1.0, 0.0], "p1"),
+            point("b", [1.0, 1.0], "p1"),
+            point("c", [0.0, 1.0], "p1"),
+            point("d", [1.0, 0.0], "p2"),
+        ],
+    )
+    results = await index.search(
+        "tasks", query_vector=[2.0, 0.1], query_filter=project_filter("p1"), limit=2
+    )
+    # Filtered by project, the most similar first
+    assert [result.id for result in results] == ["a", "b"]
+    assert results[0].payload["project_id"] == "p1"
+    results = await index.search(
+        "tasks",
+        query_vector=[2.0, 0.1],
+        query_filter=project_filter("p1"),
+        limit=2,
+        offset=2,
+    )
+    assert [result.id for result in results] == ["c"]
+    results = await index.search(
+        "tasks",
+        query_vector=[2.0, 0.1],
+        query_filter=project_filter("p1", ids=["b", "c", "d"]),
+        limit=10,
+    )
+    assert [result.id for result in results] == ["b", "c"]
+
+    # Another process reading the same directory sees the new points
+    reader = LocalVectorIndex(str(tmp_path))
+    assert len(await reader.retrieve("tasks", ids=["a", "d", "x"])) == 2
+    # Upserting an existing point replaces it
+    await index.upsert("tasks", points=[point("a", [0.0, 1.0], "p2")])
+    await index.upsert("tasks", points=[point("e", [1.0, 0.0], "p1")])
+    results = await reader.search(
+        "tasks", query_vector=[1.0, 0.0], query_filter=project_filter("p1"), limit=10
+    )
+    assert [result.id for result in results] == ["e", "b", "c"]
+    records = await reader.retrieve("tasks", ids=["a"], with_payload=["project_id"])
+    assert records[0].payload == {"project_id": "p2"}
+
+    # Only one process can write to the index
+    await reader.create_collection(
+        "tasks", vectors_config=SimpleNamespace(size=2, distance=COSINE)
+    )
+    with pytest.raises(RuntimeError):
+        await reader.upsert("tasks", points=[point("f", [1.0, 0.0], "p1")])
+    await index.close()
+    await reader.upsert("tasks", points=[point("f", [1.0, 0.0], "p1")])
+    await reader.close()
+
+
+async def test_local_vector_index_writer_lock(tmp_path, monkeypatch):
+    # The writer takes the lock on startup, a second writer fails right away
+    index = LocalVectorIndex(str(tmp_path))
+    index.acquire_writer_lock()
+    index.acquire_writer_lock()
+    with pytest.raises(RuntimeError):
+        LocalVectorIndex(str(tmp_path)).acquire_writer_lock()
+    await index.close()
+
+    # The lock is not reliable on network filesystems
+    assert vector_index.get_filesystem_type(str(tmp_path)) is not None
+    monkeypatch.setattr(
+        vector_index, "get_filesystem_type", lambda path: "fuse.gcsfuse"
+    )
+    with pytest.raises(RuntimeError, match="network filesystem"):
+        LocalVectorIndex(str(tmp_path)).acquire_writer_lock()
+
+
+async def test_local_vector_index_benchmark(tmp_path):
+    nb_points, size, nb_projects = 50_000, 384, 10
+    index = LocalVectorIndex(str(tmp_path))
+    await index.create_collection(
+        "tasks", vectors_config=SimpleNamespace(size=size, distance=COSINE)
+    )
+    vectors = np.random.default_rng(0).normal(size=(nb_points, size))
+    await index.upsert(
+        "tasks",
+        points=[
+            point(str(i), vectors[i], f"project_{i % nb_projects}")
+            for i in range(nb_points)
+        ],
+    )
+
+    nb_queries = 50
+    start_time = time.perf_counter()
+    for i in range(nb_queries):
+        results = await index.search(
+            "tasks",
+            query_vector=vectors[i],
+            query_filter=project_filter(f"project_{i % nb_projects}"),
+            limit=10,
+        )
+        assert results[0].id == str(i)
+    duration = (time.perf_counter() - start_time) / nb_queries
+    logger.info(
+        f"Searched {nb_points // nb_projects} vectors of a project in {duration * 1000:.1f} ms"
+    )
+    assert duration < 1